@@ -1,8 +1,9 @@
 """
 Модуль агента SysMonitor.
 
-Отвечает за сбор основных системных метрик (CPU, RAM, диск, количество процессов)
-и периодическую отправку этих данных на сервер SysMonitor по HTTP.
+Отвечает за сбор основных системных метрик (CPU, RAM, диск, количество процессов),
+дополнительных метрик подключаемых сборщиков (Collector) и периодическую
+отправку этих данных на сервер SysMonitor по HTTP.
 """
 
 import psutil
@@ -11,6 +12,914 @@ import requests
 import time
 import socket
 import platform
+import threading
+import json
+import gzip
+import random
+import os
+from collections import deque
+from requests.adapters import HTTPAdapter
+
+import wire
+
+
+class MetricSampler:
+    """
+    Фоновый сбор CPU и RAM с частотой выше частоты отправки.
+
+    Поток снимает значения каждые sample_interval секунд неблокирующим
+    вызовом psutil.cpu_percent(interval=None) (загрузка с момента
+    предыдущего вызова) и складывает их в кольцевой буфер фиксированного
+    размера. При отправке агент забирает накопленное окно и передаёт
+    min/avg/max/last, поэтому короткие всплески между отправками
+    не теряются.
+
+    Основные атрибуты:
+        sample_interval (float): период снятия значений, сек.
+        samples (collections.deque): кольцевой буфер (время, cpu, ram).
+    """
+    def __init__(self, sample_interval=0.5, window_size=1200):
+        """
+        :param sample_interval: период снятия значений, сек.
+        :type sample_interval: float
+        :param window_size: ёмкость кольцевого буфера; при переполнении
+                            вытесняются самые старые значения.
+        :type window_size: int
+        """
+        self.sample_interval = sample_interval
+        self.samples = deque(maxlen=window_size)
+        self.last = None # последнее снятое значение, переживает опустошение окна
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def sample(self):
+        """
+        Снять одно значение и добавить его в буфер.
+
+        :return: кортеж (время, cpu, ram).
+        :rtype: tuple
+        """
+        value = (
+            time.time(),
+            psutil.cpu_percent(interval=None),
+            psutil.virtual_memory().percent,
+        )
+        with self.lock:
+            self.samples.append(value)
+            self.last = value
+        return value
+
+    def ensure_started(self):
+        """
+        Запустить поток сбора, если он ещё не запущен.
+        """
+        if self.thread is not None:
+            return
+        # первый вызов cpu_percent(interval=None) задаёт точку отсчёта
+        psutil.cpu_percent(interval=None)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='metric-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Остановить поток сбора.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(self.sample_interval * 2 + 1)
+            self.thread = None
+
+    def drain(self):
+        """
+        Забрать все значения, накопленные с прошлого вызова.
+
+        :return: список кортежей (время, cpu, ram).
+        :rtype: list[tuple]
+        """
+        with self.lock:
+            window = list(self.samples)
+            self.samples.clear()
+        return window
+
+    def _run(self):
+        """
+        Основной цикл потока сбора.
+        """
+        while not self.stop_event.wait(self.sample_interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print("Ошибка сбора метрик:", e)
+
+
+class HttpTransport:
+    """
+    HTTP-транспорт агента: постоянное соединение, таймауты, сжатие и повторы.
+
+    Все отправки идут через один requests.Session с пулом keep-alive
+    соединений, поэтому TCP-рукопожатие не повторяется на каждый образец.
+    Таймауты подключения и чтения не дают зависшему серверу заблокировать
+    цикл отправки. Тела больше compress_min_bytes сжимаются gzip. После
+    ошибки следующая попытка откладывается с экспоненциальной задержкой
+    и случайным разбросом (jitter), чтобы агенты всего парка не
+    переподключались к серверу одновременно.
+
+    Основные атрибуты:
+        session (requests.Session): сессия с пулом соединений.
+        stats (dict): счётчики отправок, ошибок, задержек и байтов.
+    """
+    def __init__(self, connect_timeout=3.05, read_timeout=10, compress=True, compress_min_bytes=1024,
+                 backoff_base=1.0, backoff_max=300.0, pool_size=2):
+        """
+        :param connect_timeout: таймаут установки соединения, сек.
+        :type connect_timeout: float
+        :param read_timeout: таймаут ожидания ответа, сек.
+        :type read_timeout: float
+        :param compress: сжимать ли тела запросов gzip.
+        :type compress: bool
+        :param compress_min_bytes: минимальный размер тела для сжатия, байт.
+        :type compress_min_bytes: int
+        :param backoff_base: задержка после первой ошибки, сек.
+        :type backoff_base: float
+        :param backoff_max: максимальная задержка между попытками, сек.
+        :type backoff_max: float
+        :param pool_size: число keep-alive соединений в пуле.
+        :type pool_size: int
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.compress = compress
+        self.compress_min_bytes = compress_min_bytes
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.failures = 0 # число ошибок подряд
+        self.retry_at = 0.0 # момент (time.monotonic), раньше которого не отправлять
+        self.stats = {
+            'sends': 0,           # успешных отправок
+            'failures': 0,        # неудачных отправок
+            'bytes_raw': 0,       # байт тела до сжатия
+            'bytes_on_wire': 0,   # байт тела после сжатия
+            'latency_ms_total': 0.0,
+            'last_latency_ms': None,
+        }
+
+    def ready(self):
+        """
+        Проверить, истекла ли задержка после последней ошибки.
+
+        :rtype: bool
+        """
+        return time.monotonic() >= self.retry_at
+
+    def backoff_delay(self):
+        """
+        Задержка перед следующей попыткой после failures ошибок подряд.
+
+        :return: задержка в секундах: base * 2^(failures-1), не больше
+                 backoff_max, умноженная на случайный коэффициент 0.5–1.
+        :rtype: float
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** max(self.failures - 1, 0))
+        return delay * random.uniform(0.5, 1.0)
+
+    def post_json(self, url, payload, content_type='application/json'):
+        """
+        Отправить объект JSON POST-запросом.
+
+        :param url: полный адрес эндпоинта.
+        :type url: str
+        :param payload: объект, сериализуемый в JSON.
+        :type payload: dict | list
+        :param content_type: MIME-тип тела.
+        :type content_type: str
+        :return: ответ сервера.
+        :rtype: requests.Response
+        :raises requests.RequestException: при сетевой ошибке или таймауте.
+        """
+        body = json.dumps(payload).encode('utf-8')
+        return self.post(url, body, content_type)
+
+    def post(self, url, body, content_type):
+        """
+        Отправить готовое тело запроса, учитывая задержку и статистику.
+
+        Ответы 5xx и 429, сетевые ошибки и таймауты считаются временными
+        ошибками и увеличивают задержку до следующей попытки.
+
+        :param url: полный адрес эндпоинта.
+        :type url: str
+        :param body: тело запроса.
+        :type body: bytes
+        :param content_type: MIME-тип тела.
+        :type content_type: str
+        :return: ответ сервера.
+        :rtype: requests.Response
+        :raises requests.RequestException: при сетевой ошибке или таймауте.
+        """
+        headers = {'Content-Type': content_type}
+        raw_size = len(body)
+        if self.compress and raw_size >= self.compress_min_bytes:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+
+        started = time.perf_counter()
+        try:
+            response = self.session.post(url, data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            self._record_failure()
+            raise
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        self.stats['bytes_raw'] += raw_size
+        self.stats['bytes_on_wire'] += len(body)
+        self.stats['latency_ms_total'] += latency_ms
+        self.stats['last_latency_ms'] = round(latency_ms, 1)
+
+        if response.status_code >= 500 or response.status_code == 429:
+            self._record_failure()
+        elif response.status_code >= 400:
+            self.stats['failures'] += 1
+        else:
+            self.stats['sends'] += 1
+            self.failures = 0
+            self.retry_at = 0.0
+        return response
+
+    def _record_failure(self):
+        """
+        Учесть временную ошибку и назначить момент следующей попытки.
+        """
+        self.stats['failures'] += 1
+        self.failures += 1
+        self.retry_at = time.monotonic() + self.backoff_delay()
+
+    def close(self):
+        """
+        Закрыть соединения пула.
+        """
+        self.session.close()
+
+
+class Spool:
+    """
+    Дисковый буфер неотправленных образцов (store-and-forward).
+
+    Образцы дописываются построчно (NDJSON) в файлы-сегменты ограниченного
+    размера в каталоге directory. Позиция чтения хранится в файле cursor,
+    поэтому и неотправленные данные, и прогресс их досылки переживают
+    перезапуск агента. В памяти хранится только текущая пачка для
+    отправки. При превышении max_bytes удаляются самые старые сегменты.
+
+    Основные атрибуты:
+        directory (str): каталог сегментов.
+        stats (dict): счётчики appended, replayed, dropped (образцы,
+                      отклонённые сервером при досылке), dropped_segments.
+    """
+    SUFFIX = '.ndjson'
+
+    def __init__(self, directory, segment_bytes=1024 * 1024, max_bytes=64 * 1024 * 1024):
+        """
+        :param directory: каталог для файлов буфера (создаётся при необходимости).
+        :type directory: str
+        :param segment_bytes: размер сегмента, после которого начинается новый, байт.
+        :type segment_bytes: int
+        :param max_bytes: предельный суммарный размер сегментов, байт.
+        :type max_bytes: int
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.cursor_path = os.path.join(directory, 'cursor')
+        self.lock = threading.Lock()
+        self.stats = {'appended': 0, 'replayed': 0, 'dropped': 0, 'dropped_segments': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self):
+        """
+        Список сегментов от старого к новому.
+
+        :rtype: list[str]
+        """
+        names = [name for name in os.listdir(self.directory) if name.endswith(self.SUFFIX)]
+        return sorted(names)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_cursor(self):
+        """
+        Прочитать позицию чтения: (сегмент, смещение в байтах).
+        """
+        try:
+            with open(self.cursor_path, encoding='utf-8') as f:
+                name, offset = f.read().split()
+            return name, int(offset)
+        except (OSError, ValueError):
+            return None, 0
+
+    def _write_cursor(self, name, offset):
+        """
+        Атомарно сохранить позицию чтения.
+        """
+        tmp_path = self.cursor_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f'{name} {offset}')
+        os.replace(tmp_path, self.cursor_path)
+
+    def append(self, sample):
+        """
+        Дописать образец в текущий сегмент.
+
+        :param sample: образец метрик с полем timestamp.
+        :type sample: dict
+        """
+        line = json.dumps(sample, separators=(',', ':')) + '\n'
+        with self.lock:
+            segments = self.segments()
+            if segments and os.path.getsize(self._path(segments[-1])) < self.segment_bytes:
+                name = segments[-1]
+            else:
+                number = int(segments[-1][:-len(self.SUFFIX)]) + 1 if segments else 1
+                name = f'{number:012d}{self.SUFFIX}'
+                segments.append(name)
+            with open(self._path(name), 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.stats['appended'] += 1
+            self._enforce_limit(segments)
+
+    def _enforce_limit(self, segments):
+        """
+        Удалить самые старые сегменты, пока суммарный размер больше max_bytes.
+        """
+        total = sum(os.path.getsize(self._path(name)) for name in segments)
+        while total > self.max_bytes and len(segments) > 1:
+            name = segments.pop(0)
+            total -= os.path.getsize(self._path(name))
+            os.remove(self._path(name))
+            self.stats['dropped_segments'] += 1
+
+    def pending_bytes(self):
+        """
+        Объём ещё не отправленных данных, байт.
+
+        :rtype: int
+        """
+        with self.lock:
+            segments = self.segments()
+            total = sum(os.path.getsize(self._path(name)) for name in segments)
+            name, offset = self._read_cursor()
+            if segments and name == segments[0]:
+                total -= offset
+            return total
+
+    def read_batch(self, max_items):
+        """
+        Прочитать очередную пачку образцов, не сдвигая позицию чтения.
+
+        Пачка берётся из самого старого сегмента. Повреждённые строки
+        (например, недописанные при аварийном завершении) пропускаются.
+        Хвост без перевода строки в сегменте, куда больше не пишут, тоже
+        пропускается: иначе чтение остановилось бы на нём навсегда.
+
+        :param max_items: максимальный размер пачки.
+        :type max_items: int
+        :return: пара (образцы, позиция после пачки) для commit().
+        :rtype: tuple[list[dict], tuple | None]
+        """
+        with self.lock:
+            segments = self.segments()
+            if not segments:
+                return [], None
+            name = segments[0]
+            cursor_name, offset = self._read_cursor()
+            if cursor_name != name:
+                offset = 0
+
+            sealed = name != segments[-1]
+            items = []
+            with open(self._path(name), 'rb') as f:
+                f.seek(offset)
+                while len(items) < max_items:
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        if sealed:
+                            offset += len(line)
+                        break
+                    offset += len(line)
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError:
+                        continue
+            return items, (name, offset)
+
+    def commit(self, position):
+        """
+        Подтвердить отправку пачки, полученной из read_batch().
+
+        Полностью отправленный сегмент удаляется, если в него больше не пишут.
+
+        :param position: позиция, возвращённая read_batch().
+        :type position: tuple
+        :return: True, если сегмент отправлен полностью и удалён.
+        :rtype: bool
+        """
+        name, offset = position
+        with self.lock:
+            segments = self.segments()
+            path = self._path(name)
+            if not os.path.exists(path):
+                # сегмент удалён при превышении max_bytes
+                return True
+            if offset >= os.path.getsize(path) and len(segments) > 1:
+                os.remove(path)
+                return True
+            self._write_cursor(name, offset)
+            return False
+
+
+class RateLimiter:
+    """
+    Ограничитель скорости по алгоритму «ведро с жетонами».
+
+    Жетоны пополняются со скоростью rate в секунду до ёмкости burst.
+    """
+    def __init__(self, rate, burst):
+        """
+        :param rate: жетонов в секунду.
+        :type rate: float
+        :param burst: ёмкость ведра.
+        :type burst: float
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def available(self):
+        """
+        Число доступных жетонов с учётом пополнения.
+
+        :rtype: int
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return int(self.tokens)
+
+    def consume(self, count):
+        """
+        Израсходовать count жетонов.
+
+        :param count: число жетонов.
+        :type count: int
+        """
+        self.tokens -= count
+
+
+def default_spool_dir():
+    """
+    Каталог буфера по умолчанию: ~/.sysmonitor/spool.
+
+    :rtype: str
+    """
+    return os.path.join(os.path.expanduser('~'), '.sysmonitor', 'spool')
+
+
+def summarize(values):
+    """
+    Свести ряд значений к min/avg/max/last.
+
+    :param values: значения в порядке снятия.
+    :type values: list[float]
+    :rtype: dict
+    """
+    return {
+        'min': min(values),
+        'avg': round(sum(values) / len(values), 1),
+        'max': max(values),
+        'last': values[-1],
+    }
+
+
+class Collector:
+    """
+    Базовый класс подключаемого сборщика дополнительных метрик.
+
+    Каждый сборщик запускается со своим периодом interval и измеряет
+    собственную стоимость (время выполнения collect()). Если средняя
+    стоимость превышает бюджет budget_ms, период удваивается (но не больше
+    max_interval), поэтому дорогие сборщики сами реже нагружают систему.
+    Значение хранится между запусками и отправляется с каждым образцом.
+
+    Основные атрибуты:
+        name (str): ключ значения в блоке ext образца.
+        interval (float): текущий период запуска, сек.
+        value: последнее собранное значение (None — ещё не собрано).
+        cost_ms (float | None): скользящее среднее стоимости запуска, мс.
+    """
+    name = None
+
+    def __init__(self, interval=5.0, budget_ms=20.0, max_interval=300.0):
+        """
+        :param interval: период запуска, сек.
+        :type interval: float
+        :param budget_ms: допустимая средняя стоимость одного запуска, мс.
+        :type budget_ms: float
+        :param max_interval: предельный период при превышении бюджета, сек.
+        :type max_interval: float
+        """
+        self.interval = interval
+        self.budget_ms = budget_ms
+        self.max_interval = max_interval
+        self.value = None
+        self.cost_ms = None
+        self.next_run = 0.0
+
+    def collect(self):
+        """
+        Снять значение метрики; переопределяется в наследниках.
+        """
+        raise NotImplementedError
+
+    def due(self, now):
+        """
+        Проверить, пора ли запускать сборщик.
+
+        :param now: текущее значение time.monotonic().
+        :type now: float
+        :rtype: bool
+        """
+        return now >= self.next_run
+
+    def run(self, now):
+        """
+        Запустить сборщик, измерить его стоимость и запланировать следующий запуск.
+
+        Ошибка сборщика не прерывает сбор остальных метрик: значение
+        сбрасывается в None, а сообщение выводится в консоль.
+
+        :param now: текущее значение time.monotonic().
+        :type now: float
+        :return: стоимость этого запуска, мс.
+        :rtype: float
+        """
+        started = time.perf_counter()
+        try:
+            self.value = self.collect()
+        except Exception as e:
+            print(f"Ошибка сборщика {self.name}:", e)
+            self.value = None
+        cost = (time.perf_counter() - started) * 1000
+        self.cost_ms = cost if self.cost_ms is None else self.cost_ms * 0.8 + cost * 0.2
+
+        if self.cost_ms > self.budget_ms and self.interval < self.max_interval:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self.next_run = now + self.interval
+        return cost
+
+
+class RateCollector(Collector):
+    """
+    Сборщик скоростей по монотонным счётчикам (байты, операции).
+
+    Наследник возвращает из counters() словарь текущих значений счётчиков;
+    результатом сбора является их прирост в секунду с прошлого запуска.
+    Первый запуск только запоминает точку отсчёта.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.previous = None
+
+    def counters(self):
+        """
+        Текущие значения счётчиков; переопределяется в наследниках.
+
+        :rtype: dict[str, int]
+        """
+        raise NotImplementedError
+
+    def collect(self):
+        now = time.monotonic()
+        current = self.counters()
+        previous, self.previous = self.previous, (now, current)
+        if previous is None or now <= previous[0]:
+            return None
+        elapsed = now - previous[0]
+        # счётчик мог обнулиться (перезапуск интерфейса) — такие значения пропускаются
+        return {
+            key: round((value - previous[1][key]) / elapsed, 1)
+            for key, value in current.items()
+            if key in previous[1] and value >= previous[1][key]
+        }
+
+
+class PerCoreCpuCollector(Collector):
+    """
+    Загрузка каждого ядра CPU, % (с момента предыдущего запуска).
+    """
+    name = 'cpu_per_core'
+
+    def collect(self):
+        return psutil.cpu_percent(interval=None, percpu=True)
+
+
+class LoadAverageCollector(Collector):
+    """
+    Средняя загрузка системы за 1, 5 и 15 минут.
+    """
+    name = 'load_avg'
+
+    def collect(self):
+        return [round(value, 2) for value in psutil.getloadavg()]
+
+
+class ProcessCountCollector(Collector):
+    """
+    Количество запущенных процессов.
+
+    В Linux число берётся из четвёртого поля /proc/loadavg
+    ("выполняются/всего"): одно чтение вместо обхода каталога /proc.
+    Ядро считает в нём все задачи, включая потоки, поэтому значение
+    больше числа PID. Если файл недоступен (другие ОС), используется
+    список PID от psutil; получение его — заметная операция на
+    загруженных хостах, поэтому сборщик выполняется по своему, более
+    редкому расписанию, а не при каждом снятии CPU/RAM.
+    """
+    name = 'processes'
+    loadavg_path = '/proc/loadavg'
+
+    def __init__(self, interval=10.0, **kwargs):
+        super().__init__(interval, **kwargs)
+
+    def collect(self):
+        try:
+            with open(self.loadavg_path) as f:
+                return int(f.read().split()[3].split('/')[1])
+        except (OSError, ValueError, IndexError):
+            return len(psutil.pids())
+
+
+class NetworkIOCollector(RateCollector):
+    """
+    Скорость сетевого обмена по всем интерфейсам: байт и пакетов в секунду.
+    """
+    name = 'net_io'
+
+    def counters(self):
+        counters = psutil.net_io_counters()
+        return {
+            'bytes_sent': counters.bytes_sent,
+            'bytes_recv': counters.bytes_recv,
+            'packets_sent': counters.packets_sent,
+            'packets_recv': counters.packets_recv,
+        }
+
+
+class DiskIOCollector(RateCollector):
+    """
+    Скорость дискового ввода-вывода по всем дискам: байт и операций в секунду.
+    """
+    name = 'disk_io'
+
+    def counters(self):
+        counters = psutil.disk_io_counters()
+        if counters is None:
+            return {}
+        return {
+            'read_bytes': counters.read_bytes,
+            'write_bytes': counters.write_bytes,
+            'read_count': counters.read_count,
+            'write_count': counters.write_count,
+        }
+
+
+class DiskUsageCollector(Collector):
+    """
+    Заполненность каждого смонтированного физического раздела, %.
+    """
+    name = 'disk_usage'
+
+    def __init__(self, interval=60.0, **kwargs):
+        super().__init__(interval, **kwargs)
+
+    def collect(self):
+        usage = {}
+        for partition in psutil.disk_partitions(all=False):
+            try:
+                usage[partition.mountpoint] = psutil.disk_usage(partition.mountpoint).percent
+            except OSError:
+                continue # привод без носителя, нет доступа и т.п.
+        return usage
+
+
+class TopProcessesCollector(Collector):
+    """
+    Самые «тяжёлые» процессы по загрузке CPU и по занимаемой памяти (RSS).
+
+    Единственный сборщик, перебирающий все процессы, поэтому у него
+    самый большой период по умолчанию. Загрузка CPU процесса считается
+    psutil с момента предыдущего запуска, так что первый запуск даёт нули.
+    """
+    name = 'top_processes'
+
+    def __init__(self, interval=30.0, limit=5, budget_ms=200.0, **kwargs):
+        """
+        :param limit: число процессов в каждом списке.
+        :type limit: int
+        """
+        super().__init__(interval, budget_ms=budget_ms, **kwargs)
+        self.limit = limit
+
+    def collect(self):
+        processes = []
+        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_info']):
+            info = proc.info
+            if info['memory_info'] is None:
+                continue # нет доступа к процессу
+            processes.append({
+                'pid': info['pid'],
+                'name': info['name'],
+                'cpu': info['cpu_percent'] or 0.0,
+                'rss': info['memory_info'].rss,
+            })
+        return {
+            'cpu': sorted(processes, key=lambda proc: proc['cpu'], reverse=True)[:self.limit],
+            'rss': sorted(processes, key=lambda proc: proc['rss'], reverse=True)[:self.limit],
+        }
+
+
+def default_collectors():
+    """
+    Набор сборщиков, который агент использует по умолчанию.
+
+    Сборщики, не поддерживаемые платформой (например, средняя загрузка
+    без psutil.getloadavg), не включаются.
+
+    :rtype: list[Collector]
+    """
+    collectors = [
+        ProcessCountCollector(),
+        PerCoreCpuCollector(),
+        NetworkIOCollector(),
+        DiskIOCollector(),
+        DiskUsageCollector(),
+        TopProcessesCollector(),
+    ]
+    if hasattr(psutil, 'getloadavg'):
+        collectors.insert(2, LoadAverageCollector())
+    return collectors
+
+
+class RollingHistogram:
+    """
+    Последние window значений для расчёта перцентилей.
+
+    Перцентили считаются сортировкой только при формировании сводки
+    (раз в несколько минут), а учёт значения — одно добавление в deque.
+    """
+    def __init__(self, window=256):
+        """
+        :param window: сколько последних значений хранить.
+        :type window: int
+        """
+        self.values = deque(maxlen=window)
+
+    def observe(self, value):
+        """
+        Учесть одно значение.
+
+        :param value: значение, мс.
+        :type value: float
+        """
+        self.values.append(value)
+
+    def summary(self):
+        """
+        Свести окно к p50/p99/max.
+
+        :return: словарь p50, p99, max (мс) или None, если значений нет.
+        :rtype: dict | None
+        """
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        last = len(ordered) - 1
+        return {
+            'p50': round(ordered[round(last * 0.5)], 2),
+            'p99': round(ordered[round(last * 0.99)], 2),
+            'max': round(ordered[-1], 2),
+        }
+
+
+class AgentTelemetry:
+    """
+    Самонаблюдение агента: во что обходятся сбор и отправка метрик.
+
+    Время полного сбора, каждого сборщика и каждой отправки копится в
+    скользящих гистограммах; раз в interval секунд сводка прикладывается
+    к очередному образцу (ext.telemetry), и сервер сохраняет её по хосту.
+    В сводку входит и загрузка CPU самим процессом агента за период,
+    чтобы находить хосты, где мониторинг обходится слишком дорого.
+
+    Основные атрибуты:
+        counters (dict): sends, failures и replayed с предыдущей сводки.
+    """
+    def __init__(self, interval=300.0, window=256):
+        """
+        :param interval: период отправки сводки, сек.
+        :type interval: float
+        :param window: размер окна каждой гистограммы.
+        :type window: int
+        """
+        self.interval = interval
+        self.window = window
+        self.collect_ms = RollingHistogram(window)
+        self.send_ms = RollingHistogram(window)
+        self.collectors = {}
+        self.counters = {'sends': 0, 'failures': 0, 'replayed': 0}
+        self.process = psutil.Process()
+        self.last_report = time.monotonic()
+        self.last_cpu = self._cpu_seconds()
+
+    def _cpu_seconds(self):
+        times = self.process.cpu_times()
+        return times.user + times.system
+
+    def observe_collector(self, name, cost_ms):
+        """
+        Учесть стоимость одного запуска сборщика.
+        """
+        histogram = self.collectors.get(name)
+        if histogram is None:
+            histogram = self.collectors[name] = RollingHistogram(self.window)
+        histogram.observe(cost_ms)
+
+    def observe_send(self, elapsed_ms, ok, replayed=0):
+        """
+        Учесть один HTTP-запрос к серверу.
+
+        :param elapsed_ms: длительность запроса, мс.
+        :type elapsed_ms: float
+        :param ok: запрос принят сервером.
+        :type ok: bool
+        :param replayed: сколько образцов из буфера он доставил.
+        :type replayed: int
+        """
+        self.send_ms.observe(elapsed_ms)
+        self.counters['sends'] += 1
+        if not ok:
+            self.counters['failures'] += 1
+        self.counters['replayed'] += replayed
+
+    def due(self, now):
+        """
+        Проверить, пора ли прикладывать сводку.
+
+        :param now: текущее значение time.monotonic().
+        :type now: float
+        :rtype: bool
+        """
+        return now - self.last_report >= self.interval
+
+    def report(self, now, spool=None):
+        """
+        Сформировать сводку и начать новый период счётчиков.
+
+        :param now: текущее значение time.monotonic().
+        :type now: float
+        :param spool: дисковый буфер агента, если он есть.
+        :type spool: Spool | None
+        :return: словарь с ключами period (сек), collect_ms, send_ms
+                 (p50/p99/max), collectors_p99_ms, sends, failures,
+                 replayed, spool_bytes, cpu_percent (процесс агента)
+                 и rss_mb.
+        :rtype: dict
+        """
+        cpu = self._cpu_seconds()
+        period = now - self.last_report
+        summary = dict(
+            self.counters,
+            period=round(period, 1),
+            collect_ms=self.collect_ms.summary(),
+            send_ms=self.send_ms.summary(),
+            collectors_p99_ms={name: histogram.summary()['p99']
+                               for name, histogram in self.collectors.items() if histogram.values},
+            spool_bytes=spool.pending_bytes() if spool is not None else 0,
+            cpu_percent=round((cpu - self.last_cpu) / period * 100, 3) if period > 0 else None,
+            rss_mb=round(self.process.memory_info().rss / (1024 * 1024), 1),
+        )
+        self.last_report = now
+        self.last_cpu = cpu
+        self.counters = dict.fromkeys(self.counters, 0)
+        return summary
+
 
 class SystemMonitor:
     """
@@ -18,23 +927,85 @@ class SystemMonitor:
 
     Использует библиотеки psutil и shutil для доступа к информации о загрузке CPU,
     использованной оперативной памяти, дисковом пространстве и количестве процессов.
+    CPU и RAM снимаются в фоне объектом MetricSampler, остальные метрики —
+    подключаемыми сборщиками (Collector) по их собственному расписанию.
     """
+    def __init__(self, sample_interval=0.5, transport=None, spool=None,
+                 replay_batch=500, replay_rate=200, replay_jitter=30.0, collectors=None,
+                 binary=False, telemetry_interval=300.0):
+        """
+        :param sample_interval: период фонового снятия CPU/RAM, сек.
+        :type sample_interval: float
+        :param transport: HTTP-транспорт; по умолчанию HttpTransport().
+        :type transport: HttpTransport | None
+        :param spool: дисковый буфер для образцов, которые не удалось
+                      отправить; None — образцы при ошибке теряются.
+        :type spool: Spool | None
+        :param replay_batch: максимальный размер пачки при досылке.
+        :type replay_batch: int
+        :param replay_rate: предельная скорость досылки, образцов в секунду.
+        :type replay_rate: float
+        :param replay_jitter: максимальная случайная задержка начала досылки
+                              после восстановления связи, сек.
+        :type replay_jitter: float
+        :param collectors: сборщики дополнительных метрик; по умолчанию
+                           default_collectors().
+        :type collectors: list[Collector] | None
+        :param binary: отправлять образцы в компактном двоичном формате
+                       wire.py вместо JSON (поле window при этом не передаётся).
+        :type binary: bool
+        :param telemetry_interval: период отправки сводки самонаблюдения
+                                   агента, сек; None — не отправлять.
+        :type telemetry_interval: float | None
+        """
+        self.sampler = MetricSampler(sample_interval)
+        self.collectors = default_collectors() if collectors is None else collectors
+        self.binary = binary
+        self.transport = transport or HttpTransport()
+        self.spool = spool
+        self.replay_batch = replay_batch
+        self.replay_limiter = RateLimiter(replay_rate, replay_batch)
+        self.replay_jitter = replay_jitter
+        self.replay_at = 0.0 # момент (time.monotonic), раньше которого не досылать
+        self.online = True
+        self.telemetry = AgentTelemetry(telemetry_interval) if telemetry_interval else None
+
     def collect_metrics(self):
         """
-        Собрать текущие метрики системы.
+        Собрать метрики системы за окно с предыдущего вызова.
 
-        Определяет корректный путь к системному диску в зависимости от операционной
-        системы, вычисляет процент его заполнения и возвращает словарь с основными
-        показателями.
+        Не блокирует вызывающий поток: CPU и RAM берутся из кольцевого
+        буфера фонового сборщика. Если окно пусто (первый вызов), значение
+        снимается сразу. Определяет корректный путь к системному диску в
+        зависимости от операционной системы и вычисляет процент его
+        заполнения. Затем запускаются сборщики, у которых подошёл срок;
+        их последние значения передаются в блоке ext.
 
         :return: словарь с ключами:
                  - hostname: имя компьютера;
-                 - cpu: текущая загрузка CPU в процентах;
-                 - ram: использование оперативной памяти в процентах;
+                 - cpu: средняя загрузка CPU за окно в процентах;
+                 - ram: среднее использование оперативной памяти за окно в процентах;
                  - disk: заполненность системного диска в процентах;
-                 - processes: количество запущенных процессов.
+                 - processes: количество запущенных процессов (по данным
+                   ProcessCountCollector, если он подключён);
+                 - timestamp: время сбора (Unix-время, UTC);
+                 - window: min/avg/max/last по cpu и ram, число значений
+                   (samples) и длительность окна (seconds);
+                 - ext: значения сборщиков по их именам и стоимость
+                   каждого сборщика в мс (collector_cost_ms).
         :rtype: dict
         """
+        started = time.perf_counter()
+        self.sampler.ensure_started()
+        window = self.sampler.drain()
+        if not window:
+            window = [self.sampler.sample()]
+
+        cpu = summarize([value[1] for value in window])
+        ram = summarize([value[2] for value in window])
+        ext = self.run_collectors()
+        processes = ext.pop(ProcessCountCollector.name, None)
+
         system = platform.system()
         if system == 'Windows':
             disk_path = 'C:\\'
@@ -46,20 +1017,65 @@ class SystemMonitor:
         used_disk = disk_info.used
         disk_percent = (used_disk / total_disk) * 100 if total_disk > 0 else 0
 
+        if self.telemetry is not None:
+            self.telemetry.collect_ms.observe((time.perf_counter() - started) * 1000)
+
         return {
             'hostname': socket.gethostname(),
-            'cpu': psutil.cpu_percent(interval=1),
-            'ram': psutil.virtual_memory().percent,
+            'cpu': cpu['avg'],
+            'ram': ram['avg'],
             'disk': round(disk_percent, 1),
-            'processes': len(psutil.pids()),
+            'processes': processes,
+            'timestamp': round(time.time(), 3),
+            'window': {
+                'cpu': cpu,
+                'ram': ram,
+                'samples': len(window),
+                'seconds': round(window[-1][0] - window[0][0], 2),
+            },
+            'ext': ext,
         }
 
+    def run_collectors(self):
+        """
+        Запустить сборщики, у которых подошёл срок, и собрать их значения.
+
+        :return: значения сборщиков по именам и collector_cost_ms —
+                 средняя стоимость запуска каждого сборщика, мс.
+        :rtype: dict
+        """
+        now = time.monotonic()
+        ext = {}
+        costs = {}
+        for collector in self.collectors:
+            if collector.due(now):
+                cost = collector.run(now)
+                if self.telemetry is not None:
+                    self.telemetry.observe_collector(collector.name, cost)
+            if collector.value is not None:
+                ext[collector.name] = collector.value
+            if collector.cost_ms is not None:
+                costs[collector.name] = round(collector.cost_ms, 2)
+        ext['collector_cost_ms'] = costs
+        return ext
+
     def send_metrics(self, server_url):
         """
         Отправить собранные метрики на сервер SysMonitor.
 
         Формирует HTTP POST-запрос к эндпоинту /api/metrics, передавая метрики
-        в формате JSON. В случае успешного ответа сервера (код 200) возвращает True.
+        в формате JSON (или в двоичном формате, если binary=True) через
+        постоянное соединение транспорта. В случае успешного ответа сервера
+        (код 200) возвращает True. Пока после предыдущей ошибки не истекла
+        задержка повтора, запрос не выполняется.
+
+        Если задан дисковый буфер, образец, который не удалось отправить
+        из-за недоступности сервера, сохраняется в него вместе с исходным
+        временем сбора, а после восстановления связи накопленные образцы
+        досылаются пачками (см. replay_spool()).
+
+        Раз в telemetry_interval секунд к образцу прикладывается сводка
+        самонаблюдения агента (ext.telemetry, см. AgentTelemetry).
 
         :param server_url: базовый URL сервера SysMonitor
                            (например, "http://192.168.1.176:5000").
@@ -68,16 +1084,131 @@ class SystemMonitor:
         :rtype: bool
         """
         metrics = self.collect_metrics()
+        if self.telemetry is not None and self.telemetry.due(time.monotonic()):
+            metrics['ext']['telemetry'] = self.telemetry.report(time.monotonic(), self.spool)
+        if not self.transport.ready():
+            print("Отправка отложена: ожидание повтора после ошибки")
+            self._spool(metrics)
+            return False
+        started = time.perf_counter()
         try:
-            response = requests.post(
-                f'{server_url}/api/metrics',
-                json=metrics,
-            )
+            response = self.post_samples(f'{server_url}/api/metrics', [metrics], single=True)
             print("Ответ сервера:", response.status_code, response.text)
-            return response.status_code == 200
         except Exception as e:
             print("Ошибка отправки:", e)
+            self._observe_send(started, False)
+            self._spool(metrics)
+            return False
+        self._observe_send(started, response.status_code == 200)
+
+        if response.status_code >= 500 or response.status_code == 429:
+            self._spool(metrics)
             return False
+        if response.status_code != 200:
+            return False
+
+        if not self.online:
+            # связь восстановилась: досылка начнётся после случайной паузы,
+            # чтобы агенты всего парка не нагрузили сервер одновременно
+            self.online = True
+            self.replay_at = time.monotonic() + random.uniform(0, self.replay_jitter)
+        self.replay_spool(server_url)
+        return True
+
+    def post_samples(self, url, samples, single=False):
+        """
+        Отправить образцы в выбранном формате (JSON или двоичный wire.py).
+
+        :param url: полный адрес эндпоинта.
+        :type url: str
+        :param samples: образцы метрик.
+        :type samples: list[dict]
+        :param single: отправить единственный образец объектом JSON
+                       (формат /api/metrics), а не массивом.
+        :type single: bool
+        :return: ответ сервера.
+        :rtype: requests.Response
+        :raises requests.RequestException: при сетевой ошибке или таймауте.
+        """
+        if self.binary:
+            return self.transport.post(url, wire.encode(samples), wire.CONTENT_TYPE)
+        return self.transport.post_json(url, samples[0] if single else samples)
+
+    def _observe_send(self, started, ok, replayed=0):
+        """
+        Учесть запрос к серверу, начатый в момент started (perf_counter).
+        """
+        if self.telemetry is not None:
+            self.telemetry.observe_send((time.perf_counter() - started) * 1000, ok, replayed)
+
+    def _spool(self, metrics):
+        """
+        Сохранить неотправленный образец в дисковый буфер, если он задан.
+        """
+        self.online = False
+        if self.spool is not None:
+            self.spool.append(metrics)
+
+    def replay_spool(self, server_url):
+        """
+        Дослать накопленные в буфере образцы через /api/metrics/batch.
+
+        Объём досылки за вызов ограничен RateLimiter: не более replay_rate
+        образцов в секунду в среднем и не более replay_batch за один запрос.
+        Позиция в буфере сдвигается после успешного ответа сервера. Ответ
+        413 уменьшает пачку вдвое до следующего вызова; пачка, которую
+        сервер отклоняет окончательно (прочие ответы 4xx, кроме 408 и 429,
+        и 413 на один образец), отбрасывается и учитывается в
+        stats["dropped"], чтобы не задерживать досылку остального буфера.
+        Ошибки сети и остальные ответы (5xx, 408, 429) прерывают досылку
+        до следующего вызова.
+
+        :param server_url: базовый URL сервера SysMonitor.
+        :type server_url: str
+        :return: число досланных образцов.
+        :rtype: int
+        """
+        if self.spool is None or time.monotonic() < self.replay_at:
+            return 0
+
+        sent = 0
+        limit = self.replay_batch
+        while self.transport.ready():
+            budget = min(limit, self.replay_limiter.available())
+            if budget <= 0:
+                break
+            items, position = self.spool.read_batch(budget)
+            if position is None:
+                break
+            if items:
+                started = time.perf_counter()
+                try:
+                    response = self.post_samples(f'{server_url}/api/metrics/batch', items)
+                except Exception as e:
+                    print("Ошибка досылки:", e)
+                    self._observe_send(started, False)
+                    break
+                status = response.status_code
+                ok = status == 200
+                self._observe_send(started, ok, len(items) if ok else 0)
+                if status == 413 and len(items) > 1:
+                    limit = max(1, len(items) // 2)
+                    continue
+                if not ok and (not 400 <= status < 500 or status in (408, 429)):
+                    print("Ошибка досылки:", status)
+                    break
+                self.replay_limiter.consume(len(items))
+                if ok:
+                    sent += len(items)
+                    self.spool.stats['replayed'] += len(items)
+                else:
+                    print("Пачка отклонена сервером и отброшена:", status, len(items))
+                    self.spool.stats['dropped'] += len(items)
+            if not self.spool.commit(position) and not items:
+                break
+        if sent:
+            print("Дослано из буфера:", sent)
+        return sent
 
 
 if __name__ == '__main__':
@@ -90,8 +1221,9 @@ if __name__ == '__main__':
     # базовый адрес сервера SysMonitor (может быть заменён на внешний IP)
     server = 'http://127.0.0.1:5000'
 
-    # объект, отвечающий за сбор и отправку системных метрик
-    monitor = SystemMonitor()
+    # объект, отвечающий за сбор и отправку системных метрик;
+    # неотправленные образцы сохраняются на диск и досылаются позже
+    monitor = SystemMonitor(spool=Spool(default_spool_dir()))
     print('Собранные метрики:', monitor.collect_metrics())
     
     while True:
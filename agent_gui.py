@@ -12,7 +12,7 @@ import threading
 import time
 import tkinter as tk
 from tkinter import messagebox
-from agent import SystemMonitor  
+from agent import Spool, SystemMonitor, default_spool_dir
 
 # Цветовая палитра интерфейса приложения агента SysMonitor
 BG_MAIN = "#e5fff3"           # основной фон окна приложения
@@ -60,7 +60,8 @@ class AgentApp:
         self.root.geometry("520x260")
         self.root.resizable(False, False)
 
-        self.monitor = SystemMonitor() # объект для работы с метриками
+        # объект для работы с метриками; неотправленные образцы буферизуются на диске
+        self.monitor = SystemMonitor(spool=Spool(default_spool_dir()))
         self.running = False # флаг состояния мониторинга
         self.thread = None # фоновый поток, изначально отсутствует
 
@@ -217,7 +218,8 @@ class AgentApp:
         while self.running:
             ok = self.monitor.send_metrics(server_url)
             if ok:
-                self.set_status("Статус: данные отправлены", STATUS_OK)
+                latency = self.monitor.transport.stats['last_latency_ms']
+                self.set_status(f"Статус: данные отправлены ({latency:.0f} мс)", STATUS_OK)
             else:
                 self.set_status("Статус: ошибка отправки", STATUS_ERROR)
             time.sleep(interval)
@@ -284,13 +286,14 @@ class AgentApp:
         """
         Обработчик кнопки «Остановить».
 
-        Останавливает фоновый поток отправки метрик, переключает состояние
-        кнопок и обновляет статус на «остановлен».
+        Останавливает фоновый поток отправки метрик и фоновый сбор значений,
+        переключает состояние кнопок и обновляет статус на «остановлен».
         """
         if not self.running:
             return
 
         self.running = False
+        self.monitor.sampler.stop()
         self.start_btn.config(
             state=tk.NORMAL,
             bg=BUTTON_BG,
@@ -3,24 +3,39 @@
 
 Модуль содержит фабричную функцию create_app(), которая настраивает
 Flask-приложение, подключает базу данных, регистрирует blueprint с маршрутами
-и выполняет создание таблиц в базе данных.
+и подготавливает хранилище: создание таблиц и миграции схемы (app/storage.py).
+
+Любой параметр конфигурации можно переопределить переменной окружения с
+префиксом SYSMON_, например SYSMON_SQLALCHEMY_DATABASE_URI или
+SYSMON_INGEST_MODE=buffered; значения разбираются как JSON
+(SYSMON_CACHE_TTL=10, SYSMON_SCHEMA_AUTO_MIGRATE=false), вложенные ключи
+задаются через двойное подчёркивание (SYSMON_SQLITE_PRAGMAS__cache_size).
 """
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from datetime import timedelta
 import os
 
 # Глобальный объект базы данных, используемый всеми моделями приложения
 db = SQLAlchemy()
 
-def create_app():
+def create_app(config=None):
     """
     Создать и сконфигурировать экземпляр Flask-приложения SysMonitor.
 
     Настраивает секретный ключ, подключение к базе данных SQLite, включает
-    автообновление шаблонов, инициализирует SQLAlchemy и регистрирует blueprint
-    с маршрутами пользовательского интерфейса.
+    автообновление шаблонов, инициализирует SQLAlchemy, регистрирует blueprint
+    с маршрутами пользовательского интерфейса и применяет миграции схемы
+    (или, при SCHEMA_AUTO_MIGRATE = False, только проверяет версию схемы).
+
+    Порядок применения конфигурации: значения по умолчанию, переменные
+    окружения SYSMON_*, затем словарь config.
 
+    :param config: необязательный словарь с параметрами конфигурации,
+                   которые переопределяют значения по умолчанию
+                   (например, SQLALCHEMY_DATABASE_URI в тестах).
+    :type config: dict | None
     :return: сконфигурированное Flask-приложение.
     :rtype: flask.Flask
     """
@@ -33,12 +48,123 @@ def create_app():
     app.config['TEMPLATES_AUTO_RELOAD'] = True
     app.jinja_env.auto_reload = True
 
+    # Приём метрик: "sync" — запись в БД в обработчике запроса,
+    # "buffered" — через очередь в памяти и фоновый поток сброса
+    app.config['INGEST_MODE'] = 'sync'
+    app.config['INGEST_MAX_BATCH'] = 10000       # образцов в одном пакетном запросе
+    app.config['INGEST_MAX_BODY_BYTES'] = 64 * 1024 * 1024 # предел тела запроса, в том числе после распаковки gzip
+    app.config['INGEST_BUFFER_MAX_ROWS'] = 50000 # максимальная глубина очереди
+    app.config['INGEST_FLUSH_ROWS'] = 500        # сброс при накоплении стольких строк
+    app.config['INGEST_FLUSH_INTERVAL'] = 0.2    # или не реже чем раз в столько секунд
+    app.config['INGEST_OVERFLOW'] = 'drop_oldest' # политика переполнения: drop_oldest | reject
+
+    # Ярусы свёртки истории: имя -> длина интервала в секундах
+    app.config['ROLLUP_TIERS'] = {'1m': 60, '1h': 3600}
+    # Срок хранения по ярусам ("raw" — сырые измерения); None — бессрочно
+    app.config['RETENTION'] = {
+        'raw': timedelta(hours=48),
+        '1m': timedelta(days=30),
+        '1h': None,
+    }
+    app.config['RETENTION_ENABLED'] = True     # фоновое удаление устаревших данных
+    app.config['RETENTION_INTERVAL'] = 300     # период уплотнения, сек
+    app.config['RETENTION_CHUNK_ROWS'] = 5000  # строк в одной транзакции удаления
+    app.config['RETENTION_CHUNK_PAUSE'] = 0.05 # пауза между порциями, сек
+    app.config['RETENTION_LOCK_PATH'] = None   # блокировка ведущего процесса; по умолчанию instance/retention.lock
+
+    # Хранилище сырых измерений (app/metricstore.py): "sql" — таблица metric,
+    # "columnar" — столбцовые файлы в памяти (app/columnar.py), один процесс-писатель;
+    # "partitioned" — по файлу SQLite на период (app/partitions.py)
+    app.config['METRIC_STORE'] = 'sql'
+    app.config['METRIC_STORE_PATH'] = None        # каталог файлов хранилища; по умолчанию instance/metrics
+    app.config['METRIC_PARTITION'] = 'day'        # период раздела: day | week
+    app.config['METRIC_SEGMENT_ROWS'] = 4096      # строк в одном сегменте
+    app.config['METRIC_MAX_OPEN_SEGMENTS'] = 256  # сегментов, одновременно отображённых в память
+    app.config['METRIC_SEAL_ENABLED'] = True      # сжимать заполненные сегменты во фрагменты (columnar)
+    app.config['METRIC_SEAL_INTERVAL'] = 60       # период проверки сегментов, сек
+    app.config['METRIC_CHUNK_ROWS'] = 1024        # строк во фрагменте запечатанного сегмента
+
+    # Аналитика по парку (app/analytics.py)
+    app.config['ANALYTICS_STALE_SECONDS'] = 300            # компьютеры без измерений дольше не считаются текущими
+    app.config['ANALYTICS_BASELINE'] = timedelta(hours=24) # окно базовой линии CPU
+    app.config['ANALYTICS_SETTLE_SECONDS'] = 120           # интервал входит в базовую линию через столько секунд после конца
+    app.config['ANALYTICS_MIN_BASELINE_POINTS'] = 60       # интервалов в базовой линии, без которых отклонение не оценивается
+    app.config['ANALYTICS_MIN_STD'] = 1.0                  # нижняя граница σ, %
+
+    app.config['RANGE_MAX_POINTS'] = 1000 # предел числа точек в ответе /api/computers/<id>/metrics
+
+    app.config['COMPUTERS_PAGE_SIZE'] = 50       # компьютеров на странице списка по умолчанию
+    app.config['COMPUTERS_MAX_PAGE_SIZE'] = 500  # предел параметра limit
+
+    # Живые обновления списка компьютеров (SSE)
+    app.config['LIVE_POLL_INTERVAL'] = 1.0       # период опроса изменений, сек
+    app.config['LIVE_HISTORY'] = 10000           # изменений, хранимых в памяти для догоняющих клиентов
+    app.config['LIVE_HEARTBEAT'] = 15            # пинг при отсутствии изменений, сек
+    app.config['LIVE_STREAM_MAX_SECONDS'] = 60   # время жизни одного SSE-соединения, сек
+    app.config['LIVE_MAX_STREAMS'] = None        # одновременных SSE-соединений на процесс; None — без предела
+    app.config['LIVE_BUSY_RETRY'] = 30           # интервал опроса для клиентов сверх предела, сек
+    app.config['EXPORT_MAX_STREAMS'] = None      # одновременных выгрузок /api/export на процесс; None — без предела
+
+    # Кэш страниц /dashboard, /computers и /computer/<id> (app/cache.py)
+    app.config['CACHE_ENABLED'] = True
+    app.config['CACHE_MAX_ENTRIES'] = 256 # записей в LRU
+    app.config['CACHE_TTL'] = 30          # срок жизни записи, сек
+
+    # Самонаблюдение сервера: время запросов, SQL, скорость приёма (/metrics)
+    app.config['INSTRUMENTATION_ENABLED'] = True
+    app.config['SLOW_REQUEST_MS'] = 500          # журнал медленных запросов; None — выключен
+    app.config['SLOW_REQUEST_STATEMENTS'] = 10   # самых долгих SQL-запросов в записи журнала
+
+    # Схема базы: True — создавать таблицы и применять миграции при запуске
+    # (разработка); False — только проверять версию схемы, а миграции
+    # выполнять отдельно командой python serve.py --migrate
+    app.config['SCHEMA_AUTO_MIGRATE'] = True
+
+    # Пул соединений SQLAlchemy (см. engine_options() в app/storage.py)
+    app.config['DB_POOL_SIZE'] = 10      # постоянных соединений на процесс, обычно = числу потоков
+    app.config['DB_POOL_TIMEOUT'] = 30   # ожидание свободного соединения, сек
+
+    # PRAGMA, выполняемые на каждом новом соединении SQLite
+    app.config['SQLITE_PRAGMAS'] = {
+        'journal_mode': 'WAL',    # читатели не блокируют запись
+        'synchronous': 'NORMAL',  # в режиме WAL fsync только на контрольных точках
+        'cache_size': -16000,     # кэш страниц ~16 МБ
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,     # ждать блокировку до 5 с вместо ошибки
+    }
+
+    app.config.from_prefixed_env('SYSMON')
+    if config:
+        app.config.update(config)
+
+    from .storage import init_storage, check_backend, engine_options
+    check_backend(app.config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
     db.init_app(app)
 
+    from .metricstore import init_metric_store
+    from .columnar import init_sealer
+    from .ingest import init_ingest
+    from .retention import init_retention
+    from .live import init_live
+    from .streams import init_streams
+    from .alerts import init_alerts
+    from .instrumentation import init_instrumentation
+    from .cache import init_cache
+    from .analytics import init_analytics
     from .routes import main
     app.register_blueprint(main)
 
-    with app.app_context():
-        db.create_all()
+    init_storage(app)
+    init_metric_store(app)
+    init_sealer(app)
+    init_ingest(app)
+    init_retention(app)
+    init_live(app)
+    init_streams(app)
+    init_alerts(app)
+    init_instrumentation(app)
+    init_cache(app)
+    init_analytics(app)
 
     return app
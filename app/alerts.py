@@ -0,0 +1,330 @@
+"""
+Серверные правила оповещений и их потоковая проверка при приёме метрик.
+
+Правила (AlertRule) хранятся в базе и общие для всех операторов. Движок
+компилирует их в компактные объекты и держит в памяти процесса, пока не
+изменится версия правил (alert_rules_version). Состояние каждой пары
+(компьютер, правило) — с какого момента порог превышен (alert_pending) и
+открыто ли оповещение (alert_event) — хранится в базе, поэтому сервер,
+запущенный в нескольких процессах, ведёт его одинаково в любом из них.
+Каждый принятый образец проверяется только правилами своего компьютера,
+поэтому стоимость проверки — O(число правил хоста) на образец плюс два
+запроса состояния на пакет. Открытие и закрытие оповещений записывается
+в alert_event в той же транзакции, что и сами измерения; главная панель
+читает список открытых оповещений, а не пересчитывает его.
+"""
+
+import threading
+from datetime import timedelta
+
+from flask import current_app
+
+from . import db
+from .cache import bump_versions
+from .ingest import SAMPLE_FIELDS
+from .models import AlertEvent, AlertPending, AlertRule, AlertRulesVersion, ComputerState
+from .rollups import UPSERT_INSERTS
+
+# глобальные правила, создаваемые в новой базе
+DEFAULT_THRESHOLDS = {
+    'cpu': 85,
+    'ram': 80,
+    'disk': 90,
+}
+
+DEFAULT_HYSTERESIS = 5
+DEFAULT_SUSTAIN_SECONDS = 0
+
+
+class CompiledRule:
+    """
+    Правило, подготовленное к проверке: столбец образца и готовые границы.
+    """
+    __slots__ = ('id', 'metric', 'column', 'threshold', 'clear_below', 'sustain')
+
+    def __init__(self, rule):
+        """
+        :param rule: правило из базы.
+        :type rule: AlertRule
+        """
+        self.id = rule.id
+        self.metric = rule.metric
+        self.column = SAMPLE_FIELDS[rule.metric]
+        self.threshold = rule.threshold
+        self.clear_below = rule.threshold - (rule.hysteresis or 0)
+        self.sustain = timedelta(seconds=rule.sustain_seconds or 0)
+
+
+def rules_version():
+    """
+    Текущая версия правил оповещений.
+
+    :rtype: int
+    """
+    return db.session.scalar(db.select(AlertRulesVersion.version).where(AlertRulesVersion.id == 1)) or 0
+
+
+def rules_changed():
+    """
+    Увеличить версию правил оповещений.
+
+    Вызывается в транзакции, изменяющей правила, до её фиксации: после
+    фиксации каждый процесс сервера перечитает правила перед проверкой
+    следующего пакета.
+    """
+    result = db.session.execute(
+        db.update(AlertRulesVersion).where(AlertRulesVersion.id == 1)
+        .values(version=AlertRulesVersion.version + 1)
+    )
+    if not result.rowcount:
+        db.session.add(AlertRulesVersion(id=1, version=1))
+
+
+class AlertEngine:
+    """
+    Проверка правил оповещений по мере приёма образцов.
+
+    В памяти процесса хранятся только скомпилированные правила; они
+    перечитываются из базы, когда версия правил отличается от загруженной.
+    Открытые оповещения и начатые превышения компьютеров пакета читаются
+    из базы в транзакции, в которой пакет записывается, а изменения
+    записываются в неё же. Второе открытое оповещение той же пары не
+    создаётся, даже если два процесса проверяют её одновременно: вставку
+    отсекает уникальный частичный индекс ux_alert_event_open.
+
+    Основные атрибуты:
+        version (int | None): версия загруженных правил; None — правила
+                              ещё не загружены.
+        stats (dict): число оповещений, открытых и закрытых этим процессом.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.global_rules = {}
+        self.host_rules = {}
+        self.by_host = {}
+        self.stats = {'opened': 0, 'closed': 0}
+
+    def _load(self, version):
+        """
+        Прочитать и скомпилировать включённые правила.
+        """
+        global_rules, host_rules = {}, {}
+        for rule in db.session.scalars(db.select(AlertRule).where(AlertRule.enabled.is_(True))):
+            if rule.metric not in SAMPLE_FIELDS:
+                continue
+            target = global_rules if rule.computer_id is None else host_rules.setdefault(rule.computer_id, {})
+            target.setdefault(rule.metric, []).append(CompiledRule(rule))
+        self.global_rules = global_rules
+        self.host_rules = host_rules
+        self.by_host = {}
+        self.version = version
+
+    def rules_for(self, computer_id):
+        """
+        Правила, действующие для компьютера.
+
+        Правила компьютера заменяют глобальные правила по той же метрике.
+        Результат кэшируется до следующей перезагрузки правил.
+
+        :param computer_id: идентификатор компьютера.
+        :type computer_id: int
+        :rtype: list[CompiledRule]
+        """
+        rules = self.by_host.get(computer_id)
+        if rules is None:
+            own = self.host_rules.get(computer_id, {})
+            rules = [rule for group in own.values() for rule in group]
+            rules += [rule for metric, group in self.global_rules.items()
+                      if metric not in own for rule in group]
+            self.by_host[computer_id] = rules
+        return rules
+
+    def evaluate(self, rows):
+        """
+        Проверить правила по измерениям пакета.
+
+        Выполняется в текущей транзакции сессии до обновления
+        computer_state; фиксацию делает вызывающий код. Измерения старше
+        последнего проверенного измерения компьютера пропускаются.
+
+        :param rows: значения столбцов Metric, включая computer_id и timestamp.
+        :type rows: list[dict]
+        """
+        version = rules_version()
+        computer_ids = {row['computer_id'] for row in rows}
+        # блокировка защищает только кэш правил: запросы к базе идут без неё
+        with self.lock:
+            if version != self.version:
+                self._load(version)
+            rules = {computer_id: self.rules_for(computer_id) for computer_id in computer_ids}
+        if not any(rules.values()):
+            return
+
+        opened = {
+            (computer_id, rule_id) for computer_id, rule_id in db.session.execute(
+                db.select(AlertEvent.computer_id, AlertEvent.rule_id)
+                .where(AlertEvent.closed_at.is_(None), AlertEvent.computer_id.in_(computer_ids))
+            )
+        }
+        pending = dict(
+            ((computer_id, rule_id), since) for computer_id, rule_id, since in db.session.execute(
+                db.select(AlertPending.computer_id, AlertPending.rule_id, AlertPending.since)
+                .where(AlertPending.computer_id.in_(computer_ids))
+            )
+        )
+        stored = dict(pending)
+        # время последнего проверенного измерения каждого компьютера: пакет
+        # проверяется до обновления computer_state, поэтому здесь ещё
+        # прежнее значение
+        evaluated = dict(db.session.execute(
+            db.select(ComputerState.computer_id, ComputerState.timestamp)
+            .where(ComputerState.computer_id.in_(computer_ids))
+        ).all())
+
+        for row in sorted(rows, key=lambda row: row['timestamp']):
+            computer_id = row['computer_id']
+            last = evaluated.get(computer_id)
+            if last is not None and row['timestamp'] < last:
+                # досланное из спула старое измерение не должно закрывать
+                # или открывать оповещения задним числом
+                continue
+            for rule in rules[computer_id]:
+                value = row[rule.column]
+                if value is not None:
+                    self._check(rule, computer_id, value, row['timestamp'], opened, pending)
+        self._save_pending(stored, pending)
+
+    def _check(self, rule, computer_id, value, ts, opened, pending):
+        """
+        Обновить состояние пары (компьютер, правило) одним значением.
+
+        :param opened: открытые оповещения компьютеров пакета.
+        :type opened: set[tuple[int, int]]
+        :param pending: начатые превышения компьютеров пакета.
+        :type pending: dict[tuple[int, int], datetime.datetime]
+        """
+        key = (computer_id, rule.id)
+        if key in opened:
+            if value < rule.clear_below:
+                opened.discard(key)
+                result = db.session.execute(
+                    db.update(AlertEvent)
+                    .where(AlertEvent.computer_id == computer_id, AlertEvent.rule_id == rule.id,
+                           AlertEvent.closed_at.is_(None))
+                    .values(closed_at=ts)
+                )
+                self.stats['closed'] += result.rowcount
+        elif value >= rule.threshold:
+            since = pending.setdefault(key, ts)
+            if ts - since >= rule.sustain:
+                del pending[key]
+                opened.add(key)
+                insert = UPSERT_INSERTS[db.session.get_bind().dialect.name](AlertEvent)
+                result = db.session.execute(
+                    insert.values(rule_id=rule.id, computer_id=computer_id, metric=rule.metric,
+                                  threshold=rule.threshold, value=value, opened_at=since)
+                    .on_conflict_do_nothing(index_elements=['rule_id', 'computer_id'],
+                                            index_where=AlertEvent.closed_at.is_(None))
+                )
+                self.stats['opened'] += result.rowcount
+        else:
+            pending.pop(key, None)
+
+    @staticmethod
+    def _save_pending(stored, pending):
+        """
+        Записать в alert_pending изменения начатых превышений пакета.
+
+        :param stored: превышения, прочитанные из базы перед проверкой.
+        :param pending: превышения после проверки пакета.
+        """
+        stale = [key for key, since in stored.items() if pending.get(key) != since]
+        fresh = [key for key, since in pending.items() if stored.get(key) != since]
+        if stale:
+            db.session.execute(
+                db.delete(AlertPending)
+                .where(db.tuple_(AlertPending.computer_id, AlertPending.rule_id).in_(stale))
+            )
+        if fresh:
+            insert = UPSERT_INSERTS[db.session.get_bind().dialect.name](AlertPending)
+            db.session.execute(
+                insert.on_conflict_do_nothing(index_elements=['rule_id', 'computer_id']),
+                [{'computer_id': computer_id, 'rule_id': rule_id, 'since': pending[(computer_id, rule_id)]}
+                 for computer_id, rule_id in fresh],
+            )
+
+
+def get_global_rules():
+    """
+    Получить глобальные правила по метрикам CPU, RAM и диска.
+
+    :return: метрика -> правило (или None, если правила нет).
+    :rtype: dict[str, AlertRule | None]
+    """
+    rules = {metric: None for metric in DEFAULT_THRESHOLDS}
+    for rule in db.session.scalars(
+        db.select(AlertRule).where(AlertRule.computer_id.is_(None)).order_by(AlertRule.id)
+    ):
+        if rule.metric in rules and rules[rule.metric] is None:
+            rules[rule.metric] = rule
+    return rules
+
+
+def save_global_rules(thresholds, hysteresis, sustain_seconds):
+    """
+    Записать глобальные правила и увеличить версию правил.
+
+    :param thresholds: метрика -> порог.
+    :type thresholds: dict[str, float]
+    :param hysteresis: гистерезис для всех правил.
+    :type hysteresis: float
+    :param sustain_seconds: длительность превышения для всех правил, сек.
+    :type sustain_seconds: int
+    """
+    rules = get_global_rules()
+    for metric, threshold in thresholds.items():
+        rule = rules.get(metric)
+        if rule is None:
+            rule = AlertRule(metric=metric)
+            db.session.add(rule)
+        rule.threshold = threshold
+        rule.hysteresis = hysteresis
+        rule.sustain_seconds = sustain_seconds
+        rule.enabled = True
+    rules_changed()
+    db.session.commit()
+    bump_versions(config=True)
+
+
+def seed_default_rules():
+    """
+    Создать глобальные правила по умолчанию, если правил ещё нет.
+
+    Фиксацию транзакции выполняет вызывающий код (миграция схемы).
+    """
+    if db.session.execute(db.select(AlertRule.id).limit(1)).first() is not None:
+        return
+    for metric, threshold in DEFAULT_THRESHOLDS.items():
+        db.session.add(AlertRule(metric=metric, threshold=threshold,
+                                 hysteresis=DEFAULT_HYSTERESIS,
+                                 sustain_seconds=DEFAULT_SUSTAIN_SECONDS))
+
+
+def get_engine():
+    """
+    Движок оповещений текущего приложения.
+
+    :rtype: AlertEngine
+    """
+    return current_app.extensions['alerts']
+
+
+def init_alerts(app):
+    """
+    Создать движок оповещений и сохранить его в app.extensions["alerts"].
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    app.extensions['alerts'] = AlertEngine()
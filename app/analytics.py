@@ -0,0 +1,456 @@
+"""
+Аналитика по всему парку компьютеров на NumPy.
+
+Вопросы к парку целиком — распределение текущей загрузки, у кого быстрее
+всего растёт память, чья загрузка необычна для него самого — решаются
+запросом, возвращающим по строке на компьютер, результат которого
+раскладывается в массивы NumPy, и векторными операциями над ними, без
+объекта Python на компьютер:
+
+    fleet_percentiles() — p50/p95/p99 текущих CPU/RAM/диска
+                          (computer_state);
+    top_growth()        — наибольший прирост метрики за окно: наклон
+                          прямой наименьших квадратов по средним самого
+                          мелкого яруса свёртки, умноженный на длину окна;
+    anomalies()         — компьютеры, текущий CPU которых отклоняется от
+                          собственной базовой линии (среднее и σ средних
+                          за интервал яруса, ANALYTICS_BASELINE) больше
+                          чем на sigma σ.
+
+Прирост и базовая линия считаются по скользящим окнам (RollupWindow): по
+каждому компьютеру хранятся число интервалов и суммы значений, их
+квадратов и произведений на время. При вызове окно сдвигается: суммы
+интервалов, закрывшихся с прошлого вызова, добавляются, вышедших из окна —
+вычитаются, поэтому стоимость вызова не зависит от длины окна. Окно
+запоминает вклад каждого своего блока (WINDOW_BLOCKS блоков на окно) и
+вычитает ровно его, даже если в агрегаты блока позже дописались
+опоздавшие измерения.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from . import db
+from .metricstore import from_epoch, to_epoch
+from .models import Computer, ComputerState
+from .rollups import ROLLUP_FIELDS
+
+PERCENTILES = (50, 95, 99)
+
+# поле агрегата -> столбец ComputerState с текущим значением
+CURRENT_FIELDS = {name: column for name, column in ROLLUP_FIELDS.items() if name != 'processes'}
+
+# суммы окна по компьютеру: число интервалов, Σv, Σv², Σt, Σt², Σtv, где
+# v — среднее за интервал, t — его начало в секундах от начала отсчёта окна
+SUMS = ('count', 'v', 'vv', 't', 'tt', 'tv')
+
+# на сколько блоков делится окно; окно вычитает вклад блоков целиком,
+# поэтому его начало выравнивается на границу блока
+WINDOW_BLOCKS = 48
+
+
+def build_window_sql(name):
+    """
+    Суммы SUMS по блокам и компьютерам за интервал [start, end) яруса свёртки.
+
+    Интервал выбирается по индексу (resolution, bucket). Начало отсчёта
+    origin выровнено на границу блока, поэтому блок — это origin плюс
+    t, округлённое вниз до длины блока.
+    """
+    return text(
+        f'SELECT :origin + t / :block * :block AS block, computer_id,'
+        f'       count(*), sum(v), sum(v * v), sum(t), sum(t * t), sum(t * v) FROM ('
+        f'  SELECT computer_id, {name}_sum / {name}_count AS v,'
+        f'         CAST(strftime(\'%s\', bucket) AS INTEGER) - :origin AS t FROM metric_rollup'
+        f'  WHERE resolution = :resolution AND bucket >= :start AND bucket < :end AND {name}_count > 0'
+        f') GROUP BY block, computer_id'
+    ).bindparams(bindparam('start', type_=db.DateTime), bindparam('end', type_=db.DateTime))
+
+
+WINDOW_SQL = {name: build_window_sql(name) for name in ROLLUP_FIELDS}
+
+
+def as_arrays(rows, dtypes):
+    """
+    Разложить строки результата запроса по столбцам-массивам.
+
+    NULL в столбце float становится NaN.
+
+    :param rows: строки результата.
+    :type rows: list[tuple]
+    :param dtypes: тип NumPy каждого столбца.
+    :type dtypes: list
+    :rtype: list[numpy.ndarray]
+    """
+    if not rows:
+        return [np.empty(0, dtype=dtype) for dtype in dtypes]
+    return [np.array(column, dtype=dtype) for column, dtype in zip(zip(*rows), dtypes)]
+
+
+def widen(sums, width):
+    """
+    Дополнить массив сумм нулевыми столбцами до ширины width.
+
+    :type sums: numpy.ndarray
+    :type width: int
+    :rtype: numpy.ndarray
+    """
+    if width <= sums.shape[1]:
+        return sums
+    return np.pad(sums, ((0, 0), (0, width - sums.shape[1])))
+
+
+def load_current(now, max_age):
+    """
+    Текущие значения метрик компьютеров, приславших измерение не раньше
+    now - max_age, одним запросом к computer_state.
+
+    :type now: datetime.datetime
+    :type max_age: datetime.timedelta
+    :return: словарь "id" и поля CURRENT_FIELDS -> массив.
+    :rtype: dict[str, numpy.ndarray]
+    """
+    columns = [getattr(ComputerState, column) for column in CURRENT_FIELDS.values()]
+    rows = db.session.execute(
+        db.select(ComputerState.computer_id, *columns).where(ComputerState.timestamp >= now - max_age)
+    ).all()
+    arrays = as_arrays(rows, [np.int64] + [np.float64] * len(columns))
+    return dict(zip(['id', *CURRENT_FIELDS], arrays))
+
+
+def percentiles(values, q=PERCENTILES):
+    """
+    Перцентили значений без пропусков (NaN).
+
+    :type values: numpy.ndarray
+    :return: словарь "p50" -> значение; None, если значений нет.
+    :rtype: dict[str, float | None]
+    """
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {f'p{p}': None for p in q}
+    return {f'p{p}': round(float(value), 2) for p, value in zip(q, np.percentile(values, q))}
+
+
+def top_indices(scores, limit):
+    """
+    Номера limit наибольших значений по убыванию.
+
+    :type scores: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    if len(scores) > limit:
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def hostnames(ids):
+    """
+    Имена компьютеров по id одним запросом.
+
+    :rtype: dict[int, str]
+    """
+    if not len(ids):
+        return {}
+    return dict(db.session.execute(
+        db.select(Computer.id, Computer.hostname).where(Computer.id.in_([int(i) for i in ids]))
+    ).all())
+
+
+class RollupWindow:
+    """
+    Скользящее окно сумм SUMS одной метрики по каждому компьютеру.
+
+    Суммы хранятся в плотном массиве, индексом служит computer_id. Окно
+    заканчивается на последнем интервале яруса, закрытом не меньше settle
+    секунд назад: к этому времени приём обычно уже добавил к агрегату все
+    его измерения. Измерения, пришедшие позже, попадают в окно при полном
+    пересчёте — он выполняется, когда окно целиком сдвинулось со времени
+    предыдущего (и тогда же переносится начало отсчёта времени t).
+
+    Окно делится на блоки длиной block (window / WINDOW_BLOCKS, кратно
+    интервалу яруса), и вклад каждого блока хранится отдельно. Интервалы
+    выходят из окна целыми блоками, и из сумм вычитается запомненный
+    вклад, а не перечитанные агрегаты: опоздавшие измерения не уводят
+    суммы в минус. Начало окна выровнено на границу блока, поэтому окно
+    длиннее window меньше чем на один блок.
+
+    Основные атрибуты:
+        start, end (int | None): окно [start, end), Unix-время.
+        blocks (OrderedDict): начало блока -> суммы SUMS, добавленные из него.
+        stats (dict): число полных пересчётов и инкрементальных обновлений.
+    """
+    def __init__(self, name, resolution=60, window=timedelta(hours=24), settle=120):
+        """
+        :param name: поле агрегата из ROLLUP_FIELDS.
+        :type name: str
+        :param resolution: длина интервала яруса свёртки, сек.
+        :type resolution: int
+        :param window: длина окна.
+        :type window: datetime.timedelta
+        :param settle: сколько секунд после окончания интервала ждать,
+                       прежде чем включить его в окно.
+        :type settle: float
+        """
+        self.name = name
+        self.resolution = resolution
+        self.window = max(resolution, int(window.total_seconds()) // resolution * resolution)
+        self.block = max(resolution, self.window // WINDOW_BLOCKS // resolution * resolution)
+        self.settle = settle
+
+        self.lock = threading.Lock()
+        self.start = self.end = None
+        self.origin = 0
+        self.rebuilt_end = None
+        self.sums = np.zeros((len(SUMS), 1))
+        self.blocks = OrderedDict()
+        self.stats = {'rebuilds': 0, 'updates': 0}
+
+    def update(self, now=None):
+        """
+        Сдвинуть окно к текущему времени, прочитав только новые и
+        вышедшие из окна интервалы.
+
+        :param now: текущее время (UTC); параметр нужен для тестов.
+        :type now: datetime.datetime | None
+        """
+        now = now or datetime.utcnow()
+        end = int(to_epoch(now) - self.settle) // self.resolution * self.resolution
+        start = (end - self.window) // self.block * self.block
+        with self.lock:
+            if self.end is None or end < self.end or start >= self.rebuilt_end:
+                self.sums = np.zeros((len(SUMS), 1))
+                self.blocks.clear()
+                self.origin = start
+                self._add(start, end)
+                self.rebuilt_end = end
+                self.stats['rebuilds'] += 1
+            elif end > self.end:
+                self._add(self.end, end)
+                self._drop(start)
+                self.stats['updates'] += 1
+            self.start, self.end = start, end
+
+    def _add(self, start, end):
+        """
+        Добавить интервалы [start, end) к суммам окна и к вкладу их блоков.
+        """
+        if start >= end:
+            return
+        rows = db.session.execute(WINDOW_SQL[self.name], {
+            'resolution': self.resolution, 'origin': self.origin, 'block': self.block,
+            'start': from_epoch(start), 'end': from_epoch(end),
+        }).all()
+        if not rows:
+            return
+        blocks, ids, *sums = as_arrays(rows, [np.int64, np.int64] + [np.float64] * len(SUMS))
+        sums = np.array(sums)
+        width = int(ids.max()) + 1
+        self.sums = widen(self.sums, width)
+        # GROUP BY block, computer_id: в одном блоке каждый id встречается один раз
+        for block in np.unique(blocks):
+            rows = blocks == block
+            part = widen(self.blocks.get(int(block), np.zeros((len(SUMS), 1))), width)
+            part[:, ids[rows]] += sums[:, rows]
+            self.sums[:, ids[rows]] += sums[:, rows]
+            self.blocks[int(block)] = part
+
+    def _drop(self, start):
+        """
+        Вычесть из сумм окна запомненный вклад блоков, начавшихся раньше start.
+        """
+        for block in [block for block in self.blocks if block < start]:
+            part = self.blocks.pop(block)
+            self.sums[:, :part.shape[1]] -= part
+
+    def lookup(self, ids):
+        """
+        Статистика окна по компьютерам.
+
+        :type ids: numpy.ndarray
+        :return: словарь с массивами count (число интервалов), mean, std и
+                 slope (наклон прямой наименьших квадратов, единиц в
+                 секунду); где данных не хватает — NaN.
+        :rtype: dict[str, numpy.ndarray]
+        """
+        with self.lock:
+            known = ids < self.sums.shape[1]
+            sums = self.sums[:, np.where(known, ids, 0)] * known
+        count, v, vv, t, tt, tv = sums
+        count = np.maximum(count, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, v / count, np.nan)
+            variance = np.maximum(vv / count - mean * mean, 0)
+            spread = tt - t * t / count
+            slope = np.where((count > 1) & (spread > 0), (tv - t * v / count) / spread, np.nan)
+        return {'count': count, 'mean': mean, 'std': np.sqrt(variance), 'slope': slope}
+
+
+class WindowCache:
+    """
+    Окна RollupWindow по (метрике, длине окна), не больше max_windows
+    штук в LRU.
+    """
+    def __init__(self, resolution, settle=120, max_windows=8):
+        """
+        :param resolution: длина интервала яруса свёртки, сек.
+        :type resolution: int
+        :param settle: задержка включения интервала в окно, сек.
+        :type settle: float
+        :param max_windows: сколько окон держать в памяти.
+        :type max_windows: int
+        """
+        self.resolution = resolution
+        self.settle = settle
+        self.max_windows = max_windows
+        self.lock = threading.Lock()
+        self.windows = OrderedDict()
+
+    def get(self, name, window):
+        """
+        Окно метрики name длиной window, сдвинутое к текущему времени
+        вызывающим кодом (RollupWindow.update()).
+
+        :type name: str
+        :type window: datetime.timedelta
+        :rtype: RollupWindow
+        """
+        key = (name, int(window.total_seconds()))
+        with self.lock:
+            stats = self.windows.get(key)
+            if stats is None:
+                stats = self.windows[key] = RollupWindow(name, self.resolution, window, self.settle)
+                while len(self.windows) > self.max_windows:
+                    self.windows.popitem(last=False)
+            self.windows.move_to_end(key)
+        return stats
+
+
+def fleet_percentiles(now=None):
+    """
+    p50/p95/p99 текущих CPU, RAM и диска по компьютерам, приславшим
+    измерение за последние ANALYTICS_STALE_SECONDS секунд.
+
+    :param now: текущее время (UTC); параметр нужен для тестов.
+    :type now: datetime.datetime | None
+    :rtype: dict
+    """
+    now = now or datetime.utcnow()
+    current = load_current(now, timedelta(seconds=current_app.config['ANALYTICS_STALE_SECONDS']))
+    result = {'hosts': len(current['id'])}
+    for name in CURRENT_FIELDS:
+        result[name] = percentiles(current[name])
+    return result
+
+
+def top_growth(name='ram', window=timedelta(hours=1), limit=20, now=None):
+    """
+    Компьютеры с наибольшим приростом метрики за окно.
+
+    Прирост — наклон прямой наименьших квадратов по средним за интервалы
+    яруса внутри окна, умноженный на длину окна: в отличие от разности
+    крайних точек он не зависит от случайного всплеска на краю окна.
+    Компьютеры меньше чем с двумя интервалами в окне не учитываются.
+
+    :param name: поле агрегата из ROLLUP_FIELDS.
+    :type name: str
+    :type window: datetime.timedelta
+    :type limit: int
+    :param now: текущее время (UTC); параметр нужен для тестов.
+    :type now: datetime.datetime | None
+    :return: до limit записей по убыванию прироста.
+    :rtype: list[dict]
+    """
+    stats = get_windows().get(name, window)
+    stats.update(now)
+    found = stats.lookup(np.arange(stats.sums.shape[1]))
+    ids = np.flatnonzero(~np.isnan(found['slope']))
+    delta = found['slope'][ids] * stats.window
+
+    order = ids[top_indices(delta, limit)]
+    names = hostnames(order)
+    return [{
+        'computer_id': int(i),
+        'hostname': names.get(int(i)),
+        'growth': round(float(found['slope'][i] * stats.window), 2),
+        'mean': round(float(found['mean'][i]), 2),
+        'points': int(found['count'][i]),
+    } for i in order]
+
+
+def anomalies(sigma=3.0, now=None):
+    """
+    Компьютеры, текущий CPU которых отличается от среднего их базовой
+    линии больше чем на sigma σ.
+
+    σ ограничена снизу ANALYTICS_MIN_STD, чтобы простаивающий компьютер с
+    почти постоянной загрузкой не попадал в список от любого всплеска;
+    компьютеры с базовой линией короче ANALYTICS_MIN_BASELINE_POINTS
+    интервалов не оцениваются.
+
+    :type sigma: float
+    :param now: текущее время (UTC); параметр нужен для тестов.
+    :type now: datetime.datetime | None
+    :return: записи по убыванию |z|.
+    :rtype: list[dict]
+    """
+    now = now or datetime.utcnow()
+    config = current_app.config
+    baselines = get_windows().get('cpu', config['ANALYTICS_BASELINE'])
+    baselines.update(now)
+
+    current = load_current(now, timedelta(seconds=config['ANALYTICS_STALE_SECONDS']))
+    ids, cpu = current['id'], current['cpu']
+    baseline = baselines.lookup(ids)
+    with np.errstate(invalid='ignore'):
+        z = (cpu - baseline['mean']) / np.maximum(baseline['std'], config['ANALYTICS_MIN_STD'])
+        flagged = (np.abs(z) > sigma) & (baseline['count'] >= config['ANALYTICS_MIN_BASELINE_POINTS'])
+
+    found = np.flatnonzero(flagged)
+    found = found[np.argsort(-np.abs(z[found]), kind='stable')]
+    names = hostnames(ids[found])
+    return [{
+        'computer_id': int(ids[i]),
+        'hostname': names.get(int(ids[i])),
+        'cpu': round(float(cpu[i]), 2),
+        'baseline_mean': round(float(baseline['mean'][i]), 2),
+        'baseline_std': round(float(baseline['std'][i]), 2),
+        'baseline_points': int(baseline['count'][i]),
+        'z': round(float(z[i]), 2),
+    } for i in found]
+
+
+def get_windows():
+    """
+    Кэш скользящих окон текущего приложения; None, если ярусы свёртки не
+    настроены.
+
+    :rtype: WindowCache | None
+    """
+    return current_app.extensions.get('analytics')
+
+
+def init_analytics(app):
+    """
+    Создать кэш скользящих окон и сохранить его в app.extensions["analytics"].
+
+    Окна строятся по самому мелкому ярусу свёртки; без ярусов кэш не
+    создаётся.
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    tiers = app.config['ROLLUP_TIERS']
+    if not tiers:
+        return
+    app.extensions['analytics'] = WindowCache(
+        resolution=min(tiers.values()),
+        settle=app.config['ANALYTICS_SETTLE_SECONDS'],
+    )
@@ -0,0 +1,211 @@
+"""
+Кэш отрисованных страниц с инвалидацией по приёму метрик.
+
+Страницы /dashboard, /computers и /computer/<id> меняются только когда
+приходят новые измерения или меняются правила оповещений, а между тактами
+агентов запрашиваются многократно. Готовый ответ кэшируется вместе с
+версией данных, на которых он построен:
+
+- глобальная версия увеличивается при каждом сохранении пакета метрик и
+  при изменении правил; от неё зависят сводные страницы;
+- версия компьютера увеличивается при сохранении его измерений, а версия
+  настроек — при изменении правил оповещений; только от них зависит
+  страница компьютера, поэтому измерения других хостов её не сбрасывают.
+
+Запись с устаревшей версией или старше CACHE_TTL секунд не используется;
+число записей ограничено CACHE_MAX_ENTRIES с вытеснением давно не
+использованных (LRU). Каждому ответу присваивается ETag, и повторный
+запрос браузера с If-None-Match получает 304 без тела.
+
+Версии хранятся в памяти процесса: если сервер запущен в нескольких
+процессах, изменения из соседнего процесса видны после истечения TTL.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, make_response, request
+
+
+class CacheEntry:
+    """
+    Закэшированный ответ и версия данных, на которых он построен.
+    """
+    __slots__ = ('version', 'expires', 'body', 'mimetype', 'etag')
+
+    def __init__(self, version, expires, body, mimetype):
+        self.version = version
+        self.expires = expires
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class ViewCache:
+    """
+    LRU-кэш ответов с TTL и счётчиками версий.
+
+    Основные атрибуты:
+        global_version (int): версия сводных данных.
+        config_version (int): версия правил и настроек.
+        host_versions (dict): computer_id -> версия данных компьютера.
+        stats (dict): hits, misses, evictions.
+    """
+    def __init__(self, max_entries=256, ttl=30.0):
+        """
+        :param max_entries: максимальное число записей.
+        :type max_entries: int
+        :param ttl: время жизни записи, сек.
+        :type ttl: float
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.global_version = 0
+        self.config_version = 0
+        self.host_versions = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def version(self, computer_id=None):
+        """
+        Текущая версия данных страницы.
+
+        :param computer_id: компьютер страницы; None — сводная страница.
+        :type computer_id: int | None
+        :rtype: int | tuple[int, int]
+        """
+        if computer_id is None:
+            return self.global_version
+        return self.config_version, self.host_versions.get(computer_id, 0)
+
+    def bump(self, computer_ids=(), config=False):
+        """
+        Отметить изменение данных.
+
+        Глобальная версия увеличивается всегда; версии перечисленных
+        компьютеров и версия настроек — дополнительно.
+
+        :param computer_ids: компьютеры, чьи измерения изменились.
+        :type computer_ids: Iterable[int]
+        :param config: изменились правила или настройки.
+        :type config: bool
+        """
+        with self.lock:
+            self.global_version += 1
+            if config:
+                self.config_version += 1
+            for computer_id in computer_ids:
+                self.host_versions[computer_id] = self.host_versions.get(computer_id, 0) + 1
+
+    def get(self, key, version):
+        """
+        Получить запись, если она построена на текущей версии и не истекла.
+
+        :rtype: CacheEntry | None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.version != version or entry.expires <= time.monotonic():
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, key, version, body, mimetype):
+        """
+        Сохранить ответ, вытеснив давно не использованные записи.
+
+        :rtype: CacheEntry
+        """
+        entry = CacheEntry(version, time.monotonic() + self.ttl, body, mimetype)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return entry
+
+    def snapshot(self):
+        """
+        Счётчики кэша и число записей.
+
+        :rtype: dict
+        """
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries))
+
+
+def bump_versions(computer_ids=(), config=False):
+    """
+    Сбросить кэш страниц, зависящих от изменившихся данных.
+
+    Вызывается после фиксации пакета метрик и (с config=True) после
+    изменения правил.
+
+    :param computer_ids: компьютеры, чьи измерения изменились.
+    :type computer_ids: Iterable[int]
+    :param config: изменились правила или настройки.
+    :type config: bool
+    """
+    cache = current_app.extensions.get('view_cache')
+    if cache is not None:
+        cache.bump(computer_ids, config)
+
+
+def cached_view(host_arg=None):
+    """
+    Декоратор представления: отдавать готовый ответ из ViewCache.
+
+    Кэшируются только успешные GET-ответы. Ключ — эндпоинт, строка запроса
+    и, для страниц компьютера, его id. Декоратор ставится после проверки
+    входа (login_required), чтобы кэш не обходил авторизацию.
+
+    :param host_arg: имя аргумента представления с id компьютера; None —
+                     страница зависит от всех компьютеров.
+    :type host_arg: str | None
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(*args, **kwargs):
+            cache = current_app.extensions.get('view_cache')
+            if cache is None or request.method != 'GET':
+                return view_func(*args, **kwargs)
+
+            computer_id = kwargs.get(host_arg) if host_arg else None
+            key = (request.endpoint, request.query_string, computer_id)
+            # версия читается до построения ответа: если во время отрисовки
+            # придут новые метрики, запись сразу окажется устаревшей
+            version = cache.version(computer_id)
+            entry = cache.get(key, version)
+            if entry is None:
+                response = make_response(view_func(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                entry = cache.put(key, version, response.get_data(), response.mimetype)
+
+            response = Response(entry.body, mimetype=entry.mimetype)
+            response.set_etag(entry.etag)
+            # браузер всегда переспрашивает, но при совпадении ETag получает 304
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response.make_conditional(request)
+        return wrapped
+    return decorator
+
+
+def init_cache(app):
+    """
+    Создать кэш страниц, если он включён в конфигурации.
+
+    Объект сохраняется в app.extensions["view_cache"].
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    if app.config['CACHE_ENABLED']:
+        app.extensions['view_cache'] = ViewCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_TTL'])
@@ -0,0 +1,148 @@
+"""
+Сжатое кодирование фрагментов (chunks) ряда измерений.
+
+Фрагмент — несколько столбцов одинаковой длины (array.array), которые
+кодируются и распаковываются независимо от других фрагментов. Способ
+кодирования столбца определяется его типом:
+
+    q (id)         — дельта от дельты (delta-of-delta): при почти
+                     постоянном шаге значения почти все равны нулю;
+    d (timestamp)  — то же по целым микросекундам Unix-времени;
+    f (cpu/ram/...)— XOR битового представления float32 с предыдущим
+                     значением: у медленно меняющихся величин совпадают
+                     знак, порядок и старшие биты мантиссы, и результат
+                     состоит в основном из нулевых байтов;
+    i (processes)  — дельта.
+
+Закодированный столбец сжимается deflate (zlib). В отличие от побитового
+кодирования Gorilla формат выровнен по байтам: кодирование и
+декодирование выполняются операциями array/itertools/zlib над столбцом
+целиком, без цикла Python на каждое значение. Числа записываются в
+порядке байтов little-endian.
+"""
+
+import operator
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate, chain
+
+# число строк и число столбцов фрагмента
+CHUNK_HEADER = struct.Struct('<IB')
+# код типа столбца и длина сжатых данных
+COLUMN_HEADER = struct.Struct('<cI')
+COMPRESS_LEVEL = 6
+
+
+def deltas(values):
+    """
+    Разности соседних значений; первая — само значение.
+
+    :rtype: array.array
+    """
+    return array('q', map(operator.sub, values, chain([0], values)))
+
+
+def little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def from_bytes(typecode, data):
+    values = array(typecode, data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def encode_column(values):
+    """
+    Закодировать и сжать один столбец.
+
+    :param values: значения столбца с кодом типа q, d, f или i.
+    :type values: array.array
+    :rtype: bytes
+    """
+    code = values.typecode
+    if code == 'f':
+        bits = array('I', values.tobytes())
+        encoded = array('I', map(operator.xor, bits, chain([0], bits)))
+    elif code == 'i':
+        encoded = deltas(values)
+    elif code == 'q':
+        encoded = deltas(deltas(values))
+    elif code == 'd':
+        encoded = deltas(deltas(array('q', map(round, map((1e6).__mul__, values)))))
+    else:
+        raise ValueError(f'unsupported column type: {code}')
+    return zlib.compress(little_endian(encoded).tobytes(), COMPRESS_LEVEL)
+
+
+def decode_column(code, payload):
+    """
+    Распаковать столбец, закодированный encode_column().
+
+    :rtype: array.array
+    """
+    data = zlib.decompress(payload)
+    if code == 'f':
+        bits = array('I', accumulate(from_bytes('I', data), operator.xor))
+        return array('f', bits.tobytes())
+    encoded = from_bytes('q', data)
+    if code == 'i':
+        return array('i', accumulate(encoded))
+    values = accumulate(accumulate(encoded))
+    if code == 'q':
+        return array('q', values)
+    if code == 'd':
+        # деление, а не умножение на 1e-6: даёт то же число, что и исходное
+        return array('d', map((1e6).__rtruediv__, values))
+    raise ValueError(f'unsupported column type: {code}')
+
+
+def encode_chunk(columns):
+    """
+    Закодировать фрагмент.
+
+    :param columns: столбцы одинаковой длины.
+    :type columns: list[array.array]
+    :rtype: bytes
+    """
+    rows = len(columns[0]) if columns else 0
+    headers = []
+    payloads = []
+    for values in columns:
+        if len(values) != rows:
+            raise ValueError('columns of a chunk must have the same length')
+        payload = encode_column(values)
+        headers.append(COLUMN_HEADER.pack(values.typecode.encode(), len(payload)))
+        payloads.append(payload)
+    return b''.join([CHUNK_HEADER.pack(rows, len(columns)), *headers, *payloads])
+
+
+def decode_chunk(data):
+    """
+    Распаковать фрагмент, закодированный encode_chunk().
+
+    :type data: bytes | memoryview
+    :return: столбцы в исходном порядке.
+    :rtype: list[array.array]
+    """
+    rows, count = CHUNK_HEADER.unpack_from(data)
+    offset = CHUNK_HEADER.size
+    headers = []
+    for _ in range(count):
+        headers.append(COLUMN_HEADER.unpack_from(data, offset))
+        offset += COLUMN_HEADER.size
+
+    columns = []
+    for code, length in headers:
+        values = decode_column(code.decode(), data[offset:offset + length])
+        if len(values) != rows:
+            raise ValueError('corrupt chunk: column length mismatch')
+        columns.append(values)
+        offset += length
+    return columns
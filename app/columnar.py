@@ -0,0 +1,879 @@
+"""
+Столбцовое хранилище сырых измерений на файлах, отображаемых в память.
+
+Ряд каждого компьютера хранится в каталоге <root>/<computer_id>/ как
+последовательность сегментов фиксированной ёмкости. Сегмент — один файл:
+заголовок и столбцы id (int64), timestamp (float64, Unix-время),
+cpu/ram/disk (float32, NaN — нет значения) и processes (int32, -1 — нет
+значения), каждый в своей непрерывной области. Файл отображается в
+память (mmap): запись пакета — копирование готовых массивов в области
+столбцов, без объекта на строку; чтение интервала — срезы memoryview без
+копирования, границы которых находятся двоичным поиском по времени.
+
+Заголовок хранит число строк, границы времени и наибольший id и
+пишется после данных: строки, не попавшие в заголовок при аварийном
+завершении процесса, просто не видны. Заголовки всех сегментов держатся в
+памяти и служат индексом: при чтении сегменты, не пересекающие интервал,
+не открываются. Поле extra пишется построчно в NDJSON рядом с сегментом
+(<сегмент>.extra) и при чтении подставляется в измерения по id.
+
+Свежие измерения остаются в сегменте, в который идёт запись. Заполненный
+сегмент фоновое задание (SealJob) пересжимает в файл .chk: независимо
+распаковываемые фрагменты по METRIC_CHUNK_ROWS строк с кодированием
+delta-of-delta для времени и XOR/дельтами для значений (app/chunks.py) и
+оглавлением с границами времени фрагментов. Чтение длинного интервала
+распаковывает только нужные фрагменты, последние из них держатся в LRU.
+
+Уплотнение удаляет сегменты целиком, когда их самое новое измерение
+старше срока хранения. Каталог хранилища блокируется при открытии:
+писать в него может только один процесс.
+"""
+
+import atexit
+import bisect
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка каталога не выполняется
+    fcntl = None
+
+from .chunks import decode_chunk, encode_chunk
+from .metricstore import MetricRecord, MetricStore, bucket_stats, from_epoch, to_epoch
+from .rollups import ROLLUP_FIELDS
+
+MAGIC = b'SMTS'
+SEALED_MAGIC = b'SMTC'
+VERSION = 1
+# сигнатура, версия, столбец времени упорядочен, ёмкость, число строк,
+# наименьшее и наибольшее время, наибольший id
+HEADER = struct.Struct('<4sHBxIQddq')
+HEADER_SIZE = 64
+# запечатанный сегмент: число фрагментов (сразу за заголовком) и запись
+# оглавления — смещение, длина, число строк, наименьшее и наибольшее время
+CHUNK_COUNT = struct.Struct('<I')
+CHUNK_ENTRY = struct.Struct('<QIIdd')
+
+# столбец -> код типа array/memoryview; столбцы по 8 байт идут первыми,
+# поэтому при ёмкости, кратной 8, все области выровнены
+COLUMNS = {
+    'id': 'q',
+    'timestamp': 'd',
+    'cpu_percent': 'f',
+    'memory_usage': 'f',
+    'disk_usage': 'f',
+    'processes': 'i',
+}
+MISSING_INT = -1
+NAN = float('nan')
+
+logger = logging.getLogger(__name__)
+
+
+def narrow(value):
+    """
+    Значение столбца float32 как число Python без «хвоста» округления.
+
+    23.1 хранится как 23.100000381..., поэтому значение приводится к 7
+    значащим цифрам — точности float32. NaN означает пропуск.
+
+    :rtype: float | None
+    """
+    if value != value:
+        return None
+    return float(f'{value:.7g}')
+
+
+def present(values, code):
+    """
+    Значения столбца без пропусков.
+
+    :param values: список значений столбца.
+    :type values: list
+    :param code: код типа столбца.
+    :type code: str
+    :rtype: list
+    """
+    if code == 'f':
+        return [value for value in values if value == value]
+    return [value for value in values if value != MISSING_INT]
+
+
+class Segment:
+    """
+    Один файл сегмента и его заголовок в памяти.
+
+    Основные атрибуты:
+        rows (int): число записанных строк; 0 — сегмент пуст или удалён.
+        min_ts, max_ts (float): границы времени измерений, Unix-время.
+        ordered (bool): столбец времени не убывает — можно искать
+            границы интервала двоичным поиском.
+    """
+    __slots__ = ('path', 'seq', 'capacity', 'rows', 'min_ts', 'max_ts', 'last_id', 'ordered', 'offsets')
+
+    def __init__(self, path, seq, capacity, rows=0, min_ts=math.inf, max_ts=-math.inf,
+                 last_id=0, ordered=True):
+        self.path = path
+        self.seq = seq
+        self.capacity = capacity
+        self.rows = rows
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.last_id = last_id
+        self.ordered = ordered
+
+        self.offsets = {}
+        offset = HEADER_SIZE
+        for name, code in COLUMNS.items():
+            self.offsets[name] = offset
+            offset += capacity * array(code).itemsize
+
+    @property
+    def size(self):
+        """
+        Размер файла сегмента, байт.
+
+        :rtype: int
+        """
+        return self.offsets['processes'] + self.capacity * array('i').itemsize
+
+    @property
+    def extra_path(self):
+        return os.path.splitext(self.path)[0] + '.extra'
+
+    def overlaps(self, start, end):
+        """
+        Пересекает ли сегмент интервал [start, end) Unix-времени.
+
+        :rtype: bool
+        """
+        return self.rows > 0 and self.min_ts < end and self.max_ts >= start
+
+    def pack_header(self):
+        return HEADER.pack(MAGIC, VERSION, self.ordered, self.capacity, self.rows,
+                           self.min_ts, self.max_ts, self.last_id)
+
+    @classmethod
+    def load(cls, path, seq):
+        """
+        Прочитать заголовок существующего сегмента.
+
+        :rtype: Segment
+        :raises ValueError: если файл не является сегментом хранилища.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f'{path}: truncated segment header')
+        magic, version, ordered, capacity, rows, min_ts, max_ts, last_id = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path}: not a metric segment')
+        return cls(path, seq, capacity, rows, min_ts, max_ts, last_id, bool(ordered))
+
+
+class SealedSegment(Segment):
+    """
+    Запечатанный сегмент: заполненный сегмент, пересжатый во фрагменты
+    (app/chunks.py) по chunk_rows строк.
+
+    Файл .chk содержит тот же заголовок, что и сегмент (с сигнатурой
+    SEALED_MAGIC), число фрагментов, их оглавление (смещение, длина, число
+    строк, границы времени) и сами фрагменты. Чтение распаковывает только
+    фрагменты, пересекающие интервал.
+    """
+    __slots__ = ('chunks',)
+
+    def __init__(self, *args, chunks=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chunks = list(chunks)
+
+    @classmethod
+    def write(cls, path, segment, columns, chunk_rows):
+        """
+        Записать столбцы заполненного сегмента в файл фрагментов.
+
+        Файл пишется во временный и переименовывается, поэтому при сбое
+        на диске остаётся либо прежний сегмент, либо готовый файл.
+
+        :param columns: столбцы сегмента (memoryview) в порядке COLUMNS.
+        :type columns: dict[str, memoryview]
+        :rtype: SealedSegment
+        """
+        blobs = []
+        chunks = []
+        offset = HEADER_SIZE + CHUNK_ENTRY.size * -(-segment.rows // chunk_rows)
+        for first in range(0, segment.rows, chunk_rows):
+            last = min(first + chunk_rows, segment.rows)
+            blob = encode_chunk([array(code, columns[name][first:last].tobytes()) for name, code in COLUMNS.items()])
+            timestamps = columns['timestamp'][first:last]
+            chunks.append((offset, len(blob), last - first, min(timestamps), max(timestamps)))
+            blobs.append(blob)
+            offset += len(blob)
+
+        sealed = cls(path, segment.seq, segment.capacity, segment.rows, segment.min_ts, segment.max_ts,
+                     segment.last_id, segment.ordered, chunks=chunks)
+        header = bytearray(HEADER_SIZE)
+        header[:HEADER.size] = sealed.pack_header()
+        CHUNK_COUNT.pack_into(header, HEADER.size, len(chunks))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(header)
+            f.writelines(CHUNK_ENTRY.pack(*chunk) for chunk in chunks)
+            f.writelines(blobs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        return sealed
+
+    def pack_header(self):
+        return HEADER.pack(SEALED_MAGIC, VERSION, self.ordered, self.capacity, self.rows,
+                           self.min_ts, self.max_ts, self.last_id)
+
+    @classmethod
+    def load(cls, path, seq):
+        """
+        Прочитать заголовок и оглавление запечатанного сегмента.
+
+        :rtype: SealedSegment
+        :raises ValueError: если файл не является запечатанным сегментом.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise ValueError(f'{path}: truncated segment header')
+            magic, version, ordered, capacity, rows, min_ts, max_ts, last_id = HEADER.unpack_from(header)
+            if magic != SEALED_MAGIC or version != VERSION:
+                raise ValueError(f'{path}: not a sealed metric segment')
+            count, = CHUNK_COUNT.unpack_from(header, HEADER.size)
+            chunks = list(CHUNK_ENTRY.iter_unpack(f.read(CHUNK_ENTRY.size * count)))
+        return cls(path, seq, capacity, rows, min_ts, max_ts, last_id, bool(ordered), chunks=chunks)
+
+
+class ColumnarMetricStore(MetricStore):
+    """
+    Сырые измерения в сегментах столбцовых файлов, по каталогу на компьютер.
+
+    Отображения открытых сегментов хранятся в LRU не более max_open
+    штук (каждое держит файловый дескриптор). Запись и работа с LRU
+    выполняются под одной блокировкой; чтение берёт под ней только
+    memoryview сегмента и число строк, а дальше идёт без блокировки:
+    запись добавляет строки за пределами прочитанного числа.
+
+    Основные атрибуты:
+        root (str): каталог хранилища.
+        series (dict[int, list[Segment]]): сегменты по компьютерам, по
+            возрастанию номера.
+        next_id (int): id, следующий за наибольшим записанным.
+    """
+    def __init__(self, root, segment_rows=4096, max_open=256, first_id=1, chunk_rows=1024,
+                 max_decoded=64, allocate=None):
+        """
+        :param root: каталог хранилища; создаётся при необходимости.
+        :type root: str
+        :param segment_rows: ёмкость нового сегмента, строк (округляется
+                             вверх до кратной 8).
+        :type segment_rows: int
+        :param max_open: предел числа одновременно отображённых сегментов.
+        :type max_open: int
+        :param first_id: наименьший id для новых измерений.
+        :type first_id: int
+        :param chunk_rows: строк во фрагменте запечатанного сегмента.
+        :type chunk_rows: int
+        :param max_decoded: распакованных фрагментов, хранимых в LRU.
+        :type max_decoded: int
+        :param allocate: выдача id измерений в транзакции основной базы
+                         (allocate_ids); None — счётчик процесса, начиная
+                         с next_id.
+        :type allocate: Callable[[int], range] | None
+        """
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.segment_rows = -(-segment_rows // 8) * 8
+        self.max_open = max_open
+        self.chunk_rows = chunk_rows
+        self.max_decoded = max_decoded
+        self.allocate = allocate
+
+        self.lock = threading.Lock()
+        self.pending = threading.local()
+        self.maps = OrderedDict()
+        self.decoded = OrderedDict()
+        self.extras = OrderedDict()
+        self.lock_file = self._lock_directory()
+
+        self.series = {}
+        for name in os.listdir(root):
+            if name.isdigit() and os.path.isdir(os.path.join(root, name)):
+                self.series[int(name)] = self._load_series(os.path.join(root, name))
+        self.next_id = max([first_id] + [
+            segment.last_id + 1 for segments in self.series.values() for segment in segments
+        ])
+
+    def _lock_directory(self):
+        """
+        Заблокировать каталог хранилища от записи другими процессами.
+
+        :raises RuntimeError: если каталог уже открыт другим процессом.
+        """
+        lock_file = open(os.path.join(self.root, 'LOCK'), 'a+b')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise RuntimeError(f'metric store {self.root} is used by another process')
+        return lock_file
+
+    @staticmethod
+    def _load_series(directory):
+        """
+        Прочитать заголовки сегментов компьютера.
+
+        Если сбой прервал запечатывание после записи файла фрагментов, но
+        до удаления сегмента, остаётся запечатанная копия.
+        """
+        files = {}
+        for name in sorted(os.listdir(directory)):
+            stem, ext = os.path.splitext(name)
+            if ext in ('.seg', '.chk') and stem.isdigit():
+                files.setdefault(int(stem), {})[ext] = os.path.join(directory, name)
+
+        segments = []
+        for seq, paths in sorted(files.items()):
+            if '.chk' in paths:
+                if '.seg' in paths:
+                    os.remove(paths['.seg'])
+                segments.append(SealedSegment.load(paths['.chk'], seq))
+            else:
+                segments.append(Segment.load(paths['.seg'], seq))
+        return segments
+
+    # --- запись ---
+
+    def insert(self, rows):
+        """
+        Присвоить измерениям id и отложить их запись до commit().
+
+        При работе в приложении id выдаёт metric_sequence в пишущей
+        транзакции основной базы, поэтому они возрастают в порядке фиксации
+        пакетов, и курсор живых обновлений (computer_state.metric_id) не
+        перескакивает через пакет, зафиксированный позже.
+        """
+        if self.allocate is not None:
+            ids = self.allocate(len(rows))
+        else:
+            with self.lock:
+                ids = range(self.next_id, self.next_id + len(rows))
+                self.next_id += len(rows)
+        for row, metric_id in zip(rows, ids):
+            row['id'] = metric_id
+        self._pending().extend(rows)
+
+    def commit(self):
+        rows = self._pending()
+        self.pending.rows = []
+        if rows:
+            self.append(rows)
+
+    def rollback(self):
+        self.pending.rows = []
+
+    def _pending(self):
+        rows = getattr(self.pending, 'rows', None)
+        if rows is None:
+            rows = self.pending.rows = []
+        return rows
+
+    def append(self, rows):
+        """
+        Записать измерения с уже присвоенными id.
+
+        :param rows: строки измерений с ключом "id".
+        :type rows: list[dict]
+        """
+        by_computer = {}
+        for row in rows:
+            by_computer.setdefault(row['computer_id'], []).append(row)
+        with self.lock:
+            self.next_id = max(self.next_id, max(row['id'] for row in rows) + 1)
+            for computer_id, host_rows in by_computer.items():
+                segments = self.series.setdefault(computer_id, [])
+                position = 0
+                while position < len(host_rows):
+                    if not segments or segments[-1].rows >= segments[-1].capacity:
+                        segments.append(self._create_segment(computer_id, segments))
+                    segment = segments[-1]
+                    count = min(len(host_rows) - position, segment.capacity - segment.rows)
+                    self._write(segment, host_rows[position:position + count])
+                    position += count
+
+    def _create_segment(self, computer_id, segments):
+        directory = os.path.join(self.root, str(computer_id))
+        os.makedirs(directory, exist_ok=True)
+        seq = segments[-1].seq + 1 if segments else 0
+        segment = Segment(os.path.join(directory, f'{seq:08d}.seg'), seq, self.segment_rows)
+        with open(segment.path, 'wb') as f:
+            f.write(segment.pack_header())
+            f.truncate(segment.size)
+        return segment
+
+    def _write(self, segment, rows):
+        """
+        Скопировать строки в области столбцов сегмента и обновить заголовок.
+        """
+        columns = {
+            'id': array('q', [row['id'] for row in rows]),
+            'timestamp': array('d', [to_epoch(row['timestamp']) for row in rows]),
+        }
+        for name, code in COLUMNS.items():
+            if code == 'f':
+                columns[name] = array('f', [NAN if row[name] is None else row[name] for row in rows])
+            elif code == 'i':
+                columns[name] = array('i', [MISSING_INT if row[name] is None else row[name] for row in rows])
+
+        data = self._map(segment)
+        for name, values in columns.items():
+            start = segment.offsets[name] + segment.rows * values.itemsize
+            data[start:start + len(values) * values.itemsize] = values
+
+        timestamps = columns['timestamp']
+        segment.ordered = (segment.ordered and segment.max_ts <= timestamps[0]
+                           and all(a <= b for a, b in zip(timestamps, timestamps[1:])))
+        segment.min_ts = min(segment.min_ts, min(timestamps))
+        segment.max_ts = max(segment.max_ts, max(timestamps))
+        segment.last_id = max(segment.last_id, max(columns['id']))
+        segment.rows += len(rows)
+        data[:HEADER.size] = segment.pack_header()
+
+        extras = [{'id': row['id'], 'extra': row['extra']} for row in rows if row.get('extra') is not None]
+        if extras:
+            with open(segment.extra_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(item, ensure_ascii=False) + '\n' for item in extras)
+
+    # --- отображения сегментов ---
+
+    def _map(self, segment):
+        """
+        Отображение файла сегмента в память (вызывается под self.lock).
+
+        :rtype: mmap.mmap
+        """
+        data = self.maps.get(segment.path)
+        if data is not None:
+            self.maps.move_to_end(segment.path)
+            return data
+        with open(segment.path, 'r+b') as f:
+            data = mmap.mmap(f.fileno(), 0)
+        self.maps[segment.path] = data
+        while len(self.maps) > self.max_open:
+            self._unmap(next(iter(self.maps)))
+        return data
+
+    def _unmap(self, path):
+        data = self.maps.pop(path, None)
+        if data is None:
+            return
+        try:
+            data.close()
+        except BufferError:
+            # срезы ещё читаются — отображение закроется вместе с ними
+            pass
+
+    def _columns(self, segment, start=-math.inf, end=math.inf):
+        """
+        Столбцы записанных строк сегмента.
+
+        У сегмента в памяти это срезы memoryview без копирования, у
+        запечатанного — распакованные фрагменты, пересекающие интервал
+        [start, end) Unix-времени, подряд.
+
+        :return: словарь столбец -> memoryview или array.array; None, если
+                 сегмент удалён или в интервал не попал ни один фрагмент.
+        :rtype: dict | None
+        """
+        if isinstance(segment, SealedSegment):
+            return self._decode(segment, start, end)
+        with self.lock:
+            rows = segment.rows
+            if rows == 0:
+                return None
+            view = memoryview(self._map(segment))
+        return {
+            name: view[offset:offset + rows * array(COLUMNS[name]).itemsize].cast(COLUMNS[name])
+            for name, offset in segment.offsets.items()
+        }
+
+    def _decode(self, segment, start, end):
+        """
+        Распаковать фрагменты запечатанного сегмента, пересекающие интервал.
+        """
+        parts = []
+        for number, (offset, length, rows, min_ts, max_ts) in enumerate(segment.chunks):
+            if min_ts >= end or max_ts < start:
+                continue
+            key = (segment.path, number)
+            with self.lock:
+                if segment.rows == 0:
+                    return None
+                columns = self.decoded.get(key)
+                if columns is not None:
+                    self.decoded.move_to_end(key)
+            if columns is None:
+                with open(segment.path, 'rb') as f:
+                    f.seek(offset)
+                    columns = dict(zip(COLUMNS, decode_chunk(f.read(length))))
+                with self.lock:
+                    self.decoded[key] = columns
+                    while len(self.decoded) > self.max_decoded:
+                        self.decoded.popitem(last=False)
+            parts.append(columns)
+
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        joined = {name: array(code) for name, code in COLUMNS.items()}
+        for part in parts:
+            for name, values in joined.items():
+                values.extend(part[name])
+        return joined
+
+    def _segments(self, computer_id, start=-math.inf, end=math.inf):
+        with self.lock:
+            segments = list(self.series.get(computer_id, ()))
+        return [segment for segment in segments if segment.overlaps(start, end)]
+
+    def _slices(self, computer_id, start, end):
+        """
+        Строки компьютера за интервал Unix-времени [start, end).
+
+        :return: тройки (столбцы сегмента, номера строк, extra строк по id);
+                 у упорядоченного сегмента номера — непрерывный range из
+                 двоичного поиска.
+        :rtype: list[tuple[dict, range | list[int], dict]]
+        """
+        result = []
+        for segment in self._segments(computer_id, start, end):
+            columns = self._columns(segment, start, end)
+            if columns is None:
+                continue
+            timestamps = columns['timestamp']
+            if segment.ordered:
+                indices = range(bisect.bisect_left(timestamps, start), bisect.bisect_left(timestamps, end))
+            else:
+                indices = [i for i, ts in enumerate(timestamps) if start <= ts < end]
+            if indices:
+                result.append((columns, indices, self._extras(segment)))
+        return result
+
+    def _extras(self, segment):
+        """
+        Поле extra строк сегмента: id -> значение.
+
+        Файл .extra читается целиком и держится в LRU (не больше max_open
+        файлов), пока не изменится его размер. Недописанные при аварии
+        строки пропускаются.
+
+        :rtype: dict[int, dict]
+        """
+        path = segment.extra_path
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return {}
+        with self.lock:
+            cached = self.extras.get(path)
+            if cached is not None and cached[0] == size:
+                self.extras.move_to_end(path)
+                return cached[1]
+        extras = {}
+        with open(path, 'rb') as f:
+            data = f.read(size)
+        for line in data.splitlines():
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            extras[item['id']] = item['extra']
+        with self.lock:
+            self.extras[path] = (size, extras)
+            while len(self.extras) > self.max_open:
+                self.extras.popitem(last=False)
+        return extras
+
+    # --- чтение ---
+
+    @staticmethod
+    def _record(computer_id, columns, index, extras):
+        return MetricRecord(
+            id=columns['id'][index],
+            computer_id=computer_id,
+            timestamp=from_epoch(columns['timestamp'][index]),
+            cpu_percent=narrow(columns['cpu_percent'][index]),
+            memory_usage=narrow(columns['memory_usage'][index]),
+            disk_usage=narrow(columns['disk_usage'][index]),
+            processes=None if columns['processes'][index] == MISSING_INT else columns['processes'][index],
+            extra=extras.get(columns['id'][index]),
+        )
+
+    def latest(self, computer_id, limit):
+        """
+        Последние измерения: сегменты просматриваются от самого нового,
+        пока очередной не оказывается целиком старше уже найденных.
+        """
+        best = []
+        segments = sorted(self._segments(computer_id), key=lambda segment: segment.max_ts, reverse=True)
+        for segment in segments:
+            if len(best) >= limit and segment.max_ts < best[-1][0]:
+                break
+            columns = self._columns(segment)
+            if columns is None:
+                continue
+            timestamps, ids, extras = columns['timestamp'], columns['id'], self._extras(segment)
+            first = max(0, len(timestamps) - limit) if segment.ordered else 0
+            candidates = ((timestamps[i], ids[i], columns, i, extras) for i in range(first, len(timestamps)))
+            best = heapq.nlargest(limit, [*best, *candidates], key=lambda item: item[:2])
+        return [self._record(computer_id, columns, index, extras) for _, _, columns, index, extras in best]
+
+    def scan(self, computer_id, start, end):
+        """
+        Измерения за интервал: срезы сегментов сливаются по времени
+        (сегменты пересекаются по времени, если измерения приходили не по
+        порядку).
+        """
+        def stream(columns, indices, extras):
+            timestamps = columns['timestamp']
+            if not isinstance(indices, range):
+                indices = sorted(indices, key=timestamps.__getitem__)
+            for index in indices:
+                yield timestamps[index], columns, index, extras
+
+        streams = [stream(*part) for part in self._slices(computer_id, to_epoch(start), to_epoch(end))]
+        for _, columns, index, extras in heapq.merge(*streams, key=lambda item: item[0]):
+            yield self._record(computer_id, columns, index, extras)
+
+    def buckets(self, computer_id, start, end, step):
+        """
+        Агрегаты по корзинам. В упорядоченном сегменте границы корзин
+        находятся двоичным поиском, и значения корзины берутся одним срезом
+        столбца; строки неупорядоченного сегмента раскладываются по одной.
+        """
+        fields = list(ROLLUP_FIELDS.values())
+        groups = {}
+
+        def group(bucket):
+            values = groups.get(bucket)
+            if values is None:
+                values = groups[bucket] = [0] + [[] for _ in fields]
+            return values
+
+        for columns, indices, _ in self._slices(computer_id, to_epoch(start), to_epoch(end)):
+            timestamps = columns['timestamp']
+            if isinstance(indices, range):
+                low, stop = indices.start, indices.stop
+                while low < stop:
+                    bucket = int(timestamps[low]) // step * step
+                    high = bisect.bisect_left(timestamps, bucket + step, low, stop)
+                    values = group(bucket)
+                    values[0] += high - low
+                    for target, field in zip(values[1:], fields):
+                        target.extend(columns[field][low:high].tolist())
+                    low = high
+            else:
+                for index in indices:
+                    values = group(int(timestamps[index]) // step * step)
+                    values[0] += 1
+                    for target, field in zip(values[1:], fields):
+                        target.append(columns[field][index])
+
+        for bucket in sorted(groups):
+            count, *values = groups[bucket]
+            row = [bucket, count]
+            for field, field_values in zip(fields, values):
+                stats = bucket_stats(present(field_values, COLUMNS[field]))
+                if COLUMNS[field] == 'f':
+                    stats = [None if value is None else narrow(value) for value in stats]
+                row.extend(stats)
+            yield tuple(row)
+
+    # --- уплотнение ---
+
+    def delete_before(self, computer_id, cutoff, limit):
+        """
+        Удалить сегменты, все измерения которых старше cutoff.
+
+        Удаление идёт целыми файлами, от старых сегментов к новым, пока не
+        наберётся limit строк; сегмент, в котором есть хотя бы одно свежее
+        измерение, остаётся целиком. Если удалён и последний сегмент,
+        следующая запись начнёт новый.
+        """
+        cutoff = to_epoch(cutoff)
+        deleted = 0
+        with self.lock:
+            segments = self.series.get(computer_id, [])
+            for segment in list(segments):
+                if deleted >= limit:
+                    break
+                if segment.max_ts >= cutoff:
+                    continue
+                deleted += segment.rows
+                segment.rows = 0
+                segments.remove(segment)
+                self._unmap(segment.path)
+                self._forget(segment.path)
+                for path in (segment.path, segment.extra_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+        return deleted
+
+    def _forget(self, path):
+        """
+        Убрать из LRU распакованные фрагменты файла (вызывается под self.lock).
+        """
+        for key in [key for key in self.decoded if key[0] == path]:
+            del self.decoded[key]
+        self.extras.pop(os.path.splitext(path)[0] + '.extra', None)
+
+    # --- запечатывание ---
+
+    def seal(self):
+        """
+        Пересжать заполненные сегменты во фрагменты (SealedSegment).
+
+        Заполненный сегмент больше не меняется, поэтому файл фрагментов
+        пишется без блокировки; под ней сегмент лишь заменяется в ряду, а
+        файл .seg удаляется. Сегменты, в которые ещё идёт запись, остаются
+        в памяти без изменений.
+
+        :return: число запечатанных сегментов.
+        :rtype: int
+        """
+        with self.lock:
+            full = [(computer_id, segment) for computer_id, segments in self.series.items() for segment in segments
+                    if not isinstance(segment, SealedSegment) and segment.rows >= segment.capacity]
+        sealed = 0
+        for computer_id, segment in full:
+            columns = self._columns(segment)
+            if columns is None:
+                continue
+            path = os.path.splitext(segment.path)[0] + '.chk'
+            chunked = SealedSegment.write(path, segment, columns, self.chunk_rows)
+            del columns
+            with self.lock:
+                segments = self.series.get(computer_id, [])
+                if segment not in segments:
+                    # сегмент удалён уплотнением, пока писались фрагменты
+                    os.remove(path)
+                    continue
+                segments[segments.index(segment)] = chunked
+                self._unmap(segment.path)
+                os.remove(segment.path)
+            sealed += 1
+        return sealed
+
+    def close(self):
+        with self.lock:
+            for path in list(self.maps):
+                data = self.maps[path]
+                if not data.closed:
+                    data.flush()
+                self._unmap(path)
+            if not self.lock_file.closed:
+                self.lock_file.close()
+
+
+class SealJob:
+    """
+    Фоновое запечатывание заполненных сегментов столбцового хранилища.
+
+    Основные атрибуты:
+        store (ColumnarMetricStore): хранилище измерений.
+        stats (dict): число проходов и запечатанных сегментов.
+    """
+    def __init__(self, store, interval=60):
+        """
+        :param store: хранилище измерений.
+        :type store: ColumnarMetricStore
+        :param interval: период проверки сегментов, сек.
+        :type interval: float
+        """
+        self.store = store
+        self.interval = interval
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'runs': 0, 'sealed': 0}
+
+    def start(self):
+        """
+        Запустить фоновый поток запечатывания.
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name='metric-sealer', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Остановить фоновый поток после завершения текущего сегмента.
+
+        :param timeout: сколько секунд ждать завершения потока.
+        :type timeout: float
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run_once(self):
+        """
+        Запечатать все заполненные сегменты.
+
+        :return: число запечатанных сегментов.
+        :rtype: int
+        """
+        sealed = self.store.seal()
+        self.stats['runs'] += 1
+        self.stats['sealed'] += sealed
+        return sealed
+
+    def _run(self):
+        """
+        Основной цикл потока: запечатывание раз в interval секунд.
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                sealed = self.run_once()
+            except Exception:
+                logger.exception('sealing metric segments failed')
+                continue
+            if sealed:
+                logger.info('sealed metric segments: %d', sealed)
+
+
+def init_sealer(app):
+    """
+    Запустить фоновое запечатывание, если хранилище измерений столбцовое и
+    METRIC_SEAL_ENABLED включён.
+
+    Задание сохраняется в app.extensions["metric_sealer"].
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    store = app.extensions.get('metric_store')
+    if not app.config['METRIC_SEAL_ENABLED'] or not isinstance(store, ColumnarMetricStore):
+        return
+
+    job = SealJob(store, interval=app.config['METRIC_SEAL_INTERVAL'])
+    app.extensions['metric_sealer'] = job
+    job.start()
+    atexit.register(job.stop)
@@ -0,0 +1,155 @@
+"""
+Потоковая выгрузка сырых измерений в CSV или NDJSON.
+
+Выгрузка охватывает один компьютер, набор компьютеров или весь парк за
+интервал времени. Компьютеры перебираются по возрастанию id порциями
+(keyset), измерения каждого читает хранилище (MetricStore.scan()) курсором
+по возрастанию времени. Строки кодируются по одной и отдаются блоками
+около CHUNK_BYTES байт, при необходимости сжатыми gzip на лету, поэтому
+память не зависит от длины интервала и числа компьютеров. Генератор
+export_stream() используется и потоковым ответом /api/export, и
+командой export_metrics.py.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from . import db
+from .metricstore import get_metric_store
+from .models import Computer
+
+# формат -> тип содержимого
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+# столбцы CSV; в NDJSON к ним добавляется extra
+CSV_COLUMNS = ['computer_id', 'hostname', 'timestamp', 'cpu_percent', 'memory_usage', 'disk_usage', 'processes']
+
+CHUNK_BYTES = 64 * 1024
+HOST_BATCH = 1000
+
+
+def resolve_hosts(computer_ids=(), hostnames=()):
+    """
+    Найти компьютеры по id и именам.
+
+    :return: пары (id, hostname) по возрастанию id.
+    :rtype: list[tuple[int, str]]
+    :raises LookupError: если какой-либо компьютер не найден; в сообщении
+                         перечислены ненайденные.
+    """
+    computer_ids, hostnames = set(computer_ids), set(hostnames)
+    rows = db.session.execute(
+        db.select(Computer.id, Computer.hostname)
+        .where(db.or_(Computer.id.in_(computer_ids), Computer.hostname.in_(hostnames)))
+        .order_by(Computer.id)
+    ).all()
+    missing = sorted(map(str, computer_ids - {row.id for row in rows}))
+    missing += sorted(hostnames - {row.hostname for row in rows})
+    if missing:
+        raise LookupError(f'computers not found: {", ".join(missing)}')
+    return [tuple(row) for row in rows]
+
+
+def iter_fleet(batch_rows=HOST_BATCH):
+    """
+    Все компьютеры по возрастанию id порциями по batch_rows.
+
+    :rtype: collections.abc.Iterator[tuple[int, str]]
+    """
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Computer.id, Computer.hostname)
+            .where(Computer.id > last_id).order_by(Computer.id).limit(batch_rows)
+        ).all()
+        for row in rows:
+            yield tuple(row)
+        if len(rows) < batch_rows:
+            return
+        last_id = rows[-1].id
+
+
+def csv_lines(hosts, start, end, store):
+    """
+    Строки CSV с заголовком; пустое поле — нет значения.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS)
+    for computer_id, hostname in hosts:
+        for record in store.scan(computer_id, start, end):
+            writer.writerow([computer_id, hostname, record.timestamp.isoformat(), record.cpu_percent,
+                             record.memory_usage, record.disk_usage, record.processes])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_lines(hosts, start, end, store):
+    """
+    Объекты JSON по одному в строке, с полем extra.
+    """
+    for computer_id, hostname in hosts:
+        for record in store.scan(computer_id, start, end):
+            yield json.dumps({
+                'computer_id': computer_id,
+                'hostname': hostname,
+                'timestamp': record.timestamp.isoformat(),
+                'cpu_percent': record.cpu_percent,
+                'memory_usage': record.memory_usage,
+                'disk_usage': record.disk_usage,
+                'processes': record.processes,
+                'extra': record.extra,
+            }, ensure_ascii=False) + '\n'
+
+
+ENCODERS = {'csv': csv_lines, 'ndjson': ndjson_lines}
+
+
+def export_stream(hosts, start, end, fmt='csv', compress=False, chunk_bytes=CHUNK_BYTES):
+    """
+    Выгрузка измерений компьютеров за интервал [start, end).
+
+    :param hosts: пары (id, hostname), например из resolve_hosts() или
+                  iter_fleet().
+    :type hosts: collections.abc.Iterable[tuple[int, str]]
+    :type start: datetime.datetime
+    :type end: datetime.datetime
+    :param fmt: "csv" или "ndjson".
+    :type fmt: str
+    :param compress: сжимать поток gzip.
+    :type compress: bool
+    :param chunk_bytes: примерный размер отдаваемого блока до сжатия.
+    :type chunk_bytes: int
+    :return: блоки выгрузки.
+    :rtype: collections.abc.Iterator[bytes]
+    :raises ValueError: если формат не поддерживается.
+    """
+    if fmt not in ENCODERS:
+        raise ValueError(f'format must be one of: {", ".join(ENCODERS)}')
+    lines = ENCODERS[fmt](hosts, start, end, get_metric_store())
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def emit(parts):
+        data = ''.join(parts).encode('utf-8')
+        return compressor.compress(data) if compressor else data
+
+    parts, size = [], 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            data = emit(parts)
+            parts, size = [], 0
+            if data:
+                yield data
+    data = emit(parts)
+    if compressor:
+        data += compressor.flush()
+    if data:
+        yield data
@@ -0,0 +1,161 @@
+"""
+Выборка истории метрик компьютера за интервал времени с агрегацией.
+
+Интервал делится на корзины длиной step секунд; для каждой корзины
+возвращаются avg/min/max (и p95 для сырых данных) по CPU, RAM, диску и
+числу процессов. Источник выбирается самый дешёвый из подходящих: сырые
+измерения для коротких интервалов и ярусы свёртки для длинных. Ярусы
+агрегируются в SQL, сырые измерения — хранилищем (app/metricstore.py);
+ORM-объекты на каждую строку не создаются.
+"""
+
+import math
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from . import db
+from .ingest import parse_timestamp
+from .metricstore import BUCKET_SQL, get_metric_store
+from .rollups import ROLLUP_FIELDS, bucket_start
+
+
+def build_rollup_sql():
+    """
+    Запрос по ярусу свёртки: агрегаты интервалов объединяются в корзины.
+
+    Среднее считается как сумма сумм, делённая на сумму счётчиков, поэтому
+    оно точное; p95 по агрегатам восстановить нельзя, и он равен NULL.
+    """
+    counts = ', '.join(f'{name}_count' for name in ROLLUP_FIELDS)
+    aggregates = ', '.join(
+        f'sum({name}_sum) / nullif(sum({name}_count), 0), min({name}_min), max({name}_max), NULL'
+        for name in ROLLUP_FIELDS
+    )
+    bucket = BUCKET_SQL.format(column='bucket')
+    return text(
+        f'SELECT {bucket} AS b, sum(max({counts})), {aggregates} FROM metric_rollup'
+        f' WHERE computer_id = :computer_id AND resolution = :resolution'
+        f' AND bucket >= :start AND bucket < :end GROUP BY b ORDER BY b'
+    ).bindparams(bindparam('start', type_=db.DateTime), bindparam('end', type_=db.DateTime))
+
+
+ROLLUP_SQL = build_rollup_sql()
+
+
+def parse_time_arg(value, default):
+    """
+    Разобрать параметр времени из строки запроса.
+
+    :param value: Unix-время в секундах или строка ISO 8601.
+    :type value: str | None
+    :param default: значение, если параметр не задан.
+    :type default: datetime.datetime
+    :rtype: datetime.datetime
+    :raises ValueError: если значение не удаётся разобрать.
+    """
+    if not value:
+        return default
+    try:
+        return parse_timestamp(float(value))
+    except ValueError:
+        return parse_timestamp(value)
+
+
+def covers(name, start, now):
+    """
+    Проверить, хранит ли ярус данные начиная с момента start.
+
+    При выключенном уплотнении (RETENTION_ENABLED = False) данные не
+    удаляются, и любой ярус хранит всю историю.
+
+    :param name: "raw" или имя яруса из ROLLUP_TIERS.
+    :type name: str
+    :rtype: bool
+    """
+    if not current_app.config['RETENTION_ENABLED']:
+        return True
+    keep = current_app.config['RETENTION'].get(name)
+    return keep is None or start >= now - keep
+
+
+def choose_source(start, step, now):
+    """
+    Выбрать источник данных для запроса.
+
+    Из ярусов, которые ещё хранят начало интервала, берётся самый крупный
+    с разрешением не больше шага. Если шаг меньше любого доступного
+    разрешения, используется самый мелкий из доступных ярусов.
+
+    :return: пара (имя яруса, разрешение в секундах); для сырых данных —
+             ("raw", 1).
+    :rtype: tuple[str, int]
+    """
+    candidates = [('raw', 1)] + sorted(current_app.config['ROLLUP_TIERS'].items(),
+                                        key=lambda item: item[1])
+    available = [item for item in candidates if covers(item[0], start, now)]
+    if not available:
+        available = candidates[-1:]
+
+    fitting = [item for item in available if item[1] <= step]
+    if fitting:
+        return fitting[-1]
+    return available[0]
+
+
+def query_range(computer_id, start, end, step=None, now=None):
+    """
+    Получить агрегированную историю компьютера за интервал [start, end).
+
+    Число корзин ограничено RANGE_MAX_POINTS: слишком мелкий шаг
+    увеличивается. Шаг также округляется вверх до кратного разрешению
+    выбранного яруса, чтобы корзины не резали интервалы свёртки. Если шаг
+    не задан, берётся самый крупный ярус, дающий не меньше четверти
+    RANGE_MAX_POINTS корзин: так длинные интервалы читают меньше строк.
+
+    :param computer_id: идентификатор компьютера.
+    :type computer_id: int
+    :param start: начало интервала (UTC).
+    :type start: datetime.datetime
+    :param end: конец интервала (UTC), не включается.
+    :type end: datetime.datetime
+    :param step: длина корзины в секундах; по умолчанию подбирается так,
+                 чтобы получилось RANGE_MAX_POINTS корзин.
+    :type step: int | None
+    :param now: текущее время (UTC); параметр нужен для тестов.
+    :type now: datetime.datetime | None
+    :return: словарь с полями step, source и points.
+    :rtype: dict
+    """
+    now = now or datetime.utcnow()
+    span = (end - start).total_seconds()
+    max_points = current_app.config['RANGE_MAX_POINTS']
+    min_step = math.ceil(span / max_points)
+    if step is None:
+        coarse = [resolution for resolution in current_app.config['ROLLUP_TIERS'].values()
+                  if span / resolution >= max_points / 4]
+        step = max(coarse, default=1)
+    step = max(step, min_step, 1)
+
+    source, resolution = choose_source(start, step, now)
+    step = math.ceil(step / resolution) * resolution
+
+    if source == 'raw':
+        rows = get_metric_store().buckets(computer_id, start, end, step)
+    else:
+        # интервал свёртки, в который попадает start, тоже входит в ответ
+        rows = db.session.execute(ROLLUP_SQL, {
+            'computer_id': computer_id, 'start': bucket_start(start, resolution),
+            'end': end, 'step': step, 'resolution': resolution,
+        })
+
+    points = []
+    for row in rows:
+        point = {'t': row[0], 'samples': row[1]}
+        for index, name in enumerate(ROLLUP_FIELDS):
+            avg, low, high, p95 = row[2 + index * 4: 6 + index * 4]
+            point[name] = {'avg': avg, 'min': low, 'max': high, 'p95': p95}
+        points.append(point)
+
+    return {'step': step, 'source': source, 'points': points}
@@ -0,0 +1,639 @@
+"""
+Приём и сохранение метрик, поступающих от агентов SysMonitor.
+
+Модуль содержит общую логику для одиночного эндпоинта /api/metrics и
+пакетного /api/metrics/batch: проверку входящих образцов, разрешение
+имён компьютеров и запись измерений в базу одной транзакцией на пакет,
+а также буфер отложенной записи (IngestBuffer) для режима INGEST_MODE =
+"buffered".
+
+Тело запроса принимается в JSON (по умолчанию), NDJSON или в компактном
+двоичном формате wire.py (Content-Type: application/x-sysmon-binary);
+все форматы приводятся к одному виду и дальше обрабатываются одинаково.
+"""
+
+import atexit
+import json
+import logging
+import math
+import threading
+import zlib
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+
+import wire
+
+from . import db
+from .cache import bump_versions
+from .metricstore import get_metric_store
+from .models import AgentTelemetry, Computer, ComputerState
+from .rollups import UPSERT_INSERTS, update_rollups
+
+logger = logging.getLogger(__name__)
+
+
+class RawWriteError(RuntimeError):
+    """
+    Основная транзакция пакета зафиксирована, а сырые измерения не
+    записаны в хранилище (app/metricstore.py). Повторять пакет нельзя:
+    агрегаты и состояние компьютеров его уже учли.
+    """
+
+# числовые поля образца: ключ во входящем JSON -> столбец модели Metric
+SAMPLE_FIELDS = {
+    'cpu': 'cpu_percent',
+    'ram': 'memory_usage',
+    'disk': 'disk_usage',
+    'processes': 'processes',
+}
+
+# насколько отметка времени образца может опережать часы сервера: образец
+# «из будущего» навсегда закрепил бы за компьютером computer_state, так как
+# более ранние измерения его не заменяют
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+def parse_timestamp(value):
+    """
+    Преобразовать отметку времени из образца в naive datetime (UTC).
+
+    Поддерживаются Unix-время (число секунд) и строка ISO 8601. Если значение
+    не задано, используется текущее время сервера.
+
+    :param value: значение поля timestamp из входящего JSON.
+    :type value: int | float | str | None
+    :return: время измерения в UTC без информации о часовом поясе.
+    :rtype: datetime.datetime
+    :raises ValueError: если значение не удаётся разобрать.
+    """
+    if value is None:
+        return datetime.utcnow()
+    if isinstance(value, bool):
+        raise ValueError('invalid timestamp')
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is not None:
+            parsed = datetime.utcfromtimestamp(parsed.timestamp())
+        return parsed
+    raise ValueError('invalid timestamp')
+
+
+def validate_sample(data):
+    """
+    Проверить один образец метрик и привести его к единому виду.
+
+    :param data: объект JSON, присланный агентом.
+    :type data: dict
+    :return: словарь с ключами hostname, timestamp, extra, telemetry
+             и столбцами модели Metric.
+    :rtype: dict
+    :raises ValueError: если образец некорректен или его отметка времени
+                        опережает часы сервера больше чем на MAX_CLOCK_SKEW;
+                        текст ошибки возвращается клиенту.
+    """
+    if not isinstance(data, dict) or not data:
+        raise ValueError('invalid json')
+
+    hostname = data.get('hostname')
+    if not hostname or not isinstance(hostname, str):
+        raise ValueError('hostname required')
+
+    sample = {'hostname': hostname}
+    for key, column in SAMPLE_FIELDS.items():
+        value = data.get(key)
+        # json.loads пропускает NaN и Infinity, они испортили бы агрегаты и сравнения с порогами
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not math.isfinite(value)):
+            raise ValueError(f'invalid {key}')
+        sample[column] = value
+
+    try:
+        sample['timestamp'] = parse_timestamp(data.get('timestamp'))
+    except (ValueError, TypeError, OverflowError, OSError):
+        raise ValueError('invalid timestamp')
+    if sample['timestamp'] > datetime.utcnow() + MAX_CLOCK_SKEW:
+        raise ValueError('timestamp in the future')
+
+    # дополнительные метрики сохраняются как есть; старые агенты их не присылают
+    extra = data.get('ext')
+    if extra is not None and not isinstance(extra, dict):
+        raise ValueError('invalid ext')
+
+    # сводка самонаблюдения агента хранится отдельно от измерений
+    telemetry = None
+    if extra and 'telemetry' in extra:
+        extra = dict(extra)
+        telemetry = extra.pop('telemetry')
+        if not isinstance(telemetry, dict):
+            raise ValueError('invalid telemetry')
+    sample['extra'] = extra or None
+    sample['telemetry'] = telemetry
+
+    return sample
+
+
+class PayloadTooLarge(Exception):
+    """
+    Тело запроса (или оно же после распаковки) превышает INGEST_MAX_BODY_BYTES.
+    """
+
+
+def read_limited(limit, chunk_size=64 * 1024):
+    """
+    Прочитать тело текущего запроса, но не больше limit байт.
+
+    Заголовок Content-Length проверяется до чтения; тело без него
+    (Transfer-Encoding: chunked) читается порциями до превышения предела.
+
+    :type limit: int
+    :rtype: bytes
+    :raises PayloadTooLarge: если тело больше limit.
+    """
+    if request.content_length is not None and request.content_length > limit:
+        raise PayloadTooLarge()
+    chunks, size = [], 0
+    while True:
+        chunk = request.stream.read(min(chunk_size, limit + 1 - size))
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            raise PayloadTooLarge()
+
+
+def read_body():
+    """
+    Прочитать тело текущего запроса с учётом Content-Encoding.
+
+    Агенты могут сжимать тело gzip (Content-Encoding: gzip). И сжатое, и
+    несжатое тело читается не больше INGEST_MAX_BODY_BYTES; распаковка идёт
+    потоково и прерывается, как только размер превышает тот же предел,
+    чтобы сжатая «бомба» не заняла всю память.
+
+    :return: распакованное тело запроса.
+    :rtype: bytes
+    :raises ValueError: если кодировка не поддерживается или сжатые
+                        данные повреждены.
+    :raises PayloadTooLarge: если тело (до или после распаковки) слишком
+                             велико.
+    """
+    encoding = request.headers.get('Content-Encoding', 'identity').lower()
+    if encoding not in ('identity', 'gzip'):
+        raise ValueError(f'unsupported content encoding: {encoding}')
+    limit = current_app.config['INGEST_MAX_BODY_BYTES']
+    body = read_limited(limit)
+    if encoding == 'identity':
+        return body
+
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, limit + 1)
+    except zlib.error:
+        raise ValueError('invalid gzip body')
+    if len(data) > limit or decompressor.unconsumed_tail:
+        raise PayloadTooLarge()
+    return data
+
+
+def parse_sample(body, mimetype='application/json'):
+    """
+    Разобрать тело одиночного запроса /api/metrics.
+
+    :param body: распакованное тело запроса.
+    :type body: bytes
+    :param mimetype: MIME-тип запроса без параметров.
+    :type mimetype: str
+    :return: образец, прошедший validate_sample().
+    :rtype: dict
+    :raises ValueError: если тело не является корректным образцом.
+    """
+    if mimetype == wire.CONTENT_TYPE:
+        items = wire.decode(body)
+        if len(items) != 1:
+            raise ValueError('expected single sample')
+        return validate_sample(items[0])
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise ValueError('invalid json')
+    return validate_sample(data)
+
+
+def parse_batch(body, mimetype):
+    """
+    Разобрать тело пакетного запроса.
+
+    Принимается JSON-массив образцов, объект вида {"samples": [...]},
+    поток NDJSON (application/x-ndjson) — по одному объекту JSON в строке,
+    или пакет в двоичном формате (application/x-sysmon-binary). Строки
+    NDJSON, которые не удалось разобрать, возвращаются как None, чтобы их
+    можно было отклонить по отдельности.
+
+    :param body: сырое тело запроса.
+    :type body: bytes
+    :param mimetype: MIME-тип запроса без параметров.
+    :type mimetype: str
+    :return: список объектов образцов.
+    :rtype: list
+    :raises ValueError: если тело целиком не является допустимым пакетом.
+    """
+    if mimetype == wire.CONTENT_TYPE:
+        return wire.decode(body)
+
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise ValueError('invalid json')
+    if isinstance(payload, dict):
+        payload = payload.get('samples')
+    if not isinstance(payload, list):
+        raise ValueError('expected array of samples')
+    return payload
+
+
+def store_samples(samples):
+    """
+    Сохранить проверенные образцы одной транзакцией.
+
+    Компьютеры разрешаются одним запросом на весь пакет, недостающие
+    создаются, измерения передаются хранилищу сырых измерений
+    (app/metricstore.py) и становятся видны после фиксации транзакции,
+    агрегаты ярусов свёртки дополняются значениями пакета, правила оповещений проверяются
+    по каждому измерению, а текущее состояние каждого компьютера
+    обновляется самым свежим образцом из пакета.
+
+    :param samples: образцы, прошедшие validate_sample().
+    :type samples: list[dict]
+    :return: число сохранённых измерений.
+    :rtype: int
+    """
+    if not samples:
+        return 0
+
+    hostnames = {sample['hostname'] for sample in samples}
+    computers = {
+        comp.hostname: comp
+        for comp in Computer.query.filter(Computer.hostname.in_(hostnames))
+    }
+    missing = hostnames - computers.keys()
+    if missing:
+        # параллельный запрос мог уже создать тот же компьютер: вставка
+        # пропускает такие имена, а повторный запрос идёт уже внутри
+        # пишущей транзакции и видит все созданные строки
+        insert = UPSERT_INSERTS[db.session.get_bind().dialect.name](Computer)
+        db.session.execute(
+            insert.on_conflict_do_nothing(index_elements=['hostname']),
+            [{'hostname': hostname, 'created_at': datetime.utcnow()} for hostname in missing],
+        )
+        for comp in Computer.query.filter(Computer.hostname.in_(missing)):
+            computers[comp.hostname] = comp
+
+    rows = []
+    latest = {}
+    telemetry = {}
+    for sample in samples:
+        comp = computers[sample['hostname']]
+        if sample.get('telemetry') is not None:
+            newest = telemetry.get(comp.id)
+            if newest is None or sample['timestamp'] >= newest['timestamp']:
+                telemetry[comp.id] = sample
+        row = {column: sample[column] for column in SAMPLE_FIELDS.values()}
+        row['computer_id'] = comp.id
+        row['timestamp'] = sample['timestamp']
+        row['extra'] = sample.get('extra')
+        rows.append(row)
+
+        newest = latest.get(comp.id)
+        if newest is None or row['timestamp'] >= newest['timestamp']:
+            latest[comp.id] = row
+
+    store = get_metric_store()
+    alerts = current_app.extensions.get('alerts')
+    try:
+        # строки, отложенные insert() до сбоя, иначе остались бы в потоке
+        # и записались бы со следующим пакетом
+        store.insert(rows)
+        update_rollups(rows, current_app.config['ROLLUP_TIERS'].values())
+        if alerts is not None:
+            alerts.evaluate(rows)
+
+        for comp in computers.values():
+            values = latest.get(comp.id)
+            if values is None:
+                continue
+            if comp.state is None:
+                comp.state = ComputerState()
+            comp.state.update_from(values)
+        if telemetry:
+            store_telemetry(telemetry)
+
+        db.session.commit()
+    except Exception:
+        store.rollback()
+        raise
+
+    instrumentation = current_app.extensions.get('instrumentation')
+    try:
+        store.commit()
+    except Exception as exc:
+        # агрегаты и computer_state уже зафиксированы: повтор пакета учёл бы
+        # их дважды, поэтому потеря сырых строк только сообщается
+        bump_versions(latest)
+        logger.exception('metric store write failed after commit: %s raw rows lost', len(rows))
+        if instrumentation is not None:
+            instrumentation.count_ingest_lost(len(rows))
+        raise RawWriteError(f'{len(rows)} raw metric rows were not written') from exc
+
+    bump_versions(latest)
+    if instrumentation is not None:
+        instrumentation.count_ingest(len(rows))
+    return len(rows)
+
+
+def telemetry_row(computer_id, sample):
+    """
+    Значения столбцов AgentTelemetry для сводки из образца.
+
+    Числовые показатели, присланные не числами, не сохраняются в столбцы
+    (сводка целиком всё равно попадает в data).
+
+    :rtype: dict
+    """
+    summary = sample['telemetry']
+
+    def number(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        return value
+
+    def p99(key):
+        value = summary.get(key)
+        return number(value.get('p99')) if isinstance(value, dict) else None
+
+    failures = number(summary.get('failures'))
+    spool_bytes = number(summary.get('spool_bytes'))
+    return {
+        'computer_id': computer_id,
+        'reported_at': sample['timestamp'],
+        'cpu_percent': number(summary.get('cpu_percent')),
+        'rss_mb': number(summary.get('rss_mb')),
+        'collect_ms_p99': p99('collect_ms'),
+        'send_ms_p99': p99('send_ms'),
+        'failures': None if failures is None else int(failures),
+        'spool_bytes': None if spool_bytes is None else int(spool_bytes),
+        'data': summary,
+    }
+
+
+def store_telemetry(samples):
+    """
+    Записать сводки самонаблюдения агентов.
+
+    Для каждого компьютера хранится одна сводка; более старая сводка
+    (например, досланная из дискового буфера агента) не заменяет новую.
+    Выполняется в текущей транзакции сессии.
+
+    :param samples: computer_id -> самый свежий образец пакета со сводкой.
+    :type samples: dict[int, dict]
+    """
+    insert = UPSERT_INSERTS[db.session.get_bind().dialect.name](AgentTelemetry)
+    columns = [column for column in AgentTelemetry.__table__.c.keys() if column != 'computer_id']
+    db.session.execute(
+        insert.on_conflict_do_update(
+            index_elements=['computer_id'],
+            set_={column: insert.excluded[column] for column in columns},
+            where=AgentTelemetry.reported_at <= insert.excluded.reported_at,
+        ),
+        [telemetry_row(computer_id, sample) for computer_id, sample in samples.items()],
+    )
+
+
+class BufferFull(Exception):
+    """
+    Очередь буфера заполнена, и политика переполнения запрещает вытеснение.
+    """
+
+
+class IngestBuffer:
+    """
+    Буфер отложенной записи метрик с фоновым потоком сброса.
+
+    Обработчики запросов только проверяют образцы и добавляют их в
+    ограниченную очередь в памяти процесса, а фоновый поток записывает
+    очередь в базу группами по flush_rows строк либо раз в flush_interval
+    секунд — смотря что наступит раньше. Так время ответа агенту не зависит
+    от задержек диска.
+
+    Политики переполнения (overflow):
+        - "drop_oldest": вытеснять самые старые образцы из очереди;
+        - "reject": отклонять новые образцы (BufferFull), чтобы агент
+          повторил отправку позже.
+
+    Основные атрибуты:
+        app (flask.Flask): приложение, в контексте которого идёт запись.
+        stats (dict): счётчики queued, flushed, dropped, failed_flushes.
+    """
+    OVERFLOW_POLICIES = ('drop_oldest', 'reject')
+
+    def __init__(self, app, max_rows=50000, flush_rows=500, flush_interval=0.2,
+                 overflow='drop_oldest', max_retries=3):
+        """
+        :param app: Flask-приложение SysMonitor.
+        :type app: flask.Flask
+        :param max_rows: максимальная глубина очереди.
+        :type max_rows: int
+        :param flush_rows: число строк, при котором сброс начинается сразу.
+        :type flush_rows: int
+        :param flush_interval: максимальное время ожидания сброса, сек.
+        :type flush_interval: float
+        :param overflow: политика переполнения ("drop_oldest" или "reject").
+        :type overflow: str
+        :param max_retries: число попыток записи группы перед её отбрасыванием.
+        :type max_retries: int
+        """
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'unknown overflow policy: {overflow}')
+
+        self.app = app
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.max_retries = max_retries
+
+        self.queue = deque() # образцы, ожидающие записи
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.stats = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed_flushes': 0}
+
+    def put(self, samples):
+        """
+        Добавить проверенные образцы в очередь.
+
+        :param samples: образцы, прошедшие validate_sample().
+        :type samples: list[dict]
+        :raises BufferFull: если очередь заполнена и политика — "reject".
+        """
+        with self.cond:
+            free = self.max_rows - len(self.queue)
+            if len(samples) > free:
+                if self.overflow == 'reject':
+                    raise BufferFull()
+                # новые образцы ценнее старых: вытесняем голову очереди
+                excess = min(len(samples) - free, len(self.queue))
+                for _ in range(excess):
+                    self.queue.popleft()
+                self.stats['dropped'] += excess
+                if len(samples) > self.max_rows:
+                    self.stats['dropped'] += len(samples) - self.max_rows
+                    samples = samples[-self.max_rows:]
+
+            self.queue.extend(samples)
+            self.stats['queued'] += len(samples)
+            if len(self.queue) >= self.flush_rows:
+                self.cond.notify()
+
+    def snapshot(self):
+        """
+        Получить текущие значения счётчиков и глубину очереди.
+
+        :return: словарь со счётчиками буфера.
+        :rtype: dict
+        """
+        with self.cond:
+            return dict(self.stats, depth=len(self.queue), max_rows=self.max_rows,
+                        overflow=self.overflow)
+
+    def start(self):
+        """
+        Запустить фоновый поток сброса очереди.
+        """
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name='ingest-flusher', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Остановить поток сброса, предварительно записав всю очередь.
+
+        :param timeout: сколько секунд ждать завершения потока.
+        :type timeout: float
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        # если поток не запускался или не успел — дописываем остаток здесь
+        while self._flush_once():
+            pass
+
+    def _take(self):
+        """
+        Забрать из очереди не более flush_rows образцов.
+        """
+        with self.cond:
+            count = min(self.flush_rows, len(self.queue))
+            return [self.queue.popleft() for _ in range(count)]
+
+    def _flush_once(self):
+        """
+        Записать одну группу образцов.
+
+        :return: True, если группа была непустой.
+        :rtype: bool
+        """
+        batch = self._take()
+        if not batch:
+            return False
+
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                with self.app.app_context():
+                    try:
+                        store_samples(batch)
+                    except Exception:
+                        db.session.rollback()
+                        raise
+            except RawWriteError:
+                # уже записано в журнал; повтор учёл бы агрегаты дважды
+                with self.cond:
+                    self.stats['dropped'] += len(batch)
+                return True
+            except Exception:
+                logger.exception('ingest flush failed (attempt %s/%s)', attempt, self.max_retries)
+                with self.cond:
+                    self.stats['failed_flushes'] += 1
+                continue
+            with self.cond:
+                self.stats['flushed'] += len(batch)
+            return True
+
+        with self.cond:
+            self.stats['dropped'] += len(batch)
+        return True
+
+    def _run(self):
+        """
+        Основной цикл потока: ждать порога по размеру или по времени и сбрасывать.
+        """
+        while True:
+            with self.cond:
+                if self.running and len(self.queue) < self.flush_rows:
+                    self.cond.wait(self.flush_interval)
+                running = self.running
+
+            while self._flush_once():
+                if running and len(self.queue) < self.flush_rows:
+                    break
+
+            if not running and not self.queue:
+                return
+
+
+def init_ingest(app):
+    """
+    Подключить буфер отложенной записи, если он включён в конфигурации.
+
+    При INGEST_MODE = "buffered" создаёт IngestBuffer, сохраняет его в
+    app.extensions["ingest_buffer"], запускает поток сброса и регистрирует
+    запись остатка очереди при завершении процесса.
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    if app.config['INGEST_MODE'] != 'buffered':
+        return
+
+    buffer = IngestBuffer(
+        app,
+        max_rows=app.config['INGEST_BUFFER_MAX_ROWS'],
+        flush_rows=app.config['INGEST_FLUSH_ROWS'],
+        flush_interval=app.config['INGEST_FLUSH_INTERVAL'],
+        overflow=app.config['INGEST_OVERFLOW'],
+    )
+    app.extensions['ingest_buffer'] = buffer
+    buffer.start()
+    atexit.register(buffer.stop)
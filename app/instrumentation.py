@@ -0,0 +1,358 @@
+"""
+Самонаблюдение сервера SysMonitor: время запросов, SQL и приём метрик.
+
+Для каждого запроса измеряется общее время, число и суммарная длительность
+SQL-запросов (через события движка SQLAlchemy) и время отрисовки шаблонов
+(сигналы Flask). Значения накапливаются в памяти процесса в гистограммах
+и счётчиках и отдаются эндпоинтом /metrics в текстовом формате Prometheus.
+Если сервер запущен в нескольких процессах, каждый ответ /metrics содержит
+счётчики одного процесса; его pid указан в sysmon_process_info.
+Запросы дольше SLOW_REQUEST_MS записываются в журнал с разбивкой по
+SQL-запросам. На каждый SQL-запрос приходится два вызова perf_counter и
+сложение, поэтому сбор можно держать включённым постоянно.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# границы корзин гистограммы длительности запроса, сек
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# сколько SQL-запросов одного HTTP-запроса хранить для журнала медленных запросов
+MAX_STATEMENTS = 200
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин (как в Prometheus).
+    """
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Учесть одно значение.
+
+        :param value: длительность, сек.
+        :type value: float
+        """
+        index = 0
+        while index < len(LATENCY_BUCKETS) and value > LATENCY_BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class EndpointStats:
+    """
+    Накопленные значения одного эндпоинта.
+    """
+    __slots__ = ('latency', 'sql_statements', 'sql_seconds', 'template_seconds', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statuses = {}
+
+
+class Instrumentation:
+    """
+    Сбор показателей работы сервера.
+
+    Основные атрибуты:
+        endpoints (dict): (эндпоинт, метод) -> EndpointStats.
+        sql_statements (int): все SQL-запросы процесса, включая фоновые потоки.
+        ingest_rows (int): сохранённые измерения за всё время работы.
+        ingest_lost (int): измерения, не записанные в хранилище сырых
+            измерений после фиксации пакета.
+    """
+    def __init__(self, slow_request_ms=None, slow_statements=10, rate_window=60):
+        """
+        :param slow_request_ms: порог журнала медленных запросов, мс; None — не вести.
+        :type slow_request_ms: float | None
+        :param slow_statements: сколько самых долгих SQL-запросов выводить в журнал.
+        :type slow_statements: int
+        :param rate_window: окно расчёта скорости приёма, сек.
+        :type rate_window: int
+        """
+        self.slow_request_ms = slow_request_ms
+        self.slow_statements = slow_statements
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.ingest_rows = 0
+        self.ingest_lost = 0
+        self.ingest_window = deque(maxlen=rate_window) # [секунда, строк] за последние rate_window секунд
+        self.rate_window = rate_window
+        self.db_path = None
+
+    # --- HTTP-запросы ---
+
+    def before_request(self):
+        g.instrumentation = {
+            'start': time.perf_counter(),
+            'sql_statements': 0,
+            'sql_seconds': 0.0,
+            'template_seconds': 0.0,
+            'statements': [] if self.slow_request_ms is not None else None,
+        }
+
+    def after_request(self, response):
+        stats = g.pop('instrumentation', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats['start']
+        endpoint = request.endpoint or 'unmatched'
+        key = (endpoint, request.method)
+
+        with self.lock:
+            endpoint_stats = self.endpoints.get(key)
+            if endpoint_stats is None:
+                endpoint_stats = self.endpoints[key] = EndpointStats()
+            endpoint_stats.latency.observe(elapsed)
+            endpoint_stats.sql_statements += stats['sql_statements']
+            endpoint_stats.sql_seconds += stats['sql_seconds']
+            endpoint_stats.template_seconds += stats['template_seconds']
+            status = response.status_code
+            endpoint_stats.statuses[status] = endpoint_stats.statuses.get(status, 0) + 1
+
+        if self.slow_request_ms is not None and elapsed * 1000 >= self.slow_request_ms:
+            self.log_slow_request(elapsed, stats)
+        return response
+
+    def log_slow_request(self, elapsed, stats):
+        """
+        Записать медленный запрос в журнал с разбивкой времени.
+        """
+        slowest = sorted(stats['statements'], key=lambda item: item[1], reverse=True)
+        lines = [
+            f'  {seconds * 1000:8.2f} ms  {" ".join(statement.split())[:200]}'
+            for statement, seconds in slowest[:self.slow_statements]
+        ]
+        logger.warning(
+            'slow request %s %s: %.1f ms total, sql %d statements %.1f ms, templates %.1f ms%s',
+            request.method, request.full_path.rstrip('?'), elapsed * 1000,
+            stats['sql_statements'], stats['sql_seconds'] * 1000,
+            stats['template_seconds'] * 1000,
+            ''.join('\n' + line for line in lines),
+        )
+
+    def template_started(self, sender, template, context, **extra):
+        if has_request_context() and 'instrumentation' in g:
+            g.instrumentation['template_started'] = time.perf_counter()
+
+    def template_finished(self, sender, template, context, **extra):
+        if has_request_context() and 'instrumentation' in g:
+            stats = g.instrumentation
+            started = stats.pop('template_started', None)
+            if started is not None:
+                stats['template_seconds'] += time.perf_counter() - started
+
+    # --- SQL ---
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # время начала хранится в контексте выполнения запроса, а не в
+        # соединении: после ошибки after_cursor_execute не вызывается, и
+        # значение в соединении пула осталось бы до следующих запросов
+        if context is not None:
+            context.instrumentation_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.observe_statement(statement, context)
+
+    def handle_error(self, exception_context):
+        if exception_context.execution_context is not None:
+            self.observe_statement(exception_context.statement, exception_context.execution_context)
+
+    def observe_statement(self, statement, context):
+        """
+        Учесть выполненный (в том числе неудачный) SQL-запрос.
+
+        :param statement: текст запроса.
+        :type statement: str
+        :param context: контекст выполнения SQLAlchemy.
+        """
+        started = context.__dict__.pop('instrumentation_started', None) if context is not None else None
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        with self.lock:
+            self.sql_statements += 1
+            self.sql_seconds += seconds
+        if has_request_context() and 'instrumentation' in g:
+            stats = g.instrumentation
+            stats['sql_statements'] += 1
+            stats['sql_seconds'] += seconds
+            if stats['statements'] is not None and len(stats['statements']) < MAX_STATEMENTS:
+                stats['statements'].append((statement, seconds))
+
+    # --- приём метрик ---
+
+    def count_ingest(self, rows):
+        """
+        Учесть сохранённые измерения.
+
+        :param rows: число измерений.
+        :type rows: int
+        """
+        second = int(time.time())
+        with self.lock:
+            self.ingest_rows += rows
+            if self.ingest_window and self.ingest_window[-1][0] == second:
+                self.ingest_window[-1][1] += rows
+            else:
+                self.ingest_window.append([second, rows])
+
+    def count_ingest_lost(self, rows):
+        """
+        Учесть измерения, потерянные хранилищем после фиксации пакета.
+
+        :param rows: число измерений.
+        :type rows: int
+        """
+        with self.lock:
+            self.ingest_lost += rows
+
+    def ingest_rate(self):
+        """
+        Средняя скорость приёма за последние rate_window секунд, строк/с.
+
+        :rtype: float
+        """
+        since = int(time.time()) - self.rate_window
+        with self.lock:
+            rows = sum(count for second, count in self.ingest_window if second > since)
+        return rows / self.rate_window
+
+    def db_size(self):
+        """
+        Размер файла базы SQLite вместе с журналом WAL, байт.
+
+        :rtype: int | None
+        """
+        if not self.db_path:
+            return None
+        return sum(os.path.getsize(self.db_path + suffix)
+                   for suffix in ('', '-wal') if os.path.exists(self.db_path + suffix))
+
+    # --- вывод ---
+
+    def render(self, extra=None):
+        """
+        Сформировать текст для эндпоинта /metrics (формат Prometheus 0.0.4).
+
+        :param extra: дополнительные показатели: имя -> (тип, описание, значение).
+        :type extra: dict | None
+        :rtype: str
+        """
+        out = []
+
+        def header(name, kind, description):
+            out.append(f'# HELP {name} {description}')
+            out.append(f'# TYPE {name} {kind}')
+
+        header('sysmon_process_info', 'gauge', 'Server process whose counters follow; counters are per process.')
+        out.append(f'sysmon_process_info{{pid="{os.getpid()}"}} 1')
+
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+
+            header('sysmon_request_duration_seconds', 'histogram', 'HTTP request latency by endpoint.')
+            for (endpoint, method), stats in endpoints:
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.latency.counts):
+                    cumulative += count
+                    out.append(f'sysmon_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                out.append(f'sysmon_request_duration_seconds_sum{{{labels}}} {stats.latency.sum:.6f}')
+                out.append(f'sysmon_request_duration_seconds_count{{{labels}}} {stats.latency.count}')
+
+            header('sysmon_responses_total', 'counter', 'HTTP responses by endpoint and status.')
+            for (endpoint, method), stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    out.append(f'sysmon_responses_total{{endpoint="{endpoint}",method="{method}",'
+                               f'status="{status}"}} {count}')
+
+            per_request = (
+                ('sysmon_request_sql_statements_total', 'sql_statements', 'SQL statements executed by requests.'),
+                ('sysmon_request_sql_seconds_total', 'sql_seconds', 'Time spent in SQL by requests.'),
+                ('sysmon_request_template_seconds_total', 'template_seconds', 'Time spent rendering templates.'),
+            )
+            for name, attr, description in per_request:
+                header(name, 'counter', description)
+                for (endpoint, method), stats in endpoints:
+                    value = getattr(stats, attr)
+                    value = f'{value:.6f}' if isinstance(value, float) else value
+                    out.append(f'{name}{{endpoint="{endpoint}",method="{method}"}} {value}')
+
+            header('sysmon_sql_statements_total', 'counter', 'SQL statements executed by the process.')
+            out.append(f'sysmon_sql_statements_total {self.sql_statements}')
+            header('sysmon_sql_seconds_total', 'counter', 'Time spent in SQL by the process.')
+            out.append(f'sysmon_sql_seconds_total {self.sql_seconds:.6f}')
+            header('sysmon_ingest_rows_total', 'counter', 'Metric rows stored.')
+            out.append(f'sysmon_ingest_rows_total {self.ingest_rows}')
+            header('sysmon_ingest_rows_lost_total', 'counter', 'Raw metric rows not written after the batch commit.')
+            out.append(f'sysmon_ingest_rows_lost_total {self.ingest_lost}')
+
+        header('sysmon_ingest_rows_per_second', 'gauge', f'Rows stored per second over the last {self.rate_window} s.')
+        out.append(f'sysmon_ingest_rows_per_second {self.ingest_rate():.3f}')
+
+        size = self.db_size()
+        if size is not None:
+            header('sysmon_db_size_bytes', 'gauge', 'SQLite database size including WAL.')
+            out.append(f'sysmon_db_size_bytes {size}')
+
+        for name, (kind, description, value) in (extra or {}).items():
+            header(name, kind, description)
+            out.append(f'{name} {value}')
+        return '\n'.join(out) + '\n'
+
+
+def init_instrumentation(app):
+    """
+    Подключить сбор показателей, если он включён в конфигурации.
+
+    Объект сохраняется в app.extensions["instrumentation"].
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        return
+
+    instrumentation = Instrumentation(
+        slow_request_ms=app.config['SLOW_REQUEST_MS'],
+        slow_statements=app.config['SLOW_REQUEST_STATEMENTS'],
+    )
+    app.extensions['instrumentation'] = instrumentation
+
+    app.before_request(instrumentation.before_request)
+    app.after_request(instrumentation.after_request)
+    before_render_template.connect(instrumentation.template_started, app)
+    template_rendered.connect(instrumentation.template_finished, app)
+
+    with app.app_context():
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', instrumentation.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', instrumentation.after_cursor_execute)
+        event.listen(engine, 'handle_error', instrumentation.handle_error)
+        if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+            instrumentation.db_path = os.path.abspath(engine.url.database)
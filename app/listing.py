@@ -0,0 +1,142 @@
+"""
+Поиск, сортировка и постраничный вывод списка компьютеров.
+
+Список страницы /computers и API /api/computers строится одним запросом
+с LIMIT: фильтр по имени хоста (по префиксу или подстроке, без учёта
+регистра) и сортировка по имени или по текущей загрузке CPU, RAM или
+диска. Страницы выбираются по ключу (keyset): курсор следующей страницы
+содержит значение сортировки и id последней строки, поэтому стоимость
+любой страницы не зависит от её номера.
+
+Запросы обслуживаются индексами ix_computer_hostname_nocase (имя без
+учёта регистра) и ix_computer_state_cpu/ram/disk (см. миграцию 7 в
+app/storage.py).
+"""
+
+import base64
+import json
+
+from . import db
+from .models import Computer, ComputerState
+
+# сортировка по текущей метрике -> столбец ComputerState
+METRIC_SORTS = {
+    'cpu': ComputerState.cpu_percent,
+    'ram': ComputerState.memory_usage,
+    'disk': ComputerState.disk_usage,
+}
+
+SORTS = ('hostname',) + tuple(METRIC_SORTS)
+MATCH_MODES = ('prefix', 'contains')
+
+
+def encode_cursor(value, computer_id):
+    """
+    Сформировать курсор следующей страницы.
+
+    :param value: значение сортировки последней строки.
+    :type value: str | float
+    :param computer_id: id последней строки.
+    :type computer_id: int
+    :rtype: str
+    """
+    raw = json.dumps([value, computer_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Разобрать курсор, полученный от клиента.
+
+    :param token: значение параметра after.
+    :type token: str
+    :return: пара (значение сортировки, id).
+    :rtype: tuple
+    :raises ValueError: если курсор повреждён.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, computer_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    if isinstance(computer_id, bool) or not isinstance(computer_id, int):
+        raise ValueError('invalid cursor')
+    return value, computer_id
+
+
+def escape_like(text):
+    """
+    Экранировать символы шаблона LIKE в пользовательском вводе.
+
+    :rtype: str
+    """
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def query_computers(q='', match='prefix', sort='hostname', after=None, limit=50):
+    """
+    Получить одну страницу списка компьютеров.
+
+    При сортировке по имени показываются все компьютеры в алфавитном
+    порядке. При сортировке по метрике — только компьютеры, у которых эта
+    метрика есть, по убыванию значения ("самые загруженные" первыми).
+
+    :param q: строка поиска по имени хоста; пустая — без фильтра.
+    :type q: str
+    :param match: "prefix" — имя начинается с q, "contains" — содержит q.
+    :type match: str
+    :param sort: "hostname", "cpu", "ram" или "disk".
+    :type sort: str
+    :param after: курсор из предыдущей страницы.
+    :type after: str | None
+    :param limit: размер страницы.
+    :type limit: int
+    :return: пара (компьютеры с загруженным состоянием, курсор следующей
+             страницы или None, если страница последняя).
+    :rtype: tuple[list[Computer], str | None]
+    :raises ValueError: если параметры некорректны.
+    """
+    if sort not in SORTS:
+        raise ValueError(f'sort must be one of: {", ".join(SORTS)}')
+    if match not in MATCH_MODES:
+        raise ValueError(f'match must be one of: {", ".join(MATCH_MODES)}')
+
+    hostname = db.collate(Computer.hostname, 'NOCASE')
+    stmt = db.select(Computer).options(db.contains_eager(Computer.state))
+
+    if q:
+        pattern = escape_like(q) + '%'
+        if match == 'contains':
+            pattern = '%' + pattern
+        stmt = stmt.where(hostname.like(pattern, escape='\\'))
+
+    if sort == 'hostname':
+        key = hostname
+        stmt = stmt.outerjoin(Computer.state).order_by(hostname, Computer.id)
+    else:
+        key = METRIC_SORTS[sort]
+        stmt = (
+            stmt.join(Computer.state)
+            .where(key.is_not(None))
+            .order_by(key.desc(), ComputerState.computer_id.desc())
+        )
+
+    if after:
+        value, last_id = decode_cursor(after)
+        if sort == 'hostname':
+            if not isinstance(value, str):
+                raise ValueError('invalid cursor')
+            stmt = stmt.where(db.or_(key > value, db.and_(key == value, Computer.id > last_id)))
+        else:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError('invalid cursor')
+            stmt = stmt.where(db.or_(key < value, db.and_(key == value, ComputerState.computer_id < last_id)))
+
+    computers = db.session.scalars(stmt.limit(limit + 1)).unique().all()
+    next_cursor = None
+    if len(computers) > limit:
+        computers = computers[:limit]
+        last = computers[-1]
+        value = last.hostname if sort == 'hostname' else getattr(last.state, METRIC_SORTS[sort].key)
+        next_cursor = encode_cursor(value, last.id)
+    return computers, next_cursor
@@ -0,0 +1,252 @@
+"""
+Живые обновления списка компьютеров (Server-Sent Events).
+
+Один фоновый поток на процесс раз в LIVE_POLL_INTERVAL секунд выбирает из
+computer_state только строки, изменившиеся с прошлого опроса (индекс по
+metric_id), и складывает их в общую историю изменений. Потоки SSE всех
+открытых вкладок читают эту историю из памяти, начиная со своего курсора,
+поэтому нагрузка на базу за такт зависит от числа изменившихся хостов,
+а не от числа зрителей.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+from . import db
+from .models import Computer, ComputerState
+
+
+def state_payload(state, hostname):
+    """
+    Представить состояние компьютера в виде, который ожидает клиентский код.
+
+    :param state: текущее состояние компьютера.
+    :type state: ComputerState
+    :param hostname: имя компьютера.
+    :type hostname: str
+    :rtype: dict
+    """
+    return {
+        'id': state.computer_id,
+        'hostname': hostname,
+        'cpu': state.cpu_percent,
+        'ram': state.memory_usage,
+        'disk': state.disk_usage,
+        'processes': state.processes,
+        'timestamp': state.timestamp.strftime('%Y-%m-%d %H:%M:%S') if state.timestamp else None,
+    }
+
+
+class LiveFeed:
+    """
+    Общая для процесса лента изменений состояния компьютеров.
+
+    Основные атрибуты:
+        cursor (int): наибольший metric_id, уже попавший в ленту.
+        events (collections.deque): последние изменения (metric_id, данные хоста).
+    """
+    def __init__(self, app, poll_interval=1.0, history=10000):
+        """
+        :param app: Flask-приложение SysMonitor.
+        :type app: flask.Flask
+        :param poll_interval: период опроса базы, сек.
+        :type poll_interval: float
+        :param history: сколько последних изменений хранить в памяти.
+        :type history: int
+        """
+        self.app = app
+        self.poll_interval = poll_interval
+        self.events = deque(maxlen=history)
+        self.cursor = None
+        self.floor = None # курсоры меньше этого значения историей уже не покрываются
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def poll_once(self):
+        """
+        Забрать из базы изменения новее текущего курсора.
+
+        При первом вызове только запоминает текущий максимум metric_id:
+        клиенты получают исходное состояние из отрисованной страницы
+        или из снимка (snapshot).
+
+        :return: число новых изменений.
+        :rtype: int
+        """
+        with self.app.app_context():
+            if self.cursor is None:
+                cursor = db.session.query(db.func.max(ComputerState.metric_id)).scalar() or 0
+                with self.cond:
+                    self.cursor = self.floor = cursor
+                return 0
+
+            rows = db.session.execute(
+                db.select(ComputerState, Computer.hostname)
+                .join(Computer, Computer.id == ComputerState.computer_id)
+                .where(ComputerState.metric_id > self.cursor)
+                .order_by(ComputerState.metric_id)
+            ).all()
+            changes = [(state.metric_id, state_payload(state, hostname)) for state, hostname in rows]
+
+        if changes:
+            with self.cond:
+                for change in changes:
+                    if len(self.events) == self.events.maxlen:
+                        self.floor = self.events[0][0]
+                    self.events.append(change)
+                self.cursor = changes[-1][0]
+                self.cond.notify_all()
+        return len(changes)
+
+    def snapshot(self):
+        """
+        Получить состояние всех компьютеров одним запросом.
+
+        :return: пара (курсор, список данных хостов).
+        :rtype: tuple[int, list[dict]]
+        """
+        with self.app.app_context():
+            rows = db.session.execute(
+                db.select(ComputerState, Computer.hostname)
+                .join(Computer, Computer.id == ComputerState.computer_id)
+            ).all()
+        cursor = max((state.metric_id or 0 for state, _ in rows), default=0)
+        return cursor, [state_payload(state, hostname) for state, hostname in rows]
+
+    def changes_since(self, cursor):
+        """
+        Получить последние данные хостов, изменившихся после курсора.
+
+        Просматривается только хвост ленты новее курсора, каждый хост
+        возвращается один раз — в самом свежем состоянии.
+
+        :param cursor: последний metric_id, известный клиенту.
+        :type cursor: int
+        :return: пара (новый курсор, список данных хостов) или (None, None),
+                 если курсор старее истории и клиенту нужен снимок.
+        :rtype: tuple
+        """
+        with self.cond:
+            if self.cursor is None or cursor < self.floor:
+                return None, None
+            if cursor >= self.cursor:
+                return cursor, []
+
+            seen = set()
+            hosts = []
+            for metric_id, payload in reversed(self.events):
+                if metric_id <= cursor:
+                    break
+                if payload['id'] not in seen:
+                    seen.add(payload['id'])
+                    hosts.append(payload)
+            return self.cursor, hosts
+
+    def wait(self, cursor, timeout):
+        """
+        Дождаться изменений новее курсора или истечения таймаута.
+
+        :param cursor: последний metric_id, известный клиенту.
+        :type cursor: int
+        :param timeout: максимальное время ожидания, сек.
+        :type timeout: float
+        """
+        with self.cond:
+            if self.cursor is None or self.cursor <= cursor:
+                self.cond.wait(timeout)
+
+    def ensure_started(self):
+        """
+        Запустить поток опроса при первом подключении клиента.
+        """
+        with self.cond:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='live-feed', daemon=True)
+        if self.cursor is None:
+            self.poll_once()
+        self.thread.start()
+
+    def _run(self):
+        """
+        Основной цикл потока опроса.
+        """
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll_once()
+            except Exception:
+                self.app.logger.exception('live feed poll failed')
+
+    def stream(self, cursor, heartbeat=15, max_seconds=300, retry=3):
+        """
+        Генератор событий SSE для одного клиента.
+
+        Если курсор не задан или уже выпал из истории, первым событием
+        отправляется снимок всех хостов (event: snapshot). Далее каждое
+        событие содержит список изменившихся хостов, а в поле id — новый
+        курсор, который браузер пришлёт в Last-Event-ID при переподключении.
+        Соединение закрывается через max_seconds, чтобы не занимать рабочий
+        поток сервера бесконечно; EventSource переподключается сам.
+
+        :param cursor: последний metric_id, известный клиенту.
+        :type cursor: int | None
+        :param heartbeat: период комментариев-пингов при отсутствии изменений, сек.
+        :type heartbeat: float
+        :param max_seconds: время жизни соединения, сек; 0 — отправить одно
+            событие и закрыть соединение.
+        :type max_seconds: float
+        :param retry: через сколько секунд браузеру переподключаться.
+        :type retry: float
+        """
+        deadline = time.monotonic() + max_seconds
+        yield f'retry: {int(retry * 1000)}\n\n'
+
+        while True:
+            hosts = None
+            if cursor is not None:
+                new_cursor, hosts = self.changes_since(cursor)
+            if hosts is None:
+                cursor, hosts = self.snapshot()
+                yield format_event(cursor, hosts, 'snapshot')
+            elif hosts:
+                cursor = new_cursor
+                yield format_event(cursor, hosts)
+            else:
+                yield ': keepalive\n\n'
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self.wait(cursor, min(heartbeat, remaining))
+
+
+def format_event(cursor, hosts, event=None):
+    """
+    Сформировать одно событие SSE.
+
+    :rtype: str
+    """
+    lines = [f'id: {cursor}']
+    if event:
+        lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(hosts, ensure_ascii=False))
+    return '\n'.join(lines) + '\n\n'
+
+
+def init_live(app):
+    """
+    Создать ленту живых обновлений и сохранить её в app.extensions["live_feed"].
+
+    Поток опроса запускается только при подключении первого клиента.
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    app.extensions['live_feed'] = LiveFeed(
+        app,
+        poll_interval=app.config['LIVE_POLL_INTERVAL'],
+        history=app.config['LIVE_HISTORY'],
+    )
@@ -0,0 +1,356 @@
+"""
+Хранилище сырых измерений: общий интерфейс и реализация на SQLAlchemy.
+
+Запись и чтение сырых измерений (приём метрик, страница компьютера,
+история за интервал, уплотнение) идут через объект MetricStore из
+app.extensions["metric_store"]. Реализация выбирается параметром
+METRIC_STORE:
+
+    sql         — таблица metric в основной базе (SqlMetricStore);
+    columnar    — столбцовые файлы, отображаемые в память (app/columnar.py);
+    partitioned — по файлу SQLite на сутки или неделю (app/partitions.py).
+
+Агрегаты ярусов свёртки, текущее состояние компьютеров и оповещения
+всегда хранятся в основной базе: хранилище отвечает только за ряд
+сырых измерений.
+"""
+
+import atexit
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from . import db
+from .models import ComputerState, Metric, MetricSequence
+from .rollups import ROLLUP_FIELDS
+
+EPOCH = datetime(1970, 1, 1)
+
+# начало корзины в секундах Unix-времени
+BUCKET_SQL = "(CAST(strftime('%s', {column}) AS INTEGER) / :step) * :step"
+
+# одно измерение; атрибуты совпадают с моделью Metric
+MetricRecord = namedtuple(
+    'MetricRecord',
+    ['id', 'computer_id', 'timestamp', 'cpu_percent', 'memory_usage', 'disk_usage', 'processes', 'extra'],
+)
+
+
+def to_epoch(value):
+    """
+    Преобразовать naive datetime (UTC) в Unix-время, сек.
+
+    :type value: datetime.datetime
+    :rtype: float
+    """
+    return (value - EPOCH).total_seconds()
+
+
+def from_epoch(value):
+    """
+    Преобразовать Unix-время в naive datetime (UTC) с точностью до микросекунды.
+
+    :type value: float
+    :rtype: datetime.datetime
+    """
+    return EPOCH + timedelta(seconds=value)
+
+
+def bucket_stats(values):
+    """
+    avg/min/max/p95 значений одной метрики в корзине.
+
+    p95 считается методом ближайшего ранга, как в запросе по таблице
+    metric: наименьшее значение, ранг которого не меньше 95% от их числа.
+
+    :param values: значения без пропусков, в любом порядке.
+    :type values: list[float | int]
+    :return: четыре числа или четыре None, если значений нет.
+    :rtype: list
+    """
+    if not values:
+        return [None] * 4
+    values = sorted(values)
+    rank = -(-len(values) * 95 // 100)
+    return [sum(values) / len(values), values[0], values[-1], values[rank - 1]]
+
+
+def build_raw_sql(source='metric'):
+    """
+    Запрос по сырым измерениям: avg/min/max/p95 по корзинам.
+
+    Для p95 значения каждой метрики нумеруются внутри корзины по
+    возрастанию (NULL — в конце), и берётся наименьшее значение, ранг
+    которого не меньше 95% от числа значений (метод ближайшего ранга).
+
+    :param source: таблица или подзапрос со столбцами таблицы metric.
+    :type source: str
+    """
+    columns = ', '.join(ROLLUP_FIELDS.values())
+    windows = ', '.join(
+        f'row_number() OVER (PARTITION BY bucket ORDER BY {column} IS NULL, {column}) AS {name}_rn, '
+        f'count({column}) OVER (PARTITION BY bucket) AS {name}_cnt'
+        for name, column in ROLLUP_FIELDS.items()
+    )
+    aggregates = ', '.join(
+        f'avg({column}), min({column}), max({column}), '
+        f'min(CASE WHEN {name}_rn * 100 >= {name}_cnt * 95 THEN {column} END)'
+        for name, column in ROLLUP_FIELDS.items()
+    )
+    bucket = BUCKET_SQL.format(column='timestamp')
+    return text(
+        f'SELECT bucket, count(*), {aggregates} FROM ('
+        f'  SELECT bucket, {columns}, {windows} FROM ('
+        f'    SELECT {bucket} AS bucket, {columns} FROM {source}'
+        f'    WHERE computer_id = :computer_id AND timestamp >= :start AND timestamp < :end'
+        f'  )'
+        f') GROUP BY bucket ORDER BY bucket'
+    ).bindparams(bindparam('start', type_=db.DateTime), bindparam('end', type_=db.DateTime))
+
+
+RAW_SQL = build_raw_sql()
+
+
+class MetricStore:
+    """
+    Интерфейс хранилища сырых измерений.
+
+    Строка измерения — словарь со столбцами модели Metric (computer_id,
+    timestamp, cpu_percent, memory_usage, disk_usage, processes, extra).
+    Запись двухфазная: insert() вызывается внутри транзакции приёма и
+    присваивает строкам id, а commit() или rollback() — после фиксации
+    или отката этой транзакции. Идентификаторы возрастают монотонно по
+    всему хранилищу: на них опирается курсор живых обновлений.
+    """
+    def insert(self, rows):
+        """
+        Добавить измерения и присвоить каждому поле "id".
+
+        :param rows: строки измерений; словари дополняются ключом "id".
+        :type rows: list[dict]
+        """
+        raise NotImplementedError
+
+    def commit(self):
+        """
+        Сделать видимыми измерения, добавленные insert() в этом потоке.
+        """
+
+    def rollback(self):
+        """
+        Отбросить измерения, добавленные insert() в этом потоке.
+        """
+
+    def latest(self, computer_id, limit):
+        """
+        Последние измерения компьютера, от новых к старым.
+
+        :rtype: list[Metric | MetricRecord]
+        """
+        raise NotImplementedError
+
+    def scan(self, computer_id, start, end):
+        """
+        Измерения компьютера за интервал [start, end) по возрастанию времени.
+
+        :rtype: collections.abc.Iterator[Metric | MetricRecord]
+        """
+        raise NotImplementedError
+
+    def buckets(self, computer_id, start, end, step):
+        """
+        Агрегаты измерений за интервал [start, end) по корзинам step секунд.
+
+        :return: строки (начало корзины, число измерений, затем avg, min,
+                 max и p95 по каждому полю ROLLUP_FIELDS) по возрастанию
+                 начала корзины.
+        :rtype: collections.abc.Iterable[tuple]
+        """
+        raise NotImplementedError
+
+    def delete_before(self, computer_id, cutoff, limit):
+        """
+        Удалить измерения компьютера старше cutoff.
+
+        :param limit: желаемый предел числа строк за один вызов; хранилища
+                      с удалением целыми файлами могут его превысить.
+        :type limit: int
+        :return: число удалённых строк; меньше limit — старых строк не осталось.
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Освободить ресурсы хранилища.
+        """
+
+
+class SqlMetricStore(MetricStore):
+    """
+    Сырые измерения в таблице metric основной базы.
+
+    Вставка выполняется в текущей транзакции сессии, поэтому commit() и
+    rollback() ничего не делают: измерения фиксируются вместе с агрегатами
+    и состоянием компьютеров.
+    """
+    def insert(self, rows):
+        ids = db.session.scalars(
+            db.insert(Metric).returning(Metric.id, sort_by_parameter_order=True), rows
+        ).all()
+        for row, metric_id in zip(rows, ids):
+            row['id'] = metric_id
+
+    def latest(self, computer_id, limit):
+        return (
+            Metric.query
+            .filter_by(computer_id=computer_id)
+            .order_by(Metric.timestamp.desc())
+            .limit(limit)
+            .all()
+        )
+
+    def scan(self, computer_id, start, end):
+        """
+        Строки читаются курсором порциями по 1000 (yield_per) в кортежи
+        MetricRecord, без ORM-объекта на строку.
+        """
+        rows = db.session.execute(
+            db.select(*(getattr(Metric, name) for name in MetricRecord._fields))
+            .where(Metric.computer_id == computer_id, Metric.timestamp >= start, Metric.timestamp < end)
+            .order_by(Metric.timestamp)
+            .execution_options(yield_per=1000)
+        )
+        return map(MetricRecord._make, rows)
+
+    def buckets(self, computer_id, start, end, step):
+        return db.session.execute(
+            RAW_SQL, {'computer_id': computer_id, 'start': start, 'end': end, 'step': step}
+        )
+
+    def delete_before(self, computer_id, cutoff, limit):
+        """
+        Удалить одной транзакцией до limit самых старых строк.
+
+        Граница порции — время limit-й по счёту старой строки; всё, что не
+        новее неё, удаляется одним DELETE (поиск обслуживает индекс
+        (computer_id, timestamp)).
+        """
+        condition = db.and_(Metric.computer_id == computer_id, Metric.timestamp < cutoff)
+        boundary = db.session.execute(
+            db.select(Metric.timestamp).where(condition)
+            .order_by(Metric.timestamp).offset(limit - 1).limit(1)
+        ).scalar()
+        if boundary is not None:
+            condition = db.and_(Metric.computer_id == computer_id, Metric.timestamp <= boundary)
+        result = db.session.execute(db.delete(Metric).where(condition))
+        db.session.commit()
+        return result.rowcount
+
+
+def id_floor():
+    """
+    Наибольший id измерения, уже известный основной базе.
+
+    :rtype: int
+    """
+    return max(
+        db.session.scalar(db.select(db.func.max(Metric.id))) or 0,
+        db.session.scalar(db.select(db.func.max(ComputerState.metric_id))) or 0,
+    )
+
+
+def advance_sequence(floor=0):
+    """
+    Поднять metric_sequence до наибольшего известного id измерения.
+
+    Нужно при переходе на хранилище вне таблицы metric: новые id должны
+    продолжать старые, иначе курсор живых обновлений откатится.
+
+    :param floor: наибольший id, известный самому хранилищу.
+    :type floor: int
+    """
+    floor = max(id_floor(), floor)
+    db.session.execute(
+        db.update(MetricSequence)
+        .where(MetricSequence.id == 1, MetricSequence.last_id < floor)
+        .values(last_id=floor)
+    )
+
+
+def allocate_ids(count):
+    """
+    Выдать count последовательных id измерений в текущей транзакции.
+
+    :rtype: range
+    """
+    last_id = db.session.execute(
+        db.update(MetricSequence)
+        .where(MetricSequence.id == 1)
+        .values(last_id=MetricSequence.last_id + count)
+        .returning(MetricSequence.last_id)
+    ).scalar_one()
+    return range(last_id - count + 1, last_id + 1)
+
+
+def get_metric_store():
+    """
+    Хранилище сырых измерений текущего приложения.
+
+    :rtype: MetricStore
+    """
+    return current_app.extensions['metric_store']
+
+
+def init_metric_store(app):
+    """
+    Создать хранилище сырых измерений по параметру METRIC_STORE.
+
+    Хранилище сохраняется в app.extensions["metric_store"]. Хранилища вне
+    таблицы metric продолжают нумерацию измерений с наибольшего id, уже
+    известного основной базе, чтобы курсор живых обновлений не
+    откатывался при смене реализации.
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    :raises ValueError: если METRIC_STORE не поддерживается.
+    """
+    backend = app.config['METRIC_STORE']
+    if backend == 'sql':
+        store = SqlMetricStore()
+    elif backend == 'columnar':
+        from .columnar import ColumnarMetricStore
+
+        with app.app_context():
+            last_id = id_floor()
+        store = ColumnarMetricStore(
+            app.config['METRIC_STORE_PATH'] or os.path.join(app.instance_path, 'metrics'),
+            segment_rows=app.config['METRIC_SEGMENT_ROWS'],
+            max_open=app.config['METRIC_MAX_OPEN_SEGMENTS'],
+            first_id=last_id + 1,
+            chunk_rows=app.config['METRIC_CHUNK_ROWS'],
+            allocate=allocate_ids,
+        )
+        with app.app_context():
+            advance_sequence(store.next_id - 1)
+            db.session.commit()
+    elif backend == 'partitioned':
+        from .partitions import PartitionedMetricStore
+
+        with app.app_context():
+            advance_sequence()
+            db.session.commit()
+        store = PartitionedMetricStore(
+            app.config['METRIC_STORE_PATH'] or os.path.join(app.instance_path, 'metrics'),
+            period=app.config['METRIC_PARTITION'],
+            pragmas=app.config['SQLITE_PRAGMAS'],
+            keep=app.config['RETENTION'].get('raw') if app.config['RETENTION_ENABLED'] else None,
+        )
+    else:
+        raise ValueError(f'unknown METRIC_STORE: {backend}')
+
+    app.extensions['metric_store'] = store
+    atexit.register(store.close)
@@ -12,6 +12,7 @@ class Computer(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow) # дата и время регистрации компьютера в системе
 
     metrics = db.relationship('Metric', backref='computer', lazy=True, cascade="all, delete-orphan") # список всех измерений (Metric), связанных с данным компьютером
+    state = db.relationship('ComputerState', backref='computer', lazy='joined', uselist=False, cascade="all, delete-orphan") # текущее состояние (последнее измерение), загружается тем же запросом
 
 class Metric(db.Model):
     """
@@ -26,3 +27,237 @@ class Metric(db.Model):
     disk_usage = db.Column(db.Float) # заполненность диска, %
     processes = db.Column(db.Integer)  # количество запущенных процессов
     timestamp = db.Column(db.DateTime, default=datetime.utcnow) # отметка времени, когда были сняты метрики
+    extra = db.Column(db.JSON) # дополнительные метрики сборщиков агента (блок ext), без отдельных столбцов
+
+    __table_args__ = (
+        db.Index('ix_metric_computer_timestamp', 'computer_id', 'timestamp'), # выборки истории одного компьютера по времени
+    )
+
+class ComputerState(db.Model):
+    """
+    Текущее состояние компьютера — копия его последнего измерения.
+
+    Одна строка на компьютер, обновляется при каждом приёме метрик. Страницы
+    со списком компьютеров читают только эту таблицу, поэтому время их
+    отрисовки зависит от числа хостов, а не от объёма накопленной истории.
+    """
+    computer_id = db.Column(db.Integer, db.ForeignKey('computer.id'), primary_key=True) # ссылка на таблицу Computer
+    cpu_percent = db.Column(db.Float) # загрузка CPU, %
+    memory_usage = db.Column(db.Float) # использование RAM, %
+    disk_usage = db.Column(db.Float) # заполненность диска, %
+    processes = db.Column(db.Integer) # количество запущенных процессов
+    timestamp = db.Column(db.DateTime) # время последнего измерения
+    metric_id = db.Column(db.Integer, index=True) # id последнего измерения — курсор живых обновлений
+
+    __table_args__ = (
+        # сортировка списка компьютеров по текущей загрузке (app/listing.py)
+        db.Index('ix_computer_state_cpu', 'cpu_percent', 'computer_id'),
+        db.Index('ix_computer_state_ram', 'memory_usage', 'computer_id'),
+        db.Index('ix_computer_state_disk', 'disk_usage', 'computer_id'),
+    )
+
+    def update_from(self, values):
+        """
+        Скопировать значения измерения, если оно не старше текущего состояния.
+
+        :param values: значения столбцов модели Metric (id, cpu_percent,
+                       memory_usage, disk_usage, processes, timestamp).
+        :type values: dict
+        """
+        if self.timestamp is not None and values['timestamp'] < self.timestamp:
+            return
+        self.cpu_percent = values['cpu_percent']
+        self.memory_usage = values['memory_usage']
+        self.disk_usage = values['disk_usage']
+        self.processes = values['processes']
+        self.timestamp = values['timestamp']
+        self.metric_id = values.get('id')
+
+    @staticmethod
+    def backfill():
+        """
+        Заполнить состояние для компьютеров, у которых его ещё нет.
+
+        Нужна для баз, созданных до появления таблицы computer_state:
+        состояние берётся из последнего по id измерения каждого компьютера
+        одним запросом INSERT ... SELECT. Фиксацию транзакции выполняет
+        вызывающий код (миграция схемы).
+        """
+        missing = (
+            db.select(Computer.id)
+            .outerjoin(ComputerState)
+            .where(ComputerState.computer_id.is_(None))
+        )
+        if db.session.execute(missing.limit(1)).first() is None:
+            return
+
+        latest = (
+            db.select(db.func.max(Metric.id))
+            .where(Metric.computer_id.in_(missing))
+            .group_by(Metric.computer_id)
+        )
+        columns = ['computer_id', 'cpu_percent', 'memory_usage', 'disk_usage', 'processes', 'timestamp']
+        rows = db.select(*(getattr(Metric, name) for name in columns), Metric.id).where(Metric.id.in_(latest))
+        columns.append('metric_id')
+        db.session.execute(db.insert(ComputerState).from_select(columns, rows))
+
+class MetricRollup(db.Model):
+    """
+    Агрегат измерений компьютера за интервал времени (ярус свёртки).
+
+    Для каждого компьютера, разрешения (60 или 3600 секунд) и начала
+    интервала хранит минимум, максимум, сумму и число значений по каждой
+    метрике. Суммы и счётчики позволяют обновлять агрегат инкрементально
+    при приёме новых образцов и вычислять среднее как sum / count.
+    """
+    __tablename__ = 'metric_rollup'
+    __table_args__ = (
+        db.Index('ix_metric_rollup_resolution_bucket', 'resolution', 'bucket'), # выборки по всему парку за интервал (app/analytics.py)
+    )
+
+    computer_id = db.Column(db.Integer, db.ForeignKey('computer.id'), primary_key=True) # ссылка на таблицу Computer
+    resolution = db.Column(db.Integer, primary_key=True) # длина интервала, сек
+    bucket = db.Column(db.DateTime, primary_key=True) # начало интервала (UTC)
+
+    cpu_min = db.Column(db.Float) # загрузка CPU, %
+    cpu_max = db.Column(db.Float)
+    cpu_sum = db.Column(db.Float, nullable=False, default=0)
+    cpu_count = db.Column(db.Integer, nullable=False, default=0)
+
+    ram_min = db.Column(db.Float) # использование RAM, %
+    ram_max = db.Column(db.Float)
+    ram_sum = db.Column(db.Float, nullable=False, default=0)
+    ram_count = db.Column(db.Integer, nullable=False, default=0)
+
+    disk_min = db.Column(db.Float) # заполненность диска, %
+    disk_max = db.Column(db.Float)
+    disk_sum = db.Column(db.Float, nullable=False, default=0)
+    disk_count = db.Column(db.Integer, nullable=False, default=0)
+
+    processes_min = db.Column(db.Integer) # количество процессов
+    processes_max = db.Column(db.Integer)
+    processes_sum = db.Column(db.Float, nullable=False, default=0)
+    processes_count = db.Column(db.Integer, nullable=False, default=0)
+
+class MetricSequence(db.Model):
+    """
+    Последний выданный id сырого измерения.
+
+    Используется хранилищами, которые держат измерения вне таблицы metric
+    (app/partitions.py): id выдаются в транзакции основной базы и потому
+    монотонны при любом числе процессов сервера. Таблица содержит одну
+    строку с id = 1.
+    """
+    __tablename__ = 'metric_sequence'
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+
+class SchemaVersion(db.Model):
+    """
+    Запись о применённой миграции схемы базы данных.
+
+    Текущая версия схемы — максимальное значение version в таблице
+    (см. app/storage.py).
+    """
+    __tablename__ = 'schema_version'
+
+    version = db.Column(db.Integer, primary_key=True) # номер применённой миграции
+    description = db.Column(db.String(200)) # краткое описание шага
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow) # когда миграция была применена
+
+class AlertRule(db.Model):
+    """
+    Правило оповещения: порог для одной метрики.
+
+    Правило без computer_id действует на все компьютеры; правило с
+    computer_id действует на один компьютер и заменяет для него
+    глобальное правило по той же метрике. Оповещение открывается, когда
+    значение не ниже threshold непрерывно в течение sustain_seconds, и
+    закрывается, когда значение опускается ниже threshold - hysteresis.
+    """
+    __tablename__ = 'alert_rule'
+
+    id = db.Column(db.Integer, primary_key=True) # идентификатор правила
+    computer_id = db.Column(db.Integer, db.ForeignKey('computer.id'), index=True) # компьютер; NULL — глобальное правило
+    metric = db.Column(db.String(20), nullable=False) # метрика: cpu, ram, disk или processes
+    threshold = db.Column(db.Float, nullable=False) # порог срабатывания
+    hysteresis = db.Column(db.Float, nullable=False, default=0) # насколько значение должно опуститься ниже порога для закрытия
+    sustain_seconds = db.Column(db.Integer, nullable=False, default=0) # сколько секунд порог должен быть превышен непрерывно
+    enabled = db.Column(db.Boolean, nullable=False, default=True) # правило включено
+
+class AlertEvent(db.Model):
+    """
+    Оповещение: период, в течение которого правило было нарушено.
+
+    Открытое оповещение (closed_at IS NULL) — активное предупреждение,
+    которое показывает главная панель.
+    """
+    __tablename__ = 'alert_event'
+
+    id = db.Column(db.Integer, primary_key=True) # идентификатор оповещения
+    rule_id = db.Column(db.Integer, db.ForeignKey('alert_rule.id'), nullable=False) # сработавшее правило
+    computer_id = db.Column(db.Integer, db.ForeignKey('computer.id'), nullable=False) # компьютер
+    metric = db.Column(db.String(20), nullable=False) # метрика правила
+    threshold = db.Column(db.Float, nullable=False) # порог на момент срабатывания
+    value = db.Column(db.Float) # значение, открывшее оповещение
+    opened_at = db.Column(db.DateTime, nullable=False) # время измерения, открывшего оповещение
+    closed_at = db.Column(db.DateTime, index=True) # время измерения, закрывшего оповещение; NULL — активно
+
+    computer = db.relationship('Computer', lazy='joined') # компьютер, загружается тем же запросом
+
+    __table_args__ = (
+        # не больше одного открытого оповещения на пару (правило, компьютер),
+        # даже если образцы хоста принимают несколько процессов сервера
+        db.Index('ux_alert_event_open', 'rule_id', 'computer_id', unique=True,
+                 sqlite_where=db.text('closed_at IS NULL'), postgresql_where=db.text('closed_at IS NULL')),
+    )
+
+class AlertPending(db.Model):
+    """
+    Превышение порога, которое ещё не длится sustain_seconds.
+
+    Хранится в базе, а не в памяти процесса, чтобы отсчёт длительности был
+    общим для всех процессов сервера.
+    """
+    __tablename__ = 'alert_pending'
+
+    rule_id = db.Column(db.Integer, db.ForeignKey('alert_rule.id'), primary_key=True) # правило
+    computer_id = db.Column(db.Integer, db.ForeignKey('computer.id'), primary_key=True) # компьютер
+    since = db.Column(db.DateTime, nullable=False) # время измерения, с которого порог превышен
+
+class AlertRulesVersion(db.Model):
+    """
+    Версия правил оповещений (одна строка с id = 1).
+
+    Увеличивается в той же транзакции, что и изменение правил; процессы
+    сервера сверяют её перед проверкой пакета и перечитывают правила,
+    если она изменилась.
+    """
+    __tablename__ = 'alert_rules_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class AgentTelemetry(db.Model):
+    """
+    Последняя сводка самонаблюдения агента компьютера.
+
+    Агент раз в несколько минут присылает в блоке ext.telemetry, во что
+    ему обходятся сбор и отправка метрик; хранится одна, самая свежая
+    сводка на компьютер. Основные показатели вынесены в столбцы, чтобы
+    сортировать по ним хосты, полная сводка хранится в data.
+    """
+    __tablename__ = 'agent_telemetry'
+
+    computer_id = db.Column(db.Integer, db.ForeignKey('computer.id'), primary_key=True) # ссылка на таблицу Computer
+    reported_at = db.Column(db.DateTime, nullable=False) # время образца, с которым пришла сводка
+    cpu_percent = db.Column(db.Float) # загрузка CPU процессом агента за период сводки, %
+    rss_mb = db.Column(db.Float) # память процесса агента, МБ
+    collect_ms_p99 = db.Column(db.Float) # 99-й перцентиль времени сбора образца, мс
+    send_ms_p99 = db.Column(db.Float) # 99-й перцентиль времени отправки, мс
+    failures = db.Column(db.Integer) # неудачных отправок за период
+    spool_bytes = db.Column(db.Integer) # объём неотправленных образцов в дисковом буфере, байт
+    data = db.Column(db.JSON) # сводка целиком
+
+    computer = db.relationship('Computer', lazy='joined') # компьютер, загружается тем же запросом
@@ -0,0 +1,388 @@
+"""
+Секционированное хранилище сырых измерений: по файлу SQLite на период.
+
+Измерения раскладываются по времени измерения в файлы
+<root>/metric-YYYYMMDD.db, где период — сутки или неделя с понедельника
+(METRIC_PARTITION), а дата в имени — его начало (UTC). В каждом файле
+таблица metric с теми же столбцами, что и в основной базе, и индексом
+(computer_id, timestamp).
+
+Приём записывает пакет в разделы после фиксации основной транзакции;
+id измерений выдаёт последовательность metric_sequence основной базы,
+поэтому они монотонны при любом числе процессов сервера. Запрос за
+интервал открывает только разделы, пересекающие интервал: первый — как
+основную базу соединения, остальные присоединяются (ATTACH), и агрегация
+выполняется одним запросом по их объединению. Уплотнение удаляет файлы
+разделов целиком — без DELETE, удержания блокировки записи и
+фрагментации. Измерения старше срока хранения сырых данных не
+записываются, чтобы опоздавший образец не создал заново уже удалённый
+раздел. Раздел, удалённый другим процессом между просмотром каталога и
+открытием, пропускается.
+
+Перенос истории из таблицы metric основной базы выполняет
+partition_metrics.py (copy_from_table()).
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from . import db
+from .metricstore import MetricRecord, MetricStore, allocate_ids, build_raw_sql, from_epoch, to_epoch
+from .models import Metric
+
+# длина периода раздела, сутки
+PERIODS = {'day': 1, 'week': 7}
+# периоды отсчитываются от понедельника, чтобы недельные разделы начинались с него
+PERIOD_ANCHOR = date(1970, 1, 5)
+PARTITION_NAME = re.compile(r'^metric-(\d{8})\.db$')
+
+COLUMNS = ['id', 'computer_id', 'timestamp', 'cpu_percent', 'memory_usage', 'disk_usage', 'processes', 'extra']
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS metric ('
+    ' id INTEGER PRIMARY KEY, computer_id INTEGER NOT NULL, timestamp DATETIME NOT NULL,'
+    ' cpu_percent FLOAT, memory_usage FLOAT, disk_usage FLOAT, processes INTEGER, extra JSON)',
+    'CREATE INDEX IF NOT EXISTS ix_metric_computer_timestamp ON metric (computer_id, timestamp)',
+]
+# повторный перенос той же строки (тот же id) пропускается
+INSERT_SQL = f'INSERT OR IGNORE INTO metric ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})'
+SELECT_SQL = f'SELECT {", ".join(COLUMNS)} FROM metric'
+
+# SQLite по умолчанию присоединяет к соединению не более 10 баз
+MAX_ATTACHED = 10
+
+
+def format_timestamp(value):
+    """
+    Время в том же текстовом виде, в котором его хранит SQLAlchemy в SQLite.
+
+    :type value: datetime.datetime
+    :rtype: str
+    """
+    return value.isoformat(sep=' ', timespec='microseconds')
+
+
+class PartitionedMetricStore(MetricStore):
+    """
+    Сырые измерения в файлах SQLite по периодам.
+
+    Список разделов читается из каталога при каждом запросе, поэтому
+    разделы, созданные другими процессами сервера, сразу видны. Соединения
+    открываются на время одной операции; при записи схема раздела
+    проверяется каждый раз (CREATE TABLE IF NOT EXISTS), так как файл мог
+    быть удалён и создан заново другим процессом.
+
+    Основные атрибуты:
+        root (str): каталог разделов.
+        period (datetime.timedelta): длина периода раздела.
+        keep (datetime.timedelta | None): срок хранения сырых измерений;
+            более старые измерения не записываются.
+    """
+    def __init__(self, root, period='day', pragmas=None, keep=None):
+        """
+        :param root: каталог разделов; создаётся при необходимости.
+        :type root: str
+        :param period: "day" или "week".
+        :type period: str
+        :param pragmas: PRAGMA для соединений с разделами (SQLITE_PRAGMAS).
+        :type pragmas: dict | None
+        :param keep: срок хранения сырых измерений; None — бессрочно.
+        :type keep: datetime.timedelta | None
+        :raises ValueError: если период не поддерживается.
+        """
+        if period not in PERIODS:
+            raise ValueError(f'unknown METRIC_PARTITION: {period}')
+        os.makedirs(root, exist_ok=True)
+        self.root = os.path.abspath(root)
+        self.period = timedelta(days=PERIODS[period])
+        self.pragmas = dict(pragmas or {})
+        self.keep = keep
+        self.pending = threading.local()
+
+    # --- разделы ---
+
+    def partition_start(self, timestamp):
+        """
+        Начало периода, в который попадает момент timestamp.
+
+        :type timestamp: datetime.datetime
+        :rtype: datetime.datetime
+        """
+        day = timestamp.date()
+        day -= timedelta(days=(day - PERIOD_ANCHOR).days % self.period.days)
+        return datetime(day.year, day.month, day.day)
+
+    def path(self, start):
+        return os.path.join(self.root, f'metric-{start:%Y%m%d}.db')
+
+    def partitions(self, start=None, end=None):
+        """
+        Начала существующих разделов, пересекающих интервал [start, end).
+
+        :rtype: list[datetime.datetime]
+        """
+        result = []
+        for name in os.listdir(self.root):
+            match = PARTITION_NAME.match(name)
+            if match is None:
+                continue
+            begin = datetime.strptime(match.group(1), '%Y%m%d')
+            if start is not None and begin + self.period <= start:
+                continue
+            if end is not None and begin >= end:
+                continue
+            result.append(begin)
+        return sorted(result)
+
+    def _connect(self, start, create=False):
+        """
+        Открыть соединение с разделом.
+
+        Существующий раздел открывается без создания файла (mode=rw): раздел
+        мог быть удалён уплотнением. При create=True файл и схема создаются,
+        если их ещё нет.
+
+        :rtype: sqlite3.Connection
+        :raises sqlite3.OperationalError: если раздела нет, а create=False.
+        """
+        path = self.path(start)
+        if create:
+            connection = sqlite3.connect(path)
+        else:
+            connection = sqlite3.connect(Path(path).as_uri() + '?mode=rw', uri=True)
+        for name, value in self.pragmas.items():
+            if name != 'journal_mode' or create:
+                connection.execute(f'PRAGMA {name}={value}')
+        if create:
+            for statement in SCHEMA:
+                connection.execute(statement)
+        return connection
+
+    def _open(self, start):
+        """
+        Открыть существующий раздел.
+
+        :return: соединение или None, если раздел уже удалён.
+        :rtype: sqlite3.Connection | None
+        """
+        try:
+            return self._connect(start)
+        except sqlite3.OperationalError:
+            if os.path.exists(self.path(start)):
+                raise
+            return None
+
+    def _attach(self, starts):
+        """
+        Открыть первый из разделов и присоединить к нему остальные как p1, p2, ...
+
+        Уже удалённые разделы пропускаются.
+
+        :return: соединение и выражение FROM по объединению разделов;
+                 (None, None), если не осталось ни одного раздела.
+        :rtype: tuple[sqlite3.Connection | None, str | None]
+        """
+        connection, sources = None, []
+        for start in starts:
+            if connection is None:
+                connection = self._open(start)
+                if connection is not None:
+                    sources.append('SELECT * FROM main.metric')
+                continue
+            alias = f'p{len(sources)}'
+            try:
+                connection.execute(f'ATTACH DATABASE ? AS {alias}', (Path(self.path(start)).as_uri() + '?mode=rw',))
+            except sqlite3.OperationalError:
+                if os.path.exists(self.path(start)):
+                    raise
+                continue
+            sources.append(f'SELECT * FROM {alias}.metric')
+        if connection is None:
+            return None, None
+        return connection, f'({" UNION ALL ".join(sources)})'
+
+    # --- запись ---
+
+    def insert(self, rows):
+        """
+        Выдать измерениям id из metric_sequence и отложить запись до commit().
+        """
+        for row, metric_id in zip(rows, allocate_ids(len(rows))):
+            row['id'] = metric_id
+        self._pending().extend(rows)
+
+    def commit(self):
+        rows = self._pending()
+        self.pending.rows = []
+        if rows:
+            self.append(rows)
+
+    def rollback(self):
+        self.pending.rows = []
+
+    def _pending(self):
+        rows = getattr(self.pending, 'rows', None)
+        if rows is None:
+            rows = self.pending.rows = []
+        return rows
+
+    def append(self, rows):
+        """
+        Записать измерения с уже присвоенными id в их разделы.
+
+        Измерения старше срока хранения (keep) отбрасываются.
+
+        :param rows: строки измерений с ключом "id".
+        :type rows: list[dict]
+        """
+        if self.keep is not None:
+            cutoff = datetime.utcnow() - self.keep
+            rows = [row for row in rows if row['timestamp'] >= cutoff]
+        by_partition = {}
+        for row in rows:
+            by_partition.setdefault(self.partition_start(row['timestamp']), []).append(row)
+        for start, partition_rows in sorted(by_partition.items()):
+            with closing(self._connect(start, create=True)) as connection, connection:
+                connection.executemany(INSERT_SQL, [
+                    (row['id'], row['computer_id'], format_timestamp(row['timestamp']),
+                     row['cpu_percent'], row['memory_usage'], row['disk_usage'], row['processes'],
+                     None if row.get('extra') is None else json.dumps(row['extra'], ensure_ascii=False))
+                    for row in partition_rows
+                ])
+
+    # --- чтение ---
+
+    @staticmethod
+    def _record(values):
+        metric_id, computer_id, timestamp, cpu, ram, disk, processes, extra = values
+        return MetricRecord(metric_id, computer_id, datetime.fromisoformat(timestamp), cpu, ram, disk,
+                            processes, None if extra is None else json.loads(extra))
+
+    def latest(self, computer_id, limit):
+        """
+        Последние измерения: разделы читаются от нового к старому, пока
+        не наберётся limit строк.
+        """
+        records = []
+        for start in reversed(self.partitions()):
+            connection = self._open(start)
+            if connection is None:
+                continue
+            with closing(connection):
+                records.extend(map(self._record, connection.execute(
+                    f'{SELECT_SQL} WHERE computer_id = ? ORDER BY timestamp DESC LIMIT ?',
+                    (computer_id, limit - len(records)),
+                )))
+            if len(records) >= limit:
+                break
+        return records
+
+    def scan(self, computer_id, start, end):
+        """
+        Измерения за интервал: разделы не пересекаются по времени, поэтому
+        достаточно прочитать их по очереди.
+        """
+        for partition in self.partitions(start, end):
+            connection = self._open(partition)
+            if connection is None:
+                continue
+            with closing(connection):
+                cursor = connection.execute(
+                    f'{SELECT_SQL} WHERE computer_id = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp',
+                    (computer_id, format_timestamp(start), format_timestamp(end)),
+                )
+                for values in cursor:
+                    yield self._record(values)
+
+    def buckets(self, computer_id, start, end, step):
+        """
+        Агрегаты по корзинам одним запросом по объединению разделов.
+
+        Если разделов больше, чем можно присоединить, интервал делится на
+        окна по границам корзин: корзина целиком относится к окну, в
+        котором начинается, и окно присоединяет ещё и разделы с её хвостом.
+        """
+        starts = self.partitions(start, end)
+        if not starts:
+            return
+        tail = -(-step // int(self.period.total_seconds()))
+        group = max(1, MAX_ATTACHED - tail)
+        bounds = [start]
+        for first in starts[group::group]:
+            bounds.append(min(end, from_epoch(-(-int(to_epoch(first)) // step) * step)))
+        bounds.append(end)
+
+        for low, high in zip(bounds, bounds[1:]):
+            window = self.partitions(low, high)
+            if low >= high or not window:
+                continue
+            connection, source = self._attach(window)
+            if connection is None:
+                continue
+            with closing(connection):
+                yield from connection.execute(build_raw_sql(source).text, {
+                    'computer_id': computer_id, 'step': step,
+                    'start': format_timestamp(low), 'end': format_timestamp(high),
+                })
+
+    # --- уплотнение ---
+
+    def delete_before(self, computer_id, cutoff, limit):
+        """
+        Удалить разделы, период которых целиком раньше cutoff.
+
+        Разделы общие для всех компьютеров, поэтому computer_id и limit не
+        учитываются: первый вызов удаляет файлы целиком, следующие ничего
+        не находят. Раздел, который уже удалил другой процесс, пропускается.
+        """
+        deleted = 0
+        for start in self.partitions(end=cutoff):
+            if start + self.period > cutoff:
+                continue
+            path = self.path(start)
+            connection = self._open(start)
+            if connection is None:
+                continue
+            with closing(connection):
+                deleted += connection.execute('SELECT count(*) FROM metric').fetchone()[0]
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+
+def copy_from_table(store, batch_rows=5000):
+    """
+    Скопировать измерения из таблицы metric основной базы в разделы.
+
+    Строки читаются порциями по возрастанию id (keyset), поэтому память не
+    растёт с размером таблицы, и переносятся с прежними id; повторный
+    запуск пропускает уже скопированные строки.
+
+    :param store: секционированное хранилище.
+    :type store: PartitionedMetricStore
+    :param batch_rows: строк в одной порции.
+    :type batch_rows: int
+    :return: число прочитанных строк и наибольший id.
+    :rtype: tuple[int, int]
+    """
+    table = Metric.__table__
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.execute(
+            db.select(table).where(table.c.id > last_id).order_by(table.c.id).limit(batch_rows)
+        ).mappings().all()
+        db.session.rollback()
+        if not rows:
+            return total, last_id
+        store.append([dict(row) for row in rows])
+        total += len(rows)
+        last_id = rows[-1]['id']
@@ -0,0 +1,262 @@
+"""
+Политика хранения истории и фоновое уплотнение базы.
+
+Для каждого яруса (сырые измерения и ярусы свёртки из ROLLUP_TIERS) в
+конфигурации RETENTION задаётся срок хранения. Фоновый поток периодически
+удаляет устаревшие строки небольшими порциями, фиксируя транзакцию после
+каждой порции и делая паузу, чтобы не удерживать блокировку записи и не
+мешать приёму метрик.
+
+Если сервер запущен в нескольких процессах, уплотнение выполняет только
+один из них — тот, кто держит блокировку файла RETENTION_LOCK_PATH;
+остальные проверяют её на каждом такте и подхватывают работу, когда
+ведущий процесс завершается.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: уплотнение выполняет каждый процесс
+    fcntl = None
+
+from . import db
+from .models import Computer, MetricRollup
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionJob:
+    """
+    Фоновое удаление данных старше срока хранения своего яруса.
+
+    Удаление идёт по каждому компьютеру отдельно, чтобы поиск границы
+    порции обслуживался индексами (computer_id, timestamp) у metric и
+    первичным ключом у metric_rollup, а не полным просмотром таблицы.
+    Сырые измерения удаляет хранилище измерений (app/metricstore.py).
+
+    Основные атрибуты:
+        app (flask.Flask): приложение, в контексте которого идёт удаление.
+        stats (dict): число удалённых строк по ярусам за всё время работы.
+        leader (bool): процесс держит блокировку и выполняет уплотнение.
+    """
+    def __init__(self, app, policy, tiers, interval=300, chunk_rows=5000, chunk_pause=0.05,
+                 lock_path=None):
+        """
+        :param app: Flask-приложение SysMonitor.
+        :type app: flask.Flask
+        :param policy: срок хранения по ярусам ("raw" и имена из tiers);
+                       None — хранить бессрочно.
+        :type policy: dict[str, datetime.timedelta | None]
+        :param tiers: ярусы свёртки: имя -> длина интервала, сек.
+        :type tiers: dict[str, int]
+        :param interval: период запуска уплотнения, сек.
+        :type interval: float
+        :param chunk_rows: максимальное число строк, удаляемых одной транзакцией.
+        :type chunk_rows: int
+        :param chunk_pause: пауза между порциями, сек.
+        :type chunk_pause: float
+        :param lock_path: файл блокировки ведущего процесса; None —
+                          уплотнение выполняется без блокировки.
+        :type lock_path: str | None
+        """
+        self.app = app
+        self.policy = policy
+        self.tiers = tiers
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.chunk_pause = chunk_pause
+        self.lock_path = lock_path
+        self.lock_file = None
+        self.leader = False
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'runs': 0}
+
+    def start(self):
+        """
+        Запустить фоновый поток уплотнения.
+        """
+        if self.thread is not None:
+            return
+        self.acquire()
+        self.thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Остановить фоновый поток после завершения текущей порции.
+
+        :param timeout: сколько секунд ждать завершения потока.
+        :type timeout: float
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+            self.leader = False
+
+    def acquire(self):
+        """
+        Попытаться стать ведущим процессом уплотнения.
+
+        Блокировка файла снимается системой при завершении процесса,
+        поэтому после остановки ведущего её получает один из остальных.
+
+        :return: True, если уплотнение выполняет этот процесс.
+        :rtype: bool
+        """
+        if self.leader or self.lock_path is None or fcntl is None:
+            self.leader = True
+            return True
+        lock_file = open(self.lock_path, 'a+b')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        self.leader = True
+        return True
+
+    def run_once(self, now=None):
+        """
+        Выполнить один проход уплотнения по всем ярусам.
+
+        :param now: текущее время (UTC); параметр нужен для тестов.
+        :type now: datetime.datetime | None
+        :return: число удалённых строк по ярусам.
+        :rtype: dict[str, int]
+        """
+        now = now or datetime.utcnow()
+        deleted = {}
+        with self.app.app_context():
+            computer_ids = db.session.scalars(db.select(Computer.id)).all()
+
+            keep = self.policy.get('raw')
+            if keep is not None:
+                store = self.app.extensions['metric_store']
+                deleted['raw'] = sum(
+                    self._delete_raw(store, computer_id, now - keep)
+                    for computer_id in computer_ids
+                )
+
+            for name, resolution in self.tiers.items():
+                keep = self.policy.get(name)
+                if keep is None:
+                    continue
+                deleted[name] = sum(
+                    self._delete_before(MetricRollup, MetricRollup.bucket, now - keep,
+                                        MetricRollup.computer_id == computer_id,
+                                        MetricRollup.resolution == resolution)
+                    for computer_id in computer_ids
+                )
+
+        self.stats['runs'] += 1
+        for name, count in deleted.items():
+            self.stats[name] = self.stats.get(name, 0) + count
+        return deleted
+
+    def _delete_raw(self, store, computer_id, cutoff):
+        """
+        Удалить сырые измерения компьютера старше cutoff через хранилище
+        измерений, порциями не более chunk_rows.
+
+        :type store: app.metricstore.MetricStore
+        :return: число удалённых строк.
+        :rtype: int
+        """
+        total = 0
+        while not self.stop_event.is_set():
+            deleted = store.delete_before(computer_id, cutoff, self.chunk_rows)
+            total += deleted
+            if deleted < self.chunk_rows:
+                break
+            time.sleep(self.chunk_pause)
+        return total
+
+    def _delete_before(self, model, time_column, cutoff, *filters):
+        """
+        Удалить строки старше cutoff порциями не более chunk_rows.
+
+        Граница порции — значение времени chunk_rows-й по счёту старой
+        строки; всё, что не новее неё, удаляется одним DELETE.
+
+        :return: число удалённых строк.
+        :rtype: int
+        """
+        total = 0
+        while not self.stop_event.is_set():
+            condition = db.and_(*filters, time_column < cutoff)
+            boundary = db.session.execute(
+                db.select(time_column).where(condition)
+                .order_by(time_column).offset(self.chunk_rows - 1).limit(1)
+            ).scalar()
+
+            if boundary is not None:
+                condition = db.and_(*filters, time_column <= boundary)
+            result = db.session.execute(db.delete(model).where(condition))
+            db.session.commit()
+            total += result.rowcount
+
+            if boundary is None:
+                break
+            time.sleep(self.chunk_pause)
+        return total
+
+    def _run(self):
+        """
+        Основной цикл потока: уплотнение раз в interval секунд, если
+        процесс ведущий.
+        """
+        while not self.stop_event.wait(self.interval):
+            if not self.acquire():
+                continue
+            try:
+                deleted = self.run_once()
+            except Exception:
+                logger.exception('retention run failed')
+                continue
+            if any(deleted.values()):
+                logger.info('retention removed rows: %s', deleted)
+
+
+def init_retention(app):
+    """
+    Запустить фоновое уплотнение, если оно включено в конфигурации.
+
+    Задание сохраняется в app.extensions["retention"]. Файл блокировки
+    ведущего процесса по умолчанию — instance/retention.lock.
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    if not app.config['RETENTION_ENABLED']:
+        return
+
+    lock_path = app.config['RETENTION_LOCK_PATH']
+    if lock_path is None:
+        os.makedirs(app.instance_path, exist_ok=True)
+        lock_path = os.path.join(app.instance_path, 'retention.lock')
+
+    job = RetentionJob(
+        app,
+        policy=app.config['RETENTION'],
+        tiers=app.config['ROLLUP_TIERS'],
+        interval=app.config['RETENTION_INTERVAL'],
+        chunk_rows=app.config['RETENTION_CHUNK_ROWS'],
+        chunk_pause=app.config['RETENTION_CHUNK_PAUSE'],
+        lock_path=lock_path,
+    )
+    app.extensions['retention'] = job
+    job.start()
+    atexit.register(job.stop)
@@ -0,0 +1,173 @@
+"""
+Ярусы свёртки истории метрик.
+
+Помимо «сырых» измерений (Metric) сервер хранит агрегаты за минуту и за
+час (MetricRollup): минимум, максимум, сумму и число значений каждой
+метрики. Агрегаты обновляются инкрементально при каждом приёме образцов —
+пакет сначала сворачивается в памяти, а затем одним UPSERT добавляется
+к уже накопленным значениям, без пересчёта по сырой истории.
+"""
+
+from datetime import timedelta
+
+from sqlalchemy import case, func, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import db
+from .models import MetricRollup
+
+# поле агрегата -> столбец модели Metric
+ROLLUP_FIELDS = {
+    'cpu': 'cpu_percent',
+    'ram': 'memory_usage',
+    'disk': 'disk_usage',
+    'processes': 'processes',
+}
+
+# (столбец Metric, столбцы min/max/sum/count в MetricRollup)
+FIELD_COLUMNS = [
+    (column, f'{name}_min', f'{name}_max', f'{name}_sum', f'{name}_count')
+    for name, column in ROLLUP_FIELDS.items()
+]
+
+# диалекты, для которых поддерживается INSERT ... ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+_upsert_cache = {}
+
+
+def bucket_start(ts, resolution):
+    """
+    Получить начало интервала свёртки, в который попадает момент времени.
+
+    :param ts: время измерения (UTC).
+    :type ts: datetime.datetime
+    :param resolution: длина интервала в секундах, делитель суток.
+    :type resolution: int
+    :rtype: datetime.datetime
+    """
+    seconds = ts.hour * 3600 + ts.minute * 60 + ts.second
+    midnight = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + timedelta(seconds=seconds - seconds % resolution)
+
+
+def aggregate(rows, resolutions):
+    """
+    Свернуть измерения пакета в агрегаты по интервалам.
+
+    :param rows: значения столбцов Metric, включая computer_id и timestamp.
+    :type rows: list[dict]
+    :param resolutions: длины интервалов ярусов в секундах.
+    :type resolutions: collections.abc.Iterable[int]
+    :return: строки для таблицы metric_rollup.
+    :rtype: list[dict]
+    """
+    buckets = {}
+    for row in rows:
+        for resolution in resolutions:
+            key = (row['computer_id'], resolution, bucket_start(row['timestamp'], resolution))
+            agg = buckets.get(key)
+            if agg is None:
+                agg = buckets[key] = {'computer_id': key[0], 'resolution': key[1], 'bucket': key[2]}
+                for _, min_col, max_col, sum_col, count_col in FIELD_COLUMNS:
+                    agg[min_col] = agg[max_col] = None
+                    agg[sum_col] = agg[count_col] = 0
+
+            for column, min_col, max_col, sum_col, count_col in FIELD_COLUMNS:
+                value = row[column]
+                if value is None:
+                    continue
+                if agg[count_col] == 0:
+                    agg[min_col] = agg[max_col] = value
+                elif value < agg[min_col]:
+                    agg[min_col] = value
+                elif value > agg[max_col]:
+                    agg[max_col] = value
+                agg[sum_col] += value
+                agg[count_col] += 1
+
+    return list(buckets.values())
+
+
+def upsert_statement(dialect):
+    """
+    Построить (и закэшировать) UPSERT, добавляющий агрегат к существующему.
+
+    :param dialect: имя диалекта SQLAlchemy ("sqlite" или "postgresql").
+    :type dialect: str
+    :rtype: sqlalchemy.sql.dml.Insert
+    """
+    stmt = _upsert_cache.get(dialect)
+    if stmt is not None:
+        return stmt
+
+    if dialect not in UPSERT_INSERTS:
+        raise NotImplementedError(f'rollups are not supported for {dialect}')
+
+    stmt = UPSERT_INSERTS[dialect](MetricRollup)
+    new = stmt.excluded
+    old = MetricRollup.__table__.c
+    values = {}
+    for _, min_col, max_col, sum_col, count_col in FIELD_COLUMNS:
+        # сравнение с NULL ложно, поэтому отсутствующая сторона не влияет на результат
+        values[min_col] = case((new[min_col] < old[min_col], new[min_col]),
+                               else_=func.coalesce(old[min_col], new[min_col]))
+        values[max_col] = case((new[max_col] > old[max_col], new[max_col]),
+                               else_=func.coalesce(old[max_col], new[max_col]))
+        values[sum_col] = old[sum_col] + new[sum_col]
+        values[count_col] = old[count_col] + new[count_col]
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['computer_id', 'resolution', 'bucket'],
+        set_=values,
+    )
+    _upsert_cache[dialect] = stmt
+    return stmt
+
+
+def update_rollups(rows, resolutions):
+    """
+    Добавить измерения пакета к агрегатам всех ярусов.
+
+    Выполняется в текущей транзакции сессии; фиксацию делает вызывающий код.
+
+    :param rows: значения столбцов Metric, включая computer_id и timestamp.
+    :type rows: list[dict]
+    :param resolutions: длины интервалов ярусов в секундах.
+    :type resolutions: collections.abc.Iterable[int]
+    """
+    resolutions = list(resolutions)
+    if not rows or not resolutions:
+        return
+    buckets = aggregate(rows, resolutions)
+    db.session.execute(upsert_statement(db.session.get_bind().dialect.name), buckets)
+
+
+def backfill_rollups(resolutions):
+    """
+    Построить агрегаты по всей уже накопленной сырой истории (SQLite).
+
+    Используется миграцией схемы для баз, созданных до появления ярусов.
+
+    :param resolutions: длины интервалов ярусов в секундах.
+    :type resolutions: collections.abc.Iterable[int]
+    """
+    columns = ['computer_id', 'resolution', 'bucket']
+    selects = []
+    for column, min_col, max_col, sum_col, count_col in FIELD_COLUMNS:
+        columns += [min_col, max_col, sum_col, count_col]
+        selects += [f'min({column})', f'max({column})',
+                    f'coalesce(sum({column}), 0)', f'count({column})']
+
+    bucket = ("strftime('%Y-%m-%d %H:%M:%S', "
+              "(CAST(strftime('%s', timestamp) AS INTEGER) / :res) * :res, 'unixepoch') || '.000000'")
+    sql = text(
+        f'INSERT OR IGNORE INTO metric_rollup ({", ".join(columns)}) '
+        f'SELECT computer_id, :res, {bucket}, {", ".join(selects)} '
+        f'FROM metric GROUP BY computer_id, {bucket}'
+    )
+    for resolution in resolutions:
+        db.session.execute(sql, {'res': resolution})
@@ -1,31 +1,52 @@
-from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session, current_app, Response, stream_with_context
 from functools import wraps
-from .models import Computer, Metric
+from .models import Computer, ComputerState, AlertRule, AlertEvent, AlertPending, AgentTelemetry
+from .ingest import SAMPLE_FIELDS, validate_sample, parse_sample, parse_batch, read_body, store_samples, BufferFull, PayloadTooLarge
+from .history import query_range, parse_time_arg
+from .metricstore import get_metric_store
+from .listing import SORTS, query_computers
+from .cache import bump_versions, cached_view
+from .live import state_payload
+from .analytics import anomalies, fleet_percentiles, get_windows, top_growth
+from .rollups import ROLLUP_FIELDS
+from .export import FORMATS as EXPORT_FORMATS, export_stream, iter_fleet, resolve_hosts
+from .streams import get_slots
+from .alerts import (get_global_rules, save_global_rules, rules_changed,
+                     DEFAULT_THRESHOLDS, DEFAULT_HYSTERESIS, DEFAULT_SUSTAIN_SECONDS)
+from datetime import datetime, timedelta
 from . import db
 
 main = Blueprint('main', __name__)
 
-# значения по умолчанию
-DEFAULT_CPU_THRESHOLD = 85
-DEFAULT_RAM_THRESHOLD = 80
-DEFAULT_DISK_THRESHOLD = 90
+# метрика правила -> текст предупреждения на главной панели
+ALERT_MESSAGES = {
+    'disk': "Диск: {value}% заполнен",
+    'ram': "Высокая загрузка RAM: {value}%",
+    'cpu': "Высокая загрузка CPU: {value}%",
+    'processes': "Много процессов: {value}",
+}
 
 def get_thresholds():
     """
-    Получить актуальные пороговые значения оповещений.
+    Получить актуальные глобальные настройки оповещений.
 
-    Считывает значения порогов для CPU, RAM и диска из серверной сессии
-    пользователя. Если пользователь ещё не настраивал пороги, возвращаются
-    значения по умолчанию.
+    Пороги хранятся в общих правилах оповещений (AlertRule) и одинаковы
+    для всех пользователей. Если правила по метрике нет, возвращается
+    значение по умолчанию.
 
-    :return: словарь с ключами "cpu", "ram", "disk" и значениями в процентах.
+    :return: словарь с ключами "cpu", "ram", "disk" (пороги в процентах),
+             "hysteresis" и "sustain_seconds".
     :rtype: dict
     """
-    return {
-        'cpu': session.get('cpu_threshold', DEFAULT_CPU_THRESHOLD),
-        'ram': session.get('ram_threshold', DEFAULT_RAM_THRESHOLD),
-        'disk': session.get('disk_threshold', DEFAULT_DISK_THRESHOLD),
+    rules = get_global_rules()
+    thresholds = {
+        metric: int(rule.threshold) if rule else DEFAULT_THRESHOLDS[metric]
+        for metric, rule in rules.items()
     }
+    any_rule = next((rule for rule in rules.values() if rule), None)
+    thresholds['hysteresis'] = int(any_rule.hysteresis) if any_rule else DEFAULT_HYSTERESIS
+    thresholds['sustain_seconds'] = any_rule.sustain_seconds if any_rule else DEFAULT_SUSTAIN_SECONDS
+    return thresholds
 
 main = Blueprint('main', __name__)
 
@@ -100,46 +121,48 @@ def logout():
 
 @main.route('/dashboard')
 @login_required
+@cached_view()
 def dashboard():
     """
     Главная панель администратора.
 
     Отображает общее количество компьютеров, число проблемных машин,
     среднюю загрузку CPU и список активных предупреждений.
+
+    Последние значения метрик берутся из ComputerState, который загружается
+    вместе со списком компьютеров одним запросом. Предупреждения — открытые
+    оповещения (AlertEvent), которые формирует движок правил при приёме
+    метрик; здесь они только читаются.
     """
     computers = Computer.query.all()
     total = len(computers)
+    cpu_values = [comp.state.cpu_percent or 0 for comp in computers if comp.state]
 
-    alerts = []
-    cpu_values = []
-
-    thresholds = get_thresholds()
-
-    for comp in computers:
-        last = comp.metrics[-1] if comp.metrics else None
-        if not last:
-            continue
-
-        # для средней загрузки CPU
-        cpu_values.append(last.cpu_percent or 0)
+    events = (AlertEvent.query.options(db.joinedload(AlertEvent.computer).joinedload(Computer.state))
+              .filter(AlertEvent.closed_at.is_(None)).order_by(AlertEvent.opened_at).all())
+    by_computer = {}
+    for event in events:
+        by_computer.setdefault(event.computer_id, []).append(event)
 
+    alerts = []
+    for comp_events in by_computer.values():
+        comp = comp_events[0].computer
         problems_for_comp = []
-
-        if last.disk_usage is not None and last.disk_usage >= thresholds['disk']:
-            problems_for_comp.append(f"Диск: {int(last.disk_usage)}% заполнен")
-
-        if last.memory_usage is not None and last.memory_usage >= thresholds['ram']:
-            problems_for_comp.append(f"Высокая загрузка RAM: {int(last.memory_usage)}%")
-
-        if last.cpu_percent is not None and last.cpu_percent >= thresholds['cpu']:
-            problems_for_comp.append(f"Высокая загрузка CPU: {int(last.cpu_percent)}%")
-
-        if problems_for_comp:
-            alerts.append({
-                "computer": comp,
-                "message": "; ".join(problems_for_comp),
-                "timestamp": last.timestamp,
-            })
+        for metric in ALERT_MESSAGES:
+            for event in comp_events:
+                if event.metric != metric:
+                    continue
+                # показываем текущее значение, если оно уже известно
+                value = getattr(comp.state, SAMPLE_FIELDS[metric], None) if comp.state else None
+                value = event.value if value is None else value
+                problems_for_comp.append(ALERT_MESSAGES[metric].format(value=int(value)))
+                break
+
+        alerts.append({
+            "computer": comp,
+            "message": "; ".join(problems_for_comp),
+            "timestamp": comp_events[0].opened_at,
+        })
 
     problems_count = len(alerts)
     avg_cpu = int(sum(cpu_values) / len(cpu_values)) if cpu_values else 0
@@ -150,17 +173,18 @@ def dashboard():
         problems_count=problems_count,
         avg_cpu=avg_cpu,
         alerts=alerts,
-        thresholds=thresholds
+        thresholds=get_thresholds()
     )
 
 @main.route('/alerts-settings', methods=['GET', 'POST'])
 @login_required
 def alerts_settings():
     """
-    Страница настройки пороговых значений оповещений.
+    Страница настройки глобальных правил оповещений.
 
-    Позволяет задать пороги для CPU, RAM и диска. Значения сохраняются в сессии
-    и используются при формировании списка предупреждений на главной панели.
+    Позволяет задать пороги для CPU, RAM и диска, гистерезис и длительность
+    превышения. Значения сохраняются в общих правилах (AlertRule) и сразу
+    применяются движком оповещений при приёме метрик.
     """
     thresholds = get_thresholds()
     message = None
@@ -171,17 +195,17 @@ def alerts_settings():
             cpu = int(request.form.get('cpu_threshold', thresholds['cpu']))
             ram = int(request.form.get('ram_threshold', thresholds['ram']))
             disk = int(request.form.get('disk_threshold', thresholds['disk']))
+            hysteresis = int(request.form.get('hysteresis', thresholds['hysteresis']))
+            sustain = int(request.form.get('sustain_seconds', thresholds['sustain_seconds']))
 
             # ограничение
             cpu = max(0, min(cpu, 100))
             ram = max(0, min(ram, 100))
             disk = max(0, min(disk, 100))
+            hysteresis = max(0, min(hysteresis, 100))
+            sustain = max(0, sustain)
 
-            session['cpu_threshold'] = cpu
-            session['ram_threshold'] = ram
-            session['disk_threshold'] = disk
-
-            thresholds = {'cpu': cpu, 'ram': ram, 'disk': disk}
+            save_global_rules({'cpu': cpu, 'ram': ram, 'disk': disk}, hysteresis, sustain)
             message = "Настройки сохранены"
 
             return redirect(url_for('main.alerts_settings'))
@@ -195,17 +219,298 @@ def alerts_settings():
         error=error,
     )
 
+@main.route('/api/alerts')
+@login_required
+def active_alerts():
+    """
+    Список открытых оповещений.
+
+    :return: JSON-массив объектов с полями id, computer_id, hostname,
+             metric, threshold, value и opened_at.
+    :rtype: flask.Response
+    """
+    events = AlertEvent.query.filter(AlertEvent.closed_at.is_(None)).order_by(AlertEvent.opened_at).all()
+    return jsonify([{
+        'id': event.id,
+        'computer_id': event.computer_id,
+        'hostname': event.computer.hostname,
+        'metric': event.metric,
+        'threshold': event.threshold,
+        'value': event.value,
+        'opened_at': event.opened_at.isoformat(),
+    } for event in events])
+
+def rule_payload(rule):
+    """
+    Представить правило оповещения в виде JSON-объекта.
+
+    :rtype: dict
+    """
+    return {
+        'id': rule.id,
+        'computer_id': rule.computer_id,
+        'metric': rule.metric,
+        'threshold': rule.threshold,
+        'hysteresis': rule.hysteresis,
+        'sustain_seconds': rule.sustain_seconds,
+        'enabled': rule.enabled,
+    }
+
+@main.route('/api/alerts/rules', methods=['GET', 'POST'])
+@login_required
+def alert_rules():
+    """
+    Просмотр и создание правил оповещений.
+
+    GET возвращает все правила. POST создаёт правило из JSON-объекта:
+        {
+            "computer_id": 3,        // необязательно; без него — глобальное правило
+            "metric": "cpu",         // cpu, ram, disk или processes
+            "threshold": 95,
+            "hysteresis": 5,         // необязательно, по умолчанию 0
+            "sustain_seconds": 60    // необязательно, по умолчанию 0
+        }
+    Правило компьютера заменяет для него глобальное правило по той же метрике.
+
+    Ошибки:
+        - 400: если поля правила отсутствуют или имеют неверный тип;
+        - 404: если компьютер не найден.
+
+    :return: JSON со списком правил или созданным правилом (код 201).
+    :rtype: flask.Response
+    """
+    if request.method == 'GET':
+        return jsonify([rule_payload(rule) for rule in AlertRule.query.order_by(AlertRule.id)])
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'invalid json'}), 400
+    if data.get('metric') not in SAMPLE_FIELDS:
+        return jsonify({'error': 'invalid metric'}), 400
+
+    values = {}
+    for key, default in (('threshold', None), ('hysteresis', 0), ('sustain_seconds', 0)):
+        value = data.get(key, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            return jsonify({'error': f'invalid {key}'}), 400
+        values[key] = value
+
+    computer_id = data.get('computer_id')
+    if computer_id is not None and (isinstance(computer_id, bool) or not isinstance(computer_id, int)):
+        return jsonify({'error': 'invalid computer_id'}), 400
+    if computer_id is not None and db.session.get(Computer, computer_id) is None:
+        return jsonify({'error': 'computer not found'}), 404
+
+    rule = AlertRule(computer_id=computer_id, metric=data['metric'],
+                     threshold=values['threshold'], hysteresis=values['hysteresis'],
+                     sustain_seconds=int(values['sustain_seconds']),
+                     enabled=bool(data.get('enabled', True)))
+    db.session.add(rule)
+    rules_changed()
+    db.session.commit()
+    bump_versions(config=True)
+    return jsonify(rule_payload(rule)), 201
+
+@main.route('/api/alerts/rules/<int:rule_id>', methods=['DELETE'])
+@login_required
+def delete_alert_rule(rule_id):
+    """
+    Удалить правило оповещения вместе с историей его оповещений.
+
+    :param rule_id: идентификатор правила.
+    :type rule_id: int
+    :return: JSON {"status": "deleted"} или ошибка 404.
+    :rtype: flask.Response
+    """
+    rule = db.session.get(AlertRule, rule_id)
+    if rule is None:
+        return jsonify({'error': 'rule not found'}), 404
+    AlertEvent.query.filter_by(rule_id=rule_id).delete()
+    AlertPending.query.filter_by(rule_id=rule_id).delete()
+    db.session.delete(rule)
+    rules_changed()
+    db.session.commit()
+    bump_versions(config=True)
+    return jsonify({'status': 'deleted'})
+
+def listing_args():
+    """
+    Параметры поиска и страницы списка компьютеров из строки запроса.
+
+    :return: именованные аргументы для query_computers().
+    :rtype: dict
+    """
+    page_size = current_app.config['COMPUTERS_PAGE_SIZE']
+    limit = request.args.get('limit', page_size, type=int)
+    return {
+        'q': request.args.get('q', '').strip(),
+        'match': request.args.get('match', 'prefix'),
+        'sort': request.args.get('sort', 'hostname'),
+        'after': request.args.get('after') or None,
+        'limit': max(1, min(limit, current_app.config['COMPUTERS_MAX_PAGE_SIZE'])),
+    }
+
 @main.route('/computers')
 @login_required
+@cached_view()
 def index():
     """
     Страница списка компьютеров.
 
-    Показывает все зарегистрированные рабочие станции с последними метриками,
+    Показывает одну страницу рабочих станций с последними метриками и
     позволяет перейти к детальному просмотру выбранного компьютера.
+    Поиск по имени (q, match), сортировка (sort) и переход к следующей
+    странице (after) выполняются на сервере, см. app/listing.py.
+    Последние метрики читаются из ComputerState, а не из полной истории.
     """
-    computers = Computer.query.all()
-    return render_template('index.html', computers=computers)
+    args = listing_args()
+    try:
+        computers, next_cursor = query_computers(**args)
+    except ValueError:
+        return redirect(url_for('main.index'))
+    # курсор живых обновлений: страница уже содержит всё до него включительно
+    live_cursor = db.session.scalar(db.select(db.func.max(ComputerState.metric_id))) or 0
+    return render_template('index.html', computers=computers, live_cursor=live_cursor,
+                           args=args, next_cursor=next_cursor, sorts=SORTS)
+
+@main.route('/api/computers')
+@login_required
+def computers_list():
+    """
+    Страница списка компьютеров в JSON.
+
+    Параметры те же, что у /computers: q, match ("prefix" или "contains"),
+    sort ("hostname", "cpu", "ram", "disk"), after и limit. Например,
+    50 самых загруженных по CPU: /api/computers?sort=cpu&limit=50.
+
+    :return: JSON-объект с полями items (данные хостов в формате живых
+             обновлений) и next (курсор следующей страницы или null);
+             400 при некорректных параметрах.
+    :rtype: flask.Response
+    """
+    try:
+        computers, next_cursor = query_computers(**listing_args())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    items = []
+    for comp in computers:
+        if comp.state is not None:
+            items.append(state_payload(comp.state, comp.hostname))
+        else:
+            items.append({'id': comp.id, 'hostname': comp.hostname})
+    return jsonify({'items': items, 'next': next_cursor})
+
+@main.route('/api/analytics/fleet')
+@login_required
+def analytics_fleet():
+    """
+    Распределение текущей загрузки по парку.
+
+    Учитываются компьютеры, приславшие измерение за последние
+    ANALYTICS_STALE_SECONDS секунд.
+
+    :return: JSON вида {"hosts": 1200, "cpu": {"p50": 12.5, "p95": 71.0,
+             "p99": 93.2}, "ram": {...}, "disk": {...}}.
+    :rtype: flask.Response
+    """
+    return jsonify(fleet_percentiles())
+
+@main.route('/api/analytics/growth')
+@login_required
+def analytics_growth():
+    """
+    Компьютеры с наибольшим приростом метрики за окно.
+
+    Параметры строки запроса: metric — cpu, ram (по умолчанию), disk или
+    processes; window — длина окна в секундах (по умолчанию 3600); limit —
+    число записей (по умолчанию 20, не больше 1000).
+
+    Прирост — наклон тренда средних за минуту, умноженный на длину окна;
+    окно заканчивается на минуте, закрытой ANALYTICS_SETTLE_SECONDS назад.
+
+    :return: JSON с полями metric, window и items (computer_id, hostname,
+             growth, mean — среднее за окно, points — число минут; по
+             убыванию growth); 400 при некорректных параметрах; 404, если
+             ярусы свёртки не настроены.
+    :rtype: flask.Response
+    """
+    if get_windows() is None:
+        return jsonify({'error': 'rollups disabled'}), 404
+    metric = request.args.get('metric', 'ram')
+    window = request.args.get('window', 3600, type=int)
+    limit = request.args.get('limit', 20, type=int)
+    if metric not in ROLLUP_FIELDS:
+        return jsonify({'error': f'metric must be one of: {", ".join(ROLLUP_FIELDS)}'}), 400
+    if window <= 0 or limit <= 0:
+        return jsonify({'error': 'window and limit must be positive'}), 400
+
+    items = top_growth(metric, timedelta(seconds=window), min(limit, 1000))
+    return jsonify({'metric': metric, 'window': window, 'items': items})
+
+@main.route('/api/analytics/anomalies')
+@login_required
+def analytics_anomalies():
+    """
+    Компьютеры, текущий CPU которых отклоняется от их собственной
+    базовой линии (ANALYTICS_BASELINE, по умолчанию 24 ч) больше чем на
+    sigma σ.
+
+    Параметр строки запроса: sigma — порог в σ (по умолчанию 3).
+
+    :return: JSON с полями sigma и items (computer_id, hostname, cpu,
+             baseline_mean, baseline_std, baseline_points, z по убыванию
+             |z|); 400 при некорректном sigma; 404, если ярусы свёртки не
+             настроены.
+    :rtype: flask.Response
+    """
+    if get_windows() is None:
+        return jsonify({'error': 'rollups disabled'}), 404
+    sigma = request.args.get('sigma', 3.0, type=float)
+    if not sigma > 0:
+        return jsonify({'error': 'sigma must be positive'}), 400
+    return jsonify({'sigma': sigma, 'items': anomalies(sigma)})
+
+@main.route('/api/live')
+@login_required
+def live_updates():
+    """
+    Поток живых обновлений карточек компьютеров (Server-Sent Events).
+
+    Курсор — последний известный клиенту metric_id — передаётся параметром
+    cursor или заголовком Last-Event-ID, который браузер выставляет сам при
+    переподключении. Каждое событие содержит JSON-массив изменившихся
+    хостов: id, hostname, cpu, ram, disk, processes, timestamp.
+
+    Одновременных потоков не больше LIVE_MAX_STREAMS: каждый занимает
+    рабочий поток сервера. Когда мест нет, клиент получает одно событие
+    и закрытое соединение с указанием переподключиться через
+    LIVE_BUSY_RETRY секунд, то есть переходит на редкий опрос.
+
+    :rtype: flask.Response
+    """
+    cursor = request.headers.get('Last-Event-ID', request.args.get('cursor'))
+    try:
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        cursor = None
+
+    feed = current_app.extensions['live_feed']
+    feed.ensure_started()
+    slots = get_slots('live')
+    if slots.acquire():
+        events = slots.guard(feed.stream(
+            cursor,
+            heartbeat=current_app.config['LIVE_HEARTBEAT'],
+            max_seconds=current_app.config['LIVE_STREAM_MAX_SECONDS'],
+        ))
+    else:
+        events = feed.stream(cursor, max_seconds=0, retry=current_app.config['LIVE_BUSY_RETRY'])
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 @main.route('/api/metrics', methods=['POST'])
 def receive_metrics():
@@ -217,8 +522,11 @@ def receive_metrics():
     количество процессов и имя компьютера (hostname). Если компьютер ранее
     не был зарегистрирован в системе, создаётся новая запись в базе данных.
 
-    После успешного приёма создаётся объект Metric, связанный с соответствующим
-    компьютером, и сохраняется в базе данных.
+    После успешного приёма измерение передаётся хранилищу сырых измерений
+    (METRIC_STORE: таблица Metric или столбцовые файлы). Одновременно
+    обновляется текущее состояние компьютера (ComputerState). Всё это
+    выполняется одной транзакцией. В режиме INGEST_MODE = "buffered" образец только
+    ставится в очередь, а в базу его записывает фоновый поток.
 
     Формат входящего JSON:
         {
@@ -226,44 +534,273 @@ def receive_metrics():
             "cpu": 23.5,
             "ram": 58.0,
             "disk": 72.1,
-            "processes": 142
+            "processes": 142,
+            "timestamp": "2024-05-01T12:00:00Z",  // необязательно
+            "ext": {"load_avg": [0.5, 0.4, 0.3]}  // необязательно
         }
 
+    Блок ext содержит дополнительные метрики сборщиков агента (ядра CPU,
+    сеть, диски, топ процессов и т.п.) и сохраняется в поле extra как есть.
+
+    Вместо JSON образец можно передать в двоичном формате wire.py
+    (Content-Type: application/x-sysmon-binary). Тело может быть сжато gzip
+    (заголовок Content-Encoding: gzip).
+
     Ошибки:
-        - 400: если JSON отсутствует или отсутствует обязательное поле hostname.
+        - 400: если JSON отсутствует, отсутствует обязательное поле hostname
+          или значения метрик (или блока ext) имеют неверный тип;
+        - 413: если тело (или распакованное тело) больше INGEST_MAX_BODY_BYTES;
+        - 503: если очередь буфера заполнена (политика "reject").
 
-    :return: JSON-ответ {"status": "ok"} при успешном сохранении метрик.
+    :return: JSON-ответ {"status": "ok"} при успешном сохранении метрик
+             или {"status": "queued"} в буферизованном режиме.
     :rtype: flask.Response
     """
-    data = request.json
-    if not data:
-        return jsonify({'error': 'invalid json'}), 400
+    try:
+        sample = parse_sample(read_body(), request.mimetype)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PayloadTooLarge:
+        return jsonify({'error': 'payload too large'}), 413
 
-    hostname = data.get('hostname')
-    if not hostname:
-        return jsonify({'error': 'hostname required'}), 400
-
-    comp = Computer.query.filter_by(hostname=hostname).first()
-    if not comp:
-        comp = Computer(hostname=hostname)
-        db.session.add(comp)
-        db.session.commit()
-
-    metric = Metric(
-        computer_id=comp.id,
-        cpu_percent=data.get('cpu'),
-        memory_usage=data.get('ram'),
-        disk_usage=data.get('disk'),
-        processes=data.get('processes'),
-    )
+    return save_samples([sample], {})
 
-    db.session.add(metric)
-    db.session.commit()
+@main.route('/api/metrics/batch', methods=['POST'])
+def receive_metrics_batch():
+    """
+    Пакетный приём метрик от агентов и ретрансляторов.
 
-    return jsonify({'status': 'ok'}), 200
+    Тело запроса — JSON-массив образцов в формате /api/metrics (или объект
+    {"samples": [...]}), поток NDJSON с типом application/x-ndjson либо
+    пакет в двоичном формате wire.py (application/x-sysmon-binary).
+    Образцы могут относиться к разным компьютерам и содержать поле
+    timestamp с исходным временем сбора. Тело может быть сжато gzip. Корректные образцы сохраняются
+    одной транзакцией, некорректные отклоняются по отдельности.
+
+    Формат ответа:
+        {
+            "accepted": 2,
+            "rejected": 1,
+            "results": [
+                {"index": 0, "status": "ok"},
+                {"index": 1, "status": "error", "error": "hostname required"},
+                {"index": 2, "status": "ok"}
+            ]
+        }
+
+    Ошибки:
+        - 400: если тело запроса не является пакетом образцов;
+        - 413: если в пакете больше образцов, чем INGEST_MAX_BATCH, или
+          тело (или распакованное тело) больше INGEST_MAX_BODY_BYTES;
+        - 503: если очередь буфера заполнена (политика "reject").
+
+    :return: JSON-ответ с результатом по каждому образцу.
+    :rtype: flask.Response
+    """
+    try:
+        items = parse_batch(read_body(), request.mimetype)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PayloadTooLarge:
+        return jsonify({'error': 'payload too large'}), 413
+
+    max_batch = current_app.config['INGEST_MAX_BATCH']
+    if len(items) > max_batch:
+        return jsonify({'error': f'batch too large (max {max_batch})'}), 413
+
+    samples = []
+    results = []
+    for index, item in enumerate(items):
+        try:
+            samples.append(validate_sample(item))
+            results.append({'index': index, 'status': 'ok'})
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'error': str(e)})
+
+    return save_samples(samples, {
+        'accepted': len(samples),
+        'rejected': len(items) - len(samples),
+        'results': results,
+    })
+
+@main.route('/api/ingest/stats')
+def ingest_stats():
+    """
+    Счётчики буфера отложенной записи.
+
+    :return: JSON с режимом приёма и, в режиме "buffered", счётчиками
+             queued, flushed, dropped, failed_flushes и глубиной очереди.
+    :rtype: flask.Response
+    """
+    buffer = current_app.extensions.get('ingest_buffer')
+    stats = {'mode': current_app.config['INGEST_MODE']}
+    if buffer is not None:
+        stats.update(buffer.snapshot())
+    return jsonify(stats), 200
+
+# столбцы, по которым можно сортировать сводки агентов
+TELEMETRY_SORT_FIELDS = ('cpu_percent', 'rss_mb', 'collect_ms_p99', 'send_ms_p99', 'failures', 'spool_bytes')
+
+@main.route('/api/agents/telemetry')
+@login_required
+def agent_telemetry():
+    """
+    Последние сводки самонаблюдения агентов.
+
+    Параметры запроса: sort — столбец сортировки по убыванию (по умолчанию
+    cpu_percent, то есть сначала агенты, дороже всего обходящиеся своему
+    хосту), limit — число записей (по умолчанию 50).
+
+    :return: JSON-массив объектов с полями computer_id, hostname,
+             reported_at, столбцами сортировки и полной сводкой (data).
+    :rtype: flask.Response
+    """
+    sort = request.args.get('sort', 'cpu_percent')
+    if sort not in TELEMETRY_SORT_FIELDS:
+        return jsonify({'error': f'sort must be one of: {", ".join(TELEMETRY_SORT_FIELDS)}'}), 400
+    limit = request.args.get('limit', 50, type=int)
+
+    column = getattr(AgentTelemetry, sort)
+    rows = db.session.scalars(
+        db.select(AgentTelemetry)
+        .order_by(column.is_(None), column.desc(), AgentTelemetry.computer_id)
+        .limit(max(1, min(limit, 1000)))
+    ).all()
+    return jsonify([dict(
+        {field: getattr(row, field) for field in TELEMETRY_SORT_FIELDS},
+        computer_id=row.computer_id,
+        hostname=row.computer.hostname,
+        reported_at=row.reported_at.isoformat(),
+        data=row.data,
+    ) for row in rows])
+
+@main.route('/metrics')
+def server_metrics():
+    """
+    Показатели работы сервера в текстовом формате Prometheus.
+
+    Кроме данных самонаблюдения (app/instrumentation.py) включает глубину
+    очереди буфера приёма, счётчики движка оповещений и кэша страниц и
+    признак ведущего процесса уплотнения. Все счётчики относятся к
+    процессу, ответившему на запрос (sysmon_process_info); открытые
+    оповещения считаются по базе.
+
+    :return: text/plain; 404, если самонаблюдение выключено.
+    :rtype: flask.Response
+    """
+    instrumentation = current_app.extensions.get('instrumentation')
+    if instrumentation is None:
+        return jsonify({'error': 'instrumentation disabled'}), 404
+
+    extra = {}
+    buffer = current_app.extensions.get('ingest_buffer')
+    if buffer is not None:
+        snapshot = buffer.snapshot()
+        extra['sysmon_ingest_queue_depth'] = ('gauge', 'Rows waiting in the ingest buffer.', snapshot['depth'])
+        extra['sysmon_ingest_dropped_total'] = ('counter', 'Rows dropped by the ingest buffer.', snapshot['dropped'])
+    alerts = current_app.extensions.get('alerts')
+    if alerts is not None:
+        open_alerts = db.session.scalar(
+            db.select(db.func.count()).select_from(AlertEvent).where(AlertEvent.closed_at.is_(None))
+        )
+        extra['sysmon_alerts_open'] = ('gauge', 'Currently open alerts.', open_alerts)
+        extra['sysmon_alerts_opened_total'] = ('counter', 'Alerts opened by this process.', alerts.stats['opened'])
+    cache = current_app.extensions.get('view_cache')
+    if cache is not None:
+        snapshot = cache.snapshot()
+        extra['sysmon_view_cache_hits_total'] = ('counter', 'Page cache hits.', snapshot['hits'])
+        extra['sysmon_view_cache_misses_total'] = ('counter', 'Page cache misses.', snapshot['misses'])
+        extra['sysmon_view_cache_entries'] = ('gauge', 'Pages held in the cache.', snapshot['entries'])
+    retention = current_app.extensions.get('retention')
+    if retention is not None:
+        extra['sysmon_retention_leader'] = ('gauge', '1 if this process runs retention.', int(retention.leader))
+
+    return Response(instrumentation.render(extra), mimetype='text/plain; version=0.0.4')
+
+def save_samples(samples, body):
+    """
+    Сохранить образцы синхронно или поставить их в очередь буфера.
+
+    :param samples: образцы, прошедшие validate_sample().
+    :type samples: list[dict]
+    :param body: дополнительные поля JSON-ответа.
+    :type body: dict
+    :return: JSON-ответ с полем status ("ok" или "queued").
+    :rtype: tuple
+    """
+    buffer = current_app.extensions.get('ingest_buffer')
+    if buffer is None:
+        store_samples(samples)
+        return jsonify(dict(body, status='ok')), 200
+
+    try:
+        buffer.put(samples)
+    except BufferFull:
+        return jsonify({'error': 'ingest queue full'}), 503, {'Retry-After': '1'}
+    return jsonify(dict(body, status='queued')), 200
+
+@main.route('/api/export')
+@login_required
+def export_metrics():
+    """
+    Потоковая выгрузка сырых измерений (app/export.py).
+
+    Параметры строки запроса:
+        - computer_id, host: компьютеры по id или имени, параметры можно
+          повторять; без них выгружается весь парк;
+        - from, to: интервал (Unix-время или ISO 8601), по умолчанию
+          сутки до текущего времени;
+        - format: csv (по умолчанию) или ndjson;
+        - gzip: 1 — сжать выгрузку gzip (файл .gz).
+
+    Ответ передаётся по частям по мере чтения хранилища, поэтому размер
+    выгрузки не ограничен памятью сервера. Одновременных выгрузок не
+    больше EXPORT_MAX_STREAMS: каждая занимает рабочий поток сервера.
+
+    Ошибки:
+        - 400: если параметры некорректны;
+        - 404: если какой-либо из указанных компьютеров не найден;
+        - 503: если уже идёт EXPORT_MAX_STREAMS выгрузок.
+
+    :rtype: flask.Response
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'format must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    try:
+        end = parse_time_arg(request.args.get('to'), datetime.utcnow())
+        start = parse_time_arg(request.args.get('from'), end - timedelta(days=1))
+        computer_ids = [int(value) for value in request.args.getlist('computer_id')]
+    except (ValueError, OverflowError, OSError):
+        return jsonify({'error': 'invalid parameters'}), 400
+    if start >= end:
+        return jsonify({'error': 'invalid time range'}), 400
+
+    hostnames = request.args.getlist('host')
+    if computer_ids or hostnames:
+        try:
+            hosts = resolve_hosts(computer_ids, hostnames)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+    else:
+        hosts = iter_fleet()
+
+    compress = request.args.get('gzip') in ('1', 'true', 'yes')
+    filename = f'sysmonitor-metrics-{start:%Y%m%dT%H%M%S}-{end:%Y%m%dT%H%M%S}.{fmt}'
+    if compress:
+        filename += '.gz'
+    slots = get_slots('export')
+    if not slots.acquire():
+        return jsonify({'error': 'too many exports in progress'}), 503, {'Retry-After': '30'}
+    return Response(
+        stream_with_context(slots.guard(export_stream(hosts, start, end, fmt, compress))),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}', 'X-Accel-Buffering': 'no'},
+    )
 
 @main.route('/computer/<int:comp_id>')
 @login_required
+@cached_view(host_arg='comp_id')
 def computer_detail(comp_id):
     """
     Детальная страница компьютера.
@@ -272,13 +809,52 @@ def computer_detail(comp_id):
     :type comp_id: int
     """
     comp = Computer.query.get_or_404(comp_id)
-    
-    metrics = (
-        Metric.query
-        .filter_by(computer_id=comp.id)
-        .order_by(Metric.id.desc())
-        .limit(20)
-        .all()
-    )
+    metrics = get_metric_store().latest(comp.id, 20)
+
+    return render_template('detail.html', comp=comp, metrics=metrics)
+
+@main.route('/api/computers/<int:comp_id>/metrics')
+@login_required
+def computer_metrics_range(comp_id):
+    """
+    История метрик компьютера за интервал с агрегацией по корзинам.
+
+    Параметры строки запроса:
+        - from: начало интервала (Unix-время или ISO 8601), по умолчанию
+          час назад от to;
+        - to: конец интервала, по умолчанию текущее время;
+        - step: длина корзины в секундах, по умолчанию подбирается по
+          пределу RANGE_MAX_POINTS.
+
+    Формат ответа:
+        {
+            "computer_id": 1, "from": ..., "to": ..., "step": 60, "source": "1m",
+            "points": [
+                {"t": 1714564800, "samples": 12,
+                 "cpu": {"avg": 23.1, "min": 5.0, "max": 71.0, "p95": null}, ...}
+            ]
+        }
+
+    Ошибки:
+        - 400: если параметры интервала некорректны;
+        - 404: если компьютер не найден.
+
+    :param comp_id: идентификатор компьютера в базе данных.
+    :type comp_id: int
+    :rtype: flask.Response
+    """
+    comp = Computer.query.get_or_404(comp_id)
+
+    try:
+        end = parse_time_arg(request.args.get('to'), datetime.utcnow())
+        start = parse_time_arg(request.args.get('from'), end - timedelta(hours=1))
+        step = request.args.get('step', type=int)
+    except (ValueError, OverflowError, OSError):
+        return jsonify({'error': 'invalid time range'}), 400
+
+    if start >= end or (step is not None and step <= 0):
+        return jsonify({'error': 'invalid time range'}), 400
 
-    return render_template('detail.html', comp=comp, metrics=metrics)
\ No newline at end of file
+    result = query_range(comp.id, start, end, step)
+    return jsonify(dict(result, computer_id=comp.id,
+                        **{'from': start.isoformat(), 'to': end.isoformat()})), 200
@@ -0,0 +1,365 @@
+"""
+Настройка хранилища SysMonitor: пул соединений, параметры SQLite и
+миграции схемы.
+
+Поддерживается только SQLite (check_backend()). Модуль подбирает
+параметры пула соединений, навешивает
+PRAGMA на каждое новое соединение пула SQLAlchemy (WAL, synchronous,
+размер кэша, таймаут блокировки) и содержит список версионированных
+миграций. db.create_all() создаёт только отсутствующие
+таблицы, поэтому изменения существующих таблиц (индексы, новые столбцы,
+перенос данных) оформляются здесь отдельными шагами.
+"""
+
+import logging
+
+from flask import current_app
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+
+from . import db
+from .metricstore import id_floor
+from .models import AlertRulesVersion, ComputerState, MetricSequence, SchemaVersion
+from .rollups import backfill_rollups
+from .alerts import seed_default_rules
+
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedDatabase(RuntimeError):
+    """
+    SQLALCHEMY_DATABASE_URI указывает не на SQLite.
+    """
+
+
+def check_backend(config):
+    """
+    Убедиться, что база — SQLite.
+
+    Запросы истории, агрегатов и аналитики написаны для SQLite (strftime,
+    INSERT OR IGNORE, COLLATE NOCASE), поэтому с другой СУБД приложение
+    не запускается, а не ломается на первом запросе.
+
+    :param config: конфигурация приложения (SQLALCHEMY_DATABASE_URI).
+    :type config: flask.Config | dict
+    :raises UnsupportedDatabase: если база не SQLite.
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'sqlite':
+        raise UnsupportedDatabase(
+            f'only SQLite databases are supported, got "{url.get_backend_name()}"'
+        )
+
+
+def engine_options(config):
+    """
+    Параметры пула соединений для SQLALCHEMY_ENGINE_OPTIONS.
+
+    SQLite в режиме WAL допускает параллельное чтение из многих соединений
+    и одного писателя, поэтому пул держит по соединению на поток без
+    дополнительных (max_overflow = 0): лишние соединения лишь ждали бы
+    блокировку записи. Для базы в памяти Flask-SQLAlchemy сам выбирает
+    пул с одним соединением.
+
+    :param config: конфигурация приложения (SQLALCHEMY_DATABASE_URI, DB_POOL_*).
+    :type config: flask.Config | dict
+    :rtype: dict
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.database in (None, '', ':memory:'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': 0,
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+
+
+def configure_engine(app, engine):
+    """
+    Подключить установку PRAGMA к каждому новому соединению SQLite.
+
+    Значения берутся из app.config["SQLITE_PRAGMAS"]. Для базы в памяти
+    режим WAL не включается, так как он для неё не поддерживается.
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    :param engine: движок SQLAlchemy, созданный Flask-SQLAlchemy.
+    :type engine: sqlalchemy.engine.Engine
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = dict(app.config['SQLITE_PRAGMAS'])
+    if engine.url.database in (None, '', ':memory:'):
+        pragmas.pop('journal_mode', None)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """
+        Выполнить PRAGMA для только что открытого соединения.
+        """
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def has_unique_index(table, column):
+    """
+    Проверить, есть ли в таблице уникальный индекс ровно по одному столбцу.
+
+    Учитывает и явные индексы, и автоматические индексы ограничений UNIQUE.
+
+    :param table: имя таблицы.
+    :type table: str
+    :param column: имя столбца.
+    :type column: str
+    :rtype: bool
+    """
+    inspector = inspect(db.engine)
+    for index in inspector.get_indexes(table):
+        if index['unique'] and index['column_names'] == [column]:
+            return True
+    for constraint in inspector.get_unique_constraints(table):
+        if constraint['column_names'] == [column]:
+            return True
+    return False
+
+
+def add_column(table, column, ddl):
+    """
+    Добавить столбец в существующую таблицу, если его ещё нет.
+
+    :param table: имя таблицы.
+    :type table: str
+    :param column: имя столбца.
+    :type column: str
+    :param ddl: определение столбца для ALTER TABLE (тип и ограничения).
+    :type ddl: str
+    """
+    columns = {info['name'] for info in inspect(db.session.connection()).get_columns(table)}
+    if column not in columns:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def migrate_computer_state():
+    """
+    Миграция 1: заполнить computer_state для уже существующих компьютеров.
+    """
+    ComputerState.backfill()
+
+
+def migrate_indexes():
+    """
+    Миграция 2: индекс по (computer_id, timestamp) для выборок истории
+    и уникальный индекс по hostname, если базу создавали без него.
+    """
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_metric_computer_timestamp '
+        'ON metric (computer_id, timestamp)'
+    ))
+    if not has_unique_index('computer', 'hostname'):
+        db.session.execute(text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_computer_hostname ON computer (hostname)'
+        ))
+
+
+def migrate_rollups():
+    """
+    Миграция 3: построить ярусы свёртки по уже накопленной истории.
+    """
+    backfill_rollups(current_app.config['ROLLUP_TIERS'].values())
+
+
+def migrate_state_cursor():
+    """
+    Миграция 4: computer_state.metric_id — курсор для живых обновлений.
+    """
+    add_column('computer_state', 'metric_id', 'INTEGER')
+    db.session.execute(text(
+        'UPDATE computer_state SET metric_id = '
+        '(SELECT max(id) FROM metric WHERE metric.computer_id = computer_state.computer_id) '
+        'WHERE metric_id IS NULL'
+    ))
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_computer_state_metric_id ON computer_state (metric_id)'
+    ))
+
+
+def migrate_metric_extra():
+    """
+    Миграция 5: metric.extra — дополнительные метрики сборщиков агента.
+    """
+    add_column('metric', 'extra', 'JSON')
+
+
+def migrate_alert_rules():
+    """
+    Миграция 6: глобальные правила оповещений по умолчанию.
+
+    Раньше пороги хранились в сессии каждого оператора; теперь это общие
+    правила в таблице alert_rule.
+    """
+    seed_default_rules()
+
+
+def migrate_listing_indexes():
+    """
+    Миграция 7: индексы для поиска и сортировки списка компьютеров.
+
+    Индекс по hostname COLLATE NOCASE обслуживает поиск по префиксу без
+    учёта регистра (LIKE 'abc%') и сортировку по имени; индексы
+    computer_state — сортировку по текущей загрузке.
+    """
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_computer_hostname_nocase '
+        'ON computer (hostname COLLATE NOCASE)'
+    ))
+    for name, column in (('cpu', 'cpu_percent'), ('ram', 'memory_usage'), ('disk', 'disk_usage')):
+        db.session.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_computer_state_{name} '
+            f'ON computer_state ({column}, computer_id)'
+        ))
+
+
+def migrate_metric_sequence():
+    """
+    Миграция 8: строка metric_sequence, с которой хранилища вне таблицы
+    metric начинают выдавать id измерений.
+    """
+    if db.session.get(MetricSequence, 1) is None:
+        db.session.add(MetricSequence(id=1, last_id=id_floor()))
+
+
+def migrate_rollup_bucket_index():
+    """
+    Миграция 9: индекс metric_rollup (resolution, bucket) для выборок
+    агрегатов всего парка за интервал (app/analytics.py).
+    """
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_metric_rollup_resolution_bucket '
+        'ON metric_rollup (resolution, bucket)'
+    ))
+
+
+def migrate_alert_state():
+    """
+    Миграция 10: состояние оповещений, общее для процессов сервера, —
+    строка alert_rules_version и уникальный индекс открытых оповещений
+    (таблицы создаёт db.create_all()). Из повторно открытых оповещений
+    одной пары открытым остаётся самое раннее.
+    """
+    db.session.execute(text(
+        'UPDATE alert_event SET closed_at = opened_at '
+        'WHERE closed_at IS NULL AND id NOT IN ('
+        'SELECT MIN(id) FROM alert_event WHERE closed_at IS NULL GROUP BY rule_id, computer_id)'
+    ))
+    db.session.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_alert_event_open '
+        'ON alert_event (rule_id, computer_id) WHERE closed_at IS NULL'
+    ))
+    if db.session.get(AlertRulesVersion, 1) is None:
+        db.session.add(AlertRulesVersion(id=1, version=0))
+
+
+# Упорядоченный список миграций: (версия, описание, функция).
+# Каждый шаг должен быть идемпотентным: на новой базе таблицы уже созданы
+# db.create_all(), и шаги лишь проверяют, что всё на месте.
+MIGRATIONS = [
+    (1, 'computer_state backfill', migrate_computer_state),
+    (2, 'metric (computer_id, timestamp) index', migrate_indexes),
+    (3, 'metric_rollup backfill', migrate_rollups),
+    (4, 'computer_state.metric_id cursor', migrate_state_cursor),
+    (5, 'metric.extra column', migrate_metric_extra),
+    (6, 'default alert rules', migrate_alert_rules),
+    (7, 'computer list search and sort indexes', migrate_listing_indexes),
+    (8, 'metric id sequence', migrate_metric_sequence),
+    (9, 'metric_rollup (resolution, bucket) index', migrate_rollup_bucket_index),
+    (10, 'shared alert state and single open alert per rule and host', migrate_alert_state),
+]
+
+# Версия схемы, которую ожидает текущий код
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version():
+    """
+    Получить версию схемы базы данных.
+
+    :return: номер последней применённой миграции или 0.
+    :rtype: int
+    """
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
+
+def migrate():
+    """
+    Применить к базе все миграции новее её текущей версии.
+
+    Каждая миграция выполняется в своей транзакции вместе с записью
+    в schema_version, поэтому прерванный запуск продолжится с того же шага.
+
+    :return: список номеров применённых миграций.
+    :rtype: list[int]
+    """
+    version = current_version()
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info('applying migration %s: %s', number, description)
+        try:
+            step()
+            db.session.add(SchemaVersion(version=number, description=description))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        applied.append(number)
+    return applied
+
+
+class SchemaMismatch(RuntimeError):
+    """
+    Версия схемы базы не совпадает с ожидаемой кодом.
+    """
+
+
+def check_schema():
+    """
+    Убедиться, что все миграции уже применены, не выполняя DDL.
+
+    :raises SchemaMismatch: если база не создана, устарела или новее кода.
+    """
+    try:
+        version = current_version()
+    except DBAPIError:
+        # таблицы schema_version ещё нет — база не инициализирована
+        db.session.rollback()
+        version = 0
+    if version != SCHEMA_VERSION:
+        raise SchemaMismatch(
+            f'database schema version is {version}, expected {SCHEMA_VERSION}; '
+            f'run "python serve.py --migrate" first'
+        )
+
+
+def init_storage(app):
+    """
+    Подготовить хранилище: настроить соединения, затем создать таблицы и
+    применить миграции или, при SCHEMA_AUTO_MIGRATE = False, только
+    проверить версию схемы.
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    :raises SchemaMismatch: если миграции выключены, а схема устарела.
+    """
+    with app.app_context():
+        configure_engine(app, db.engine)
+        if app.config['SCHEMA_AUTO_MIGRATE']:
+            db.create_all()
+            migrate()
+        else:
+            check_schema()
@@ -0,0 +1,119 @@
+"""
+Ограничение числа одновременных долгих потоковых ответов.
+
+Поток SSE (/api/live) и выгрузка (/api/export) занимают рабочий поток
+сервера на всё время передачи. Под gunicorn с рабочим классом gthread
+потоков в процессе немного (--threads), и без ограничения несколько
+открытых вкладок или выгрузок заняли бы их все, оставив приём метрик и
+страницы без потоков. Поэтому у каждого вида потоков есть свой предел
+(LIVE_MAX_STREAMS, EXPORT_MAX_STREAMS); None — без ограничения.
+"""
+
+import threading
+
+
+class StreamSlots:
+    """
+    Счётчик занятых мест для потоковых ответов одного вида.
+
+    Основные атрибуты:
+        limit (int | None): предел одновременных потоков; None — без предела.
+        active (int): потоки, передающиеся сейчас.
+        stats (dict): число отказов из-за заполненных мест.
+    """
+    def __init__(self, limit=None):
+        """
+        :param limit: предел одновременных потоков; None — без предела.
+        :type limit: int | None
+        """
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.active = 0
+        self.stats = {'rejected': 0}
+
+    def acquire(self):
+        """
+        Занять место, если оно есть.
+
+        :return: True, если место занято; его нужно освободить release().
+        :rtype: bool
+        """
+        with self.lock:
+            if self.limit is not None and self.active >= self.limit:
+                self.stats['rejected'] += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+    def guard(self, chunks):
+        """
+        Обернуть части ответа так, чтобы место освободилось, когда сервер
+        закроет ответ: после передачи, при отключении клиента или если
+        ответ так и не начали передавать.
+
+        Место должно быть уже занято acquire().
+
+        :param chunks: части ответа.
+        :type chunks: Iterable
+        :rtype: SlotGuard
+        """
+        return SlotGuard(self, chunks)
+
+
+class SlotGuard:
+    """
+    Итератор по частям ответа, освобождающий место в close().
+
+    Генератор с try/finally здесь не подходит: закрытие ещё не запущенного
+    генератора не выполняет его finally, и место осталось бы занятым.
+    """
+    def __init__(self, slots, chunks):
+        self.slots = slots
+        self.chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            close = getattr(self.chunks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.slots.release()
+
+
+def get_slots(kind):
+    """
+    Места потоков вида kind ("live" или "export") текущего приложения.
+
+    :rtype: StreamSlots
+    """
+    from flask import current_app
+
+    return current_app.extensions['stream_slots'][kind]
+
+
+def init_streams(app):
+    """
+    Создать счётчики мест потоковых ответов и сохранить их в
+    app.extensions["stream_slots"].
+
+    :param app: Flask-приложение SysMonitor.
+    :type app: flask.Flask
+    """
+    app.extensions['stream_slots'] = {
+        'live': StreamSlots(app.config['LIVE_MAX_STREAMS']),
+        'export': StreamSlots(app.config['EXPORT_MAX_STREAMS']),
+    }
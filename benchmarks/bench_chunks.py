@@ -0,0 +1,213 @@
+"""
+Размер на диске и скорость чтения длинного интервала для таблицы metric,
+столбцовых сегментов и запечатанных фрагментов (app/chunks.py).
+
+Генерирует ряды --hosts компьютеров по --samples измерений с шагом 5 с
+(время с дрожанием, CPU — случайное блуждание с одним знаком после
+запятой, медленно меняющиеся RAM и диск, число процессов ±несколько) и
+записывает одни и те же строки в три хранилища:
+
+    sql      — таблица metric в файле SQLite (SqlMetricStore);
+    hot      — сегменты ColumnarMetricStore, отображаемые в память;
+    sealed   — те же сегменты после ColumnarMetricStore.seal().
+
+Для каждого выводит байт на измерение, сжатие относительно sql и время
+полного просмотра ряда одного компьютера (scan) и агрегации за весь
+интервал по часовым корзинам (buckets). Размер sealed считается по
+файлам фрагментов и запечатанным в них строкам: незаполненные сегменты, в
+которые ещё идёт запись, остаются прежними (они учтены в total). Отчёт
+JSON пишется в --output.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_chunks.py
+    python benchmarks/bench_chunks.py --hosts 20 --samples 50000 --output chunks.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.columnar import ColumnarMetricStore, SealedSegment
+from app.metricstore import SqlMetricStore
+from app.models import Computer
+from bench_fleet import git_revision
+
+INTERVAL = 5
+
+
+def make_series(computer_id, count, start, rnd):
+    """
+    Ряд измерений одного компьютера, похожий на присылаемый агентом.
+
+    :rtype: list[dict]
+    """
+    cpu = rnd.uniform(5, 40)
+    ram = rnd.uniform(30, 70)
+    disk = rnd.uniform(20, 90)
+    processes = rnd.randint(120, 300)
+    rows = []
+    for i in range(count):
+        cpu = min(100.0, max(0.0, cpu + rnd.gauss(0, 3)))
+        ram = min(100.0, max(0.0, ram + rnd.gauss(0, 0.05)))
+        if rnd.random() < 0.01:
+            disk += 0.1
+        processes += rnd.choice((-2, -1, 0, 0, 0, 1, 2))
+        rows.append({
+            'computer_id': computer_id,
+            'timestamp': start + timedelta(seconds=i * INTERVAL + rnd.randint(0, 300) / 1000),
+            'cpu_percent': round(cpu, 1),
+            'memory_usage': round(ram, 1),
+            'disk_usage': round(disk, 1),
+            'processes': processes,
+            'extra': None,
+        })
+    return rows
+
+
+def directory_size(path, suffixes):
+    """
+    Суммарный размер файлов каталога с указанными расширениями, байт.
+
+    :rtype: int
+    """
+    total = 0
+    for directory, _, names in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(directory, name)) for name in names if name.endswith(suffixes))
+    return total
+
+
+def timed(func, repeat):
+    """
+    Лучшее время из repeat вызовов func, мс, и результат последнего вызова.
+
+    :rtype: tuple[float, object]
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def measure(store, computer_id, start, end, repeat, before_read=None):
+    """
+    Время scan() и buckets() за весь интервал одного компьютера.
+
+    :param before_read: вызывается перед каждым чтением (сброс кэшей).
+    :rtype: dict
+    """
+    def scan():
+        if before_read:
+            before_read()
+        return sum(1 for _ in store.scan(computer_id, start, end))
+
+    def buckets():
+        if before_read:
+            before_read()
+        return list(store.buckets(computer_id, start, end, 3600))
+
+    scan_ms, rows = timed(scan, repeat)
+    buckets_ms, result = timed(buckets, repeat)
+    return {'scan_ms': round(scan_ms, 2), 'buckets_ms': round(buckets_ms, 2), 'rows': rows, 'buckets': len(result)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hosts', type=int, default=10)
+    parser.add_argument('--samples', type=int, default=20000, help='измерений на компьютер')
+    parser.add_argument('--segment-rows', type=int, default=4096)
+    parser.add_argument('--chunk-rows', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='файл для отчёта JSON')
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(seconds=args.samples * INTERVAL)
+    end = start + timedelta(seconds=args.samples * INTERVAL + 1)
+    total_rows = args.hosts * args.samples
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(workdir, "metric.db")}',
+            'RETENTION_ENABLED': False,
+            'INSTRUMENTATION_ENABLED': False,
+            'CACHE_ENABLED': False,
+            'LIVE_POLL_INTERVAL': 3600,
+            'METRIC_STORE': 'sql',
+        })
+        columnar = ColumnarMetricStore(os.path.join(workdir, 'columnar'), segment_rows=args.segment_rows,
+                                       chunk_rows=args.chunk_rows)
+        with app.app_context():
+            sql = SqlMetricStore()
+            for number in range(args.hosts):
+                comp = Computer(hostname=f'WS-{number:04d}')
+                db.session.add(comp)
+                db.session.commit()
+                rows = make_series(comp.id, args.samples, start, rnd)
+                for position in range(0, len(rows), 5000):
+                    batch = rows[position:position + 5000]
+                    sql.insert([dict(row) for row in batch])
+                    db.session.commit()
+                    columnar.insert(batch)
+                    columnar.commit()
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+                connection.exec_driver_sql('VACUUM')
+            computer_id = comp.id
+
+            results['sql'] = {'bytes': os.path.getsize(os.path.join(workdir, 'metric.db')),
+                              'stored_rows': total_rows, **measure(sql, computer_id, start, end, args.repeat)}
+            results['hot'] = {'bytes': directory_size(os.path.join(workdir, 'columnar'), ('.seg',)),
+                              'stored_rows': total_rows, **measure(columnar, computer_id, start, end, args.repeat)}
+            started = time.perf_counter()
+            sealed_segments = columnar.seal()
+            seal_ms = (time.perf_counter() - started) * 1000
+            sealed_rows = sum(segment.rows for segments in columnar.series.values()
+                              for segment in segments if isinstance(segment, SealedSegment))
+            results['sealed'] = {'bytes': directory_size(os.path.join(workdir, 'columnar'), ('.chk',)),
+                                 'stored_rows': sealed_rows,
+                                 'total': directory_size(os.path.join(workdir, 'columnar'), ('.seg', '.chk')),
+                                 **measure(columnar, computer_id, start, end, args.repeat, columnar.decoded.clear)}
+            db.session.remove()
+            db.engine.dispose()
+        columnar.close()
+
+    for name, result in results.items():
+        assert result['rows'] == args.samples, (name, result['rows'])
+        result['bytes_per_row'] = round(result['bytes'] / result['stored_rows'], 2)
+        result['ratio'] = round(results['sql']['bytes_per_row'] / result['bytes_per_row'], 1)
+
+    print(f'{args.hosts} hosts x {args.samples} samples, segment {args.segment_rows} rows, '
+          f'chunk {args.chunk_rows} rows; sealed {sealed_segments} segments in {seal_ms:.0f} ms, '
+          f'store total after sealing {results["sealed"]["total"]} bytes')
+    print(f'{"store":<8} {"bytes":>12} {"B/row":>8} {"vs sql":>7} {"scan ms":>9} {"buckets ms":>11}')
+    for name, result in results.items():
+        print(f'{name:<8} {result["bytes"]:>12} {result["bytes_per_row"]:>8.2f} {result["ratio"]:>6.1f}x '
+              f'{result["scan_ms"]:>9.1f} {result["buckets_ms"]:>11.1f}')
+
+    if args.output:
+        report = {
+            'params': vars(args),
+            'env': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count(), 'git': git_revision()},
+            'seal': {'segments': sealed_segments, 'ms': round(seal_ms, 1)},
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
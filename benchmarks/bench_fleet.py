@@ -0,0 +1,425 @@
+"""
+Нагрузочная модель парка агентов: приём метрик и страницы интерфейса.
+
+Сценарий ingest: --hosts виртуальных агентов по очереди отправляют
+образцы (по одному на /api/metrics или пачками по --batch на
+/api/metrics/batch) в --workers потоков. Измеряются пропускная
+способность, задержки p50/p99 и прирост файла SQLite на образец.
+
+Сценарий pages: база заполняется историей (--seed-hosts × --seed-metrics
+строк, напрямую через SQL), после чего замеряется время ответа
+/dashboard, /computers и /computer/<id>. Кэш страниц (app/cache.py) по
+умолчанию выключен, и каждая страница строится заново (cold). С
+--page-cache он включается, и отдельно замеряются ответы из кэша (warm);
+перед каждым замером cold кэш сбрасывается. Для уже запущенного сервера
+сбросить кэш нельзя, поэтому замеряется только warm.
+
+Цель --target:
+    client — тестовый клиент Flask поверх create_app() (без сети);
+    server — локальный многопоточный сервер werkzeug на свободном порту;
+    http://host:port — уже запущенный сервер (seed в этом режиме недоступен).
+
+Результат печатается в JSON (или пишется в --output), чтобы его можно было
+сравнивать между версиями:
+    python benchmarks/bench_fleet.py --hosts 200 --ticks 20 --output before.json
+    python benchmarks/bench_fleet.py --seed-hosts 10000 --seed-metrics 10000000 --skip-ingest
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import requests
+
+import wire
+from app import create_app, db
+from app.models import ComputerState
+
+PAGES = ['/dashboard', '/computers', '/computer/{id}']
+
+
+def percentile(values, pct):
+    """
+    Перцентиль методом ближайшего ранга.
+
+    :rtype: float | None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def latency_summary(seconds):
+    """
+    Свести задержки (сек) к p50/p99/max/mean в миллисекундах.
+
+    :rtype: dict
+    """
+    ms = [value * 1000 for value in seconds]
+    return {
+        'p50': round(percentile(ms, 50), 3) if ms else None,
+        'p99': round(percentile(ms, 99), 3) if ms else None,
+        'max': round(max(ms), 3) if ms else None,
+        'mean': round(sum(ms) / len(ms), 3) if ms else None,
+    }
+
+
+def db_size(path):
+    """
+    Размер базы SQLite вместе с журналом WAL, байт.
+
+    :rtype: int
+    """
+    return sum(os.path.getsize(path + suffix)
+               for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Target:
+    """
+    Куда отправляются запросы: тестовый клиент Flask или HTTP-сервер.
+
+    У каждого рабочего потока свой клиент (сессия), поэтому куки входа
+    и соединения keep-alive не разделяются между потоками.
+    """
+    def __init__(self, app=None, base_url=None):
+        self.app = app
+        self.base_url = base_url
+        self.local = threading.local()
+
+    def client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.app.test_client() if self.base_url is None else requests.Session()
+            self.local.client = client
+            self.login(client)
+        return client
+
+    def login(self, client):
+        form = {'username': 'admin', 'password': 'admin'}
+        if self.base_url is None:
+            client.post('/login', data=form)
+        else:
+            client.post(self.base_url + '/login', data=form, allow_redirects=False)
+
+    def post(self, path, body, content_type):
+        client = self.client()
+        if self.base_url is None:
+            return client.post(path, data=body, content_type=content_type).status_code
+        return client.post(self.base_url + path, data=body,
+                           headers={'Content-Type': content_type}).status_code
+
+    def get(self, path):
+        client = self.client()
+        if self.base_url is None:
+            response = client.get(path)
+            return response.status_code, len(response.data)
+        response = client.get(self.base_url + path)
+        return response.status_code, len(response.content)
+
+
+def make_sample(hostname, ts, rnd, shape):
+    """
+    Образец метрик виртуального агента.
+
+    :param shape: "basic" — только основные поля, "ext" — с блоком ext.
+    :type shape: str
+    :rtype: dict
+    """
+    sample = {
+        'hostname': hostname,
+        'cpu': round(rnd.uniform(0, 100), 1),
+        'ram': round(rnd.uniform(20, 90), 1),
+        'disk': round(rnd.uniform(10, 95), 1),
+        'processes': rnd.randint(80, 400),
+        'timestamp': round(ts, 3),
+    }
+    if shape == 'ext':
+        sample['ext'] = {
+            'cpu_per_core': [round(rnd.uniform(0, 100), 1) for _ in range(8)],
+            'load_avg': [round(rnd.uniform(0, 4), 2) for _ in range(3)],
+            'net_io': {'bytes_sent': round(rnd.uniform(0, 1e6), 1),
+                       'bytes_recv': round(rnd.uniform(0, 1e6), 1)},
+        }
+    return sample
+
+
+def encode(samples, batch, binary):
+    """
+    Тело запроса и путь для пачки образцов.
+
+    :rtype: tuple[str, bytes, str]
+    """
+    if binary:
+        path = '/api/metrics' if batch == 1 else '/api/metrics/batch'
+        return path, wire.encode(samples), wire.CONTENT_TYPE
+    if batch == 1:
+        return '/api/metrics', json.dumps(samples[0]).encode('utf-8'), 'application/json'
+    return '/api/metrics/batch', json.dumps(samples).encode('utf-8'), 'application/json'
+
+
+def run_ingest(target, args, db_path):
+    """
+    Сценарий ingest: виртуальные агенты отправляют --ticks образцов каждый.
+
+    :rtype: dict
+    """
+    rnd = random.Random(1)
+    start_ts = time.time() - args.ticks * args.interval
+    samples = [
+        make_sample(f'bench-{host:05d}', start_ts + tick * args.interval, rnd, args.shape)
+        for tick in range(args.ticks) for host in range(args.hosts)
+    ]
+    requests_ = [encode(samples[i:i + args.batch], args.batch, args.binary)
+                 for i in range(0, len(samples), args.batch)]
+
+    size_before = db_size(db_path) if db_path else None
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    pace = 1.0 / args.rate if args.rate else 0
+    started = time.perf_counter()
+
+    def send(index):
+        nonlocal errors
+        if pace:
+            delay = started + index * pace - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        path, body, content_type = requests_[index]
+        t0 = time.perf_counter()
+        try:
+            ok = target.post(path, body, content_type) == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - t0
+        with lock:
+            latencies.append(elapsed)
+            errors += not ok
+
+    with ThreadPoolExecutor(args.workers) as pool:
+        list(pool.map(send, range(len(requests_))))
+    seconds = time.perf_counter() - started
+
+    result = {
+        'requests': len(requests_),
+        'samples': len(samples),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'samples_per_sec': round(len(samples) / seconds, 1),
+        'requests_per_sec': round(len(requests_) / seconds, 1),
+        'latency_ms': latency_summary(latencies),
+    }
+    if db_path:
+        size_after = db_size(db_path)
+        result.update(db_bytes_before=size_before, db_bytes_after=size_after,
+                      db_bytes_per_sample=round((size_after - size_before) / len(samples), 1))
+    return result
+
+
+def seed_history(app, db_path, hosts, metrics, interval):
+    """
+    Заполнить базу историей напрямую через SQL (без HTTP и ORM).
+
+    Измерения распределяются по хостам равномерно, по interval секунд
+    между соседними измерениями одного хоста, и заканчиваются текущим
+    моментом. Текущее состояние хостов заполняется ComputerState.backfill().
+
+    :return: время заполнения, сек.
+    :rtype: float
+    """
+    started = time.perf_counter()
+    ticks = -(-metrics // hosts)
+    start = int(time.time()) - ticks * interval
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    with conn:
+        conn.execute(
+            'INSERT INTO computer (hostname, created_at) '
+            'WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?) '
+            "SELECT printf('seed-%06d', n), datetime('now') FROM seq",
+            (hosts,),
+        )
+        # хосты вставлены одним запросом, поэтому их id идут подряд
+        first_id = conn.execute("SELECT id FROM computer WHERE hostname = 'seed-000001'").fetchone()[0]
+        conn.execute(
+            'INSERT INTO metric (computer_id, cpu_percent, memory_usage, disk_usage, processes, timestamp) '
+            'WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < ? - 1) '
+            'SELECT ? + n % ?, abs(random() % 10000) / 100.0, abs(random() % 10000) / 100.0, '
+            '       abs(random() % 10000) / 100.0, 100 + abs(random() % 300), '
+            "       strftime('%Y-%m-%d %H:%M:%S', ? + (n / ?) * ?, 'unixepoch') || '.000000' "
+            'FROM seq',
+            (metrics, first_id, hosts, start, hosts, interval),
+        )
+    conn.close()
+
+    with app.app_context():
+        ComputerState.backfill()
+        db.session.commit()
+    return time.perf_counter() - started
+
+
+def run_pages(target, app, repeat):
+    """
+    Сценарий pages: время ответа страниц интерфейса.
+
+    :return: страница -> {"cold": ..., "warm": ...}; замер, который в этом
+             режиме недоступен, равен None.
+    :rtype: dict
+    """
+    computer_id = 1
+    cache = None
+    if app is not None:
+        cache = app.extensions.get('view_cache')
+        with app.app_context():
+            computer_id = db.session.execute(db.text('SELECT min(id) FROM computer')).scalar() or 1
+
+    def measure(path, before=None):
+        target.get(path) # прогрев соединений и кэшей базы
+        timings = []
+        status = size = None
+        for _ in range(repeat):
+            if before is not None:
+                before()
+            t0 = time.perf_counter()
+            status, size = target.get(path)
+            timings.append(time.perf_counter() - t0)
+        return dict(latency_summary(timings), status=status, bytes=size)
+
+    results = {}
+    for page in PAGES:
+        path = page.format(id=computer_id)
+        result = {'cold': None, 'warm': None}
+        if app is not None:
+            # bump(config=True) делает устаревшими все записи кэша
+            result['cold'] = measure(path, (lambda: cache.bump(config=True)) if cache is not None else None)
+        if app is None or cache is not None:
+            result['warm'] = measure(path)
+        results[page] = result
+    return results
+
+
+def start_server(app):
+    """
+    Запустить многопоточный сервер werkzeug на свободном порту.
+
+    :return: пара (базовый URL, сервер).
+    """
+    from werkzeug.serving import make_server
+
+    # журнал каждого запроса заметно замедляет сервер и засоряет вывод
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SysMonitor fleet benchmark')
+    parser.add_argument('--target', default='client', help='client, server или URL сервера')
+    parser.add_argument('--db', help='файл SQLite (по умолчанию временный)')
+    parser.add_argument('--hosts', type=int, default=100, help='виртуальных агентов')
+    parser.add_argument('--ticks', type=int, default=10, help='образцов от каждого агента')
+    parser.add_argument('--interval', type=float, default=5.0, help='шаг времени между образцами агента, сек')
+    parser.add_argument('--batch', type=int, default=1, help='образцов в запросе (1 — /api/metrics)')
+    parser.add_argument('--shape', choices=['basic', 'ext'], default='basic', help='состав образца')
+    parser.add_argument('--binary', action='store_true', help='двоичный формат wire.py вместо JSON')
+    parser.add_argument('--workers', type=int, default=4, help='параллельных отправителей')
+    parser.add_argument('--rate', type=float, default=0, help='запросов в секунду (0 — без ограничения)')
+    parser.add_argument('--ingest-mode', choices=['sync', 'buffered'], default='sync')
+    parser.add_argument('--skip-ingest', action='store_true')
+    parser.add_argument('--seed-hosts', type=int, default=0, help='хостов в заполняемой истории')
+    parser.add_argument('--seed-metrics', type=int, default=0, help='строк metric в заполняемой истории')
+    parser.add_argument('--seed-interval', type=int, default=30, help='шаг истории на хост, сек')
+    parser.add_argument('--page-repeat', type=int, default=20, help='замеров каждой страницы')
+    parser.add_argument('--page-cache', action='store_true',
+                        help='включить кэш страниц и замерить ответы из него (warm)')
+    parser.add_argument('--output', help='файл для результата JSON')
+    args = parser.parse_args()
+
+    report = {
+        'benchmark': 'fleet',
+        'format': 2,
+        'started_at': datetime.utcnow().isoformat() + 'Z',
+        'env': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'params': vars(args),
+    }
+
+    app = None
+    db_path = None
+    server = None
+    if args.target in ('client', 'server'):
+        if args.db:
+            db_path = os.path.abspath(args.db)
+        else:
+            db_path = os.path.join(tempfile.mkdtemp(prefix='sysmon-bench-'), 'bench.db')
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+            'RETENTION_ENABLED': False,
+            'INGEST_MODE': args.ingest_mode,
+            'CACHE_ENABLED': args.page_cache,
+        })
+        if args.seed_metrics:
+            seconds = seed_history(app, db_path, args.seed_hosts or 1, args.seed_metrics, args.seed_interval)
+            report['seed'] = {'hosts': args.seed_hosts or 1, 'metrics': args.seed_metrics,
+                              'seconds': round(seconds, 1), 'db_bytes': db_size(db_path)}
+        if args.target == 'server':
+            base_url, server = start_server(app)
+            target = Target(base_url=base_url)
+        else:
+            target = Target(app=app)
+    else:
+        if args.seed_metrics:
+            parser.error('--seed-metrics requires --target client or server')
+        target = Target(base_url=args.target.rstrip('/'))
+
+    if not args.skip_ingest:
+        report['ingest'] = run_ingest(target, args, db_path)
+        buffer = app.extensions.get('ingest_buffer') if app else None
+        if buffer is not None:
+            buffer.stop()
+            report['ingest']['db_bytes_after_flush'] = db_size(db_path)
+    report['pages'] = run_pages(target, app, args.page_repeat)
+
+    if server is not None:
+        server.shutdown()
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Пропускная способность serve.py в зависимости от числа процессов.
+
+Для каждого значения --workers запускается `python serve.py` на
+свободном порту поверх общей временной базы SQLite (миграции применяются
+один раз через serve.py --migrate, затем база заполняется --hosts
+компьютерами). В течение --duration секунд --clients клиентских потоков
+выполняют запросы сценария:
+
+    pages  — /dashboard, /computers, /computer/<id> (вошедший оператор);
+    ingest — POST /api/metrics от случайного компьютера;
+    mixed  — 9 страниц на 1 образец.
+
+Для каждого числа процессов печатается число запросов в секунду и задержки
+p50/p99; полный отчёт в JSON пишется в --output:
+
+    python benchmarks/bench_serve.py --workers 1 2 4 --threads 8 --clients 32
+    python benchmarks/bench_serve.py --scenario ingest --workers 1 2 4 --output serve.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import requests
+
+from bench_fleet import Target, git_revision, latency_summary
+
+SCENARIOS = {
+    'pages': ['/dashboard', '/computers', '/computer/{id}'],
+    'ingest': ['POST'],
+    'mixed': ['/dashboard', '/computers', '/computer/{id}'] * 3 + ['POST'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(env, workers, threads):
+    """
+    Запустить serve.py и дождаться готовности.
+
+    :return: процесс сервера и его базовый URL.
+    :rtype: tuple[subprocess.Popen, str]
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, 'serve.py'), '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', str(threads)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + '/api/ingest/stats', timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+
+def run_load(base_url, scenario, clients, duration, hosts):
+    """
+    Нагрузить сервер запросами сценария в clients потоков.
+
+    :return: число запросов, ошибок и задержки, сек.
+    :rtype: tuple[int, int, list[float]]
+    """
+    target = Target(base_url=base_url)
+    paths = SCENARIOS[scenario]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        local = []
+        failed = 0
+        while time.monotonic() < deadline:
+            path = rnd.choice(paths)
+            started = time.perf_counter()
+            if path == 'POST':
+                sample = {'hostname': f'BENCH-{rnd.randrange(hosts):05d}', 'cpu': rnd.uniform(0, 100),
+                          'ram': rnd.uniform(0, 100), 'disk': rnd.uniform(0, 100), 'processes': 200}
+                status = target.post('/api/metrics', json.dumps(sample), 'application/json')
+            else:
+                status, _ = target.get(path.format(id=rnd.randrange(1, hosts + 1)))
+            local.append(time.perf_counter() - started)
+            failed += status != 200
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), errors[0], latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=8, help='потоков в процессе сервера')
+    parser.add_argument('--clients', type=int, default=32, help='параллельных клиентов')
+    parser.add_argument('--duration', type=float, default=10.0, help='длительность замера, сек')
+    parser.add_argument('--hosts', type=int, default=500, help='компьютеров в базе')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    parser.add_argument('--output', help='файл для отчёта JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='sysmon-serve-')
+    env = dict(os.environ, SYSMON_SQLALCHEMY_DATABASE_URI=f'sqlite:///{os.path.join(workdir, "bench.db")}',
+               SYSMON_RETENTION_ENABLED='false')
+    subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'serve.py'), '--migrate'],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+
+    report = {
+        'env': {'python': platform.python_version(), 'platform': platform.platform(),
+                'cpus': os.cpu_count(), 'git': git_revision()},
+        'params': vars(args),
+        'results': [],
+    }
+    print(f'{"workers":>7} {"req/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for workers in args.workers:
+        process, base_url = start_server(env, workers, args.threads)
+        try:
+            requests.post(base_url + '/api/metrics/batch', json=[
+                {'hostname': f'BENCH-{i:05d}', 'cpu': 10.0, 'ram': 20.0, 'disk': 30.0, 'processes': 100}
+                for i in range(args.hosts)
+            ]).raise_for_status()
+            requests_done, errors, latencies = run_load(
+                base_url, args.scenario, args.clients, args.duration, args.hosts)
+        finally:
+            process.terminate()
+            process.wait(30)
+
+        result = dict(workers=workers, requests=requests_done, errors=errors,
+                      rps=round(requests_done / args.duration, 1), latency_ms=latency_summary(latencies))
+        report['results'].append(result)
+        print(f'{workers:>7} {result["rps"]:>9.1f} {result["latency_ms"]["p50"]:>8.2f} '
+              f'{result["latency_ms"]["p99"]:>8.2f} {errors:>7}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
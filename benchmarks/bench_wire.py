@@ -0,0 +1,100 @@
+"""
+Сравнение JSON и двоичного формата wire.py на пакете образцов.
+
+Для пакета из --samples образцов (по умолчанию 1000) от --hosts хостов
+выводит размер тела (как есть и после gzip) и время разбора: только
+декодирование тела и полный путь сервера parse_batch() + validate_sample().
+
+Запуск из корня репозитория:
+    python benchmarks/bench_wire.py
+    python benchmarks/bench_wire.py --samples 5000 --no-ext
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wire
+from app.ingest import parse_batch, validate_sample
+
+
+def make_samples(count, hosts, with_ext=True):
+    """
+    Сгенерировать образцы, похожие на присылаемые агентом.
+
+    :rtype: list[dict]
+    """
+    rnd = random.Random(1)
+    now = time.time()
+    samples = []
+    for i in range(count):
+        sample = {
+            'hostname': f'WS-{i % hosts:04d}.corp.example',
+            'cpu': round(rnd.uniform(0, 100), 1),
+            'ram': round(rnd.uniform(20, 90), 1),
+            'disk': round(rnd.uniform(10, 95), 1),
+            'processes': rnd.randint(80, 400),
+            'timestamp': round(now - (count - i) * 5, 3),
+        }
+        if with_ext:
+            sample['ext'] = {
+                'cpu_per_core': [round(rnd.uniform(0, 100), 1) for _ in range(8)],
+                'load_avg': [round(rnd.uniform(0, 4), 2) for _ in range(3)],
+                'net_io': {'bytes_sent': round(rnd.uniform(0, 1e6), 1),
+                           'bytes_recv': round(rnd.uniform(0, 1e6), 1)},
+            }
+        samples.append(sample)
+    return samples
+
+
+def best_time(func, repeat):
+    """
+    Лучшее время одного вызова func из repeat замеров, мс.
+
+    :rtype: float
+    """
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def server_path(body, mimetype):
+    """
+    Путь сервера от тела запроса до проверенных образцов.
+    """
+    return [validate_sample(item) for item in parse_batch(body, mimetype)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--hosts', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-ext', action='store_true', help='образцы без блока ext')
+    args = parser.parse_args()
+
+    samples = make_samples(args.samples, args.hosts, not args.no_ext)
+    bodies = {
+        'json': (json.dumps(samples).encode('utf-8'), 'application/json', json.loads),
+        'binary': (wire.encode(samples), wire.CONTENT_TYPE, wire.decode),
+    }
+    assert server_path(bodies['json'][0], 'application/json') == \
+        server_path(bodies['binary'][0], wire.CONTENT_TYPE)
+
+    scale = 1000 / args.samples
+    print(f'{args.samples} samples, {args.hosts} hosts, ext={"no" if args.no_ext else "yes"}; '
+          f'values per 1000 samples')
+    print(f'{"format":<8} {"bytes":>10} {"gzip":>10} {"decode ms":>10} {"ingest ms":>10}')
+    for name, (body, mimetype, decode) in bodies.items():
+        print(f'{name:<8} {len(body) * scale:>10.0f} {len(gzip.compress(body)) * scale:>10.0f} '
+              f'{best_time(lambda: decode(body), args.repeat) * scale:>10.2f} '
+              f'{best_time(lambda: server_path(body, mimetype), args.repeat) * scale:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
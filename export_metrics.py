@@ -0,0 +1,77 @@
+"""
+Выгрузка истории сырых измерений в CSV или NDJSON (app/export.py).
+
+Без --host и --computer-id выгружается весь парк. Интервал по умолчанию —
+сутки до текущего момента; --from и --to принимают Unix-время или ISO 8601.
+Выгрузка пишется в --output (по умолчанию в stdout) блоками по мере чтения,
+так что память не растёт с объёмом истории.
+
+    python export_metrics.py --host WS-01 --from 2025-03-01 --to 2025-03-02 > ws-01.csv
+    python export_metrics.py --format ndjson --gzip --output fleet.ndjson.gz
+
+База и хранилище измерений берутся из тех же переменных SYSMON_*, что и у
+сервера. Столбцовое хранилище (SYSMON_METRIC_STORE='"columnar"') занято
+работающим сервером — в этом случае выгружайте через GET /api/export.
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.export import CHUNK_BYTES, FORMATS, export_stream, iter_fleet, resolve_hosts
+from app.history import parse_time_arg
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Export SysMonitor raw metrics as CSV or NDJSON')
+    parser.add_argument('--host', action='append', default=[], help='имя компьютера (можно повторять)')
+    parser.add_argument('--computer-id', action='append', type=int, default=[],
+                        help='id компьютера (можно повторять)')
+    parser.add_argument('--from', dest='start', help='начало интервала (по умолчанию сутки до --to)')
+    parser.add_argument('--to', dest='end', help='конец интервала (по умолчанию сейчас)')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--gzip', action='store_true', help='сжать выгрузку gzip')
+    parser.add_argument('--output', help='файл выгрузки (по умолчанию stdout)')
+    parser.add_argument('--chunk', type=int, default=CHUNK_BYTES, help='размер записываемого блока, байт')
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    try:
+        end = parse_time_arg(args.end, datetime.utcnow())
+        start = parse_time_arg(args.start, end - timedelta(days=1))
+    except (ValueError, OverflowError, OSError):
+        parser.error('invalid time range')
+    if start >= end:
+        parser.error('invalid time range')
+
+    app = create_app({
+        'RETENTION_ENABLED': False,
+        'METRIC_SEAL_ENABLED': False,
+        'INGEST_MODE': 'sync',
+    })
+    with app.app_context():
+        if args.host or args.computer_id:
+            try:
+                hosts = resolve_hosts(args.computer_id, args.host)
+            except LookupError as e:
+                parser.exit(1, f'{e}\n')
+        else:
+            hosts = iter_fleet()
+
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for block in export_stream(hosts, start, end, args.format, args.gzip, args.chunk):
+                output.write(block)
+        finally:
+            if args.output:
+                output.close()
+        db.session.remove()
+        db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Перенос истории сырых измерений из таблицы metric в разделы по периодам.
+
+Строки копируются порциями по возрастанию id в файлы
+<path>/metric-YYYYMMDD.db (app/partitions.py) с прежними id, поэтому
+прерванный перенос можно просто запустить заново. После копирования
+последовательность id измерений поднимается до наибольшего перенесённого
+id, а с --delete строки удаляются из основной базы (порциями, чтобы не
+держать блокировку записи); --vacuum затем возвращает место файлу базы.
+
+    python partition_metrics.py --path /var/lib/sysmonitor/metrics --period day
+    python partition_metrics.py --path /var/lib/sysmonitor/metrics --delete --vacuum
+
+Основная база берётся из SYSMON_SQLALCHEMY_DATABASE_URI. Сервер на время
+переноса лучше остановить, а затем запустить с
+SYSMON_METRIC_STORE='"partitioned"' и тем же SYSMON_METRIC_STORE_PATH.
+"""
+
+import argparse
+import os
+
+from app import create_app, db
+from app.metricstore import advance_sequence
+from app.models import Metric
+from app.partitions import PERIODS, PartitionedMetricStore, copy_from_table
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Move SysMonitor raw metrics into partition files')
+    parser.add_argument('--path', default=os.environ.get('SYSMON_METRIC_STORE_PATH'),
+                        help='каталог разделов (по умолчанию instance/metrics)')
+    parser.add_argument('--period', choices=sorted(PERIODS), default='day', help='период раздела')
+    parser.add_argument('--batch', type=int, default=5000, help='строк в одной порции')
+    parser.add_argument('--delete', action='store_true',
+                        help='удалить перенесённые строки из таблицы metric')
+    parser.add_argument('--vacuum', action='store_true', help='выполнить VACUUM основной базы')
+    return parser
+
+
+def delete_copied(last_id, batch_rows):
+    """
+    Удалить из таблицы metric строки с id не больше last_id порциями.
+
+    :return: число удалённых строк.
+    :rtype: int
+    """
+    deleted = 0
+    while True:
+        boundary = db.session.scalar(
+            db.select(Metric.id).where(Metric.id <= last_id)
+            .order_by(Metric.id).offset(batch_rows - 1).limit(1)
+        )
+        result = db.session.execute(db.delete(Metric).where(Metric.id <= (boundary or last_id)))
+        db.session.commit()
+        deleted += result.rowcount
+        if boundary is None:
+            return deleted
+
+
+def main():
+    args = build_parser().parse_args()
+    app = create_app({
+        'SCHEMA_AUTO_MIGRATE': True,
+        'RETENTION_ENABLED': False,
+        'INGEST_MODE': 'sync',
+        'METRIC_STORE': 'sql',
+    })
+    with app.app_context():
+        store = PartitionedMetricStore(
+            args.path or os.path.join(app.instance_path, 'metrics'),
+            period=args.period,
+            pragmas=app.config['SQLITE_PRAGMAS'],
+        )
+        copied, last_id = copy_from_table(store, args.batch)
+        advance_sequence()
+        db.session.commit()
+        print(f'Перенесено строк: {copied}, разделов: {len(store.partitions())}')
+
+        if args.delete and copied:
+            print('Удалено из metric:', delete_copied(last_id, args.batch))
+        if args.vacuum:
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.exec_driver_sql('VACUUM')
+        db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+"""
+Промежуточный узел (relay) SysMonitor.
+
+Relay запускается в удалённой площадке или подсети и принимает от агентов
+те же запросы, что и центральный сервер: POST /api/metrics (один образец)
+и POST /api/metrics/batch (досылка из дискового буфера агента). Образцы
+буферизуются по хостам, повторы с тем же временем сбора отбрасываются, а
+раз в flush_interval секунд всё накопленное уходит на центральный сервер
+одним сжатым запросом к /api/metrics/batch. В итоге сервер получает
+несколько крупных запросов в секунду вместо тысяч мелких.
+
+Запуск:
+    python relay.py --server http://192.168.1.176:5000 --port 5001
+
+Агенты направляются на relay так же, как на сервер:
+    SystemMonitor().send_metrics("http://relay-host:5001")
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+
+import wire
+from agent import HttpTransport
+
+logger = logging.getLogger('relay')
+
+# максимальный размер тела запроса от агента после распаковки, байт
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+
+
+class RelayBuffer:
+    """
+    Буфер образцов, сгруппированных по хостам.
+
+    Для каждого хоста образцы хранятся в OrderedDict по времени сбора,
+    а ключи недавно пересланных образцов запоминаются, поэтому повторная
+    отправка того же образца (например, досылка после обрыва, когда ответ
+    не дошёл до агента) не создаёт дубликат. Общий объём буфера ограничен:
+    при переполнении вытесняются самые старые образцы самого «тяжёлого»
+    хоста.
+
+    Основные атрибуты:
+        hosts (dict[str, OrderedDict]): hostname -> {timestamp: образец}.
+        stats (dict): счётчики accepted, duplicates, dropped, forwarded.
+    """
+    def __init__(self, max_samples=100000):
+        """
+        :param max_samples: максимальное число образцов в буфере.
+        :type max_samples: int
+        """
+        self.max_samples = max_samples
+        self.hosts = {}
+        self.size = 0
+        self.recent = OrderedDict() # (hostname, timestamp) уже пересланных образцов
+        self.stats = {'accepted': 0, 'duplicates': 0, 'dropped': 0, 'forwarded': 0}
+
+    def add(self, sample):
+        """
+        Добавить образец в буфер.
+
+        Образец без времени сбора получает время приёма relay, чтобы
+        задержка пересылки не сдвигала его на сервере.
+
+        :param sample: образец в формате /api/metrics.
+        :type sample: dict
+        :return: False, если такой образец уже принят.
+        :rtype: bool
+        """
+        if sample.get('timestamp') is None:
+            sample['timestamp'] = round(time.time(), 3)
+        if (sample['hostname'], sample['timestamp']) in self.recent or not self._insert(sample):
+            self.stats['duplicates'] += 1
+            return False
+        self.stats['accepted'] += 1
+        return True
+
+    def _insert(self, sample):
+        """
+        Поместить образец в очередь его хоста.
+
+        :return: False, если образец с тем же временем уже в очереди.
+        :rtype: bool
+        """
+        samples = self.hosts.setdefault(sample['hostname'], OrderedDict())
+        key = sample['timestamp']
+        if key in samples:
+            return False
+        samples[key] = sample
+        self.size += 1
+        if self.size > self.max_samples:
+            self._evict()
+        return True
+
+    def _evict(self):
+        """
+        Вытеснить самый старый образец хоста с наибольшей очередью.
+        """
+        hostname = max(self.hosts, key=lambda name: len(self.hosts[name]))
+        samples = self.hosts[hostname]
+        samples.popitem(last=False)
+        if not samples:
+            del self.hosts[hostname]
+        self.size -= 1
+        self.stats['dropped'] += 1
+
+    def take(self, max_items):
+        """
+        Забрать из буфера не более max_items образцов.
+
+        Образцы забираются по кругу между хостами, чтобы один хост с
+        большой досылкой не задерживал свежие данные остальных.
+
+        :param max_items: максимальный размер пачки.
+        :type max_items: int
+        :rtype: list[dict]
+        """
+        batch = []
+        while self.hosts and len(batch) < max_items:
+            for hostname in list(self.hosts):
+                samples = self.hosts[hostname]
+                batch.append(samples.popitem(last=False)[1])
+                if not samples:
+                    del self.hosts[hostname]
+                if len(batch) >= max_items:
+                    break
+        self.size -= len(batch)
+        return batch
+
+    def done(self, batch):
+        """
+        Отметить пачку как пересланную.
+
+        :param batch: образцы, полученные из take().
+        :type batch: list[dict]
+        """
+        for sample in batch:
+            self.recent[(sample['hostname'], sample['timestamp'])] = None
+        while len(self.recent) > self.max_samples:
+            self.recent.popitem(last=False)
+        self.stats['forwarded'] += len(batch)
+
+    def put_back(self, batch):
+        """
+        Вернуть в буфер пачку, которую не удалось переслать.
+
+        :param batch: образцы, полученные из take().
+        :type batch: list[dict]
+        """
+        for sample in batch:
+            self._insert(sample)
+
+
+class Relay:
+    """
+    asyncio-сервер приёма метрик от агентов с пакетной пересылкой.
+
+    HTTP-разбор минимальный: поддерживаются только запросы с Content-Length
+    (так отправляют requests и HttpTransport агента) и Content-Encoding:
+    gzip. Пересылка выполняется в пуле потоков через HttpTransport агента,
+    поэтому relay наследует его таймауты, сжатие и экспоненциальную
+    задержку повтора при недоступности сервера.
+    """
+    def __init__(self, server_url, flush_interval=1.0, batch_size=5000,
+                 max_samples=100000, transport=None):
+        """
+        :param server_url: базовый URL центрального сервера.
+        :type server_url: str
+        :param flush_interval: период пересылки, сек.
+        :type flush_interval: float
+        :param batch_size: максимальное число образцов в одном запросе к серверу.
+        :type batch_size: int
+        :param max_samples: ёмкость буфера, образцов.
+        :type max_samples: int
+        :param transport: HTTP-транспорт до сервера; по умолчанию HttpTransport().
+        :type transport: HttpTransport | None
+        """
+        self.server_url = server_url.rstrip('/')
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.buffer = RelayBuffer(max_samples)
+        self.transport = transport or HttpTransport()
+
+    def accept(self, path, body, content_type='application/json'):
+        """
+        Обработать тело запроса агента.
+
+        :param path: путь запроса.
+        :type path: str
+        :param body: распакованное тело запроса.
+        :type body: bytes
+        :param content_type: MIME-тип тела: JSON или двоичный формат wire.py.
+        :type content_type: str
+        :return: пара (код ответа, объект JSON для ответа).
+        :rtype: tuple[int, dict]
+        """
+        if content_type == wire.CONTENT_TYPE:
+            try:
+                data = wire.decode(body)
+            except wire.WireError as e:
+                return 400, {'error': str(e)}
+            if path == '/api/metrics':
+                if len(data) != 1:
+                    return 400, {'error': 'expected single sample'}
+                data = data[0]
+        else:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return 400, {'error': 'invalid json'}
+
+        if path == '/api/metrics':
+            samples = [data]
+        elif isinstance(data, dict) and isinstance(data.get('samples'), list):
+            samples = data['samples']
+        elif isinstance(data, list):
+            samples = data
+        else:
+            return 400, {'error': 'invalid json'}
+
+        accepted = 0
+        for sample in samples:
+            # полную проверку выполнит сервер; relay отсеивает только то,
+            # что нельзя сгруппировать по хосту и времени сбора
+            if not isinstance(sample, dict) or not isinstance(sample.get('hostname'), str):
+                if path == '/api/metrics':
+                    return 400, {'error': 'hostname required'}
+                continue
+            timestamp = sample.get('timestamp')
+            if timestamp is not None and (isinstance(timestamp, bool)
+                                          or not isinstance(timestamp, (int, float, str))):
+                if path == '/api/metrics':
+                    return 400, {'error': 'invalid timestamp'}
+                continue
+            accepted += self.buffer.add(sample)
+        return 200, {'status': 'ok', 'accepted': accepted}
+
+    async def flush(self):
+        """
+        Переслать накопленные образцы на центральный сервер.
+
+        Пачка, которую сервер не принял из-за ошибки сети или 5xx,
+        возвращается в буфер и будет отправлена при следующем такте.
+
+        :return: число пересланных образцов.
+        :rtype: int
+        """
+        forwarded = 0
+        while self.buffer.size and self.transport.ready():
+            batch = self.buffer.take(self.batch_size)
+            url = f'{self.server_url}/api/metrics/batch'
+            try:
+                response = await asyncio.to_thread(self.transport.post_json, url, batch)
+            except Exception as e:
+                logger.warning('forward failed: %s', e)
+                self.buffer.put_back(batch)
+                break
+            if response.status_code >= 500 or response.status_code == 429:
+                logger.warning('forward failed: HTTP %s', response.status_code)
+                self.buffer.put_back(batch)
+                break
+            if response.status_code != 200:
+                # 4xx: повтор не поможет, пачка отбрасывается
+                logger.error('server rejected batch: HTTP %s', response.status_code)
+                self.buffer.stats['dropped'] += len(batch)
+                continue
+            self.buffer.done(batch)
+            forwarded += len(batch)
+        return forwarded
+
+    async def flush_loop(self):
+        """
+        Периодическая пересылка буфера.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('flush failed')
+
+    async def handle(self, reader, writer):
+        """
+        Обслужить одно соединение агента (с поддержкой keep-alive).
+        """
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = self.route(method, path, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(format_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def route(self, method, path, headers, body):
+        """
+        Выбрать обработчик запроса.
+
+        :return: пара (код ответа, объект JSON для ответа).
+        :rtype: tuple[int, dict]
+        """
+        path = path.split('?', 1)[0]
+        if path == '/stats':
+            stats = dict(self.buffer.stats, buffered=self.buffer.size, hosts=len(self.buffer.hosts))
+            return 200, stats
+        if path not in ('/api/metrics', '/api/metrics/batch'):
+            return 404, {'error': 'not found'}
+        if method != 'POST':
+            return 405, {'error': 'method not allowed'}
+        if body is None:
+            return 413, {'error': 'payload too large'}
+
+        if headers.get('content-encoding', '').lower() == 'gzip':
+            # распаковка прерывается на MAX_BODY_BYTES, чтобы сжатая «бомба» не заняла всю память
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            try:
+                body = decompressor.decompress(body, MAX_BODY_BYTES + 1)
+            except zlib.error:
+                return 400, {'error': 'invalid gzip body'}
+            if len(body) > MAX_BODY_BYTES or decompressor.unconsumed_tail:
+                return 413, {'error': 'payload too large'}
+            if not decompressor.eof:
+                return 400, {'error': 'invalid gzip body'}
+        content_type = headers.get('content-type', '').split(';', 1)[0].strip().lower()
+        return self.accept(path, body, content_type)
+
+    async def serve(self, host='0.0.0.0', port=5001):
+        """
+        Запустить приём запросов и периодическую пересылку.
+
+        :param host: адрес для прослушивания.
+        :type host: str
+        :param port: порт для прослушивания.
+        :type port: int
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info('relay listening on %s:%s, forwarding to %s', host, port, self.server_url)
+        flusher = asyncio.create_task(self.flush_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flusher.cancel()
+            await self.flush()
+            self.transport.close()
+
+
+async def read_request(reader):
+    """
+    Прочитать один HTTP-запрос.
+
+    :return: кортеж (метод, путь, заголовки, тело) или None, если клиент
+             закрыл соединение. Тело равно None, если превышает MAX_BODY_BYTES.
+    :rtype: tuple | None
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        # тело не читаем, поэтому соединение дальше использовать нельзя
+        headers['connection'] = 'close'
+        return method, path, headers, None
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+def format_response(status, payload, keep_alive=True):
+    """
+    Сформировать HTTP-ответ с телом JSON.
+
+    :rtype: bytes
+    """
+    body = json.dumps(payload).encode('utf-8')
+    head = (
+        f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}\r\n'
+        f'Content-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+    )
+    return head.encode('latin-1') + body
+
+
+def main():
+    """
+    Точка входа: разбор аргументов командной строки и запуск relay.
+    """
+    parser = argparse.ArgumentParser(description='SysMonitor relay')
+    parser.add_argument('--server', required=True, help='URL центрального сервера')
+    parser.add_argument('--host', default='0.0.0.0', help='адрес для приёма агентов')
+    parser.add_argument('--port', type=int, default=5001, help='порт для приёма агентов')
+    parser.add_argument('--interval', type=float, default=1.0, help='период пересылки, сек')
+    parser.add_argument('--batch-size', type=int, default=5000, help='образцов в одном запросе')
+    parser.add_argument('--max-samples', type=int, default=100000, help='ёмкость буфера')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    relay = Relay(args.server, flush_interval=args.interval, batch_size=args.batch_size,
+                  max_samples=args.max_samples)
+    try:
+        asyncio.run(relay.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
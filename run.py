@@ -3,6 +3,7 @@
 
 Создаёт экземпляр Flask-приложения через фабрику create_app()
 и запускает встроенный веб-сервер на всех интерфейсах хоста.
+Предназначена для разработки; для эксплуатации используйте serve.py.
 """
 
 from app import create_app
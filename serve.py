@@ -0,0 +1,190 @@
+"""
+Производственный запуск сервера SysMonitor.
+
+Приложение работает под gunicorn: по умолчанию один процесс с пулом
+потоков (--threads, рабочий класс gthread); несколько процессов
+задаются явно (--workers). Каждый процесс
+создаёт приложение сам после fork, поэтому соединения с базой и фоновые
+потоки не разделяются между процессами. Процессы не выполняют DDL:
+схема только проверяется (SCHEMA_AUTO_MIGRATE = False), а миграции
+применяются заранее отдельной командой:
+
+    python serve.py --migrate
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+
+В нескольких процессах кэш страниц, буфер приёма и счётчики /metrics
+у каждого процесса свои, а уплотнение истории выполняет только один
+из них (см. app/retention.py).
+
+Параметры запуска берутся из аргументов или переменных окружения
+SYSMON_BIND, SYSMON_WORKERS, SYSMON_THREADS и SYSMON_TIMEOUT; параметры
+приложения — из переменных SYSMON_* (см. app/__init__.py).
+
+Столбцовое хранилище измерений (SYSMON_METRIC_STORE="columnar") открывает
+только один процесс, поэтому с ним сервер запускается с одним процессом,
+а явное --workers больше 1 отклоняется.
+
+Если gunicorn недоступен (например, в Windows), сервер запускается в
+одном процессе на многопоточном WSGI-сервере werkzeug.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+
+from app import create_app, db
+from app.storage import current_version
+
+
+# Число процессов по умолчанию. Запись в SQLite выполняется по одной
+# транзакции за раз, а кэш страниц у каждого процесса свой, поэтому
+# несколько процессов включаются явно (см. benchmarks/bench_serve.py).
+DEFAULT_WORKERS = 1
+
+
+def metric_store():
+    """
+    Хранилище измерений из переменной SYSMON_METRIC_STORE.
+
+    Значение разбирается как JSON, как это делает create_app(); строка
+    без кавычек тоже принимается.
+
+    :rtype: str
+    """
+    value = os.environ.get('SYSMON_METRIC_STORE', 'sql')
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def resolve_workers(workers, store):
+    """
+    Число процессов сервера с учётом хранилища измерений.
+
+    :param workers: число из --workers или SYSMON_WORKERS; None — не задано.
+    :type workers: int | None
+    :param store: хранилище измерений (METRIC_STORE).
+    :type store: str
+    :rtype: int
+    :raises ValueError: если для столбцового хранилища задано больше
+                        одного процесса.
+    """
+    if store == 'columnar':
+        if workers not in (None, 1):
+            raise ValueError(
+                f'METRIC_STORE "columnar" is opened by a single process; '
+                f'run with --workers 1 instead of {workers}'
+            )
+        return 1
+    return workers if workers is not None else DEFAULT_WORKERS
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='SysMonitor production server')
+    parser.add_argument('--bind', default=os.environ.get('SYSMON_BIND', '0.0.0.0:5000'),
+                        help='адрес и порт (host:port)')
+    parser.add_argument('--workers', type=int, default=os.environ.get('SYSMON_WORKERS'),
+                        help='число процессов (со столбцовым хранилищем — 1)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SYSMON_THREADS', 8)),
+                        help='потоков в каждом процессе')
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('SYSMON_TIMEOUT', 60)),
+                        help='предельное время обработки запроса, сек')
+    parser.add_argument('--migrate', action='store_true',
+                        help='создать таблицы, применить миграции схемы и выйти')
+    return parser
+
+
+def app_config(threads):
+    """
+    Переопределения конфигурации для процессов сервера.
+
+    Пул соединений по числу потоков процесса; DDL не выполняется.
+    Долгие потоковые ответы (SSE /api/live и /api/export) получают
+    по четверти потоков процесса, если пределы не заданы явно через
+    SYSMON_LIVE_MAX_STREAMS и SYSMON_EXPORT_MAX_STREAMS: иначе открытые
+    вкладки и выгрузки заняли бы все потоки и остановили приём метрик.
+
+    :rtype: dict
+    """
+    config = {'SCHEMA_AUTO_MIGRATE': False, 'DB_POOL_SIZE': threads}
+    for key in ('LIVE_MAX_STREAMS', 'EXPORT_MAX_STREAMS'):
+        if f'SYSMON_{key}' not in os.environ:
+            config[key] = max(1, threads // 4)
+    return config
+
+
+def run_migrations():
+    """
+    Применить миграции схемы и вывести итоговую версию.
+    """
+    app = create_app({
+        'SCHEMA_AUTO_MIGRATE': True,
+        'RETENTION_ENABLED': False,
+        'INGEST_MODE': 'sync',
+    })
+    with app.app_context():
+        print('Схема базы данных: версия', current_version())
+        db.engine.dispose()
+
+
+def run_gunicorn(args):
+    """
+    Запустить приложение под gunicorn.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class SysMonitorApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': args.bind,
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gthread',
+                'timeout': args.timeout,
+                'graceful_timeout': args.timeout,
+                # приложение создаётся в каждом процессе после fork
+                'preload_app': False,
+                'accesslog': os.environ.get('SYSMON_ACCESS_LOG'),
+            }
+            for key, value in options.items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return create_app(app_config(args.threads))
+
+    SysMonitorApplication().run()
+
+
+def run_werkzeug(args):
+    """
+    Запустить приложение в одном процессе на многопоточном сервере werkzeug.
+    """
+    from werkzeug.serving import make_server
+
+    host, _, port = args.bind.rpartition(':')
+    app = create_app(app_config(args.threads))
+    print(f'gunicorn недоступен: один процесс werkzeug на {args.bind}')
+    make_server(host or '0.0.0.0', int(port), app, threaded=True).serve_forever()
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.migrate:
+        run_migrations()
+        return
+    try:
+        args.workers = resolve_workers(args.workers, metric_store())
+    except ValueError as exc:
+        parser.error(str(exc))
+    if importlib.util.find_spec('gunicorn') is not None:
+        run_gunicorn(args)
+    else:
+        run_werkzeug(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,4 +5,35 @@ import sys
 ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
 
 if ROOT_DIR not in sys.path:
-    sys.path.insert(0, ROOT_DIR)
\ No newline at end of file
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+from app import create_app, db
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'RETENTION_ENABLED': False,
+        'LIVE_POLL_INTERVAL': 3600,
+    })
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def logged_in_client(client):
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    return client
@@ -1,3 +1,6 @@
+import gzip
+import json
+import time
 import agent
 from agent import SystemMonitor
 
@@ -18,14 +21,356 @@ def test_collect_metrics_basic():
 def test_send_metrics_success(monkeypatch):
     monitor = agent.SystemMonitor()
 
-    def fake_post(url, json):
+    def fake_post(url, data, headers, timeout):
         class FakeResponse:
             def __init__(self):
                 self.status_code = 200
                 self.text = 'OK'
         return FakeResponse()
 
-    monkeypatch.setattr(agent.requests, 'post', fake_post)
+    monkeypatch.setattr(monitor.transport.session, 'post', fake_post)
 
     ok = monitor.send_metrics('http://blablafake:5000')
-    assert ok is True
\ No newline at end of file
+    assert ok is True
+
+def test_collect_metrics_does_not_block():
+    monitor = SystemMonitor(sample_interval=0.05)
+    start = time.monotonic()
+    monitor.collect_metrics()
+    assert time.monotonic() - start < 0.5
+
+    time.sleep(0.3)
+    data = monitor.collect_metrics()
+    monitor.sampler.stop()
+
+    window = data['window']
+    assert window['samples'] >= 2
+    assert window['cpu']['min'] <= window['cpu']['avg'] <= window['cpu']['max']
+    assert data['cpu'] == window['cpu']['avg']
+    assert 'processes' not in window
+
+
+def test_sampler_window_is_drained_between_sends(monkeypatch):
+    sampler = agent.MetricSampler(window_size=3)
+    values = iter([10.0, 90.0, 20.0, 30.0])
+    monkeypatch.setattr(agent.psutil, 'cpu_percent', lambda interval=None: next(values))
+
+    for _ in range(4):
+        sampler.sample()
+    window = sampler.drain()
+
+    # кольцевой буфер хранит только последние window_size значений
+    assert [value[1] for value in window] == [90.0, 20.0, 30.0]
+    assert agent.summarize([value[1] for value in window]) == {
+        'min': 20.0, 'avg': 46.7, 'max': 90.0, 'last': 30.0,
+    }
+    assert sampler.drain() == []
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+
+
+def test_transport_compresses_and_counts(monkeypatch):
+    transport = agent.HttpTransport(compress_min_bytes=100)
+    sent = []
+
+    def fake_post(url, data, headers, timeout):
+        sent.append((data, headers, timeout))
+        return FakeResponse(200)
+
+    monkeypatch.setattr(transport.session, 'post', fake_post)
+
+    transport.post_json('http://server/api/metrics', {'hostname': 'small'})
+    transport.post_json('http://server/api/metrics/batch', [{'hostname': 'x' * 50}] * 20)
+
+    assert 'Content-Encoding' not in sent[0][1]
+    assert sent[1][1]['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(sent[1][0]).startswith(b'[{"hostname"')
+    assert sent[0][2] == transport.timeout
+    assert transport.stats['sends'] == 2
+    assert transport.stats['bytes_on_wire'] < transport.stats['bytes_raw']
+
+
+def test_transport_backoff_after_failures(monkeypatch):
+    transport = agent.HttpTransport(backoff_base=10, backoff_max=40)
+    statuses = iter([503, 503, 503, 503, 200])
+    monkeypatch.setattr(transport.session, 'post',
+                        lambda url, data, headers, timeout: FakeResponse(next(statuses)))
+
+    delays = []
+    for _ in range(4):
+        transport.post('http://server/api/metrics', b'{}', 'application/json')
+        delays.append(transport.retry_at - time.monotonic())
+        assert not transport.ready()
+
+    assert 4 < delays[0] <= 10
+    assert 19 < delays[2] <= 40
+    assert 19 < delays[3] <= 40
+
+    transport.post('http://server/api/metrics', b'{}', 'application/json')
+    assert transport.ready()
+    assert transport.stats['failures'] == 4
+
+
+def test_spool_survives_restart_and_skips_partial_lines(tmp_path):
+    spool = agent.Spool(str(tmp_path))
+    for i in range(5):
+        spool.append({'hostname': 'pc', 'timestamp': 1000 + i})
+
+    items, position = spool.read_batch(3)
+    assert [item['timestamp'] for item in items] == [1000, 1001, 1002]
+    spool.commit(position)
+
+    # недописанная при аварии строка не должна ломать чтение
+    with open(tmp_path / spool.segments()[-1], 'a') as f:
+        f.write('{"hostname": "pc", "time')
+
+    restarted = agent.Spool(str(tmp_path))
+    items, position = restarted.read_batch(10)
+    assert [item['timestamp'] for item in items] == [1003, 1004]
+
+
+def test_spool_skips_partial_tail_of_sealed_segment(tmp_path):
+    spool = agent.Spool(str(tmp_path), segment_bytes=100)
+    for i in range(10):
+        spool.append({'hostname': 'pc', 'timestamp': 1000 + i})
+    segments = spool.segments()
+    assert len(segments) > 2
+
+    # первый сегмент обрезан посреди последней строки
+    path = tmp_path / segments[0]
+    path.write_bytes(path.read_bytes()[:-5])
+
+    timestamps = []
+    for _ in range(20):
+        items, position = spool.read_batch(2)
+        if position is None:
+            break
+        timestamps += [item['timestamp'] for item in items]
+        spool.commit(position)
+    # пропадает только обрезанный образец, сегмент удалён
+    assert not path.exists()
+    assert len(timestamps) == 9 and timestamps[-1] == 1009
+    assert spool.read_batch(10)[0] == []
+
+
+def test_spool_rotates_and_caps_size(tmp_path):
+    spool = agent.Spool(str(tmp_path), segment_bytes=200, max_bytes=1000)
+    for i in range(100):
+        spool.append({'hostname': 'pc', 'timestamp': i})
+
+    assert len(spool.segments()) > 1
+    assert spool.pending_bytes() <= 1000 + 200
+    assert spool.stats['dropped_segments'] > 0
+
+    # остаются самые свежие образцы
+    items, _ = spool.read_batch(1000)
+    assert items[0]['timestamp'] > 0
+
+
+def test_monitor_spools_on_outage_and_replays(monkeypatch, tmp_path):
+    spool = agent.Spool(str(tmp_path), segment_bytes=300)
+    monitor = SystemMonitor(spool=spool, replay_batch=4, replay_jitter=0)
+    monitor.transport.backoff_base = 0
+    calls = []
+    status = {'code': 503}
+
+    def fake_post(url, data, headers, timeout):
+        calls.append((url, data))
+        return FakeResponse(status['code'])
+
+    monkeypatch.setattr(monitor.transport.session, 'post', fake_post)
+    monitor.transport.compress = False
+
+    for _ in range(6):
+        assert monitor.send_metrics('http://server') is False
+    monitor.sampler.stop()
+    assert spool.stats['appended'] == 6
+
+    status['code'] = 200
+    calls.clear()
+    assert monitor.send_metrics('http://server') is True
+    # первый вызов исчерпал ёмкость ограничителя; остальное — после паузы
+    assert spool.read_batch(10)[0] != []
+    time.sleep(0.05)
+    monitor.replay_spool('http://server')
+
+    batches = [json.loads(data) for url, data in calls if url.endswith('/batch')]
+    assert all(len(batch) <= 4 for batch in batches)
+    replayed = [sample for batch in batches for sample in batch]
+    assert len(replayed) == 6
+    timestamps = [sample['timestamp'] for sample in replayed]
+    assert timestamps == sorted(timestamps)
+    assert spool.read_batch(10)[0] == []
+
+
+class CountingCollector(agent.Collector):
+    name = 'counting'
+
+    def __init__(self, cost, **kwargs):
+        super().__init__(**kwargs)
+        self.cost = cost
+        self.runs = 0
+
+    def collect(self):
+        self.runs += 1
+        time.sleep(self.cost)
+        return self.runs
+
+
+def test_collectors_run_on_own_interval_and_back_off_when_expensive():
+    cheap = CountingCollector(0, interval=10)
+    expensive = CountingCollector(0.02, interval=10, budget_ms=5, max_interval=40)
+    expensive.name = 'expensive'
+    monitor = SystemMonitor(collectors=[cheap, expensive])
+
+    ext = monitor.run_collectors()
+    ext = monitor.run_collectors()
+    assert ext['counting'] == 1 and ext['expensive'] == 1
+    assert ext['collector_cost_ms']['expensive'] >= 5
+    assert cheap.interval == 10
+    assert expensive.interval == 20
+
+    for _ in range(3):
+        expensive.run(time.monotonic())
+    assert expensive.interval == 40
+
+
+def test_rate_collector_reports_deltas_per_second(monkeypatch):
+    class Fake(agent.RateCollector):
+        name = 'fake'
+        values = iter([100, 300, 50])
+
+        def counters(self):
+            return {'bytes': next(self.values)}
+
+    clock = iter([10.0, 12.0, 14.0])
+    monkeypatch.setattr(agent.time, 'monotonic', lambda: next(clock))
+    collector = Fake()
+    assert collector.collect() is None
+    assert collector.collect() == {'bytes': 100.0}
+    # сброс счётчика не даёт отрицательной скорости
+    assert collector.collect() == {}
+
+
+def test_process_count_from_loadavg(monkeypatch, tmp_path):
+    loadavg = tmp_path / 'loadavg'
+    loadavg.write_text('0.52 0.58 0.59 3/412 12345\n')
+    collector = agent.ProcessCountCollector()
+    collector.loadavg_path = str(loadavg)
+    monkeypatch.setattr(agent.psutil, 'pids', lambda: [1, 2])
+    assert collector.collect() == 412
+
+    # без /proc (Windows, macOS) — по списку PID
+    collector.loadavg_path = str(tmp_path / 'missing')
+    assert collector.collect() == 2
+
+
+def test_collect_metrics_includes_extended_block():
+    monitor = SystemMonitor(collectors=agent.default_collectors())
+    data = monitor.collect_metrics()
+    monitor.sampler.stop()
+
+    assert isinstance(data['processes'], int)
+    ext = data['ext']
+    assert 'processes' not in ext
+    assert len(ext['cpu_per_core']) >= 1
+    assert ext['top_processes']['rss']
+    assert set(ext['collector_cost_ms']) >= {'processes', 'top_processes', 'disk_usage'}
+
+
+def test_send_metrics_binary(monkeypatch):
+    import wire
+
+    monitor = SystemMonitor(collectors=[], binary=True)
+    sent = []
+
+    def fake_post(url, data, headers, timeout):
+        sent.append((data, headers))
+        return FakeResponse(200)
+
+    monkeypatch.setattr(monitor.transport.session, 'post', fake_post)
+    monitor.transport.compress = False
+    assert monitor.send_metrics('http://server') is True
+    monitor.sampler.stop()
+
+    data, headers = sent[0]
+    assert headers['Content-Type'] == wire.CONTENT_TYPE
+    [sample] = wire.decode(data)
+    assert sample['hostname'] and sample['timestamp']
+
+
+def test_telemetry_summary_attached_periodically(monkeypatch):
+    monitor = SystemMonitor(collectors=[CountingCollector(0)], telemetry_interval=60)
+    sent = []
+    status = {'code': 503}
+
+    def fake_post(url, data, headers, timeout):
+        sent.append(json.loads(data))
+        return FakeResponse(status['code'])
+
+    monkeypatch.setattr(monitor.transport.session, 'post', fake_post)
+    monitor.transport.compress = False
+    monitor.transport.backoff_base = 0
+
+    assert monitor.send_metrics('http://server') is False
+    status['code'] = 200
+    assert monitor.send_metrics('http://server') is True
+    assert all('telemetry' not in sample['ext'] for sample in sent)
+
+    monitor.telemetry.last_report -= 60
+    assert monitor.send_metrics('http://server') is True
+    monitor.sampler.stop()
+
+    summary = sent[-1]['ext']['telemetry']
+    assert summary['sends'] == 2 and summary['failures'] == 1
+    assert summary['collect_ms']['p99'] >= summary['collect_ms']['p50'] > 0
+    assert summary['send_ms']['max'] >= 0
+    assert set(summary['collectors_p99_ms']) == {'counting'}
+    assert summary['cpu_percent'] >= 0 and summary['rss_mb'] > 0
+    # счётчики начали новый период: в нём только отправка самой сводки
+    assert monitor.telemetry.counters['sends'] == 1
+
+
+def test_rolling_histogram_keeps_last_values():
+    histogram = agent.RollingHistogram(window=100)
+    assert histogram.summary() is None
+    for value in range(1000):
+        histogram.observe(value)
+    assert histogram.summary() == {'p50': 950, 'p99': 998, 'max': 999}
+
+
+def test_replay_halves_oversized_batches_and_drops_rejected(monkeypatch, tmp_path):
+    spool = agent.Spool(str(tmp_path))
+    for i in range(8):
+        spool.append({'hostname': 'REPLAY', 'cpu': float(i), 'timestamp': i, 'bad': i == 4})
+    monitor = SystemMonitor(spool=spool, replay_batch=8, replay_rate=1000, replay_jitter=0)
+    monitor.sampler.stop()
+    monitor.transport.compress = False
+    batches = []
+
+    def fake_post(url, data, headers, timeout):
+        batch = json.loads(data)
+        if len(batch) > 2:
+            return FakeResponse(413)
+        if any(sample['bad'] for sample in batch):
+            return FakeResponse(400)
+        batches.append(batch)
+        return FakeResponse(200)
+
+    monkeypatch.setattr(monitor.transport.session, 'post', fake_post)
+    # пачка из 8 уменьшается до 2; пачка с образцом, который сервер не
+    # принимает, отбрасывается, и досылка идёт дальше
+    assert monitor.replay_spool('http://server') == 6
+    assert [[sample['cpu'] for sample in batch] for batch in batches] == [[0.0, 1.0], [2.0, 3.0], [6.0, 7.0]]
+    assert spool.stats['dropped'] == 2
+    assert spool.read_batch(10)[0] == []
+
+    # ошибка сервера оставляет образцы в буфере
+    spool.append({'hostname': 'REPLAY', 'cpu': 8.0, 'timestamp': 8, 'bad': False})
+    monkeypatch.setattr(monitor.transport.session, 'post', lambda *args, **kwargs: FakeResponse(503))
+    assert monitor.replay_spool('http://server') == 0
+    assert len(spool.read_batch(10)[0]) == 1
@@ -0,0 +1,154 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.alerts import AlertEngine
+from app.models import AlertEvent, AlertPending, AlertRule, Computer
+
+
+def post(client, hostname, ts, **values):
+    resp = client.post('/api/metrics', json=dict(values, hostname=hostname, timestamp=ts))
+    assert resp.status_code == 200
+
+
+def events(app, hostname):
+    with app.app_context():
+        return (AlertEvent.query.join(Computer).filter(Computer.hostname == hostname)
+                .order_by(AlertEvent.id).all())
+
+
+def test_default_rules_are_seeded(app):
+    with app.app_context():
+        rules = {rule.metric: rule.threshold for rule in AlertRule.query.filter_by(computer_id=None)}
+    assert rules == {'cpu': 85, 'ram': 80, 'disk': 90}
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_sustain_and_hysteresis(client, app):
+    client.post('/alerts-settings', data={'cpu_threshold': 90, 'ram_threshold': 80,
+                                          'disk_threshold': 90, 'hysteresis': 10,
+                                          'sustain_seconds': 20})
+    t0 = 1700000000
+    post(client, 'ALERT-PC', t0, cpu=95.0)
+    post(client, 'ALERT-PC', t0 + 10, cpu=96.0)
+    assert events(app, 'ALERT-PC') == []
+
+    # превышение прервалось — отсчёт длительности начинается заново
+    post(client, 'ALERT-PC', t0 + 15, cpu=50.0)
+    post(client, 'ALERT-PC', t0 + 20, cpu=95.0)
+    post(client, 'ALERT-PC', t0 + 40, cpu=97.0)
+    [event] = events(app, 'ALERT-PC')
+    assert event.metric == 'cpu' and event.closed_at is None
+    assert event.opened_at == datetime.utcfromtimestamp(t0 + 20)
+
+    # внутри полосы гистерезиса оповещение остаётся открытым
+    post(client, 'ALERT-PC', t0 + 45, cpu=85.0)
+    assert events(app, 'ALERT-PC')[0].closed_at is None
+    post(client, 'ALERT-PC', t0 + 50, cpu=70.0)
+    assert events(app, 'ALERT-PC')[0].closed_at == datetime.utcfromtimestamp(t0 + 50)
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_host_rule_overrides_global_rule(client, app):
+    post(client, 'QUIET-PC', 1700000000, ram=10.0)
+    with app.app_context():
+        comp_id = Computer.query.filter_by(hostname='QUIET-PC').one().id
+
+    for bad in ('1', 1.5, True, [comp_id]):
+        resp = client.post('/api/alerts/rules', json={'computer_id': bad, 'metric': 'ram', 'threshold': 99})
+        assert resp.status_code == 400
+        assert resp.get_json()['error'] == 'invalid computer_id'
+    resp = client.post('/api/alerts/rules', json={'computer_id': comp_id, 'metric': 'ram', 'threshold': 99})
+    assert resp.status_code == 201
+    post(client, 'QUIET-PC', 1700000005, ram=90.0)
+    post(client, 'OTHER-PC', 1700000005, ram=90.0)
+
+    assert events(app, 'QUIET-PC') == []
+    assert [event.metric for event in events(app, 'OTHER-PC')] == ['ram']
+
+    resp = client.post('/api/alerts/rules', json={'metric': 'swap', 'threshold': 1})
+    assert resp.status_code == 400
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_dashboard_reads_open_events(client, app):
+    post(client, 'HOT-PC', 1700000000, cpu=99.0, disk=95.0)
+    post(client, 'COOL-PC', 1700000000, cpu=5.0)
+
+    resp = client.get('/dashboard')
+    assert 'Диск: 95% заполнен; Высокая загрузка CPU: 99%' in resp.get_data(as_text=True)
+    assert b'COOL-PC' not in resp.data
+
+    alerts = client.get('/api/alerts').get_json()
+    assert {(alert['hostname'], alert['metric']) for alert in alerts} == {('HOT-PC', 'cpu'), ('HOT-PC', 'disk')}
+
+
+def test_engine_restores_open_alerts_after_restart(client, app):
+    post(client, 'RESTART-PC', 1700000000, cpu=99.0)
+    app.extensions['alerts'] = AlertEngine()
+
+    post(client, 'RESTART-PC', 1700000005, cpu=99.0)
+    assert len(events(app, 'RESTART-PC')) == 1
+    post(client, 'RESTART-PC', 1700000010, cpu=1.0)
+    assert events(app, 'RESTART-PC')[0].closed_at is not None
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_engines_in_separate_processes_share_state(client, app):
+    # два движка — как в двух процессах сервера с общей базой
+    first, second = AlertEngine(), AlertEngine()
+
+    def post_via(engine, ts, cpu):
+        app.extensions['alerts'] = engine
+        post(client, 'SHARED-PC', ts, cpu=cpu)
+
+    t0 = 1700000000
+    post_via(first, t0, 10.0)
+    post_via(second, t0, 10.0)
+    # правило меняет запрос, который обслужил первый процесс
+    app.extensions['alerts'] = first
+    client.post('/alerts-settings', data={'cpu_threshold': 50, 'ram_threshold': 80, 'disk_threshold': 90,
+                                          'hysteresis': 5, 'sustain_seconds': 20})
+
+    # превышение начинается в одном процессе, а продолжается в другом
+    post_via(second, t0 + 10, 60.0)
+    post_via(first, t0 + 20, 60.0)
+    assert events(app, 'SHARED-PC') == []
+    post_via(second, t0 + 30, 60.0)
+    [event] = events(app, 'SHARED-PC')
+    assert event.opened_at == datetime.utcfromtimestamp(t0 + 10) and event.threshold == 50
+
+    # второй процесс не видит открытого оповещения в памяти, но база не даёт открыть ещё одно
+    with app.app_context():
+        comp_id = Computer.query.filter_by(hostname='SHARED-PC').one().id
+        rule = next(rule for rule in first.rules_for(comp_id) if rule.metric == 'cpu')
+        first._check(rule, comp_id, 70.0, datetime.utcfromtimestamp(t0 + 40), set(), {})
+        db.session.commit()
+    assert len(events(app, 'SHARED-PC')) == 1
+
+    post_via(first, t0 + 50, 10.0)
+    assert events(app, 'SHARED-PC')[0].closed_at == datetime.utcfromtimestamp(t0 + 50)
+    with app.app_context():
+        assert AlertPending.query.count() == 0
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_replayed_samples_do_not_close_alerts(client, app):
+    t0 = 1700000000
+    post(client, 'REPLAY-PC', t0 + 60, cpu=99.0)
+    [event] = events(app, 'REPLAY-PC')
+    assert event.closed_at is None
+
+    # агент досылает из спула измерения, снятые до открытия оповещения
+    resp = client.post('/api/metrics/batch', json=[
+        {'hostname': 'REPLAY-PC', 'cpu': 10.0, 'timestamp': t0},
+        {'hostname': 'REPLAY-PC', 'cpu': 20.0, 'timestamp': t0 + 30},
+    ])
+    assert resp.status_code == 200
+    [event] = events(app, 'REPLAY-PC')
+    assert event.closed_at is None
+
+    post(client, 'REPLAY-PC', t0 + 90, cpu=10.0)
+    [event] = events(app, 'REPLAY-PC')
+    assert event.closed_at == datetime.utcfromtimestamp(t0 + 90) >= event.opened_at
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.analytics import RollupWindow, get_windows, percentiles, top_indices
+from app.models import Computer
+
+NOW = datetime.utcnow().replace(second=0, microsecond=0)
+
+
+def post(client, samples):
+    for first in range(0, len(samples), 5000):
+        assert client.post('/api/metrics/batch', json=samples[first:first + 5000]).status_code == 200
+
+
+def sample(hostname, minutes_ago, cpu, ram=50.0, disk=40.0):
+    return {'hostname': hostname, 'cpu': cpu, 'ram': ram, 'disk': disk, 'processes': 100,
+            'timestamp': (NOW - timedelta(minutes=minutes_ago, seconds=-30)).isoformat()}
+
+
+def test_vector_helpers():
+    assert top_indices(np.array([1.0, 5.0, 3.0, 4.0]), 2).tolist() == [1, 3]
+    assert top_indices(np.array([1.0, 2.0]), 5).tolist() == [1, 0]
+    assert percentiles(np.array([np.nan, 10.0, 20.0, 30.0]), (50,)) == {'p50': 20.0}
+    assert percentiles(np.array([np.nan])) == {'p50': None, 'p95': None, 'p99': None}
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_fleet_percentiles_and_ram_growth(client):
+    samples = []
+    for number in range(10):
+        for minutes_ago in range(60, -1, -5):
+            # у компьютера N память растёт на N % за час
+            samples.append(sample(f'FLEET-{number}', minutes_ago, cpu=float(number * 10),
+                                  ram=30.0 + number * (60 - minutes_ago) / 60))
+    samples.append(sample('STALE-PC', 30, cpu=100.0, ram=99.0))
+    post(client, samples)
+
+    fleet = client.get('/api/analytics/fleet').get_json()
+    assert fleet['hosts'] == 10
+    expected = np.percentile(np.arange(10) * 10.0, [50, 95, 99])
+    assert [fleet['cpu'][key] for key in ('p50', 'p95', 'p99')] == pytest.approx(expected.tolist())
+    assert fleet['ram']['p50'] == pytest.approx(34.5)
+
+    result = client.get('/api/analytics/growth', query_string={'limit': 3}).get_json()
+    assert result['metric'] == 'ram' and result['window'] == 3600
+    assert [item['hostname'] for item in result['items']] == ['FLEET-9', 'FLEET-8', 'FLEET-7']
+    # память растёт линейно: наклон тренда — 9 % за 60 минут
+    assert result['items'][0]['growth'] == pytest.approx(9.0, abs=0.01)
+    assert result['items'][0]['points'] >= 10
+
+    assert client.get('/api/analytics/growth', query_string={'metric': 'gpu'}).status_code == 400
+    assert client.get('/api/analytics/anomalies', query_string={'sigma': 0}).status_code == 400
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_anomalies_with_incremental_baseline(client, app):
+    samples = []
+    for minutes_ago in range(180, 0, -1):
+        for number in range(4):
+            samples.append(sample(f'BASE-{number}', minutes_ago, cpu=20.0 + number + (minutes_ago % 5)))
+    # последнее измерение: BASE-0 резко загружен, BASE-1 — в пределах обычного
+    samples += [sample('BASE-0', 0, cpu=95.0), sample('BASE-1', 0, cpu=24.0)]
+    post(client, samples)
+
+    result = client.get('/api/analytics/anomalies').get_json()
+    assert [item['hostname'] for item in result['items']] == ['BASE-0']
+    item = result['items'][0]
+    assert item['baseline_mean'] == pytest.approx(22.0, abs=0.1)
+    assert item['baseline_std'] == pytest.approx(1.41, abs=0.05)
+    assert item['z'] > 3
+
+    baselines = get_windows().get('cpu', app.config['ANALYTICS_BASELINE'])
+    assert baselines.stats == {'rebuilds': 1, 'updates': 0}
+    baselines.update(NOW + timedelta(minutes=3))
+    baselines.update(NOW + timedelta(minutes=3))
+    assert baselines.stats == {'rebuilds': 1, 'updates': 1}
+
+    # инкрементальное окно совпадает с окном, построенным заново
+    fresh = RollupWindow('cpu', window=timedelta(hours=1))
+    fresh.update(NOW + timedelta(minutes=3))
+    short = RollupWindow('cpu', window=timedelta(hours=1))
+    short.update(NOW - timedelta(minutes=30))
+    short.update(NOW + timedelta(minutes=3))
+    assert short.stats == {'rebuilds': 1, 'updates': 1}
+    ids = np.array([comp.id for comp in Computer.query.order_by(Computer.hostname)] + [999])
+    expected, actual = fresh.lookup(ids), short.lookup(ids)
+    for key in ('count', 'mean', 'std', 'slope'):
+        np.testing.assert_allclose(actual[key], expected[key], atol=1e-9)
+    # окно — 60 минут до NOW + 1 мин; минута NOW есть только у BASE-0 и BASE-1
+    assert actual['count'].tolist() == [60, 60, 59, 59, 0]
+
+
+def test_window_subtracts_what_it_added(client, app):
+    post(client, [sample('LATE-PC', minutes_ago, cpu=80.0) for minutes_ago in (*range(120, 90, -1), *range(60, 30, -1))])
+    window = RollupWindow('cpu', window=timedelta(hours=2))
+    window.update(NOW)
+    comp_id = Computer.query.filter_by(hostname='LATE-PC').one().id
+    assert window.lookup(np.array([comp_id]))['count'].tolist() == [60]
+
+    # пропуск досылается из очереди агента уже после того, как попал в окно
+    post(client, [sample('LATE-PC', minutes_ago, cpu=20.0) for minutes_ago in range(90, 60, -1)])
+    window.update(NOW + timedelta(minutes=45))
+    assert window.stats == {'rebuilds': 1, 'updates': 1}
+    # из окна вышли только блоки с добавленными значениями 80: вычтены ровно они
+    count, v = window.sums[:2, comp_id]
+    stats = window.lookup(np.array([comp_id]))
+    assert 0 < count <= 60 and v == 80.0 * count
+    assert stats['mean'][0] == 80.0 and stats['std'][0] == 0
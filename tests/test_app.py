@@ -1,23 +1,8 @@
+from datetime import datetime, timedelta
+
 import pytest
 from app import create_app, db
-from app.models import Computer, Metric
-
-@pytest.fixture
-def app():
-    app = create_app()
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-
-    with app.app_context():
-        db.create_all()
-        yield app
-        db.session.remove()
-        db.drop_all()
-
-
-@pytest.fixture
-def client(app):
-    return app.test_client()
+from app.models import Computer, Metric, ComputerState
 
 def test_api_metrics_requires_hostname(client, app):
     data = {
@@ -50,4 +35,401 @@ def test_api_metrics_creates_computer_and_metric(client, app):
         assert metric.cpu_percent == data['cpu']
         assert metric.memory_usage == data['ram']
         assert metric.disk_usage == data['disk']
-        assert metric.processes == data['processes']
\ No newline at end of file
+        assert metric.processes == data['processes']
+
+def test_api_metrics_updates_computer_state(client, app):
+    for cpu in (10.0, 30.0):
+        data = {'hostname': 'STATE-PC', 'cpu': cpu, 'ram': 40.0, 'disk': 50.0, 'processes': 7}
+        assert client.post('/api/metrics', json=data).status_code == 200
+
+    with app.app_context():
+        comp = Computer.query.filter_by(hostname='STATE-PC').first()
+        assert len(comp.metrics) == 2
+        assert comp.state.cpu_percent == 30.0
+        assert comp.state.timestamp == comp.metrics[-1].timestamp
+
+
+def test_computer_state_backfill(app):
+    with app.app_context():
+        comp = Computer(hostname='OLD-PC')
+        db.session.add(comp)
+        db.session.flush()
+        db.session.add(Metric(computer_id=comp.id, cpu_percent=5.0, processes=1))
+        db.session.add(Metric(computer_id=comp.id, cpu_percent=15.0, processes=2))
+        db.session.commit()
+
+        ComputerState.backfill()
+
+        state = db.session.get(ComputerState, comp.id)
+        assert state.cpu_percent == 15.0
+        assert state.processes == 2
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_computers_page_uses_state(client, app):
+    client.post('/api/metrics', json={'hostname': 'PAGE-PC', 'cpu': 12.5, 'ram': 1.0, 'disk': 2.0, 'processes': 3})
+
+    resp = client.get('/computers')
+    assert resp.status_code == 200
+    assert b'PAGE-PC' in resp.data
+    assert b'12.5%' in resp.data
+
+    resp = client.get('/dashboard')
+    assert resp.status_code == 200
+
+
+def test_api_metrics_batch_json_array(client, app):
+    batch = [
+        {'hostname': 'BATCH-1', 'cpu': 1.0, 'ram': 2.0, 'disk': 3.0, 'processes': 4,
+         'timestamp': '2024-01-01T00:00:05Z'},
+        {'hostname': 'BATCH-1', 'cpu': 9.0, 'ram': 2.0, 'disk': 3.0, 'processes': 4,
+         'timestamp': '2024-01-01T00:00:00Z'},
+        {'cpu': 1.0},
+        {'hostname': 'BATCH-2', 'cpu': 'high'},
+        {'hostname': 'BATCH-2', 'cpu': 5.0, 'ram': 6.0, 'disk': 7.0, 'processes': 8},
+    ]
+    resp = client.post('/api/metrics/batch', json=batch)
+    assert resp.status_code == 200
+
+    body = resp.get_json()
+    assert body['accepted'] == 3
+    assert body['rejected'] == 2
+    assert [r['status'] for r in body['results']] == ['ok', 'ok', 'error', 'error', 'ok']
+    assert body['results'][2]['error'] == 'hostname required'
+    assert body['results'][3]['error'] == 'invalid cpu'
+
+    with app.app_context():
+        comp = Computer.query.filter_by(hostname='BATCH-1').first()
+        assert len(comp.metrics) == 2
+        # состояние берётся из самого свежего образца, а не из последнего в пакете
+        assert comp.state.cpu_percent == 1.0
+        assert Computer.query.count() == 2
+
+
+def test_api_metrics_rejects_future_timestamps(client, app):
+    soon = (datetime.utcnow() + timedelta(minutes=1)).isoformat()
+    batch = [
+        {'hostname': 'CLOCK-PC', 'cpu': 1.0, 'timestamp': '2099-01-01T00:00:00Z'},
+        {'hostname': 'CLOCK-PC', 'cpu': 2.0, 'timestamp': soon},
+    ]
+    resp = client.post('/api/metrics/batch', json=batch)
+    assert [r['status'] for r in resp.get_json()['results']] == ['error', 'ok']
+    assert resp.get_json()['results'][0]['error'] == 'timestamp in the future'
+    resp = client.post('/api/metrics', json={'hostname': 'CLOCK-PC', 'cpu': 3.0, 'timestamp': 4102444800})
+    assert resp.status_code == 400
+
+    # более позднее измерение с верными часами по-прежнему обновляет состояние
+    assert client.post('/api/metrics', json={'hostname': 'CLOCK-PC', 'cpu': 4.0,
+                                             'timestamp': soon}).status_code == 200
+    with app.app_context():
+        assert Computer.query.filter_by(hostname='CLOCK-PC').one().state.cpu_percent == 4.0
+
+
+def test_api_metrics_rejects_non_finite_values(client, app):
+    for body in (b'{"hostname": "NAN-PC", "cpu": NaN}', b'{"hostname": "NAN-PC", "ram": Infinity}',
+                 b'{"hostname": "NAN-PC", "disk": -Infinity}'):
+        resp = client.post('/api/metrics', data=body, content_type='application/json')
+        assert resp.status_code == 400
+
+    body = b'[{"hostname": "NAN-PC", "cpu": NaN}, {"hostname": "NAN-PC", "cpu": 5.0}]'
+    resp = client.post('/api/metrics/batch', data=body, content_type='application/json')
+    assert [r['status'] for r in resp.get_json()['results']] == ['error', 'ok']
+    assert resp.get_json()['results'][0]['error'] == 'invalid cpu'
+
+    with app.app_context():
+        assert [m.cpu_percent for m in Metric.query.all()] == [5.0]
+
+
+def test_api_metrics_batch_ndjson(client, app):
+    body = b'{"hostname": "ND-1", "cpu": 1.0}\nnot json\n\n{"hostname": "ND-2", "cpu": 2.0}\n'
+    resp = client.post('/api/metrics/batch', data=body, content_type='application/x-ndjson')
+    assert resp.status_code == 200
+
+    body = resp.get_json()
+    assert body['accepted'] == 2
+    assert body['results'][1] == {'index': 1, 'status': 'error', 'error': 'invalid json'}
+
+    with app.app_context():
+        assert Metric.query.count() == 2
+
+
+def test_api_metrics_batch_rejects_non_array(client):
+    resp = client.post('/api/metrics/batch', json={'hostname': 'X'})
+    assert resp.status_code == 400
+
+
+def test_concurrent_first_samples_from_new_host(tmp_path):
+    import threading
+    from sqlalchemy import event
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "race.db"}', 'RETENTION_ENABLED': False})
+    # оба запроса сначала не находят компьютер и только потом создают его
+    barrier = threading.Barrier(2, timeout=5)
+    local = threading.local()
+
+    def after_lookup(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT') and 'FROM computer' in statement and not getattr(local, 'waited', False):
+            local.waited = True
+            barrier.wait()
+
+    statuses = []
+
+    def send(cpu):
+        resp = app.test_client().post('/api/metrics', json={'hostname': 'RACE-PC', 'cpu': cpu})
+        statuses.append(resp.status_code)
+
+    with app.app_context():
+        event.listen(db.engine, 'after_cursor_execute', after_lookup)
+        threads = [threading.Thread(target=send, args=(float(cpu),)) for cpu in (1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        event.remove(db.engine, 'after_cursor_execute', after_lookup)
+
+        assert statuses == [200, 200]
+        comp = Computer.query.filter_by(hostname='RACE-PC').one()
+        assert sorted(m.cpu_percent for m in comp.metrics) == [1.0, 2.0]
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_buffered_ingest_drains_on_stop():
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'INGEST_MODE': 'buffered',
+        'INGEST_FLUSH_INTERVAL': 60,
+    })
+    buffer = app.extensions['ingest_buffer']
+    client = app.test_client()
+
+    for i in range(3):
+        resp = client.post('/api/metrics', json={'hostname': 'BUF-PC', 'cpu': float(i)})
+        assert resp.status_code == 200
+        assert resp.get_json()['status'] == 'queued'
+
+    stats = client.get('/api/ingest/stats').get_json()
+    assert stats['mode'] == 'buffered'
+    assert stats['queued'] == 3
+
+    buffer.stop()
+
+    with app.app_context():
+        assert Metric.query.count() == 3
+        assert Computer.query.filter_by(hostname='BUF-PC').first().state.cpu_percent == 2.0
+    assert buffer.snapshot()['flushed'] == 3
+    assert buffer.snapshot()['depth'] == 0
+
+
+def test_ingest_buffer_overflow_policies(app):
+    from app.ingest import IngestBuffer, BufferFull, validate_sample
+
+    samples = [validate_sample({'hostname': 'OVF', 'cpu': float(i)}) for i in range(5)]
+
+    buffer = IngestBuffer(app, max_rows=3, overflow='drop_oldest')
+    buffer.put(samples[:2])
+    buffer.put(samples[2:])
+    assert [s['cpu_percent'] for s in buffer.queue] == [2.0, 3.0, 4.0]
+    assert buffer.snapshot()['dropped'] == 2
+
+    buffer = IngestBuffer(app, max_rows=3, overflow='reject')
+    buffer.put(samples[:3])
+    with pytest.raises(BufferFull):
+        buffer.put(samples[3:])
+    assert buffer.snapshot()['depth'] == 3
+
+
+def test_storage_pragmas_and_indexes(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "wal.db"}', 'RETENTION_ENABLED': False})
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1  # NORMAL
+            indexes = {row[1] for row in conn.exec_driver_sql('PRAGMA index_list(metric)')}
+        assert 'ix_metric_computer_timestamp' in indexes
+
+        from app.storage import current_version, SCHEMA_VERSION
+        assert current_version() == SCHEMA_VERSION
+        db.engine.dispose()
+
+
+def test_storage_migrates_existing_database(tmp_path):
+    import sqlite3
+
+    path = tmp_path / 'old.db'
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE computer (id INTEGER PRIMARY KEY, hostname VARCHAR(128) NOT NULL UNIQUE,
+                               created_at DATETIME);
+        CREATE TABLE metric (id INTEGER PRIMARY KEY, computer_id INTEGER NOT NULL REFERENCES computer(id),
+                             cpu_percent FLOAT, memory_usage FLOAT, disk_usage FLOAT,
+                             processes INTEGER, timestamp DATETIME);
+        INSERT INTO computer (id, hostname) VALUES (1, 'LEGACY-PC');
+        INSERT INTO metric (computer_id, cpu_percent, processes, timestamp)
+            VALUES (1, 11.0, 5, '2024-01-01 00:00:00.000000'),
+                   (1, 22.0, 6, '2024-01-01 00:00:05.000000');
+    ''')
+    conn.close()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'RETENTION_ENABLED': False})
+    with app.app_context():
+        from app.storage import current_version, SCHEMA_VERSION
+        assert current_version() == SCHEMA_VERSION
+        assert Computer.query.first().state.cpu_percent == 22.0
+        assert Metric.query.first().extra is None
+
+        from app.models import MetricRollup
+        minute = MetricRollup.query.filter_by(resolution=60).one()
+        assert (minute.cpu_min, minute.cpu_max, minute.cpu_count) == (11.0, 22.0, 2)
+        assert minute.bucket.isoformat() == '2024-01-01T00:00:00'
+        db.engine.dispose()
+
+    conn = sqlite3.connect(path)
+    indexes = {row[1] for row in conn.execute('PRAGMA index_list(metric)')}
+    conn.close()
+    assert 'ix_metric_computer_timestamp' in indexes
+
+
+def test_api_metrics_accepts_gzip_body(client, app):
+    import gzip
+    import io
+    import json
+
+    body = gzip.compress(json.dumps([{'hostname': 'GZ-PC', 'cpu': 1.0}] * 3).encode())
+    resp = client.post('/api/metrics/batch', data=body,
+                       headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    assert resp.status_code == 200
+    assert resp.get_json()['accepted'] == 3
+
+    resp = client.post('/api/metrics', data=b'not gzip',
+                       headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    assert resp.status_code == 400
+
+    app.config['INGEST_MAX_BODY_BYTES'] = 100
+    resp = client.post('/api/metrics/batch', data=body,
+                       headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    assert resp.status_code == 413
+
+    # несжатое тело ограничено тем же пределом
+    plain = json.dumps([{'hostname': 'GZ-PC', 'cpu': 1.0}] * 3).encode()
+    resp = client.post('/api/metrics/batch', data=plain, content_type='application/json')
+    assert resp.status_code == 413
+    # тело без Content-Length
+    resp = client.post('/api/metrics/batch', input_stream=io.BytesIO(plain), content_type='application/json',
+                       headers={'Transfer-Encoding': 'chunked'}, environ_overrides={'wsgi.input_terminated': True})
+    assert resp.status_code == 413
+    resp = client.post('/api/metrics', data=b'{"hostname": "GZ-PC", "cpu": 1.0}', content_type='application/json')
+    assert resp.status_code == 200
+
+
+def test_api_metrics_stores_extended_payload(client, app):
+    ext = {'load_avg': [0.5, 0.4, 0.3], 'net_io': {'bytes_recv': 1024.0},
+           'disk_usage': {'/': 40.0, '/home': 70.5}}
+    resp = client.post('/api/metrics', json={'hostname': 'EXT-PC', 'cpu': 1.0, 'ext': ext})
+    assert resp.status_code == 200
+    resp = client.post('/api/metrics', json={'hostname': 'EXT-PC', 'cpu': 2.0})
+    assert resp.status_code == 200
+
+    with app.app_context():
+        metrics = Computer.query.filter_by(hostname='EXT-PC').one().metrics
+        assert sorted(metrics, key=lambda m: m.id)[0].extra == ext
+        assert sorted(metrics, key=lambda m: m.id)[1].extra is None
+
+    resp = client.post('/api/metrics', json={'hostname': 'EXT-PC', 'ext': [1, 2]})
+    assert resp.status_code == 400
+    assert b'invalid ext' in resp.data
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_agent_telemetry_stored_per_host(client, app):
+    def post(ts, cpu_percent):
+        resp = client.post('/api/metrics', json={
+            'hostname': 'TELEMETRY-PC', 'cpu': 5.0, 'timestamp': ts,
+            'ext': {'load_avg': [0.1, 0.2, 0.3], 'telemetry': {
+                'cpu_percent': cpu_percent, 'collect_ms': {'p50': 1.0, 'p99': 4.5, 'max': 9.0},
+                'send_ms': {'p50': 20.0, 'p99': 80.0, 'max': 95.0}, 'failures': 2, 'spool_bytes': 512,
+            }},
+        })
+        assert resp.status_code == 200
+
+    post(1700000600, 1.5)
+    # досланная из буфера более старая сводка не заменяет новую
+    post(1700000000, 9.0)
+    client.post('/api/metrics', json={'hostname': 'OTHER-PC', 'cpu': 5.0,
+                                      'ext': {'telemetry': {'cpu_percent': 0.2}}})
+
+    with app.app_context():
+        metric = Metric.query.order_by(Metric.id).first()
+        assert metric.extra == {'load_avg': [0.1, 0.2, 0.3]}
+
+    rows = client.get('/api/agents/telemetry').get_json()
+    assert [row['hostname'] for row in rows] == ['TELEMETRY-PC', 'OTHER-PC']
+    assert rows[0]['cpu_percent'] == 1.5
+    assert rows[0]['collect_ms_p99'] == 4.5 and rows[0]['send_ms_p99'] == 80.0
+    assert rows[0]['failures'] == 2 and rows[0]['spool_bytes'] == 512
+    assert rows[0]['reported_at'] == '2023-11-14T22:23:20'
+    assert rows[1]['collect_ms_p99'] is None
+
+    assert client.get('/api/agents/telemetry?sort=hostname').status_code == 400
+    assert client.post('/api/metrics', json={'hostname': 'BAD-PC', 'ext': {'telemetry': 1}}).status_code == 400
+
+
+def test_config_from_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv('SYSMON_INGEST_FLUSH_ROWS', '7')
+    monkeypatch.setenv('SYSMON_INGEST_OVERFLOW', 'reject')
+    monkeypatch.setenv('SYSMON_SQLITE_PRAGMAS__cache_size', '-2000')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "env.db"}',
+                      'RETENTION_ENABLED': False, 'DB_POOL_SIZE': 3})
+
+    assert app.config['INGEST_FLUSH_ROWS'] == 7
+    assert app.config['INGEST_OVERFLOW'] == 'reject'
+    assert app.config['SQLITE_PRAGMAS']['cache_size'] == -2000
+    assert app.config['SQLITE_PRAGMAS']['journal_mode'] == 'WAL'
+    with app.app_context():
+        assert db.engine.pool.size() == 3
+        db.engine.dispose()
+
+
+def test_engine_options_sqlite_only():
+    from app.storage import UnsupportedDatabase, engine_options
+
+    config = {'DB_POOL_SIZE': 8, 'DB_POOL_TIMEOUT': 30}
+    assert engine_options(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///:memory:')) == {}
+    assert engine_options(dict(config, SQLALCHEMY_DATABASE_URI='sqlite:///x.db'))['max_overflow'] == 0
+    with pytest.raises(UnsupportedDatabase, match='only SQLite'):
+        create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql://db/sysmon', 'RETENTION_ENABLED': False})
+
+
+def test_serve_workers_for_columnar_store(monkeypatch):
+    import serve
+
+    assert serve.resolve_workers(None, 'sql') == 1
+    assert serve.resolve_workers(3, 'sql') == 3
+    assert serve.resolve_workers(None, 'columnar') == 1
+    with pytest.raises(ValueError, match='--workers 1'):
+        serve.resolve_workers(4, 'columnar')
+
+    monkeypatch.setenv('SYSMON_METRIC_STORE', '"columnar"')
+    assert serve.metric_store() == 'columnar'
+    monkeypatch.setenv('SYSMON_WORKERS', '2')
+    monkeypatch.setattr('sys.argv', ['serve.py'])
+    with pytest.raises(SystemExit):
+        serve.main()
+
+
+def test_schema_check_only_startup(tmp_path):
+    from app.storage import SchemaMismatch
+
+    uri = f'sqlite:///{tmp_path / "prod.db"}'
+    with pytest.raises(SchemaMismatch, match='schema version is 0'):
+        create_app({'SQLALCHEMY_DATABASE_URI': uri, 'SCHEMA_AUTO_MIGRATE': False})
+
+    create_app({'SQLALCHEMY_DATABASE_URI': uri, 'RETENTION_ENABLED': False})
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'SCHEMA_AUTO_MIGRATE': False,
+                      'RETENTION_ENABLED': False})
+    # после миграции процесс с проверкой схемы запускается и принимает метрики
+    with app.app_context():
+        assert app.test_client().post('/api/metrics', json={'hostname': 'PROD', 'cpu': 1.0}).status_code == 200
+        db.engine.dispose()
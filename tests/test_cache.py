@@ -0,0 +1,83 @@
+import pytest
+
+import app.cache as cache_module
+from app.cache import ViewCache
+from app.models import Computer
+
+
+def post(client, hostname, cpu):
+    assert client.post('/api/metrics', json={'hostname': hostname, 'cpu': cpu}).status_code == 200
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_repeat_view_served_from_cache_until_ingest(client, app):
+    post(client, 'CACHE-PC', 11.0)
+    cache = app.extensions['view_cache']
+
+    first = client.get('/computers')
+    second = client.get('/computers')
+    assert first.data == second.data
+    assert cache.stats['hits'] == 1
+    assert first.headers['ETag'] == second.headers['ETag']
+
+    post(client, 'CACHE-PC', 77.0)
+    third = client.get('/computers')
+    assert b'77.0%' in third.data
+    assert third.headers['ETag'] != first.headers['ETag']
+    assert cache.stats['hits'] == 1
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_if_none_match_returns_304(client):
+    post(client, 'ETAG-PC', 5.0)
+    etag = client.get('/dashboard').headers['ETag']
+
+    resp = client.get('/dashboard', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.data == b''
+
+    post(client, 'ETAG-PC', 6.0)
+    assert client.get('/dashboard', headers={'If-None-Match': etag}).status_code == 200
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_host_page_invalidated_by_own_host_only(client, app):
+    post(client, 'HOST-A', 1.0)
+    post(client, 'HOST-B', 1.0)
+    cache = app.extensions['view_cache']
+    with app.app_context():
+        comp_id = Computer.query.filter_by(hostname='HOST-A').one().id
+
+    client.get(f'/computer/{comp_id}')
+    post(client, 'HOST-B', 2.0)
+    client.get(f'/computer/{comp_id}')
+    assert cache.stats == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+    post(client, 'HOST-A', 2.0)
+    client.get(f'/computer/{comp_id}')
+    assert cache.stats['misses'] == 2
+    # изменение правил сбрасывает и страницы компьютеров
+    client.post('/api/alerts/rules', json={'metric': 'ram', 'threshold': 95})
+    client.get(f'/computer/{comp_id}')
+    client.get(f'/computer/{comp_id}')
+    assert cache.stats['misses'] == 3 and cache.stats['hits'] == 2
+
+    # несуществующий компьютер не кэшируется
+    assert client.get('/computer/9999').status_code == 404
+    assert client.get('/computer/9999').status_code == 404
+    assert ('main.computer_detail', b'', 9999) not in cache.entries
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = ViewCache(max_entries=2, ttl=10)
+    for key in 'abc':
+        cache.put(key, 0, key.encode(), 'text/html')
+    assert list(cache.entries) == ['b', 'c']
+    assert cache.stats['evictions'] == 1
+
+    assert cache.get('b', 0).body == b'b'
+    assert cache.get('b', 1) is None
+
+    now = cache_module.time.monotonic()
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now + 11)
+    assert cache.get('c', 0) is None
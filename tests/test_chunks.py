@@ -0,0 +1,90 @@
+import math
+import os
+import random
+from array import array
+from datetime import datetime, timedelta
+
+from app.chunks import decode_chunk, encode_chunk
+from app.columnar import ColumnarMetricStore, SealedSegment
+
+T0 = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(hours=1)
+
+
+def row(seconds, cpu, processes):
+    return {'computer_id': 1, 'timestamp': T0 + timedelta(seconds=seconds), 'cpu_percent': cpu,
+            'memory_usage': 40.0 + seconds / 1000, 'disk_usage': None, 'processes': processes, 'extra': None}
+
+
+def write(store, rows):
+    store.insert(rows)
+    store.commit()
+
+
+def test_chunk_round_trip():
+    rng = random.Random(7)
+    start = datetime(2025, 3, 1).timestamp()
+    columns = [
+        array('q', range(1000, 1500)),
+        array('d', [start + 5 * i + rng.randint(0, 999) / 1000 for i in range(500)]),
+        array('f', [math.nan if i % 50 == 0 else rng.uniform(0, 100) for i in range(500)]),
+        array('i', [-1 if i % 70 == 0 else 100 + rng.randint(-3, 3) for i in range(500)]),
+    ]
+    decoded = decode_chunk(encode_chunk(columns))
+    assert [values.typecode for values in decoded] == ['q', 'd', 'f', 'i']
+    # сравнение байтов: NaN не равен сам себе
+    assert [values.tobytes() for values in decoded] == [values.tobytes() for values in columns]
+    assert decode_chunk(encode_chunk([array('q'), array('d')])) == [array('q'), array('d')]
+
+
+def test_seal_keeps_reads_and_survives_reopen(tmp_path):
+    store = ColumnarMetricStore(str(tmp_path), segment_rows=16, chunk_rows=4)
+    rows = [row(5 * i, cpu=round(i * 1.7 % 100, 1), processes=100 + i % 3) for i in range(40)]
+    rows[6]['extra'] = {'gpu': 6}
+    write(store, rows)
+    # одно измерение приходит с опозданием
+    write(store, [row(12, cpu=55.5, processes=None)])
+    start, end = T0 + timedelta(seconds=20), T0 + timedelta(seconds=150)
+    before = (list(store.scan(1, start, end)), list(store.buckets(1, start, end, 30)), store.latest(1, 5))
+
+    assert store.seal() == 2
+    assert store.seal() == 0
+    assert [isinstance(segment, SealedSegment) for segment in store.series[1]] == [True, True, False]
+    assert sorted(os.listdir(tmp_path / '1')) == ['00000000.chk', '00000000.extra', '00000001.chk', '00000002.seg']
+    assert (list(store.scan(1, start, end)), list(store.buckets(1, start, end, 30)), store.latest(1, 5)) == before
+    assert [r.extra for r in store.scan(1, T0 + timedelta(seconds=30), T0 + timedelta(seconds=36))] == [{'gpu': 6}, None]
+
+    # интервал внутри одного фрагмента распаковывает только его
+    store.decoded.clear()
+    assert [r.id for r in store.scan(1, T0 + timedelta(seconds=100), T0 + timedelta(seconds=110))] == [21, 22]
+    assert list(store.decoded) == [(store.series[1][1].path, 1)]
+
+    write(store, [row(5 * i, cpu=1.0, processes=1) for i in range(40, 60)])
+    store.close()
+    reopened = ColumnarMetricStore(str(tmp_path), chunk_rows=4)
+    assert reopened.next_id == 62
+    assert list(reopened.scan(1, start, end)) == before[0]
+    assert reopened.seal() == 1
+    reopened.close()
+
+
+def test_retention_and_interrupted_seal(tmp_path):
+    store = ColumnarMetricStore(str(tmp_path), segment_rows=8, chunk_rows=4)
+    write(store, [row(60 * i, cpu=1.0, processes=1) for i in range(20)])
+    assert store.seal() == 2
+    assert store.delete_before(1, T0 + timedelta(minutes=12), 5000) == 8
+    assert store.latest(1, 100)[-1].timestamp == T0 + timedelta(minutes=8)
+    assert not store.decoded or all(path.endswith('00000001.chk') for path, _ in store.decoded)
+
+    # сбой после записи фрагментов, но до удаления сегмента
+    segment = store.series[1][-1]
+    write(store, [row(60 * i, cpu=2.0, processes=2) for i in range(20, 24)])
+    assert segment.rows == segment.capacity
+    columns = store._columns(segment)
+    SealedSegment.write(os.path.splitext(segment.path)[0] + '.chk', segment, columns, 4)
+    del columns
+    store.close()
+
+    reopened = ColumnarMetricStore(str(tmp_path))
+    assert sorted(os.listdir(tmp_path / '1')) == ['00000001.chk', '00000002.chk']
+    assert [r.cpu_percent for r in reopened.latest(1, 5)] == [2.0, 2.0, 2.0, 2.0, 1.0]
+    reopened.close()
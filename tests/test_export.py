@@ -0,0 +1,106 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.export import export_stream, iter_fleet
+
+NOW = datetime.utcnow().replace(second=0, microsecond=0)
+
+
+def fill(client):
+    samples = []
+    for minutes_ago in range(30, 0, -1):
+        for hostname in ('EXP-A', 'EXP-B', 'EXP-C'):
+            samples.append({'hostname': hostname, 'cpu': float(minutes_ago), 'ram': 50.0, 'disk': 40.0,
+                            'processes': 100, 'ext': {'gpu': minutes_ago},
+                            'timestamp': (NOW - timedelta(minutes=minutes_ago)).isoformat()})
+    assert client.post('/api/metrics/batch', json=samples).status_code == 200
+
+
+def rows(response):
+    return list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_export_csv_scopes(client):
+    fill(client)
+    window = {'from': (NOW - timedelta(hours=1)).isoformat(), 'to': NOW.isoformat()}
+
+    response = client.get('/api/export', query_string={**window, 'host': 'EXP-B'})
+    assert response.status_code == 200 and response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    single = rows(response)
+    assert len(single) == 30 and {row['hostname'] for row in single} == {'EXP-B'}
+    # по возрастанию времени
+    assert [float(row['cpu_percent']) for row in single] == [float(m) for m in range(30, 0, -1)]
+
+    computer_id = single[0]['computer_id']
+    both = rows(client.get('/api/export', query_string={**window, 'host': 'EXP-A', 'computer_id': computer_id}))
+    assert len(both) == 60 and {row['hostname'] for row in both} == {'EXP-A', 'EXP-B'}
+
+    fleet = rows(client.get('/api/export', query_string=window))
+    assert len(fleet) == 90
+    # узкий интервал отсекает старые измерения
+    recent = rows(client.get('/api/export', query_string={'from': (NOW - timedelta(minutes=10)).isoformat(),
+                                                         'to': NOW.isoformat()}))
+    assert len(recent) == 30
+
+    assert client.get('/api/export', query_string={'host': 'NOPE'}).status_code == 404
+    assert client.get('/api/export', query_string={'format': 'xml'}).status_code == 400
+    assert client.get('/api/export', query_string={'from': 'soon'}).status_code == 400
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_export_ndjson_gzip(client):
+    fill(client)
+    query = {'from': (NOW - timedelta(hours=1)).isoformat(), 'format': 'ndjson'}
+
+    plain = client.get('/api/export', query_string=query)
+    assert plain.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in plain.get_data(as_text=True).splitlines()]
+    assert len(lines) == 90
+    assert lines[0]['extra'] == {'gpu': 30}
+    # компьютеры по возрастанию id
+    assert [line['computer_id'] for line in lines] == sorted(line['computer_id'] for line in lines)
+
+    packed = client.get('/api/export', query_string={**query, 'gzip': 1})
+    assert packed.mimetype == 'application/gzip'
+    assert packed.headers['Content-Disposition'].endswith('.ndjson.gz')
+    assert gzip.decompress(packed.get_data()) == plain.get_data()
+
+
+def test_export_stream_chunks(app, client):
+    fill(client)
+    start = NOW - timedelta(hours=1)
+    hosts = list(iter_fleet(batch_rows=2))
+    assert sorted(hostname for _, hostname in hosts) == ['EXP-A', 'EXP-B', 'EXP-C']
+    assert [computer_id for computer_id, _ in hosts] == sorted(computer_id for computer_id, _ in hosts)
+
+    blocks = list(export_stream(hosts, start, NOW, chunk_bytes=256))
+    assert len(blocks) > 10 and all(len(block) < 512 for block in blocks)
+    assert b''.join(blocks) == b''.join(export_stream(hosts, start, NOW))
+    packed = list(export_stream(hosts, start, NOW, compress=True, chunk_bytes=256))
+    assert gzip.decompress(b''.join(packed)) == b''.join(blocks)
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_export_over_limit(app, client):
+    fill(client)
+    slots = app.extensions['stream_slots']['export']
+    slots.limit = 1
+    assert slots.acquire()
+
+    response = client.get('/api/export')
+    assert response.status_code == 503 and response.headers['Retry-After']
+
+    slots.release()
+    assert len(rows(client.get('/api/export'))) == 90
+    assert slots.active == 0
+    # ответ, который так и не начали читать, тоже освобождает место
+    client.get('/api/export', buffered=False).close()
+    assert slots.active == 0
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from app.history import query_range
+from app.models import Computer
+
+
+def seed(client, start, values, interval=1):
+    client.post('/api/metrics/batch', json=[
+        {'hostname': 'HIST-PC', 'cpu': float(v), 'ram': 50.0, 'disk': 10.0, 'processes': 100,
+         'timestamp': (start + timedelta(seconds=i * interval)).isoformat()}
+        for i, v in enumerate(values)
+    ])
+    return Computer.query.filter_by(hostname='HIST-PC').one().id
+
+
+def test_raw_range_aggregates_with_p95(client, app):
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(minutes=10) - timedelta(seconds=(now - timedelta(minutes=10)).second)
+    comp_id = seed(client, start, range(1, 21))
+
+    result = query_range(comp_id, start, start + timedelta(seconds=20), step=10, now=now)
+
+    assert result['source'] == 'raw'
+    assert [p['samples'] for p in result['points']] == [10, 10]
+    first = result['points'][0]['cpu']
+    assert (first['min'], first['max'], first['avg']) == (1.0, 10.0, 5.5)
+    assert first['p95'] == 10.0
+    assert result['points'][1]['cpu']['p95'] == 20.0
+
+
+def test_long_range_uses_rollups_and_caps_points(client, app):
+    now = datetime(2024, 6, 30)
+    start = datetime(2024, 6, 1)
+    comp_id = seed(client, start, [10, 30, 50], interval=3600)
+
+    result = query_range(comp_id, start, now, now=now)
+
+    assert result['source'] in ('1m', '1h')
+    assert len(result['points']) <= app.config['RANGE_MAX_POINTS']
+    assert result['step'] * app.config['RANGE_MAX_POINTS'] >= (now - start).total_seconds()
+    assert sum(p['samples'] for p in result['points']) == 3
+    assert result['points'][0]['cpu']['avg'] == 10.0
+    assert result['points'][0]['cpu']['p95'] is None
+
+    # без уплотнения сырые данные хранятся сколько угодно долго
+    result = query_range(comp_id, start, start + timedelta(hours=3), step=1,
+                         now=start + timedelta(days=60))
+    assert result['source'] == 'raw'
+    assert [p['cpu']['max'] for p in result['points']] == [10.0, 30.0, 50.0]
+
+    # за пределами хранения сырых данных и минутного яруса — только часовой
+    app.config['RETENTION_ENABLED'] = True
+    result = query_range(comp_id, start, start + timedelta(hours=3), step=1,
+                         now=start + timedelta(days=60))
+    assert result['source'] == '1h'
+    assert result['step'] == 3600
+    assert [p['cpu']['max'] for p in result['points']] == [10.0, 30.0, 50.0]
+
+
+def test_range_api(logged_in_client, app):
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(minutes=5)
+    comp_id = seed(logged_in_client, start, [5, 15])
+
+    resp = logged_in_client.get(f'/api/computers/{comp_id}/metrics',
+                         query_string={'from': start.isoformat(), 'step': 60})
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body['computer_id'] == comp_id
+    assert body['source'] == '1m'
+    assert sum(p['samples'] for p in body['points']) == 2
+
+    resp = logged_in_client.get(f'/api/computers/{comp_id}/metrics', query_string={'from': 'yesterday'})
+    assert resp.status_code == 400
+    assert logged_in_client.get('/api/computers/999/metrics').status_code == 404
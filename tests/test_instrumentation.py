@@ -0,0 +1,79 @@
+import logging
+import os
+
+import pytest
+
+from app import create_app
+
+
+def metric_value(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + ' ') or line.startswith(name + '{'):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_metrics_endpoint_reports_requests_and_sql(client):
+    client.post('/api/metrics', json={'hostname': 'INSTR-PC', 'cpu': 10.0})
+    client.get('/computers')
+
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/plain'
+    text = resp.get_data(as_text=True)
+
+    labels = 'endpoint="main.index",method="GET"'
+    assert f'sysmon_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+    assert f'sysmon_request_duration_seconds_count{{{labels}}} 1' in text
+    assert f'sysmon_responses_total{{{labels},status="200"}} 1' in text
+    assert metric_value(text, f'sysmon_request_sql_statements_total{{{labels}}}') >= 1
+    assert metric_value(text, f'sysmon_request_template_seconds_total{{{labels}}}') > 0
+    assert metric_value(text, 'sysmon_ingest_rows_total') == 1
+    assert metric_value(text, f'sysmon_process_info{{pid="{os.getpid()}"}}') == 1
+    assert metric_value(text, 'sysmon_ingest_rows_per_second') > 0
+    assert metric_value(text, 'sysmon_sql_statements_total') >= 1
+    assert metric_value(text, 'sysmon_alerts_open') == 0
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_slow_request_log_lists_statements(app, client, caplog):
+    app.extensions['instrumentation'].slow_request_ms = 0
+    with caplog.at_level(logging.WARNING, logger='app.instrumentation'):
+        client.get('/computers')
+
+    [record] = [r for r in caplog.records if r.name == 'app.instrumentation']
+    message = record.getMessage()
+    assert message.startswith('slow request GET /computers:')
+    assert 'SELECT' in message
+
+
+def test_failed_statements_are_counted_once(app):
+    import pytest
+    from sqlalchemy.exc import OperationalError
+    from app import db
+
+    instrumentation = app.extensions['instrumentation']
+    with db.engine.connect() as conn:
+        before = instrumentation.sql_statements
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.exec_driver_sql('SELECT * FROM no_such_table')
+        conn.exec_driver_sql('SELECT 1')
+        assert instrumentation.sql_statements == before + 4
+        # после ошибок в соединении пула не остаётся незавершённых замеров
+        assert not any(key.startswith('instrumentation') for key in conn.info)
+
+
+def test_db_size_reported_for_file_database(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "size.db"}',
+                      'RETENTION_ENABLED': False})
+    text = app.test_client().get('/metrics').get_data(as_text=True)
+    assert metric_value(text, 'sysmon_db_size_bytes') > 0
+
+
+def test_instrumentation_can_be_disabled():
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'RETENTION_ENABLED': False,
+                      'INSTRUMENTATION_ENABLED': False})
+    assert 'instrumentation' not in app.extensions
+    assert app.test_client().get('/metrics').status_code == 404
@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import text
+
+from app import db
+from app.listing import query_computers
+
+
+@pytest.fixture
+def fleet(client):
+    samples = [{'hostname': f'web-{i:02d}', 'cpu': float(i * 3 % 50), 'ram': 40.0, 'disk': 10.0}
+               for i in range(30)]
+    samples += [{'hostname': 'DB-01', 'cpu': 99.0}, {'hostname': 'db-02', 'cpu': 1.0},
+                {'hostname': 'web_x', 'ram': 5.0}]
+    assert client.post('/api/metrics/batch', json=samples).status_code == 200
+    return samples
+
+
+def walk_items(client, **params):
+    items = []
+    after = None
+    while True:
+        body = client.get('/api/computers', query_string=dict(params, after=after)).get_json()
+        items += body['items']
+        after = body['next']
+        if after is None:
+            return items
+
+
+def walk(client, **params):
+    return [item['hostname'] for item in walk_items(client, **params)]
+
+
+def test_keyset_pages_cover_list_once(logged_in_client, fleet):
+    hostnames = walk(logged_in_client, limit=7)
+    assert hostnames == sorted((sample['hostname'] for sample in fleet), key=str.lower)
+
+
+def test_search_prefix_and_contains(logged_in_client, fleet):
+    assert walk(logged_in_client, q='DB') == ['DB-01', 'db-02']
+    assert walk(logged_in_client, q='web-1', limit=3) == [f'web-{i}' for i in range(10, 20)]
+    # символы шаблона LIKE в запросе ищутся буквально
+    assert walk(logged_in_client, q='_x', match='contains') == ['web_x']
+    assert walk(logged_in_client, q='-0', match='contains', limit=4) == ['DB-01', 'db-02'] + [f'web-0{i}' for i in range(10)]
+
+
+def test_sort_by_metric_descending(logged_in_client, fleet):
+    body = logged_in_client.get('/api/computers', query_string={'sort': 'cpu', 'limit': 3}).get_json()
+    assert [item['hostname'] for item in body['items']][0] == 'DB-01'
+    assert body['items'][0]['cpu'] == 99.0
+
+    values = [(item['cpu'], item['id']) for item in walk_items(logged_in_client, sort='cpu', limit=4)]
+    assert values == sorted(values, reverse=True)
+    # компьютеры без значения метрики в такой сортировке не показываются
+    assert len(values) == 32
+
+
+def test_invalid_parameters(logged_in_client, fleet):
+    assert logged_in_client.get('/api/computers?sort=name').status_code == 400
+    assert logged_in_client.get('/api/computers?match=regex').status_code == 400
+    assert logged_in_client.get('/api/computers?after=garbage').status_code == 400
+    assert logged_in_client.get('/computers?after=garbage').status_code == 302
+
+
+def test_computers_page_is_paginated(logged_in_client, fleet, app):
+    app.config['COMPUTERS_PAGE_SIZE'] = 10
+    page = logged_in_client.get('/computers?q=web').get_data(as_text=True)
+    assert 'web-09' in page and 'web-10' not in page
+    assert 'дальше →' in page
+
+
+def test_queries_use_indexes(app, fleet):
+    sql = {
+        'prefix': "SELECT id FROM computer WHERE hostname COLLATE NOCASE LIKE 'web%' ESCAPE '\\' "
+                  "ORDER BY hostname COLLATE NOCASE, id",
+        'cpu': 'SELECT computer_id FROM computer_state WHERE cpu_percent IS NOT NULL '
+               'ORDER BY cpu_percent DESC, computer_id DESC LIMIT 50',
+    }
+    plans = {name: ' '.join(row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + query)))
+             for name, query in sql.items()}
+    assert 'ix_computer_hostname_nocase' in plans['prefix'] and 'TEMP B-TREE' not in plans['prefix']
+    assert 'ix_computer_state_cpu' in plans['cpu'] and 'TEMP B-TREE' not in plans['cpu']
+
+    computers, next_cursor = query_computers(q='web', limit=5)
+    assert len(computers) == 5 and next_cursor
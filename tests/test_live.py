@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from app.live import LiveFeed
+
+
+def post(client, hostname, cpu):
+    resp = client.post('/api/metrics', json={'hostname': hostname, 'cpu': cpu, 'ram': 1.0,
+                                             'disk': 2.0, 'processes': 3})
+    assert resp.status_code == 200
+
+
+def test_feed_returns_only_changed_hosts(client, app):
+    post(client, 'LIVE-1', 1.0)
+    post(client, 'LIVE-2', 2.0)
+
+    feed = LiveFeed(app)
+    feed.poll_once()
+    start = feed.cursor
+    assert feed.changes_since(start) == (start, [])
+
+    post(client, 'LIVE-1', 10.0)
+    post(client, 'LIVE-1', 11.0)
+    post(client, 'LIVE-3', 3.0)
+    assert feed.poll_once() == 2
+
+    cursor, hosts = feed.changes_since(start)
+    assert cursor == feed.cursor
+    assert sorted(h['hostname'] for h in hosts) == ['LIVE-1', 'LIVE-3']
+    assert [h['cpu'] for h in hosts if h['hostname'] == 'LIVE-1'] == [11.0]
+
+    # курсор, выпавший из истории, требует снимка
+    assert feed.changes_since(start - 1) == (None, None)
+
+
+def test_feed_history_floor(client, app):
+    feed = LiveFeed(app, history=2)
+    feed.poll_once()
+    start = feed.cursor
+    for i in range(3):
+        post(client, f'FLOOR-{i}', float(i))
+    feed.poll_once()
+
+    assert feed.changes_since(start) == (None, None)
+    cursor, hosts = feed.changes_since(feed.events[0][0])
+    assert [h['hostname'] for h in hosts] == ['FLOOR-2']
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_live_stream_sends_snapshot(client, app):
+    post(client, 'SSE-PC', 42.0)
+    app.config['LIVE_STREAM_MAX_SECONDS'] = 0
+
+    resp = client.get('/api/live')
+    assert resp.mimetype == 'text/event-stream'
+    body = resp.get_data(as_text=True)
+    assert 'event: snapshot' in body
+
+    data = [line[len('data: '):] for line in body.splitlines() if line.startswith('data: ')]
+    hosts = json.loads(data[0])
+    assert hosts[0]['hostname'] == 'SSE-PC'
+    assert hosts[0]['cpu'] == 42.0
+
+
+@pytest.mark.usefixtures('logged_in_client')
+def test_live_stream_over_limit_polls(client, app):
+    post(client, 'SSE-BUSY', 7.0)
+    slots = app.extensions['stream_slots']['live']
+    slots.limit = 1
+    assert slots.acquire()
+
+    # мест нет: одно событие и закрытое соединение, несмотря на 60 с жизни потока
+    body = client.get('/api/live').get_data(as_text=True)
+    assert body.startswith(f"retry: {app.config['LIVE_BUSY_RETRY'] * 1000}\n\n")
+    assert 'event: snapshot' in body and 'SSE-BUSY' in body
+    assert slots.active == 1 and slots.stats['rejected'] == 1
+
+    slots.release()
+    app.config['LIVE_STREAM_MAX_SECONDS'] = 0
+    body = client.get('/api/live').get_data(as_text=True)
+    assert body.startswith('retry: 3000\n\n')
+    assert slots.active == 0
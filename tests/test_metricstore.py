@@ -0,0 +1,203 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app, db
+from app.columnar import ColumnarMetricStore
+from app.metricstore import SqlMetricStore
+from app.models import Computer, Metric
+
+T0 = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(minutes=10)
+
+
+@pytest.fixture
+def columnar_app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'RETENTION_ENABLED': False,
+        'LIVE_POLL_INTERVAL': 3600,
+        'METRIC_STORE': 'columnar',
+        'METRIC_STORE_PATH': str(tmp_path / 'metrics'),
+        'METRIC_SEGMENT_ROWS': 8,
+    })
+    with app.app_context():
+        yield app
+        db.session.remove()
+    app.extensions['metric_store'].close()
+
+
+def row(computer_id, seconds, cpu=None, processes=None):
+    return {'computer_id': computer_id, 'timestamp': T0 + timedelta(seconds=seconds),
+            'cpu_percent': cpu, 'memory_usage': 50.0, 'disk_usage': None,
+            'processes': processes, 'extra': None}
+
+
+def write(store, rows):
+    store.insert(rows)
+    store.commit()
+
+
+def post_series(client):
+    samples = [{'hostname': 'STORE-PC', 'cpu': float(i % 7) * 10.5, 'ram': 40.0 + i, 'processes': 100 + i,
+                'timestamp': (T0 + timedelta(seconds=5 * i)).isoformat()} for i in range(30)]
+    for i in (0, 13, 29):
+        samples[i]['ext'] = {'gpu': i, 'net': {'rx': i * 100}}
+    # одно измерение приходит с опозданием
+    samples.append({'hostname': 'STORE-PC', 'cpu': 99.5, 'timestamp': (T0 + timedelta(seconds=7)).isoformat()})
+    assert client.post('/api/metrics/batch', json=samples).status_code == 200
+    return Computer.query.filter_by(hostname='STORE-PC').one().id
+
+
+def history(client, comp_id):
+    params = {'from': T0.isoformat(), 'to': (T0 + timedelta(minutes=5)).isoformat(), 'step': 30}
+    return client.get(f'/api/computers/{comp_id}/metrics', query_string=params).get_json()
+
+
+def test_columnar_matches_sql_backend(app, columnar_app):
+    results, exports = [], []
+    for flask_app in (app, columnar_app):
+        with flask_app.app_context():
+            client = flask_app.test_client()
+            with client.session_transaction() as sess:
+                sess['logged_in'] = True
+            comp_id = post_series(client)
+            results.append(history(client, comp_id))
+            export = client.get('/api/export', query_string={'from': T0.isoformat(), 'format': 'ndjson'})
+            exports.append([json.loads(line) for line in export.get_data(as_text=True).splitlines()])
+
+            page = client.get(f'/computer/{comp_id}')
+            assert page.status_code == 200
+            assert b'129' in page.data
+
+    sql_result, columnar_result = results
+    assert columnar_result['source'] == 'raw'
+    assert len(columnar_result['points']) == len(sql_result['points'])
+    for expected, actual in zip(sql_result['points'], columnar_result['points']):
+        assert actual['t'] == expected['t'] and actual['samples'] == expected['samples']
+        for name in ('cpu', 'ram', 'disk', 'processes'):
+            # столбцы float32 хранят 7 значащих цифр
+            assert actual[name] == {key: value if value is None else pytest.approx(value, rel=1e-6)
+                                    for key, value in expected[name].items()}
+    # поле extra читается обратно из файла .extra сегмента
+    sql_export, columnar_export = exports
+    assert [line['extra'] for line in columnar_export] == [line['extra'] for line in sql_export]
+    assert sum(line['extra'] is not None for line in columnar_export) == 3
+    with columnar_app.app_context():
+        assert Metric.query.count() == 0
+
+
+def test_segments_latest_and_scan(tmp_path):
+    store = ColumnarMetricStore(str(tmp_path), segment_rows=8)
+    write(store, [row(1, i, cpu=float(i), processes=i) for i in range(20)])
+    write(store, [row(1, 3.5, cpu=23.1), row(2, 0, cpu=1.0)])
+
+    assert [len(segments) for segments in store.series.values()] == [3, 1]
+    assert [record.cpu_percent for record in store.latest(1, 3)] == [19.0, 18.0, 17.0]
+
+    scanned = list(store.scan(1, T0 + timedelta(seconds=3), T0 + timedelta(seconds=6)))
+    assert [record.cpu_percent for record in scanned] == [3.0, 23.1, 4.0, 5.0]
+    assert scanned[1].disk_usage is None and scanned[1].processes is None
+    assert scanned[1].timestamp == T0 + timedelta(seconds=3.5)
+
+    rows = list(store.buckets(1, T0, T0 + timedelta(seconds=10), 5))
+    assert [(bucket_row[0] % 5, bucket_row[1]) for bucket_row in rows] == [(0, 6), (0, 5)]
+    store.close()
+
+
+def test_rollback_reopen_and_ids(tmp_path):
+    store = ColumnarMetricStore(str(tmp_path), segment_rows=8, first_id=100)
+    rows = [row(1, i, cpu=1.0) for i in range(3)]
+    write(store, rows)
+    assert [r['id'] for r in rows] == [100, 101, 102]
+
+    store.insert([row(1, 10, cpu=2.0)])
+    store.rollback()
+    store.commit()
+    assert len(store.latest(1, 10)) == 3
+
+    with pytest.raises(RuntimeError):
+        ColumnarMetricStore(str(tmp_path))
+    store.close()
+
+    reopened = ColumnarMetricStore(str(tmp_path))
+    assert reopened.next_id == 103
+    assert [record.id for record in reopened.latest(1, 10)] == [102, 101, 100]
+    reopened.close()
+
+
+def test_delete_whole_segments(tmp_path):
+    store = ColumnarMetricStore(str(tmp_path), segment_rows=8)
+    write(store, [row(1, i * 60, cpu=1.0) for i in range(20)])
+
+    # граница внутри второго сегмента: удаляется только первый
+    assert store.delete_before(1, T0 + timedelta(minutes=12), 5000) == 8
+    assert len(store.series[1]) == 2
+    assert store.latest(1, 100)[-1].timestamp == T0 + timedelta(minutes=8)
+
+    assert store.delete_before(1, T0 + timedelta(days=1), 5000) == 12
+    assert store.latest(1, 10) == []
+    write(store, [row(1, 0, cpu=5.0)])
+    assert store.latest(1, 1)[0].cpu_percent == 5.0
+    store.close()
+
+
+def test_sql_store_deletes_in_chunks(app):
+    comp = Computer(hostname='CHUNK-PC')
+    db.session.add(comp)
+    db.session.commit()
+    store = SqlMetricStore()
+    write(store, [row(comp.id, i, cpu=1.0) for i in range(5)])
+    db.session.commit()
+
+    assert store.delete_before(comp.id, T0 + timedelta(seconds=4), 3) == 3
+    assert store.delete_before(comp.id, T0 + timedelta(seconds=4), 3) == 1
+    assert [m.timestamp for m in store.latest(comp.id, 10)] == [T0 + timedelta(seconds=4)]
+
+
+def test_columnar_ids_from_sequence_and_lost_rows(columnar_app, monkeypatch):
+    from app.ingest import RawWriteError
+    from app.models import MetricSequence
+
+    client = columnar_app.test_client()
+    comp_id = post_series(client)
+    store = columnar_app.extensions['metric_store']
+    # id выдаёт metric_sequence в транзакции пакета, а не счётчик процесса
+    ids = [record.id for record in store.latest(comp_id, 100)]
+    assert db.session.get(MetricSequence, 1).last_id == max(ids) == store.next_id - 1
+    assert db.session.get(Computer, comp_id).state.metric_id in ids
+
+    def broken(rows):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(store, 'append', broken)
+    sample = {'hostname': 'STORE-PC', 'cpu': 1.0, 'timestamp': (T0 + timedelta(minutes=4)).isoformat()}
+    with pytest.raises(RawWriteError):
+        client.post('/api/metrics', json=sample)
+    db.session.remove()
+    # агрегаты и состояние зафиксированы, потеря сырых строк учтена
+    assert db.session.get(Computer, comp_id).state.metric_id == max(ids) + 1
+    assert columnar_app.extensions['instrumentation'].ingest_lost == 1
+
+
+def test_failed_insert_does_not_leak_into_next_batch(columnar_app, monkeypatch):
+    client = columnar_app.test_client()
+    store = columnar_app.extensions['metric_store']
+    insert = store.insert
+
+    def broken(rows):
+        insert(rows)
+        raise OSError('disk full')
+
+    monkeypatch.setattr(store, 'insert', broken)
+    sample = {'hostname': 'LEAK-PC', 'cpu': 1.0, 'timestamp': T0.isoformat()}
+    with pytest.raises(OSError):
+        client.post('/api/metrics', json=sample)
+    db.session.remove()
+
+    monkeypatch.setattr(store, 'insert', insert)
+    sample = {'hostname': 'LEAK-PC', 'cpu': 2.0, 'timestamp': (T0 + timedelta(seconds=5)).isoformat()}
+    assert client.post('/api/metrics', json=sample).status_code == 200
+    comp_id = Computer.query.filter_by(hostname='LEAK-PC').one().id
+    assert [record.cpu_percent for record in store.latest(comp_id, 10)] == [2.0]
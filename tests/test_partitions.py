@@ -0,0 +1,142 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import app.partitions as partitions_module
+from app import create_app, db
+from app.models import Computer, ComputerState, Metric
+from app.partitions import PartitionedMetricStore, copy_from_table
+
+# полночь UTC внутри срока хранения сырых данных
+MIDNIGHT = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+@pytest.fixture
+def partitioned_app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'RETENTION_ENABLED': False,
+        'LIVE_POLL_INTERVAL': 3600,
+        'METRIC_STORE': 'partitioned',
+        'METRIC_STORE_PATH': str(tmp_path / 'metrics'),
+    })
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def post(client, seconds, cpu):
+    sample = {'hostname': 'PART-PC', 'cpu': cpu, 'ram': 30.0, 'processes': 50,
+              'timestamp': (MIDNIGHT + timedelta(seconds=seconds)).isoformat()}
+    assert client.post('/api/metrics', json=sample).status_code == 200
+
+
+def test_ingest_writes_day_partitions(partitioned_app):
+    client = partitioned_app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    for seconds, cpu in ((-90, 10.0), (-30, 20.0), (30, 30.0), (90, 40.0)):
+        post(client, seconds, cpu)
+
+    store = partitioned_app.extensions['metric_store']
+    assert store.partitions() == [MIDNIGHT - timedelta(days=1), MIDNIGHT]
+    assert Metric.query.count() == 0
+    comp = Computer.query.one()
+    # курсор живых обновлений — последний выданный id
+    assert comp.state.metric_id == 4
+
+    assert [m.cpu_percent for m in store.latest(comp.id, 3)] == [40.0, 30.0, 20.0]
+    assert b'40.0%' in client.get(f'/computer/{comp.id}').data
+
+    # корзина в 2 минуты пересекает полночь — её значения из обоих разделов
+    params = {'from': (MIDNIGHT - timedelta(minutes=2)).isoformat(),
+              'to': (MIDNIGHT + timedelta(minutes=2)).isoformat(), 'step': 120}
+    points = client.get(f'/api/computers/{comp.id}/metrics', query_string=params).get_json()['points']
+    assert [(p['samples'], p['cpu']['avg']) for p in points] == [(2, 15.0), (2, 35.0)]
+
+    scanned = store.scan(comp.id, MIDNIGHT - timedelta(days=1), MIDNIGHT + timedelta(days=1))
+    assert [m.cpu_percent for m in scanned] == [10.0, 20.0, 30.0, 40.0]
+
+
+def test_buckets_split_when_partitions_exceed_attach_limit(tmp_path, monkeypatch):
+    store = PartitionedMetricStore(str(tmp_path))
+    rows = [{'id': i + 1, 'computer_id': 1, 'timestamp': MIDNIGHT + timedelta(hours=6 * i),
+             'cpu_percent': float(i), 'memory_usage': None, 'disk_usage': None, 'processes': i, 'extra': None}
+            for i in range(20)]
+    store.append(rows)
+    assert len(store.partitions()) == 5
+
+    start, end = MIDNIGHT, MIDNIGHT + timedelta(days=5)
+    expected = list(store.buckets(1, start, end, 7 * 3600))
+    monkeypatch.setattr(partitions_module, 'MAX_ATTACHED', 3)
+    assert list(store.buckets(1, start, end, 7 * 3600)) == expected
+    assert sum(row[1] for row in expected) == 20
+
+
+def test_retention_unlinks_whole_partitions(tmp_path):
+    store = PartitionedMetricStore(str(tmp_path))
+    store.append([{'id': i + 1, 'computer_id': 1, 'timestamp': MIDNIGHT - timedelta(days=3 - i),
+                   'cpu_percent': 1.0, 'memory_usage': None, 'disk_usage': None, 'processes': None,
+                   'extra': {'n': i}} for i in range(4)])
+
+    # граница внутри суток: раздел этих суток остаётся целиком
+    assert store.delete_before(1, MIDNIGHT - timedelta(days=1, hours=12), 5000) == 1
+    assert store.partitions() == [MIDNIGHT - timedelta(days=d) for d in (2, 1, 0)]
+    assert sorted(os.listdir(tmp_path)) == [f'metric-{day:%Y%m%d}.db' for day in store.partitions()]
+    assert store.latest(1, 1)[0].extra == {'n': 3}
+
+
+def test_copy_from_table_and_sequence(app, tmp_path):
+    comp = Computer(hostname='OLD-PC')
+    db.session.add(comp)
+    db.session.flush()
+    for i in range(7):
+        db.session.add(Metric(computer_id=comp.id, cpu_percent=float(i), processes=i,
+                              timestamp=MIDNIGHT + timedelta(minutes=i)))
+    db.session.commit()
+    ComputerState.backfill()
+    db.session.commit()
+
+    store = PartitionedMetricStore(str(tmp_path), period='week')
+    assert copy_from_table(store, batch_rows=3) == (7, 7)
+    assert copy_from_table(store, batch_rows=3) == (7, 7)
+    assert [m.id for m in store.latest(comp.id, 10)] == [7, 6, 5, 4, 3, 2, 1]
+    assert store.partitions() == [store.partition_start(MIDNIGHT)]
+    assert store.partition_start(MIDNIGHT).weekday() == 0
+
+    from app.metricstore import advance_sequence, allocate_ids
+    advance_sequence()
+    assert list(allocate_ids(2)) == [8, 9]
+
+
+def test_two_stores_share_directory(tmp_path):
+    def sample(metric_id, timestamp):
+        return {'id': metric_id, 'computer_id': 1, 'timestamp': timestamp, 'cpu_percent': 1.0,
+                'memory_usage': None, 'disk_usage': None, 'processes': None, 'extra': None}
+
+    writer = PartitionedMetricStore(str(tmp_path))
+    cleaner = PartitionedMetricStore(str(tmp_path), keep=timedelta(days=2))
+    old = MIDNIGHT - timedelta(days=3)
+    writer.append([sample(1, old), sample(2, MIDNIGHT)])
+    assert cleaner.delete_before(1, MIDNIGHT, 5000) == 1
+
+    # раздел удалён другим процессом: запись создаёт его заново вместе со схемой
+    writer.append([sample(3, old)])
+    assert [m.id for m in writer.scan(1, old, old + timedelta(days=1))] == [3]
+    # измерения старше срока хранения не пересоздают удалённый раздел
+    assert cleaner.delete_before(1, MIDNIGHT, 5000) == 1
+    cleaner.append([sample(4, old), sample(5, MIDNIGHT + timedelta(minutes=1))])
+    assert cleaner.partitions() == [MIDNIGHT]
+
+    # список разделов устарел: удалённые файлы пропускаются
+    stale = [old, MIDNIGHT - timedelta(days=1), MIDNIGHT]
+    connection, source = writer._attach(stale)
+    with connection:
+        assert connection.execute(f'SELECT count(*) FROM {source}').fetchone()[0] == 2
+    connection.close()
+    assert writer._attach(stale[:2]) == (None, None)
+    writer.partitions = lambda start=None, end=None: stale
+    assert writer.delete_before(1, MIDNIGHT, 5000) == 0
+    assert [m.id for m in writer.latest(1, 10)] == [5, 2]
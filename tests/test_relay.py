@@ -0,0 +1,108 @@
+import asyncio
+import gzip
+import json
+
+import relay
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+
+
+class FakeTransport:
+    def __init__(self, statuses):
+        self.statuses = iter(statuses)
+        self.sent = []
+
+    def ready(self):
+        return True
+
+    def post_json(self, url, payload):
+        self.sent.append((url, payload))
+        return FakeResponse(next(self.statuses))
+
+    def close(self):
+        pass
+
+
+def test_buffer_deduplicates_and_caps_size():
+    buffer = relay.RelayBuffer(max_samples=3)
+    assert buffer.add({'hostname': 'a', 'timestamp': 1})
+    assert not buffer.add({'hostname': 'a', 'timestamp': 1})
+    for ts in (2, 3, 4):
+        buffer.add({'hostname': 'a', 'timestamp': ts})
+
+    assert buffer.size == 3
+    assert buffer.stats == {'accepted': 4, 'duplicates': 1, 'dropped': 1, 'forwarded': 0}
+
+    batch = buffer.take(10)
+    assert [sample['timestamp'] for sample in batch] == [2, 3, 4]
+    buffer.done(batch)
+    # повтор уже пересланного образца тоже отбрасывается
+    assert not buffer.add({'hostname': 'a', 'timestamp': 3})
+
+
+def test_flush_batches_hosts_and_retries_on_server_error():
+    transport = FakeTransport([503, 200, 200])
+    node = relay.Relay('http://central:5000/', batch_size=3, transport=transport)
+    for ts in range(3):
+        node.accept('/api/metrics', json.dumps({'hostname': 'a', 'cpu': 1, 'timestamp': ts}))
+    node.accept('/api/metrics/batch', json.dumps([{'hostname': 'b', 'timestamp': 0}]))
+
+    assert asyncio.run(node.flush()) == 0
+    assert node.buffer.size == 4
+
+    assert asyncio.run(node.flush()) == 4
+    url, first = transport.sent[1]
+    assert url == 'http://central:5000/api/metrics/batch'
+    # пачка набирается по кругу между хостами
+    assert [sample['hostname'] for sample in first] == ['a', 'b', 'a']
+    assert node.buffer.stats['forwarded'] == 4
+
+
+def test_http_roundtrip_with_gzip():
+    node = relay.Relay('http://central:5000', transport=FakeTransport([]))
+
+    async def scenario():
+        server = await asyncio.start_server(node.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+        body = gzip.compress(json.dumps([{'hostname': 'pc', 'timestamp': 1},
+                                         {'hostname': 'pc', 'timestamp': 1}]).encode())
+        writer.write(b'POST /api/metrics/batch HTTP/1.1\r\nHost: relay\r\n'
+                     b'Content-Type: application/json\r\nContent-Encoding: gzip\r\n'
+                     + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        writer.write(b'GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n')
+        await writer.drain()
+        raw = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return raw
+
+    raw = asyncio.run(scenario())
+    first, second = raw.split(b'HTTP/1.1 ')[1:]
+    assert first.startswith(b'200')
+    assert json.loads(first.split(b'\r\n\r\n', 1)[1]) == {'status': 'ok', 'accepted': 1}
+    stats = json.loads(second.split(b'\r\n\r\n', 1)[1])
+    assert stats['buffered'] == 1 and stats['duplicates'] == 1
+
+
+def test_route_rejects_gzip_bomb_and_bad_timestamps():
+    node = relay.Relay('http://central:5000', transport=FakeTransport([]))
+    gzip_headers = {'content-encoding': 'gzip', 'content-type': 'application/json'}
+
+    bomb = gzip.compress(b' ' * (relay.MAX_BODY_BYTES + 1024))
+    assert node.route('POST', '/api/metrics/batch', gzip_headers, bomb)[0] == 413
+    assert node.route('POST', '/api/metrics', gzip_headers, b'not gzip')[0] == 400
+    truncated = gzip.compress(b'{"hostname": "pc"}')[:-8]
+    assert node.route('POST', '/api/metrics', gzip_headers, truncated)[0] == 400
+
+    # нехешируемое время сбора не должно ронять обработчик соединения
+    status, payload = node.route('POST', '/api/metrics', {}, b'{"hostname": "pc", "timestamp": [1]}')
+    assert (status, payload) == (400, {'error': 'invalid timestamp'})
+    body = json.dumps([{'hostname': 'pc', 'timestamp': {'t': 1}}, {'hostname': 'pc', 'timestamp': 2}])
+    assert node.route('POST', '/api/metrics/batch', {}, body.encode()) == (200, {'status': 'ok', 'accepted': 1})
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Computer, Metric, MetricRollup
+from app.retention import RetentionJob
+from app.rollups import bucket_start
+
+
+def post(client, hostname, ts, cpu, ram=50.0):
+    resp = client.post('/api/metrics', json={
+        'hostname': hostname, 'cpu': cpu, 'ram': ram, 'disk': 10.0, 'processes': 100,
+        'timestamp': ts.isoformat(),
+    })
+    assert resp.status_code == 200
+
+
+def test_bucket_start():
+    ts = datetime(2024, 3, 1, 13, 47, 31, 250000)
+    assert bucket_start(ts, 60) == datetime(2024, 3, 1, 13, 47)
+    assert bucket_start(ts, 3600) == datetime(2024, 3, 1, 13, 0)
+
+
+def test_rollups_are_updated_incrementally(client, app):
+    base = datetime(2024, 3, 1, 12, 0, 0)
+    post(client, 'ROLL-PC', base + timedelta(seconds=5), 10.0)
+    post(client, 'ROLL-PC', base + timedelta(seconds=10), 30.0)
+    client.post('/api/metrics/batch', json=[
+        {'hostname': 'ROLL-PC', 'cpu': 20.0, 'timestamp': (base + timedelta(seconds=15)).isoformat()},
+        {'hostname': 'ROLL-PC', 'cpu': 90.0, 'timestamp': (base + timedelta(minutes=1)).isoformat()},
+    ])
+
+    minute = MetricRollup.query.filter_by(resolution=60, bucket=base).one()
+    assert minute.cpu_count == 3
+    assert (minute.cpu_min, minute.cpu_max) == (10.0, 30.0)
+    assert minute.cpu_sum / minute.cpu_count == 20.0
+    # образец из пакета без ram не влияет на агрегат ram
+    assert minute.ram_count == 2
+
+    hour = MetricRollup.query.filter_by(resolution=3600, bucket=base).one()
+    assert hour.cpu_count == 4
+    assert hour.cpu_max == 90.0
+    assert MetricRollup.query.filter_by(resolution=60).count() == 2
+
+
+def test_retention_deletes_in_chunks(client, app):
+    now = datetime(2024, 3, 10, 0, 0, 0)
+    for i in range(7):
+        post(client, 'OLD-PC', now - timedelta(days=3, minutes=i), float(i))
+    post(client, 'OLD-PC', now - timedelta(hours=1), 50.0)
+
+    job = RetentionJob(app, policy=app.config['RETENTION'], tiers=app.config['ROLLUP_TIERS'],
+                       chunk_rows=3, chunk_pause=0)
+    deleted = job.run_once(now=now)
+
+    assert deleted['raw'] == 7
+    assert deleted['1m'] == 0
+    assert Metric.query.count() == 1
+    # часовые агрегаты хранятся бессрочно
+    assert MetricRollup.query.filter_by(resolution=3600).count() == 3
+
+    deleted = job.run_once(now=now + timedelta(days=31))
+    assert deleted['1m'] == 8
+    assert MetricRollup.query.filter_by(resolution=60).count() == 0
+
+
+def test_retention_runs_in_one_process(app, tmp_path):
+    lock_path = str(tmp_path / 'retention.lock')
+    jobs = [RetentionJob(app, policy=app.config['RETENTION'], tiers=app.config['ROLLUP_TIERS'],
+                         lock_path=lock_path) for _ in range(2)]
+    assert [job.acquire() for job in jobs] == [True, False]
+    # блокировка освобождается при остановке ведущего
+    jobs[0].stop()
+    assert jobs[1].acquire() and jobs[1].leader
+    jobs[1].stop()
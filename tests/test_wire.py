@@ -0,0 +1,60 @@
+import gzip
+
+import pytest
+
+import wire
+from app.models import Computer
+
+
+SAMPLES = [
+    {'hostname': 'WIRE-1', 'cpu': 12.5, 'ram': 40.0, 'disk': 70.1, 'processes': 120,
+     'timestamp': 1700000000.5, 'ext': {'load_avg': [0.5, 0.25, 0.1]}},
+    {'hostname': 'WIRE-2', 'cpu': None, 'ram': 1.0, 'disk': None, 'processes': None,
+     'timestamp': None},
+    {'hostname': 'WIRE-1', 'cpu': 99.0, 'ram': 41.0, 'disk': 70.1, 'processes': 121,
+     'timestamp': 1700000005.5, 'ext': {'net_io': {'bytes_recv': 10.0}}},
+]
+
+
+def test_roundtrip_matches_json_shape():
+    body = wire.encode(SAMPLES)
+    assert body.startswith(wire.MAGIC)
+    assert wire.decode(body) == SAMPLES
+
+
+@pytest.mark.parametrize('body', [
+    b'',
+    b'XXX' + wire.encode(SAMPLES)[3:],
+    wire.encode(SAMPLES)[:-5],
+    wire.encode(SAMPLES) + b'[{}]',
+])
+def test_decode_rejects_corrupted_payload(body):
+    with pytest.raises(wire.WireError):
+        wire.decode(body)
+
+
+def test_decode_rejects_unknown_version():
+    body = bytearray(wire.encode(SAMPLES))
+    body[3] = wire.VERSION + 1
+    with pytest.raises(wire.WireError, match='unsupported wire version'):
+        wire.decode(bytes(body))
+
+
+def test_server_accepts_binary_single_and_batch(client, app):
+    headers = {'Content-Type': wire.CONTENT_TYPE}
+    resp = client.post('/api/metrics', data=wire.encode(SAMPLES[:1]), headers=headers)
+    assert resp.status_code == 200
+
+    resp = client.post('/api/metrics/batch', data=gzip.compress(wire.encode(SAMPLES)),
+                       headers=dict(headers, **{'Content-Encoding': 'gzip'}))
+    assert resp.status_code == 200
+    assert resp.get_json()['accepted'] == 3
+
+    resp = client.post('/api/metrics', data=wire.encode(SAMPLES), headers=headers)
+    assert resp.status_code == 400
+
+    with app.app_context():
+        comp = Computer.query.filter_by(hostname='WIRE-1').one()
+        assert len(comp.metrics) == 3
+        assert comp.state.cpu_percent == 99.0
+        assert {tuple(m.extra) for m in comp.metrics} == {('load_avg',), ('net_io',)}
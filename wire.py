@@ -0,0 +1,164 @@
+"""
+Компактный двоичный формат передачи образцов метрик (SysMonitor wire format).
+
+Используется агентом и сервером как необязательная альтернатива JSON и
+выбирается заголовком Content-Type: application/x-sysmon-binary. Имена
+полей в теле не повторяются, а имена хостов записываются один раз в
+таблицу строк, поэтому пакет из тысяч образцов заметно меньше JSON и
+разбирается одним вызовом struct.iter_unpack вместо построчного
+разбора JSON.
+
+Структура тела (все числа little-endian):
+    заголовок    3s B H I   — b"SMW", версия формата, число хостов, число образцов;
+    хосты        H + UTF-8  — длина и имя каждого хоста;
+    образцы      H d d d d i B — индекс хоста, timestamp (Unix-время),
+                 cpu, ram, disk, processes, флаг наличия блока ext;
+    блоки ext    один JSON-массив (UTF-8) блоков ext тех образцов, у
+                 которых установлен флаг, в порядке образцов.
+
+Отсутствующие значения кодируются как NaN (для processes — как -1).
+Блоки ext разбираются одним вызовом json.loads на весь пакет.
+"""
+
+import json
+import math
+import struct
+
+# MIME-тип тела запроса в двоичном формате
+CONTENT_TYPE = 'application/x-sysmon-binary'
+
+MAGIC = b'SMW'
+VERSION = 1
+
+HEADER = struct.Struct('<3sBHI')
+HOST_LENGTH = struct.Struct('<H')
+RECORD = struct.Struct('<HddddiB')
+
+NAN = float('nan')
+
+
+class WireError(ValueError):
+    """
+    Тело не является корректным пакетом в двоичном формате.
+    """
+
+
+def _number(value):
+    return NAN if value is None else float(value)
+
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+
+def encode(samples):
+    """
+    Закодировать список образцов в двоичный формат.
+
+    Учитываются поля hostname, timestamp, cpu, ram, disk, processes и ext;
+    остальные поля (например, window) не передаются.
+
+    :param samples: образцы в формате /api/metrics.
+    :type samples: list[dict]
+    :rtype: bytes
+    """
+    hosts = {}
+    records = []
+    extras = []
+    for sample in samples:
+        host_index = hosts.setdefault(sample['hostname'], len(hosts))
+        ext = sample.get('ext')
+        if ext:
+            extras.append(ext)
+        processes = sample.get('processes')
+        records.append(RECORD.pack(
+            host_index,
+            _number(sample.get('timestamp')),
+            _number(sample.get('cpu')),
+            _number(sample.get('ram')),
+            _number(sample.get('disk')),
+            -1 if processes is None else processes,
+            1 if ext else 0,
+        ))
+
+    parts = [HEADER.pack(MAGIC, VERSION, len(hosts), len(records))]
+    for hostname in hosts:
+        name = hostname.encode('utf-8')
+        parts.append(HOST_LENGTH.pack(len(name)))
+        parts.append(name)
+    parts.extend(records)
+    if extras:
+        parts.append(json.dumps(extras, separators=(',', ':')).encode('utf-8'))
+    return b''.join(parts)
+
+
+def decode(body):
+    """
+    Разобрать тело в двоичном формате.
+
+    Результат совпадает с тем, что дал бы json.loads для того же пакета
+    в JSON, и дальше проходит обычную проверку validate_sample().
+
+    :param body: тело запроса.
+    :type body: bytes
+    :return: список образцов в формате /api/metrics.
+    :rtype: list[dict]
+    :raises WireError: если тело повреждено или версия не поддерживается.
+    """
+    view = memoryview(body)
+    try:
+        magic, version, host_count, record_count = HEADER.unpack_from(view, 0)
+    except struct.error:
+        raise WireError('invalid binary payload')
+    if magic != MAGIC:
+        raise WireError('invalid binary payload')
+    if version != VERSION:
+        raise WireError(f'unsupported wire version: {version}')
+
+    offset = HEADER.size
+    hosts = []
+    try:
+        for _ in range(host_count):
+            (length,) = HOST_LENGTH.unpack_from(view, offset)
+            offset += HOST_LENGTH.size
+            hosts.append(bytes(view[offset:offset + length]).decode('utf-8'))
+            offset += length
+    except (struct.error, UnicodeDecodeError):
+        raise WireError('invalid binary payload')
+
+    records_end = offset + record_count * RECORD.size
+    if records_end > len(view):
+        raise WireError('invalid binary payload')
+
+    extras = []
+    if records_end < len(view):
+        try:
+            extras = json.loads(bytes(view[records_end:]))
+        except ValueError:
+            raise WireError('invalid binary payload')
+        if not isinstance(extras, list):
+            raise WireError('invalid binary payload')
+    extras = iter(extras)
+
+    samples = []
+    for host_index, timestamp, cpu, ram, disk, processes, has_ext in \
+            RECORD.iter_unpack(view[offset:records_end]):
+        if host_index >= len(hosts):
+            raise WireError('invalid binary payload')
+        sample = {
+            'hostname': hosts[host_index],
+            'cpu': _optional(cpu),
+            'ram': _optional(ram),
+            'disk': _optional(disk),
+            'processes': None if processes < 0 else processes,
+            'timestamp': _optional(timestamp),
+        }
+        if has_ext:
+            sample['ext'] = next(extras, None)
+            if sample['ext'] is None:
+                raise WireError('invalid binary payload')
+        samples.append(sample)
+
+    if next(extras, None) is not None:
+        raise WireError('invalid binary payload')
+    return samples